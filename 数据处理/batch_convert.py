@@ -1,83 +1,402 @@
 """
 批量转换 MedQA 数据集为百炼格式的脚本
+
+原始文件可以是压缩的（如 Mainland/4_options/train.jsonl.gz），未压缩文件不存在时
+自动使用同名的 .gz / .zst 文件；--compress 把输出写成 .jsonl.gz / .jsonl.zst。
 """
 
 import os
+import hashlib
+import argparse
 from pathlib import Path
-from convert_to_bailian_format import convert_to_bailian_format
+from concurrent.futures import ProcessPoolExecutor
+from compressed_io import COMPRESSION_SUFFIXES, compression_of, uncompressed_size
+from conversion_cache import ConversionCache
+from pipeline_metrics import PipelineMetrics, default_profile_prefix, merge_profiles, profile_section
+from convert_to_bailian_format import (
+    CONVERTER_VERSION,
+    DEDUP_REPORT_FILE_NAME,
+    UPLOAD_LIMIT_MB,
+    ShardedJsonlWriter,
+    convert_to_bailian_format,
+    print_warning,
+    read_shard_manifest,
+    shard_manifest_path,
+    split_byte_ranges,
+)
 
 
-def batch_convert():
-    """批量转换所有 MedQA 数据集"""
+# 定义要转换的数据集
+DATASETS = [
+    # 中国大陆数据集（4选项）
+    ("Mainland/4_options/train.jsonl", "mainland_4opt_train.jsonl"),
+    ("Mainland/4_options/dev.jsonl", "mainland_4opt_dev.jsonl"),
+    ("Mainland/4_options/test.jsonl", "mainland_4opt_test.jsonl"),
     
-    # 由于脚本在"数据处理"子文件夹中，需要向上一层找到项目根目录
-    base_dir = Path(__file__).parent.parent / "datasets" / "MedQA" / "questions"
-    output_dir = Path(__file__).parent.parent / "datasets" / "MedQA_BaiLian"
-    
-    # 定义要转换的数据集
-    datasets = [
-        # 中国大陆数据集（4选项）
-        ("Mainland/4_options/train.jsonl", "mainland_4opt_train.jsonl"),
-        ("Mainland/4_options/dev.jsonl", "mainland_4opt_dev.jsonl"),
-        ("Mainland/4_options/test.jsonl", "mainland_4opt_test.jsonl"),
-        
-        # 台湾数据集
-        ("Taiwan/train.jsonl", "taiwan_train.jsonl"),
-        ("Taiwan/dev.jsonl", "taiwan_dev.jsonl"),
-        ("Taiwan/test.jsonl", "taiwan_test.jsonl"),
+    # 台湾数据集
+    ("Taiwan/train.jsonl", "taiwan_train.jsonl"),
+    ("Taiwan/dev.jsonl", "taiwan_dev.jsonl"),
+    ("Taiwan/test.jsonl", "taiwan_test.jsonl"),
+    
+    # 美国数据集（4选项）
+    ("US/4_options/phrases_no_exclude_train.jsonl", "us_4opt_train.jsonl"),
+    ("US/4_options/phrases_no_exclude_dev.jsonl", "us_4opt_dev.jsonl"),
+    ("US/4_options/phrases_no_exclude_test.jsonl", "us_4opt_test.jsonl"),
+]
+
+SYSTEM_PROMPT = "你是一个专业的医学助手，擅长回答医学选择题。请根据题目和选项，给出正确答案。"
+
+# 并行模式下，超过该大小的单个文件会被切分为多个字节范围交给不同进程
+DEFAULT_CHUNK_MB = 32
+
+
+def _convert_range(task):
+    """
+    进程池工作函数：转换输入文件的一个字节范围；给出 profile_prefix 时分析本段转换
+
+    Returns:
+        (converted, skipped, report)，report 中是分段内的行数和警告（行号相对分段开头）
+    """
+    (input_path, part_path, system_prompt, start, end, max_shard_bytes, fast, skip_offsets,
+     columns_location, profile_prefix) = task
+    columns = None
+    if columns_location is not None:
+        from medqa_columns import cached_columns
+        columns = cached_columns(*columns_location)
+    report = {}
+    with profile_section(profile_prefix, enabled=profile_prefix is not None, quiet=True):
+        converted, skipped = convert_to_bailian_format(
+            input_path, part_path, system_prompt, start=start, end=end, max_shard_bytes=max_shard_bytes,
+            fast=fast, skip_offsets=skip_offsets, columns=columns, report=report)
+    return converted, skipped, report
+
+
+def _merge_parts(part_paths, output_path, max_shard_bytes=None):
+    """按顺序逐行拼接分段输出（必要时重新分片）并删除临时文件"""
+    with ShardedJsonlWriter(output_path, max_shard_bytes) as outfile:
+        for part_path in part_paths:
+            with open(part_path, 'rb') as part:
+                for line in part:
+                    outfile.write(line)
+            os.remove(part_path)
+
+
+def _input_path(base_dir, input_rel):
+    """原始文件路径：未压缩的文件不存在时依次查找同名的 .gz / .zst 文件"""
+    input_path = base_dir / input_rel
+    if not input_path.exists():
+        for suffix in COMPRESSION_SUFFIXES:
+            candidate = input_path.with_name(input_path.name + suffix)
+            if candidate.exists():
+                return candidate
+    return input_path
+
+
+def _output_shards(output_path):
+    """返回输出的分片列表 [(路径, 大小MB), ...]；未分片时只有输出文件本身。大小均为压缩前的大小"""
+    manifest_path = shard_manifest_path(output_path)
+    if manifest_path.exists():
+        manifest = read_shard_manifest(manifest_path)
+        return [(Path(shard['file']), shard['bytes'] / (1024 * 1024)) for shard in manifest['shards']]
+    return [(output_path, uncompressed_size(output_path) / (1024 * 1024))]
+
+
+def _skip_digest(skip_offsets):
+    """去重删除集合的摘要，写入缓存参数；集合为空时输出与不去重相同，返回 None"""
+    if not skip_offsets:
+        return None
+    return hashlib.sha256(','.join(map(str, sorted(skip_offsets))).encode('ascii')).hexdigest()
+
+
+def _convert_parallel(jobs, system_prompt, workers, chunk_mb, max_shard_bytes=None, fast=False,
+                      skip_sets=None, columns=None, profile_prefix=None):
+    """
+    并行转换多个数据集
+    
+    每个数据集按 chunk_mb 切分为若干字节范围，所有范围统一提交到进程池；
+    同一数据集的分段结果按原顺序拼接，保证输出与串行转换完全一致。
+    skip_sets 为 {output_name: 要丢弃的行偏移集合}，每个分段只携带落在自己范围内的偏移。
+    给出 columns（MedQAColumns）时各进程从列式缓存读取题目。
+    给出 profile_prefix 时每个分段单独分析，输出 <profile_prefix>.<数据集>.partNNN.prof。
+    各分段返回自己读取的行数和警告，数据集转换完成后按分段顺序把行号累加换算后打印，
+    警告中的行号与串行转换一致（相对整个文件），不需要预先统计各分段的行数。
+    
+    Returns:
+        {output_name: (converted, skipped)} 或 {output_name: Exception}
+    """
+    chunk_bytes = max(1, int(chunk_mb * 1024 * 1024))
+    columns_location = columns.location if columns is not None else None
+    plans = []
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for input_rel, output_name, input_path, output_path in jobs:
+            num_ranges = max(1, -(-input_path.stat().st_size // chunk_bytes))
+            ranges = split_byte_ranges(input_path, num_ranges)
+            skip_offsets = (skip_sets or {}).get(output_name)
+            profiles = [
+                f"{profile_prefix}.{output_name}.part{i:03d}" if profile_prefix else None
+                for i in range(len(ranges))
+            ]
+            
+            if len(ranges) == 1:
+                part_paths = [output_path]
+                tasks = [(str(input_path), str(output_path), system_prompt, 0, None, max_shard_bytes, fast,
+                          skip_offsets, columns_location, profiles[0])]
+            else:
+                part_paths = [
+                    output_path.with_name(f".{output_name}.part{i:03d}")
+                    for i in range(len(ranges))
+                ]
+                tasks = [
+                    (str(input_path), str(part_path), system_prompt, start, end, None, fast,
+                     {o for o in skip_offsets if start <= o < end} if skip_offsets else None,
+                     columns_location, profile)
+                    for part_path, (start, end), profile in zip(part_paths, ranges, profiles)
+                ]
+            
+            print(f"正在转换: {input_rel} ({len(ranges)} 个分段)")
+            print(f"  -> {output_path}")
+            futures = [executor.submit(_convert_range, task) for task in tasks]
+            plans.append((output_name, output_path, part_paths, futures))
+        print()
         
-        # 美国数据集（4选项）
-        ("US/4_options/phrases_no_exclude_train.jsonl", "us_4opt_train.jsonl"),
-        ("US/4_options/phrases_no_exclude_dev.jsonl", "us_4opt_dev.jsonl"),
-        ("US/4_options/phrases_no_exclude_test.jsonl", "us_4opt_test.jsonl"),
-    ]
+        outcomes = {}
+        for output_name, output_path, part_paths, futures in plans:
+            try:
+                counts = [future.result() for future in futures]
+                lines_before = 0
+                for _, _, report in counts:
+                    for line_num, message in report['warnings']:
+                        print_warning(lines_before + line_num, message)
+                    lines_before += report['lines']
+                if len(part_paths) > 1:
+                    _merge_parts(part_paths, output_path, max_shard_bytes)
+                outcomes[output_name] = (
+                    sum(c for c, _, _ in counts),
+                    sum(s for _, s, _ in counts),
+                )
+            except Exception as e:
+                for part_path in part_paths:
+                    if part_path != output_path and part_path.exists():
+                        os.remove(part_path)
+                outcomes[output_name] = e
     
-    system_prompt = "你是一个专业的医学助手，擅长回答医学选择题。请根据题目和选项，给出正确答案。"
+    return outcomes
+
+
+def batch_convert(workers=1, chunk_mb=DEFAULT_CHUNK_MB, max_shard_mb=UPLOAD_LIMIT_MB, fast=False,
+                  force=False, dedup=None, dedup_threshold=None, use_columns=False, metrics=None,
+                  profile_prefix=None, compress=None, input_dir=None, output_dir=None, datasets=DATASETS):
+    """
+    批量转换所有 MedQA 数据集
+    
+    Args:
+        workers: 并行进程数（1 表示串行转换）
+        chunk_mb: 并行模式下单个分段的大小（MB）
+        max_shard_mb: 单个输出文件的最大大小（MB），超过时自动分片；None 或 0 表示不分片
+        fast: 是否使用高吞吐转换路径
+        force: 忽略增量缓存，重新转换所有数据集
+        dedup: 重复题目处理方式：None 不检测，'report' 只生成报告，'drop' 删除重复题目
+            （test 划分只报告不删除）
+        dedup_threshold: 近似重复的 Jaccard 相似度阈值（默认见 dedup.DEFAULT_THRESHOLD）
+        use_columns: 从 MedQA 列式缓存读取题目（见 medqa_columns.py），不再逐行解码 JSON；
+            输出与逐行解析完全一致
+        metrics: pipeline_metrics.PipelineMetrics（可选），记录列式缓存、去重、转换各阶段的
+            耗时、行数和吞吐量
+        profile_prefix: 用 cProfile 和 tracemalloc 分析转换循环，各数据集（并行时为各分段）
+            单独输出，最后合并为 <profile_prefix>.prof
+        compress: 输出压缩格式：None 不压缩，'gz' 或 'zst' 输出 xxx.jsonl.gz / xxx.jsonl.zst
+            （分片上限仍按压缩前的大小计算）
+        input_dir: 原始数据目录（默认 datasets/MedQA/questions）
+        output_dir: 输出目录（默认 datasets/MedQA_BaiLian）
+        datasets: [(相对 input_dir 的输入路径, 输出文件名), ...]（默认 DATASETS）
+    
+    Returns:
+        各数据集的转换结果 [{'name', 'converted', 'skipped', 'size_mb', 'shards', 'max_shard_mb'}, ...]，
+        转换失败的数据集不在其中
+    """
+    metrics = metrics or PipelineMetrics("batch_convert")
+    
+    # 由于脚本在"数据处理"子文件夹中，需要向上一层找到项目根目录
+    base_dir = Path(input_dir) if input_dir else Path(__file__).parent.parent / "datasets" / "MedQA" / "questions"
+    output_dir = Path(output_dir) if output_dir else Path(__file__).parent.parent / "datasets" / "MedQA_BaiLian"
+    
+    system_prompt = SYSTEM_PROMPT
+    max_shard_bytes = int(max_shard_mb * 1024 * 1024) if max_shard_mb else None
+    
+    # 影响输出内容的参数，任一变化都会使对应数据集的缓存失效
+    params = {
+        'system_prompt': system_prompt,
+        'converter_version': CONVERTER_VERSION,
+        'max_shard_bytes': max_shard_bytes,
+    }
     
     # 创建输出目录
     output_dir.mkdir(parents=True, exist_ok=True)
+    cache = ConversionCache(output_dir)
     
     print("=" * 60)
     print("批量转换 MedQA 数据集为百炼平台格式")
+    if workers > 1:
+        print(f"并行模式: {workers} 个进程, 分段大小 {chunk_mb} MB")
+    if compress:
+        print(f"输出压缩: .jsonl.{compress}")
     print("=" * 60)
     print()
     
-    results = []
-    
+    jobs = []
     for input_rel, output_name in datasets:
-        input_path = base_dir / input_rel
+        input_path = _input_path(base_dir, input_rel)
+        if compression_of(input_path):
+            input_rel = str(Path(input_rel).with_name(input_path.name).as_posix())
+        if compress:
+            output_name = f"{output_name}.{compress}"
         output_path = output_dir / output_name
         
         if not input_path.exists():
             print(f"⚠️  跳过 (文件不存在): {input_rel}")
             continue
         
-        print(f"正在转换: {input_rel}")
-        print(f"  -> {output_path}")
+        jobs.append((input_rel, output_name, input_path, output_path))
+    
+    # 列式缓存：源文件未变化时直接复用，否则重新解析一次
+    columns = None
+    if use_columns and jobs:
+        import medqa_columns
         
-        try:
-            converted, skipped = convert_to_bailian_format(
-                str(input_path),
-                str(output_path),
-                system_prompt
+        with metrics.phase("columns") as phase:
+            # 缓存放在题目目录旁边的 .columns（默认即 datasets/MedQA/.columns）
+            columns = medqa_columns.build_columns(base_dir, base_dir.parent / ".columns")
+            phase.add(rows=len(columns))
+        print(f"🗂️  使用列式缓存: {columns.columns_dir}（{len(columns)} 题）\n")
+    
+    # 重复题目检测：所有划分一起读取一遍，得到每个数据集要删除的行
+    skip_sets = {}
+    if dedup and jobs:
+        import dedup as dedup_stage
+        
+        threshold = dedup_threshold or dedup_stage.DEFAULT_THRESHOLD
+        with metrics.phase("dedup", mode=dedup) as phase:
+            result = dedup_stage.deduplicate(
+                [(output_name, input_path) for _, output_name, input_path, _ in jobs],
+                workers=workers, chunk_mb=chunk_mb, threshold=threshold, columns=columns,
             )
+            phase.add(bytes=sum(input_path.stat().st_size for _, _, input_path, _ in jobs),
+                      duplicates=len(result['duplicates']))
+        dedup_stage.print_summary(result)
+        report_path = output_dir / DEDUP_REPORT_FILE_NAME
+        dedup_stage.write_report(result, report_path)
+        print(f"重复题目报告: {report_path}（{len(result['duplicates'])} 条）\n")
+        if dedup == 'drop':
+            skip_sets = {name: offsets for name, offsets in result['drop'].items() if offsets}
+    
+    fingerprints = {}
+    cached = {}
+    dataset_params = {}
+    for input_rel, output_name, input_path, output_path in jobs:
+        dataset_params[output_name] = dict(params, dedup=_skip_digest(skip_sets.get(output_name)))
+        fingerprints[output_name] = cache.input_fingerprint(output_name, input_path)
+        if not force:
+            entry = cache.lookup(output_name, fingerprints[output_name], dataset_params[output_name])
+            if entry:
+                cached[output_name] = entry
+    
+    pending = [job for job in jobs if job[1] not in cached]
+    metrics.count("datasets_cached", len(cached))
+    
+    if workers > 1 and pending:
+        # 并行时各数据集的分段交错执行，只能整体计时
+        with metrics.phase("convert", dataset="*", workers=workers) as phase:
+            outcomes = _convert_parallel(pending, system_prompt, workers, chunk_mb, max_shard_bytes, fast,
+                                         skip_sets, columns, profile_prefix)
+            phase.add(rows=sum(o[0] for o in outcomes.values() if not isinstance(o, Exception)),
+                      skipped=sum(o[1] for o in outcomes.values() if not isinstance(o, Exception)),
+                      bytes=sum(input_path.stat().st_size for _, _, input_path, _ in pending))
+    else:
+        outcomes = None
+    
+    results = []
+    
+    for input_rel, output_name, input_path, output_path in jobs:
+        if output_name in cached:
+            entry = cached[output_name]
+            # 分片列表和压缩前的大小记录在缓存中；早期的缓存记录没有这一项时重新统计
+            if 'shards' in entry:
+                shards = [(output_path.with_name(shard['file']), shard['size_mb']) for shard in entry['shards']]
+            else:
+                shards = _output_shards(output_path)
+            print(f"♻️  未变化，跳过: {input_rel}")
+            results.append({
+                'name': output_name,
+                'converted': entry['converted'],
+                'skipped': entry['skipped'],
+                'size_mb': sum(size for _, size in shards),
+                'shards': len(shards),
+                'max_shard_mb': max(size for _, size in shards),
+            })
+            continue
+        
+        if outcomes is None:
+            print(f"正在转换: {input_rel}")
+            print(f"  -> {output_path}")
+        else:
+            print(f"已转换: {input_rel}")
+        
+        try:
+            if outcomes is None:
+                with metrics.phase("convert", dataset=output_name, workers=1) as phase, \
+                        profile_section(f"{profile_prefix}.{output_name}", enabled=profile_prefix is not None,
+                                        quiet=True):
+                    converted, skipped = convert_to_bailian_format(
+                        str(input_path),
+                        str(output_path),
+                        system_prompt,
+                        max_shard_bytes=max_shard_bytes,
+                        fast=fast,
+                        skip_offsets=skip_sets.get(output_name),
+                        columns=columns
+                    )
+                    phase.add(rows=converted, skipped=skipped, bytes=input_path.stat().st_size)
+            elif isinstance(outcomes[output_name], Exception):
+                raise outcomes[output_name]
+            else:
+                converted, skipped = outcomes[output_name]
             
-            file_size_mb = output_path.stat().st_size / (1024 * 1024)
+            shards = _output_shards(output_path)
+            file_size_mb = sum(size for _, size in shards)
+            
+            output_files = [path for path, _ in shards]
+            if len(shards) > 1:
+                output_files.append(shard_manifest_path(output_path))
+            cache.record(output_name, input_rel, fingerprints[output_name], dataset_params[output_name],
+                         output_files, converted, skipped, shards)
             
             results.append({
                 'name': output_name,
                 'converted': converted,
                 'skipped': skipped,
-                'size_mb': file_size_mb
+                'size_mb': file_size_mb,
+                'shards': len(shards),
+                'max_shard_mb': max(size for _, size in shards),
             })
             
-            status = "✅" if file_size_mb <= 300 else "⚠️  (超过300MB限制)"
-            print(f"  完成: {converted} 条, {file_size_mb:.2f} MB {status}\n")
+            status = "✅" if results[-1]['max_shard_mb'] <= UPLOAD_LIMIT_MB else f"⚠️  (超过{UPLOAD_LIMIT_MB}MB限制)"
+            print(f"  完成: {converted} 条, {file_size_mb:.2f} MB {status}")
+            if len(shards) > 1:
+                for shard_file, shard_size in shards:
+                    print(f"    分片 {shard_file.name}: {shard_size:.2f} MB")
+            print()
             
         except Exception as e:
+            cache.invalidate(output_name)
+            metrics.count("datasets_failed")
             print(f"  ❌ 错误: {e}\n")
             continue
     
+    if profile_prefix is not None and pending:
+        merge_profiles(sorted(Path(profile_prefix).parent.glob(f"{Path(profile_prefix).name}.*.prof")),
+                       profile_prefix)
+    
     # 显示汇总
     print("=" * 60)
     print("转换汇总")
@@ -87,7 +406,8 @@ def batch_convert():
     total_size = sum(r['size_mb'] for r in results)
     
     for result in results:
-        print(f"{result['name']:<35} {result['converted']:>6} 条  {result['size_mb']:>8.2f} MB")
+        shard_note = f"  ({result['shards']} 个分片)" if result['shards'] > 1 else ""
+        print(f"{result['name']:<35} {result['converted']:>6} 条  {result['size_mb']:>8.2f} MB{shard_note}")
     
     print("-" * 60)
     print(f"{'总计':<35} {total_converted:>6} 条  {total_size:>8.2f} MB")
@@ -96,14 +416,62 @@ def batch_convert():
     print()
     
     # 大文件警告
-    large_files = [r for r in results if r['size_mb'] > 300]
+    large_files = [r for r in results if r['max_shard_mb'] > UPLOAD_LIMIT_MB]
     if large_files:
-        print("⚠️  以下文件超过 300MB，需要分割:")
+        print(f"⚠️  以下文件超过 {UPLOAD_LIMIT_MB}MB，需要分割（可使用 --max-shard-mb 自动分片）:")
         for r in large_files:
-            print(f"  - {r['name']}: {r['size_mb']:.2f} MB")
+            print(f"  - {r['name']}: {r['max_shard_mb']:.2f} MB")
         print()
+    
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量转换 MedQA 数据集为百炼平台格式')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='并行进程数（默认 1，即串行转换；0 表示使用全部 CPU 核心）')
+    parser.add_argument('--chunk-mb', type=float, default=DEFAULT_CHUNK_MB,
+                       help=f'并行模式下大文件的分段大小，单位 MB（默认 {DEFAULT_CHUNK_MB}）')
+    parser.add_argument('--max-shard-mb', type=float, default=UPLOAD_LIMIT_MB,
+                       help=f'单个输出文件的最大大小，超过时自动分片（默认 {UPLOAD_LIMIT_MB}，0 表示不分片）')
+    parser.add_argument('--fast', action='store_true',
+                       help='使用高吞吐转换路径，输出与默认路径一致')
+    parser.add_argument('--force', action='store_true',
+                       help='忽略增量缓存，重新转换所有数据集')
+    parser.add_argument('--dedup', action='store_true',
+                       help='删除完全重复和近似重复的题目（test 划分只报告不删除），报告写入 dedup_report.jsonl')
+    parser.add_argument('--dedup-report', action='store_true',
+                       help='只检测重复题目并生成报告，不删除')
+    parser.add_argument('--dedup-threshold', type=float, default=None,
+                       help='近似重复的相似度阈值（MinHash 估计的 Jaccard 相似度，默认 0.8）')
+    parser.add_argument('--columns', action='store_true',
+                       help='从 MedQA 列式缓存读取题目（首次运行时建立），转换和去重不再逐行解码 JSON')
+    parser.add_argument('--metrics', metavar='FILE',
+                       help='把各阶段耗时、行/秒、MB/秒和内存峰值写入指标文件（.prom 结尾为 Prometheus textfile，'
+                            '否则为 JSON Lines；默认读取环境变量 METRICS_FILE）')
+    parser.add_argument('--profile', nargs='?', const='', metavar='PREFIX',
+                       help='用 cProfile 和 tracemalloc 分析转换循环（并行时每个分段单独分析后合并），'
+                            '默认写入 datasets/MedQA_BaiLian/.profile/')
+    parser.add_argument('--compress', choices=['gz', 'zst'],
+                       help='压缩输出为 .jsonl.gz 或 .jsonl.zst（zst 需要 pip install zstandard）；'
+                            '分片上限和 300MB 检查仍按压缩前的大小计算')
+    
+    args = parser.parse_args()
+    
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    dedup = 'drop' if args.dedup else ('report' if args.dedup_report else None)
+    metrics = PipelineMetrics.from_env("batch_convert", args.metrics)
+    profile_prefix = None
+    if args.profile is not None:
+        profile_prefix = str(args.profile or default_profile_prefix("batch_convert"))
+    with metrics.phase("total", workers=workers):
+        batch_convert(workers=workers, chunk_mb=args.chunk_mb, max_shard_mb=args.max_shard_mb, fast=args.fast,
+                      force=args.force, dedup=dedup, dedup_threshold=args.dedup_threshold,
+                      use_columns=args.columns, metrics=metrics, profile_prefix=profile_prefix,
+                      compress=args.compress)
+    metrics.close()
 
 
 if __name__ == '__main__':
-    batch_convert()
+    main()
 
@@ -0,0 +1,404 @@
+"""
+离线 Batch 接口评测
+
+同步评测（evaluate_model.py）每道题占用一个连接等待回答。测试集较大、又不需要
+立即拿到结果时，可以改用百炼 OpenAI 兼容的 Batch 接口（/compatible-mode/v1），
+价格是实时调用的一半：
+1. 流式读取测试集，生成 Batch 请求文件（每行一个 /v1/chat/completions 请求），
+   超过单文件请求数或大小上限时自动拆成多个文件
+2. 上传请求文件（purpose=batch）并为每个文件创建 Batch 任务
+3. 轮询任务状态，状态和进度都不变时逐渐拉长轮询间隔，只在状态变化时输出
+4. 任务结束后流式下载结果文件和错误文件，按 custom_id 对应回原题目，
+   写成与同步评测相同格式的结果文件并统计准确率
+
+提交后的任务记录在结果文件旁的 xxx.batch.json 中：中途退出（或使用 --no-wait）后
+用相同参数重新运行，会继续轮询已提交的任务而不是重复提交。全部收回后再次运行，
+只会为出错或缺失的题目提交新的任务。
+
+用法：
+    python batch_eval.py <model_id> ../datasets/MedQA_BaiLian/mainland_4opt_test.jsonl
+    python batch_eval.py <model_id> <test_file> --no-wait        # 只提交，稍后再运行收取结果
+    python batch_eval.py <model_id> <test_file> --max-requests 1000 --limit 5000
+"""
+
+import os
+import json
+import time
+from pathlib import Path
+
+from dashscope_http import DashScopeHTTPClient
+from evaluate_model import (
+    default_output_file,
+    extract_answer,
+    iter_eval_items,
+    load_results,
+    print_summary,
+    summarize,
+)
+from upload_stream import MultipartFileStream
+
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+
+# 单个请求文件的上限
+MAX_REQUESTS_PER_FILE = 50000
+MAX_FILE_MB = 500
+
+# 任务结束状态，进入后不再轮询
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+STATUS_LABELS = {
+    "validating": "🔍 校验中",
+    "in_progress": "🔄 处理中",
+    "finalizing": "📦 生成结果",
+    "completed": "✅ 完成",
+    "failed": "❌ 失败",
+    "expired": "⌛ 已过期",
+    "cancelling": "🚫 取消中",
+    "cancelled": "🚫 已取消",
+}
+
+
+def compatible_base(api_base=None):
+    """
+    OpenAI 兼容接口地址
+
+    优先读取 DASHSCOPE_COMPATIBLE_BASE；否则由 DASHSCOPE_API_BASE 的 /api/v1 换成
+    /compatible-mode/v1，指向本地替身服务时两者自动一致。
+    """
+    explicit = os.getenv("DASHSCOPE_COMPATIBLE_BASE")
+    if explicit:
+        return explicit.rstrip("/")
+    api_base = (api_base or os.getenv("DASHSCOPE_API_BASE", "https://dashscope.aliyuncs.com/api/v1")).rstrip("/")
+    if api_base.endswith("/api/v1"):
+        api_base = api_base[:-len("/api/v1")]
+    return f"{api_base}/compatible-mode/v1"
+
+
+def custom_id(index):
+    return f"item-{index}"
+
+
+def parse_custom_id(value):
+    return int(value.rsplit("-", 1)[1])
+
+
+def batch_state_file(output_file):
+    """已提交任务的记录文件：eval_results/<数据集>.<模型>.batch.json"""
+    return Path(output_file).with_suffix(".batch.json")
+
+
+def write_request_files(dataset_path, model_id, input_dir, name, skip=(), limit=None,
+                        max_requests=MAX_REQUESTS_PER_FILE, max_file_mb=MAX_FILE_MB):
+    """
+    流式生成 Batch 请求文件，超过请求数或大小上限时换下一个文件
+
+    Args:
+        skip: 已有结果的题目序号，不再生成请求
+
+    Returns:
+        [{'input_file': 路径, 'requests': 请求数}]
+    """
+    input_dir = Path(input_dir)
+    input_dir.mkdir(parents=True, exist_ok=True)
+    max_bytes = int(max_file_mb * 1024 * 1024)
+
+    files = []
+    outfile = None
+    size = 0
+    for index, messages, _ in iter_eval_items(dataset_path, limit):
+        if index in skip:
+            continue
+        line = json.dumps({
+            'custom_id': custom_id(index),
+            'method': 'POST',
+            'url': BATCH_ENDPOINT,
+            'body': {'model': model_id, 'messages': messages},
+        }, ensure_ascii=False).encode('utf-8') + b'\n'
+
+        if outfile is None or files[-1]['requests'] >= max_requests or size + len(line) > max_bytes:
+            if outfile is not None:
+                outfile.close()
+            path = input_dir / f"{name}.batch{len(files):03d}.jsonl"
+            outfile = open(path, 'wb')
+            files.append({'input_file': str(path), 'requests': 0})
+            size = 0
+        outfile.write(line)
+        size += len(line)
+        files[-1]['requests'] += 1
+
+    if outfile is not None:
+        outfile.close()
+    return files
+
+
+class BatchClient:
+    """OpenAI 兼容的文件和 Batch 接口"""
+
+    def __init__(self, api_key, base_url=None, max_retries=3):
+        self.http = DashScopeHTTPClient(api_key, base_url or compatible_base(), max_retries=max_retries,
+                                        timeout=(5.0, 600.0))
+
+    @staticmethod
+    def _check(response, action):
+        if response.status_code != 200:
+            raise RuntimeError(f"{action}失败: HTTP {response.status_code} {response.text[:200]}")
+        return response.json()
+
+    def upload(self, file_path):
+        """上传请求文件，返回 File ID"""
+        body = MultipartFileStream(file_path, 'file', {'purpose': 'batch'}, 'application/jsonl')
+        response = self.http.post("files", data=body, headers={"Content-Type": body.content_type})
+        return self._check(response, "上传请求文件")['id']
+
+    def create(self, input_file_id, metadata=None):
+        """创建 Batch 任务（非幂等，只在服务端确定未处理时重试）"""
+        body = {'input_file_id': input_file_id, 'endpoint': BATCH_ENDPOINT,
+                'completion_window': COMPLETION_WINDOW}
+        if metadata:
+            body['metadata'] = metadata
+        response = self.http.post("batches", json=body, idempotent=False)
+        return self._check(response, "创建 Batch 任务")
+
+    def retrieve(self, batch_id):
+        return self._check(self.http.get(f"batches/{batch_id}"), "查询 Batch 任务")
+
+    def iter_file_lines(self, file_id):
+        """流式下载文件内容，逐行返回"""
+        response = self.http.get(f"files/{file_id}/content", stream=True)
+        if response.status_code != 200:
+            response.close()
+            raise RuntimeError(f"下载结果文件失败: HTTP {response.status_code}")
+        with response:
+            for line in response.iter_lines():
+                if line.strip():
+                    yield line
+
+    def close(self):
+        self.http.close()
+
+
+def parse_result_line(line):
+    """
+    解析结果文件或错误文件中的一行
+
+    Returns:
+        (题目序号, 回答文本, 错误信息)：成功时错误信息为 None
+    """
+    item = json.loads(line)
+    index = parse_custom_id(item['custom_id'])
+    response = item.get('response') or {}
+    if item.get('error'):
+        error = item['error']
+        return index, None, f"{error.get('code')}: {error.get('message')}"
+    if response.get('status_code') != 200:
+        body = response.get('body') or {}
+        message = (body.get('error') or {}).get('message') or body.get('message') or ''
+        return index, None, f"HTTP {response.get('status_code')}: {message}"
+    return index, response['body']['choices'][0]['message']['content'], None
+
+
+def _load_state(state_file):
+    if not state_file.exists():
+        return None
+    with open(state_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_state(state_file, state):
+    temp_file = state_file.with_name(state_file.name + ".tmp")
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(temp_file, state_file)
+
+
+def submit(client, state, state_file, dataset_name):
+    """上传尚未上传的请求文件并创建任务，每一步完成后立即保存状态"""
+    for batch in state['batches']:
+        if not batch.get('input_file_id'):
+            batch['input_file_id'] = client.upload(batch['input_file'])
+            _save_state(state_file, state)
+        if not batch.get('batch_id'):
+            created = client.create(batch['input_file_id'], {'dataset': dataset_name, 'model': state['model']})
+            batch['batch_id'] = created['id']
+            batch['status'] = created.get('status', 'validating')
+            _save_state(state_file, state)
+            print(f"📤 已提交 {Path(batch['input_file']).name}: {batch['requests']} 个请求 -> {batch['batch_id']}")
+
+
+def collect(client, batch, golds, outfile):
+    """
+    下载一个已结束任务的结果，写入结果文件
+
+    请求文件中没有出现在结果和错误文件里的题目（如任务过期）记为错误。
+
+    Returns:
+        写入的记录数
+    """
+    with open(batch['input_file'], 'r', encoding='utf-8') as f:
+        pending = {parse_custom_id(json.loads(line)['custom_id']) for line in f if line.strip()}
+
+    def write(index, text, error):
+        pred = extract_answer(text) if error is None else None
+        gold = golds.get(index)
+        record = {
+            'index': index,
+            'gold': gold,
+            'pred': pred,
+            'correct': error is None and pred is not None and pred == gold,
+            'latency_ms': None,
+            'error': error,
+            'response': text,
+        }
+        outfile.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    written = 0
+    for key in ('output_file_id', 'error_file_id'):
+        if not batch.get(key):
+            continue
+        for line in client.iter_file_lines(batch[key]):
+            index, text, error = parse_result_line(line)
+            if index not in pending:
+                continue
+            pending.discard(index)
+            write(index, text, error)
+            written += 1
+
+    for index in sorted(pending):
+        write(index, None, f"batch {batch['status']}: 未返回结果")
+        written += 1
+    outfile.flush()
+    return written
+
+
+def _print_progress(batch):
+    counts = batch.get('request_counts') or {}
+    label = STATUS_LABELS.get(batch['status'], batch['status'])
+    progress = ""
+    if counts.get('total'):
+        progress = f"  {counts.get('completed', 0)}/{counts['total']}（失败 {counts.get('failed', 0)}）"
+    print(f"   {batch['batch_id']}: {label}{progress}")
+
+
+def run_batch_eval(model_id, dataset_path, output_file=None, api_key=None, limit=None, wait=True,
+                   max_requests=MAX_REQUESTS_PER_FILE, max_file_mb=MAX_FILE_MB,
+                   min_interval=10.0, max_interval=300.0, backoff=1.5, client=None):
+    """
+    用 Batch 接口评测
+
+    Args:
+        output_file: 结果文件（默认 eval_results/<数据集>.<模型>.jsonl，与同步评测共用）
+        wait: False 时提交后立即返回，之后用相同参数再次调用收取结果
+        min_interval / max_interval: 轮询间隔范围（秒），状态不变时按 backoff 倍数拉长
+        client: BatchClient（默认按环境变量创建）
+
+    Returns:
+        汇总字典（见 evaluate_model.summarize）；任务尚未结束时返回 None
+    """
+    output_file = Path(output_file or default_output_file(dataset_path, model_id))
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    state_file = batch_state_file(output_file)
+    own_client = client is None
+    client = client or BatchClient(api_key or os.getenv("DASHSCOPE_API_KEY"))
+
+    try:
+        state = _load_state(state_file)
+        if state is None:
+            done = {index for index, record in load_results(output_file).items() if record['error'] is None}
+            if done:
+                print(f"♻️  已有 {len(done)} 道题目的结果，只为其余题目提交任务")
+            files = write_request_files(dataset_path, model_id, output_file.parent / "batch_inputs",
+                                        output_file.stem, done, limit, max_requests, max_file_mb)
+            if not files:
+                print("✅ 所有题目都已有结果，无需提交")
+                return summarize(load_results(output_file))
+            state = {'dataset': str(dataset_path), 'model': model_id, 'limit': limit,
+                     'created_at': time.time(), 'batches': files}
+            _save_state(state_file, state)
+            print(f"📝 生成 {len(files)} 个请求文件，共 {sum(b['requests'] for b in files)} 个请求")
+        else:
+            print(f"♻️  继续跟踪已提交的 {len(state['batches'])} 个 Batch 任务（{state_file.name}）")
+
+        submit(client, state, state_file, Path(dataset_path).name)
+        if not wait:
+            print("💡 任务已提交，稍后用相同参数重新运行即可收取结果")
+            return None
+
+        golds = {index: gold for index, _, gold in iter_eval_items(dataset_path, state.get('limit'))}
+        interval = min_interval
+        with open(output_file, 'a', encoding='utf-8') as outfile:
+            while True:
+                changed = False
+                for batch in state['batches']:
+                    if batch.get('collected'):
+                        continue
+                    if batch.get('status') not in TERMINAL_STATUSES:
+                        info = client.retrieve(batch['batch_id'])
+                        counts = info.get('request_counts')
+                        status_changed = info['status'] != batch.get('status')
+                        changed = changed or status_changed or counts != batch.get('request_counts')
+                        batch.update(status=info['status'], request_counts=counts,
+                                     output_file_id=info.get('output_file_id'),
+                                     error_file_id=info.get('error_file_id'))
+                        if status_changed:
+                            _print_progress(batch)
+                    if batch['status'] in TERMINAL_STATUSES:
+                        written = collect(client, batch, golds, outfile)
+                        batch['collected'] = True
+                        changed = True
+                        print(f"📥 收回 {batch['batch_id']} 的 {written} 条结果")
+                    _save_state(state_file, state)
+
+                if all(batch.get('collected') for batch in state['batches']):
+                    break
+                interval = min_interval if changed else min(max_interval, interval * backoff)
+                time.sleep(interval)
+
+        for batch in state['batches']:
+            Path(batch['input_file']).unlink(missing_ok=True)
+        state_file.unlink()
+        return summarize(load_results(output_file))
+    finally:
+        if own_client:
+            client.close()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='用百炼 Batch 接口离线评测模型')
+    parser.add_argument('model_id', help='模型 ID（微调后的模型或基础模型）')
+    parser.add_argument('test_file', help='测试集路径（百炼格式 JSONL 或分片清单）')
+    parser.add_argument('--output', help='结果文件路径（默认: eval_results/<数据集>.<模型>.jsonl）')
+    parser.add_argument('--limit', type=int, default=None, help='只评测前 N 道题')
+    parser.add_argument('--no-wait', action='store_true', help='提交后立即退出，之后用相同参数重新运行收取结果')
+    parser.add_argument('--max-requests', type=int, default=MAX_REQUESTS_PER_FILE,
+                        help=f'单个请求文件的最大请求数（默认 {MAX_REQUESTS_PER_FILE}）')
+    parser.add_argument('--max-file-mb', type=float, default=MAX_FILE_MB,
+                        help=f'单个请求文件的最大大小（MB，默认 {MAX_FILE_MB}）')
+    parser.add_argument('--poll-interval', type=float, default=10, help='最短轮询间隔（秒，默认 10）')
+    parser.add_argument('--max-poll-interval', type=float, default=300, help='最长轮询间隔（秒，默认 300）')
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    api_key = os.getenv("DASHSCOPE_API_KEY")
+    if not api_key:
+        print("❌ 请在 .env 文件中设置 DASHSCOPE_API_KEY")
+        return
+
+    try:
+        summary = run_batch_eval(args.model_id, args.test_file, args.output, api_key, args.limit,
+                                 wait=not args.no_wait, max_requests=args.max_requests,
+                                 max_file_mb=args.max_file_mb, min_interval=args.poll_interval,
+                                 max_interval=args.max_poll_interval)
+    except KeyboardInterrupt:
+        print("\n⚠️  已停止等待，任务仍在服务端运行，重新运行相同命令即可继续收取结果")
+        return
+    if summary is not None:
+        print_summary(summary, f"Batch 评测结果: {args.model_id}")
+
+
+if __name__ == '__main__':
+    main()
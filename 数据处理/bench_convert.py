@@ -0,0 +1,389 @@
+"""
+转换基准测试：用可复现的合成 MedQA 数据（1 万到 1000 万行）测量
+convert_to_bailian_format（标准路径、--fast 路径）和 batch_convert 并行路径的
+行/秒、MB/秒、内存峰值和输出大小，并与保存的基线比较。
+
+合成数据按固定种子生成，中文（大陆、台湾）、英文和中英混合题目按比例混合，
+有 4 选项和 5 选项题目，题干长短不一，少量行包含引号、反斜杠、换行等需要转义的
+字符，另有约千分之一的坏行用于覆盖跳过逻辑。生成的文件保存在 --data-dir 中，
+规模和种子相同时直接复用。
+
+每次测量都在新的子进程中进行，内存峰值互不影响。每个用例默认测量 5 次，用耗时的中位数
+与基线比较，单次测量的偶然波动（同一台机器上相邻两次可差 ±20%）不会被误报为退化；
+结果表同时给出最快一次和各次之间的波动幅度。batch 用例调用公开的 batch_convert()，
+包括其中的增量缓存检查、分段计数和输出合并。
+
+用法：
+    python bench_convert.py                                        # 默认 1 万、10 万、100 万行
+    python bench_convert.py --scales 10k,1m,10m --paths convert-fast,batch --workers 8
+    python bench_convert.py --save-baseline                        # 把本次结果保存为基线
+    python bench_convert.py --json bench_convert.json              # 结果另存为 JSON
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import statistics
+import argparse
+import platform
+import tempfile
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from pipeline_metrics import peak_rss_bytes
+
+
+# 合成数据格式变化时递增，旧的缓存数据不再复用
+GENERATOR_VERSION = 1
+
+PATHS = ("convert", "convert-fast", "batch")
+
+DEFAULT_SCALES = "10k,100k,1m"
+
+DEFAULT_BASELINE = Path(__file__).parent / "bench_convert_baseline.json"
+
+DEFAULT_DATA_DIR = Path(tempfile.gettempdir()) / "medqa_bench"
+
+# 每个用例的测量次数，取耗时的中位数
+DEFAULT_REPEAT = 5
+
+# 中位数行/秒下降或内存峰值上升超过该比例时视为性能退化
+DEFAULT_TOLERANCE = 0.15
+
+# 题目语言分布：(语言, 权重)
+LANGUAGE_MIX = (("zh-CN", 0.45), ("zh-TW", 0.15), ("en", 0.30), ("mixed", 0.10))
+
+# 5 选项题目的比例（其余为 4 选项）
+FIVE_OPTION_RATE = 0.15
+
+# 含需要转义字符的行、坏行的比例
+SPECIAL_CHAR_RATE = 0.02
+BAD_LINE_RATE = 0.001
+
+ZH_CN_TERMS = (
+    "患者", "男性", "女性", "岁", "发热", "咳嗽", "腹痛", "胸痛", "头痛", "呕吐", "腹泻", "乏力", "心悸",
+    "呼吸困难", "血压", "心率", "体温", "白细胞", "血红蛋白", "血小板", "肝功能", "肾功能", "尿蛋白",
+    "腰椎穿刺", "脑脊液", "心电图", "胸片", "CT", "超声", "诊断", "治疗", "首选", "最可能", "禁忌",
+    "急性", "慢性", "阑尾炎", "肺炎", "心肌梗死", "糖尿病", "高血压", "肝硬化", "胃溃疡", "贫血",
+    "抗生素", "青霉素", "阿司匹林", "胰岛素", "手术", "复查", "随访", "既往史", "查体", "入院",
+)
+
+ZH_TW_TERMS = (
+    "病人", "男性", "女性", "歲", "發燒", "咳嗽", "腹痛", "胸痛", "頭痛", "嘔吐", "腹瀉", "疲倦", "心悸",
+    "呼吸困難", "血壓", "心跳", "體溫", "白血球", "血紅素", "血小板", "肝功能", "腎功能", "蛋白尿",
+    "腰椎穿刺", "腦脊髓液", "心電圖", "胸部X光", "電腦斷層", "超音波", "診斷", "治療", "首選", "最可能",
+    "急性", "慢性", "闌尾炎", "肺炎", "心肌梗塞", "糖尿病", "高血壓", "肝硬化", "胃潰瘍", "貧血",
+)
+
+EN_TERMS = (
+    "patient", "presents", "with", "a", "history", "of", "fever", "cough", "abdominal", "pain", "chest",
+    "headache", "vomiting", "diarrhea", "fatigue", "palpitations", "dyspnea", "blood", "pressure", "heart",
+    "rate", "temperature", "leukocyte", "count", "hemoglobin", "platelet", "serum", "creatinine", "lumbar",
+    "puncture", "cerebrospinal", "fluid", "ECG", "shows", "ST", "elevation", "most", "likely", "diagnosis",
+    "next", "best", "step", "in", "management", "acute", "chronic", "appendicitis", "pneumonia",
+    "myocardial", "infarction", "diabetes", "hypertension", "cirrhosis", "ulcer", "anemia", "year-old",
+    "man", "woman", "emergency", "department", "examination", "reveals", "tenderness", "mg/dL", "mm Hg",
+)
+
+MIXED_TERMS = ZH_CN_TERMS + ("ECG", "MRI", "PCI", "ARDS", "HbA1c", "TNF-α", "IL-6", "mg/kg", "mmol/L", "ICU")
+
+SPECIAL_PIECES = ('"引号"', "\\", "\n", "\t", "5～10℃", "<0.05", "μg", "'single'", "α/β", "©")
+
+OPTION_LABELS = "ABCDE"
+
+META_INFO = {"zh-CN": ("第一部分　基础医学", "第二部分　临床医学"), "zh-TW": ("醫師國考",),
+             "en": ("step1", "step2&3"), "mixed": ("临床医学",)}
+
+
+def parse_scale(text):
+    """'10k' -> 10000，'1m' -> 1000000"""
+    text = text.strip().lower()
+    multiplier = {'k': 1000, 'm': 1000 * 1000}.get(text[-1:], 1)
+    number = text[:-1] if multiplier > 1 else text
+    return int(float(number) * multiplier)
+
+
+def format_scale(rows):
+    if rows >= 1000 * 1000 and rows % (1000 * 1000) == 0:
+        return f"{rows // (1000 * 1000)}m"
+    if rows >= 1000 and rows % 1000 == 0:
+        return f"{rows // 1000}k"
+    return str(rows)
+
+
+def _text(rng, language, min_words, max_words):
+    if language == "en":
+        return " ".join(rng.choices(EN_TERMS, k=rng.randint(min_words, max_words)))
+    terms = ZH_TW_TERMS if language == "zh-TW" else (MIXED_TERMS if language == "mixed" else ZH_CN_TERMS)
+    return "".join(rng.choices(terms, k=rng.randint(min_words, max_words)))
+
+
+def synthetic_record(rng):
+    """生成一条合成 MedQA 记录"""
+    languages, weights = zip(*LANGUAGE_MIX)
+    language = rng.choices(languages, weights)[0]
+    # 英文题多为较长的病例描述
+    question = _text(rng, language, 20, 80) if language == "en" else _text(rng, language, 6, 40)
+    question += "?" if language == "en" else "（　　）。"
+    if rng.random() < SPECIAL_CHAR_RATE:
+        position = rng.randint(0, len(question))
+        question = question[:position] + rng.choice(SPECIAL_PIECES) + question[position:]
+
+    num_options = 5 if rng.random() < FIVE_OPTION_RATE else 4
+    options = {label: _text(rng, language, 1, 6) for label in OPTION_LABELS[:num_options]}
+    answer_idx = rng.choice(OPTION_LABELS[:num_options])
+    return {
+        "question": question,
+        "options": options,
+        "answer": options[answer_idx],
+        "meta_info": rng.choice(META_INFO[language]),
+        "answer_idx": answer_idx,
+    }
+
+
+def generate_dataset(output_file, rows, seed=42):
+    """按固定种子生成 rows 行原始 MedQA 格式数据（含少量坏行）"""
+    rng = random.Random(seed)
+    temp_file = Path(output_file).with_name(Path(output_file).name + ".tmp")
+    with open(temp_file, 'w', encoding='utf-8', buffering=4 * 1024 * 1024) as f:
+        for _ in range(rows):
+            if rng.random() < BAD_LINE_RATE:
+                f.write("{bad json\n")
+            else:
+                f.write(json.dumps(synthetic_record(rng), ensure_ascii=False) + "\n")
+    os.replace(temp_file, output_file)
+
+
+def dataset_path(data_dir, rows, seed):
+    """合成数据文件；同一规模和种子的数据只生成一次"""
+    data_dir = Path(data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    path = data_dir / f"synthetic_{format_scale(rows)}_seed{seed}_v{GENERATOR_VERSION}.jsonl"
+    if not path.exists():
+        print(f"🧬 生成合成数据: {path.name} ({rows} 行)...", flush=True)
+        start = time.perf_counter()
+        generate_dataset(path, rows, seed)
+        print(f"   {path.stat().st_size / (1024 * 1024):.1f} MB，用时 {time.perf_counter() - start:.1f} 秒")
+    return path
+
+
+def _output_bytes(output_path):
+    """输出总大小（输出目录是本次测量专用的临时目录，其中的分片和清单都计入，增量缓存文件不计入）"""
+    return sum(p.stat().st_size for p in output_path.parent.iterdir() if p.name.startswith(output_path.stem))
+
+
+def _silence_stdout():
+    """测量子进程的初始化函数：坏行警告和进度输出（包括并行路径的各个工作进程）都丢弃"""
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    os.close(devnull)
+
+
+def _measure(path_name, input_file, output_file, workers, chunk_mb):
+    """在子进程中转换一次，返回耗时、行数、内存峰值和输出大小"""
+    from batch_convert import SYSTEM_PROMPT, batch_convert
+    from convert_to_bailian_format import convert_to_bailian_format
+
+    input_path, output_path = Path(input_file), Path(output_file)
+    start = time.perf_counter()
+    if path_name == "batch":
+        results = batch_convert(workers=workers, chunk_mb=chunk_mb, max_shard_mb=None, fast=True, force=True,
+                                input_dir=input_path.parent, output_dir=output_path.parent,
+                                datasets=[(input_path.name, output_path.name)])
+        if not results:
+            raise RuntimeError(f"batch_convert 转换失败: {input_path}")
+        converted, skipped = results[0]['converted'], results[0]['skipped']
+    else:
+        converted, skipped = convert_to_bailian_format(str(input_path), str(output_path), SYSTEM_PROMPT,
+                                                       fast=path_name == "convert-fast")
+    seconds = time.perf_counter() - start
+
+    peaks = [peak_rss_bytes(), peak_rss_bytes(children=True)]
+    peaks = [peak for peak in peaks if peak]
+    return {
+        'seconds': seconds,
+        'rows': converted,
+        'skipped': skipped,
+        'peak_rss_mb': max(peaks) / (1024 * 1024) if peaks else None,
+        'output_mb': _output_bytes(output_path) / (1024 * 1024),
+    }
+
+
+def run_case(path_name, input_path, workers, chunk_mb, repeat):
+    """测量一个路径在一个规模上的表现：repeat 次测量中耗时的中位数、最快一次和波动幅度"""
+    input_mb = input_path.stat().st_size / (1024 * 1024)
+    runs = []
+    peak = None
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory(prefix="bench_convert_") as temp_dir:
+            output_file = Path(temp_dir) / "output.jsonl"
+            # 每次测量使用全新的子进程（spawn），内存峰值不受前一次影响
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=_silence_stdout) as executor:
+                result = executor.submit(_measure, path_name, str(input_path), str(output_file),
+                                         workers, chunk_mb).result()
+        if result['peak_rss_mb'] is not None:
+            peak = max(peak or 0, result['peak_rss_mb'])
+        runs.append(result)
+
+    seconds = sorted(run['seconds'] for run in runs)
+    median = statistics.median(seconds)
+    result = dict(runs[0], seconds=median)
+    result['best_seconds'] = seconds[0]
+    result['spread'] = (seconds[-1] - seconds[0]) / median
+    result['repeat'] = len(runs)
+    result['peak_rss_mb'] = peak
+    result['input_mb'] = input_mb
+    result['rows_per_s'] = result['rows'] / median
+    result['mb_per_s'] = input_mb / median
+    return result
+
+
+def environment():
+    """影响结果可比性的环境信息"""
+    try:
+        import orjson
+        orjson_version = orjson.__version__
+    except ImportError:
+        orjson_version = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'orjson': orjson_version,
+        'generator_version': GENERATOR_VERSION,
+    }
+
+
+def case_key(path_name, rows, workers):
+    return f"{path_name}@{format_scale(rows)}" + (f"/w{workers}" if path_name == "batch" else "")
+
+
+def load_baseline(path):
+    path = Path(path)
+    if not path.exists():
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(path, results, env):
+    """把本次结果合并进基线文件（同一用例覆盖旧值）"""
+    baseline = load_baseline(path) or {'results': {}}
+    baseline['environment'] = env
+    baseline['updated_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    for key, result in results.items():
+        baseline['results'][key] = {name: result[name] for name in
+                                    ('rows', 'rows_per_s', 'mb_per_s', 'spread', 'peak_rss_mb', 'output_mb')}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2)
+
+
+def compare(result, reference, tolerance):
+    """
+    与基线比较
+
+    Returns:
+        (说明文本, 是否退化)；没有基线时返回 ("-", False)
+    """
+    if reference is None:
+        return "-", False
+    notes = []
+    regressed = False
+    speed = result['rows_per_s'] / reference['rows_per_s'] - 1
+    notes.append(f"{speed:+.1%}")
+    if speed < -tolerance:
+        regressed = True
+    if result['peak_rss_mb'] and reference.get('peak_rss_mb'):
+        memory = result['peak_rss_mb'] / reference['peak_rss_mb'] - 1
+        if memory > tolerance:
+            notes.append(f"内存 {memory:+.0%}")
+            regressed = True
+    if reference.get('output_mb') and abs(result['output_mb'] - reference['output_mb']) > 0.01:
+        notes.append("输出大小变化")
+    return " ".join(notes) + (" ⚠️" if regressed else ""), regressed
+
+
+def print_report(results, baseline, tolerance):
+    """打印结果表，返回退化的用例列表"""
+    reference = (baseline or {}).get('results', {})
+
+    def fmt(value, spec='.1f'):
+        return format(value, spec) if value is not None else "-"
+
+    print("\n" + "=" * 112)
+    print("📈 转换基准测试结果（耗时为中位数）")
+    print("=" * 112)
+    print(f"{'用例':<22} {'行数':>10} {'耗时(s)':>9} {'最快(s)':>9} {'波动':>6} {'行/秒':>11} {'MB/秒':>8} "
+          f"{'内存峰值MB':>10} {'输出MB':>9}  对比基线")
+    regressions = []
+    for key, r in results.items():
+        note, regressed = compare(r, reference.get(key), tolerance)
+        if regressed:
+            regressions.append(key)
+        print(f"{key:<22} {r['rows']:>10} {r['seconds']:>9.2f} {r['best_seconds']:>9.2f} {r['spread']:>6.0%} "
+              f"{r['rows_per_s']:>11.0f} {r['mb_per_s']:>8.2f} {fmt(r['peak_rss_mb']):>10} {r['output_mb']:>9.1f}  "
+              f"{note}")
+    print("=" * 112)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='用合成 MedQA 数据对转换路径做多规模基准测试')
+    parser.add_argument('--scales', default=DEFAULT_SCALES,
+                        help=f'数据规模（逗号分隔，可用 k/m 后缀，默认 {DEFAULT_SCALES}，最大建议 10m）')
+    parser.add_argument('--paths', default=','.join(PATHS),
+                        help='要测量的路径：convert（标准）、convert-fast（--fast）、batch（batch_convert 并行）')
+    parser.add_argument('--workers', type=int, default=0, help='batch 路径的进程数（默认 0，即全部 CPU 核心）')
+    parser.add_argument('--chunk-mb', type=float, default=32, help='batch 路径的分段大小（MB）')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help=f'每个用例的测量次数，用耗时的中位数比较（默认 {DEFAULT_REPEAT}）')
+    parser.add_argument('--seed', type=int, default=42, help='合成数据的随机种子')
+    parser.add_argument('--data-dir', default=str(DEFAULT_DATA_DIR), help='合成数据保存目录（相同规模和种子时复用）')
+    parser.add_argument('--baseline', default=str(DEFAULT_BASELINE), help='基线文件')
+    parser.add_argument('--save-baseline', action='store_true', help='把本次结果写入基线文件')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f'中位数行/秒下降或内存峰值上升超过该比例时视为退化（默认 {DEFAULT_TOLERANCE}）')
+    parser.add_argument('--json', help='把结果另存为 JSON 文件')
+    args = parser.parse_args()
+
+    scales = [parse_scale(s) for s in args.scales.split(',') if s.strip()]
+    paths = [p.strip() for p in args.paths.split(',') if p.strip()]
+    unknown = [p for p in paths if p not in PATHS]
+    if unknown:
+        parser.error(f"未知的路径: {', '.join(unknown)}（可选 {', '.join(PATHS)}）")
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+
+    env = environment()
+    baseline = load_baseline(args.baseline)
+    if baseline and baseline.get('environment') != env:
+        print(f"⚠️  基线的运行环境与当前不同，对比仅供参考: {baseline.get('environment')}")
+
+    results = {}
+    for rows in scales:
+        input_path = dataset_path(args.data_dir, rows, args.seed)
+        for path_name in paths:
+            key = case_key(path_name, rows, workers)
+            print(f"⏱️  {key} ...", flush=True)
+            results[key] = run_case(path_name, input_path, workers, args.chunk_mb, max(1, args.repeat))
+
+    regressions = print_report(results, baseline, args.tolerance)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'environment': env, 'settings': vars(args), 'results': results}, f,
+                      ensure_ascii=False, indent=2)
+        print(f"结果已保存: {args.json}")
+    if args.save_baseline:
+        save_baseline(args.baseline, results, env)
+        print(f"✅ 基线已更新: {args.baseline}")
+    elif regressions:
+        print(f"❌ 性能退化（超过 {args.tolerance:.0%}）: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+"""
+端到端基准测试：在本地 DashScope 替身服务（mock_dashscope.py）上运行
+上传、创建任务、监控任务和评测四条路径，报告吞吐量和尾延迟。
+
+用法：
+    python bench_dashscope.py
+    python bench_dashscope.py --files 8 --size-mb 20 --jobs 20 --eval-items 500 --error-rate 0.05 --rps 50
+    python bench_dashscope.py --phases upload,create --json bench_result.json
+"""
+
+import os
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_upload import make_test_file
+from mock_dashscope import MockSettings, start_server
+from upload_registry import REGISTRY_FILE_NAME, UploadRegistry
+
+
+PHASES = ("upload", "create", "monitor", "evaluate")
+
+
+def latency_stats(latencies_ms):
+    """p50/p95/p99/最大延迟（毫秒）"""
+    from evaluate_model import percentile
+    return {
+        'p50_ms': percentile(latencies_ms, 50),
+        'p95_ms': percentile(latencies_ms, 95),
+        'p99_ms': percentile(latencies_ms, 99),
+        'max_ms': max(latencies_ms) if latencies_ms else None,
+    }
+
+
+def http_timings(automation, method, prefix, since):
+    """取出 automation.http 在 since 之后记录的、指定接口的请求耗时"""
+    timings = list(automation.http.timings)[since:]
+    return [t for t in timings if t.method == method and t.path.strip('/').startswith(prefix)]
+
+
+def phase_report(timings, elapsed, **extra):
+    """把一组 RequestTiming 汇总为报告"""
+    latencies = [t.elapsed * 1000 for t in timings]
+    report = {
+        'requests': len(timings),
+        'errors': sum(1 for t in timings if t.status != 200),
+        'retries': sum(t.attempts - 1 for t in timings),
+        'elapsed_s': elapsed,
+        'requests_per_second': len(timings) / elapsed if elapsed > 0 else None,
+    }
+    report.update(latency_stats(latencies))
+    report.update(extra)
+    return report
+
+
+def make_eval_file(num_items):
+    """生成百炼格式的合成测试集"""
+    fd, path = tempfile.mkstemp(suffix='.jsonl')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        for i in range(num_items):
+            question = f"第 {i} 题：下列哪项正确？\n\n选项：\nA. 甲\nB. 乙\nC. 丙\nD. 丁"
+            record = {'messages': [
+                {'role': 'system', 'content': '你是一个专业的医学助手。'},
+                {'role': 'user', 'content': question},
+                {'role': 'assistant', 'content': f"答案是 {'ABCD'[i % 4]}. 丁"},
+            ]}
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    return path
+
+
+def run_benchmark(automation, args, quiet):
+    """依次运行各阶段，返回 {阶段: 报告}"""
+    import evaluate_model as model_eval
+
+    phases = [p.strip() for p in args.phases.split(',') if p.strip()]
+    results = {}
+    file_ids = []
+    job_ids = []
+    temp_files = []
+
+    try:
+        if 'upload' in phases or 'create' in phases:
+            paths = [make_test_file(args.size_mb) for _ in range(args.files)]
+            temp_files.extend(paths)
+            total_mb = sum(os.path.getsize(p) for p in paths) / (1024 * 1024)
+
+            since = len(automation.http.timings)
+            start = time.perf_counter()
+            with quiet():
+                file_ids = automation.upload_files(paths, max_concurrency=args.upload_concurrency, force=True)
+            elapsed = time.perf_counter() - start
+            file_ids = [f for f in file_ids if f]
+            if 'upload' in phases:
+                results['upload'] = phase_report(
+                    http_timings(automation, 'POST', 'files', since), elapsed,
+                    succeeded=len(file_ids), total_mb=total_mb,
+                    mb_per_second=total_mb / elapsed if elapsed > 0 else None)
+
+        if ('create' in phases or 'monitor' in phases) and file_ids:
+            since = len(automation.http.timings)
+            start = time.perf_counter()
+            with quiet(), ThreadPoolExecutor(max_workers=args.create_concurrency) as executor:
+                job_ids = list(executor.map(
+                    lambda i: automation.create_fine_tune_job(file_ids[i % len(file_ids)]),
+                    range(args.jobs)))
+            elapsed = time.perf_counter() - start
+            job_ids = [j for j in job_ids if j]
+            if 'create' in phases:
+                results['create'] = phase_report(
+                    http_timings(automation, 'POST', 'fine-tunes', since), elapsed, succeeded=len(job_ids))
+
+        if 'monitor' in phases and job_ids:
+            since = len(automation.http.timings)
+            start = time.perf_counter()
+            with quiet():
+                states = automation.monitor_jobs(job_ids, min_interval=args.monitor_min_interval,
+                                                 max_interval=args.monitor_max_interval)
+            elapsed = time.perf_counter() - start
+            finished = sum(1 for s in states.values() if s.get('status') in ('SUCCEEDED', 'FAILED', 'CANCELLED'))
+            polls = http_timings(automation, 'GET', 'fine-tunes', since)
+            results['monitor'] = phase_report(
+                polls, elapsed, jobs=len(job_ids), finished=finished,
+                polls_per_job=len(polls) / len(job_ids),
+                expected_job_seconds=args.pending_seconds + args.running_seconds)
+
+        if 'evaluate' in phases:
+            eval_file = args.eval_file or make_eval_file(args.eval_items)
+            if not args.eval_file:
+                temp_files.append(eval_file)
+            fd, output_file = tempfile.mkstemp(suffix='.jsonl')
+            os.close(fd)
+            temp_files.append(output_file)
+
+            call = model_eval.generation_call('mock-model', api_key=automation.api_key)
+            with quiet():
+                summary = model_eval.evaluate(call, eval_file, output_file, args.eval_concurrency,
+                                              args.eval_rps, args.eval_items)
+            records = model_eval.load_results(output_file).values()
+            latencies = [r['latency_ms'] for r in records if r['error'] is None]
+            report = {
+                'requests': summary['total'],
+                'errors': summary['errors'],
+                'requests_per_second': summary.get('requests_per_second'),
+            }
+            report.update(latency_stats(latencies))
+            results['evaluate'] = report
+    finally:
+        for path in temp_files:
+            if os.path.exists(path):
+                os.remove(path)
+
+    return results
+
+
+def print_report(results, server_stats):
+    """打印各阶段的吞吐量和尾延迟"""
+    def fmt(value, spec='.1f'):
+        return format(value, spec) if value is not None else "-"
+
+    print("\n" + "=" * 78)
+    print("📈 基准测试结果（本地替身服务）")
+    print("=" * 78)
+    print(f"{'阶段':<10} {'请求':>6} {'失败':>5} {'重试':>5} {'请求/秒':>9} "
+          f"{'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9} {'最大(ms)':>9}")
+    for phase in PHASES:
+        if phase not in results:
+            continue
+        r = results[phase]
+        print(f"{phase:<10} {r['requests']:>6} {r['errors']:>5} {r.get('retries', 0):>5} "
+              f"{fmt(r['requests_per_second']):>9} {fmt(r['p50_ms']):>9} {fmt(r['p95_ms']):>9} "
+              f"{fmt(r['p99_ms']):>9} {fmt(r['max_ms']):>9}")
+
+    if 'upload' in results:
+        print(f"\n上传: {results['upload']['total_mb']:.1f} MB，{fmt(results['upload']['mb_per_second'], '.2f')} MB/s")
+    if 'monitor' in results:
+        r = results['monitor']
+        print(f"监控: {r['finished']}/{r['jobs']} 个任务结束，用时 {r['elapsed_s']:.1f} 秒"
+              f"（任务本身 {r['expected_job_seconds']:.1f} 秒），平均每个任务轮询 {r['polls_per_job']:.1f} 次")
+    print(f"替身服务: 共 {server_stats['requests']} 个请求，限流 {server_stats['throttled']}，"
+          f"注入错误 {server_stats['errors']}")
+    print("=" * 78)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='在本地替身服务上对上传/创建/监控/评测做基准测试')
+    parser.add_argument('--phases', default=','.join(PHASES), help='要运行的阶段（逗号分隔）')
+    parser.add_argument('--files', type=int, default=4, help='上传文件数')
+    parser.add_argument('--size-mb', type=float, default=10, help='每个上传文件的大小（MB）')
+    parser.add_argument('--upload-concurrency', type=int, default=4, help='并发上传数')
+    parser.add_argument('--jobs', type=int, default=10, help='创建的任务数')
+    parser.add_argument('--create-concurrency', type=int, default=4, help='并发创建任务数')
+    parser.add_argument('--monitor-min-interval', type=float, default=0.5, help='监控最短轮询间隔（秒）')
+    parser.add_argument('--monitor-max-interval', type=float, default=5, help='监控最长轮询间隔（秒）')
+    parser.add_argument('--eval-items', type=int, default=200, help='评测题目数')
+    parser.add_argument('--eval-file', help='评测用测试集（默认生成合成题目）')
+    parser.add_argument('--eval-concurrency', type=int, default=16, help='评测并发数')
+    parser.add_argument('--eval-rps', type=float, default=None, help='评测客户端限速（每秒请求数）')
+    parser.add_argument('--latency-ms', type=float, default=20, help='替身服务文件/任务接口基础延迟（毫秒）')
+    parser.add_argument('--jitter-ms', type=float, default=10, help='替身服务延迟抖动平均值（毫秒）')
+    parser.add_argument('--generation-latency-ms', type=float, default=200, help='替身服务生成接口基础延迟（毫秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='替身服务返回 503 的概率')
+    parser.add_argument('--rps', type=float, default=None, help='替身服务限流（每秒请求数）')
+    parser.add_argument('--pending-seconds', type=float, default=1, help='任务 PENDING 时长（秒）')
+    parser.add_argument('--running-seconds', type=float, default=5, help='任务 RUNNING 时长（秒）')
+    parser.add_argument('--json', help='把结果另存为 JSON 文件')
+    parser.add_argument('--verbose', action='store_true', help='显示 FineTuneAutomation 的输出')
+    args = parser.parse_args()
+
+    settings = MockSettings(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        generation_latency_ms=args.generation_latency_ms,
+        error_rate=args.error_rate,
+        rps=args.rps,
+        pending_seconds=args.pending_seconds,
+        running_seconds=args.running_seconds,
+    )
+    server, api_base = start_server(settings)
+
+    # 文件/任务接口走 DASHSCOPE_API_BASE，Generation.call 走 SDK 的 base_http_api_url
+    os.environ["DASHSCOPE_API_BASE"] = api_base
+    os.environ["DASHSCOPE_HTTP_BASE_URL"] = api_base
+    os.environ["DASHSCOPE_API_KEY"] = "bench-key"
+    import dashscope
+    dashscope.base_http_api_url = api_base
+
+    # 替身服务返回的 File ID 和任务只在本次测试中有效，不能写入真实的上传登记表和状态库；
+    # 状态库在构造 FineTuneAutomation 时就会打开，要先指向临时目录。回答缓存也不使用
+    registry_dir = tempfile.TemporaryDirectory()
+    os.environ["PIPELINE_STATE_FILE"] = str(Path(registry_dir.name) / "state.sqlite")
+    os.environ["RESPONSE_CACHE"] = "0"
+
+    from fine_tune_automation import FineTuneAutomation
+    automation = FineTuneAutomation()
+    automation.upload_registry = UploadRegistry(Path(registry_dir.name) / REGISTRY_FILE_NAME, api_base,
+                                                automation.api_key)
+    # 每个请求都要进入统计，不能被历史长度截断
+    automation.http.timings = deque()
+
+    @contextlib.contextmanager
+    def quiet():
+        if args.verbose:
+            yield
+            return
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            yield
+
+    print(f"🧪 替身服务: {api_base}（延迟 {args.latency_ms:g}±{args.jitter_ms:g} ms，"
+          f"错误率 {args.error_rate:.0%}，限流 {args.rps or '无'}）")
+    try:
+        results = run_benchmark(automation, args, quiet)
+        server_stats = dict(server.config.app.state.counters)
+    finally:
+        automation.http.close()
+        automation.state.close()
+        server.should_exit = True
+        registry_dir.cleanup()
+
+    print_report(results, server_stats)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'settings': vars(args), 'results': results, 'server': server_stats},
+                      f, ensure_ascii=False, indent=2)
+        print(f"结果已保存: {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+上传基准测试：在本地启动一个替身文件上传接口，测量 FineTuneAutomation.upload_file
+的吞吐量、耗时和内存占用，可模拟服务端错误以验证重试逻辑。
+
+用法：
+    python bench_upload.py --size-mb 200 --runs 3
+    python bench_upload.py --size-mb 50 --fail-rate 0.3 --compare-buffered
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import resource
+import tempfile
+import threading
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _UploadHandler(BaseHTTPRequestHandler):
+    """模拟 POST /api/v1/files：读完请求体后返回 File ID，按比例返回 503"""
+    
+    fail_rate = 0.0
+    
+    def do_POST(self):
+        remaining = int(self.headers.get('Content-Length', 0))
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+        
+        if not self.path.rstrip('/').endswith('/files'):
+            self._reply(404, {'message': 'not found'})
+        elif random.random() < self.fail_rate:
+            self._reply(503, {'message': 'service unavailable'})
+        else:
+            self._reply(200, {'data': {'uploaded_files': [{'file_id': f"file-{uuid.uuid4().hex[:16]}"}]}})
+    
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(fail_rate=0.0):
+    """在随机端口启动替身服务，返回 (server, api_base)"""
+    _UploadHandler.fail_rate = fail_rate
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _UploadHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/api/v1"
+
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存（MB）"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 下单位为 KB，macOS 下为字节
+    return rss / 1024 if sys.platform != 'darwin' else rss / (1024 * 1024)
+
+
+def make_test_file(size_mb):
+    """生成指定大小的 JSONL 测试文件"""
+    line = (json.dumps({"messages": [{"role": "user", "content": "测试" * 100}]}, ensure_ascii=False) + '\n').encode('utf-8')
+    fd, path = tempfile.mkstemp(suffix='.jsonl')
+    target = int(size_mb * 1024 * 1024)
+    with os.fdopen(fd, 'wb') as f:
+        written = 0
+        block = line * max(1, (1024 * 1024) // len(line))
+        while written < target:
+            f.write(block)
+            written += len(block)
+    return path
+
+
+def upload_buffered(api_base, api_key, file_path):
+    """旧的上传方式（requests files= 一次性构建请求体），作为对照"""
+    import requests
+    with open(file_path, 'rb') as f:
+        response = requests.post(
+            f"{api_base}/files",
+            headers={"Authorization": f"Bearer {api_key}"},
+            files={'files': (os.path.basename(file_path), f, 'application/json')},
+            data={'purpose': 'fine-tune', 'descriptions': 'bench'},
+        )
+    return response.status_code == 200
+
+
+def main():
+    parser = argparse.ArgumentParser(description='文件上传基准测试（本地替身接口）')
+    parser.add_argument('--size-mb', type=float, default=100, help='测试文件大小（MB）')
+    parser.add_argument('--runs', type=int, default=3, help='重复次数')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='替身接口返回 503 的概率')
+    parser.add_argument('--compare-buffered', action='store_true', help='同时测试旧的非流式上传方式')
+    args = parser.parse_args()
+    
+    server, api_base = start_server(args.fail_rate)
+    os.environ["DASHSCOPE_API_BASE"] = api_base
+    os.environ.setdefault("DASHSCOPE_API_KEY", "bench-key")
+    
+    # 替身接口返回的 File ID 不能写入真实的上传登记表和状态库；状态库在构造
+    # FineTuneAutomation 时就会打开，要先指向临时目录
+    from upload_registry import REGISTRY_FILE_NAME, UploadRegistry
+    registry_dir = tempfile.TemporaryDirectory()
+    os.environ["PIPELINE_STATE_FILE"] = str(Path(registry_dir.name) / "state.sqlite")
+    
+    from fine_tune_automation import FineTuneAutomation
+    automation = FineTuneAutomation()
+    automation.upload_registry = UploadRegistry(Path(registry_dir.name) / REGISTRY_FILE_NAME, api_base,
+                                                automation.api_key)
+    
+    file_path = make_test_file(args.size_mb)
+    size_mb = os.path.getsize(file_path) / (1024 * 1024)
+    
+    try:
+        print(f"测试文件: {size_mb:.1f} MB, 替身接口: {api_base}, 错误率: {args.fail_rate:.0%}")
+        rss_before = peak_rss_mb()
+        timings = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            # 内容相同的文件会命中登记表，强制每次都真正上传
+            ok = automation.upload_file(file_path, "bench", force=True)
+            timings.append((time.perf_counter() - start, bool(ok)))
+        
+        print("\n" + "=" * 60)
+        print("流式上传结果")
+        print("=" * 60)
+        for i, (elapsed, ok) in enumerate(timings, 1):
+            print(f"第 {i} 次: {elapsed:6.2f} 秒  {size_mb / elapsed:8.2f} MB/s  {'✅' if ok else '❌'}")
+        print(f"峰值内存增长: {peak_rss_mb() - rss_before:.1f} MB")
+        
+        if args.compare_buffered:
+            _UploadHandler.fail_rate = 0.0
+            rss_before = peak_rss_mb()
+            start = time.perf_counter()
+            ok = upload_buffered(api_base, automation.api_key, file_path)
+            elapsed = time.perf_counter() - start
+            print("\n对照（非流式上传）:")
+            print(f"{elapsed:6.2f} 秒  {size_mb / elapsed:8.2f} MB/s  {'✅' if ok else '❌'}")
+            print(f"峰值内存增长: {peak_rss_mb() - rss_before:.1f} MB")
+    finally:
+        os.remove(file_path)
+        automation.state.close()
+        registry_dir.cleanup()
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
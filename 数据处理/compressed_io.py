@@ -0,0 +1,141 @@
+"""
+按扩展名透明读写压缩的 JSONL
+
+原始题目和转换结果放在网络盘上时，转换时间主要花在磁盘读写上。输入输出文件名
+以 .gz 或 .zst 结尾时按流压缩/解压（如 mainland_4opt_train.jsonl.gz），不在磁盘上
+生成解压后的临时文件：
+
+    with open_input("train.jsonl.zst") as f:
+        for raw in f:
+            ...
+
+- .gz 使用标准库 gzip
+- .zst 使用 zstandard（pip install zstandard），未安装时读写 .zst 文件会报错
+
+压缩文件不能按字节偏移随机访问，调用方得到的行偏移、字节数都指解压后的内容；
+百炼平台的 300MB 限制也按解压后的大小计算（见 uncompressed_size）。
+"""
+
+import io
+import gzip
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# 扩展名 -> 压缩格式
+COMPRESSION_SUFFIXES = {'.gz': 'gzip', '.zst': 'zstd'}
+
+# 读写压缩流时的缓冲区大小
+STREAM_BUFFER_SIZE = 4 * 1024 * 1024
+
+# gzip 默认级别 9 压缩很慢，6 的压缩率相差无几
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def compression_of(path):
+    """按扩展名判断压缩格式：'gzip'、'zstd'，未压缩返回 None"""
+    return COMPRESSION_SUFFIXES.get(Path(path).suffix.lower())
+
+
+def compression_suffix(path):
+    """压缩扩展名（如 .gz），未压缩返回空字符串"""
+    return Path(path).suffix if compression_of(path) else ''
+
+
+def strip_compression(path):
+    """去掉压缩扩展名：xxx.jsonl.gz -> xxx.jsonl"""
+    path = Path(path)
+    return path.with_suffix('') if compression_of(path) else path
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise RuntimeError("读写 .zst 文件需要 zstandard，请运行: pip install zstandard")
+    return zstandard
+
+
+class _CompressedFile:
+    """压缩流，关闭时一并关闭底层文件"""
+
+    def __init__(self, stream, fileobj):
+        self._stream = stream
+        self._fileobj = fileobj
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __iter__(self):
+        return iter(self._stream)
+
+    @property
+    def closed(self):
+        return self._fileobj.closed
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._fileobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def open_input(path, buffer_size=STREAM_BUFFER_SIZE):
+    """以二进制只读方式打开文件；压缩文件返回解压后的流"""
+    kind = compression_of(path)
+    fileobj = open(path, 'rb', buffering=buffer_size)
+    if kind is None:
+        return fileobj
+    try:
+        if kind == 'gzip':
+            stream = gzip.GzipFile(fileobj=fileobj, mode='rb')
+        else:
+            stream = _require_zstandard().ZstdDecompressor().stream_reader(fileobj, read_size=buffer_size)
+        return _CompressedFile(io.BufferedReader(stream, buffer_size), fileobj)
+    except BaseException:
+        fileobj.close()
+        raise
+
+
+def open_output(path):
+    """以二进制写方式打开文件；文件名以 .gz / .zst 结尾时写入压缩流"""
+    kind = compression_of(path)
+    fileobj = open(path, 'wb')
+    if kind is None:
+        return fileobj
+    try:
+        if kind == 'gzip':
+            # 不写入文件名和时间戳：同样的内容压缩结果相同，分片改名后也不会留下旧文件名
+            stream = gzip.GzipFile(filename='', mode='wb', compresslevel=GZIP_LEVEL, fileobj=fileobj, mtime=0)
+        else:
+            stream = _require_zstandard().ZstdCompressor(level=ZSTD_LEVEL).stream_writer(fileobj, closefd=False)
+        return _CompressedFile(stream, fileobj)
+    except BaseException:
+        fileobj.close()
+        raise
+
+
+def iter_chunks(path, chunk_size=STREAM_BUFFER_SIZE):
+    """按块读取文件解压后的内容"""
+    with open_input(path) as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def uncompressed_size(path):
+    """解压后的字节数；压缩文件需要完整解压一遍，未压缩文件直接取文件大小"""
+    if compression_of(path) is None:
+        return Path(path).stat().st_size
+    return sum(len(chunk) for chunk in iter_chunks(path))
@@ -0,0 +1,139 @@
+"""
+批量转换的增量缓存
+
+在输出目录中保存 .convert_cache.json，为每个数据集记录：
+输入文件的 SHA-256、大小和修改时间，系统提示，转换器版本，分片上限，
+以及每个输出文件的 SHA-256 和大小、各分片压缩前的大小。再次运行 batch_convert 时，
+输入内容和转换参数都未变化、输出文件也完好的数据集会被直接跳过，
+汇总中的大小直接取自缓存记录，不需要为统计大小再解压 .gz / .zst 输出。
+"""
+
+import os
+import json
+import hashlib
+from pathlib import Path
+
+
+CACHE_FILE_NAME = ".convert_cache.json"
+CACHE_FORMAT_VERSION = 1
+
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def file_sha256(path):
+    """计算文件的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ConversionCache:
+    """输出目录中的转换缓存清单"""
+    
+    def __init__(self, output_dir):
+        self.path = Path(output_dir) / CACHE_FILE_NAME
+        self.entries = {}
+        if self.path.exists():
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == CACHE_FORMAT_VERSION:
+                    self.entries = data.get('entries', {})
+            except (OSError, ValueError) as e:
+                print(f"⚠️  转换缓存损坏，将全部重新转换: {e}")
+    
+    def input_fingerprint(self, output_name, input_path):
+        """
+        计算输入文件的指纹
+        
+        大小和修改时间都与缓存记录一致时直接沿用记录的哈希，不读取文件内容；
+        否则重新计算 SHA-256（文件被 touch 但内容未变时仍能命中缓存）。
+        """
+        stat = Path(input_path).stat()
+        entry = self.entries.get(output_name)
+        if (entry and entry['input_size'] == stat.st_size
+                and entry['input_mtime_ns'] == stat.st_mtime_ns):
+            sha256 = entry['input_sha256']
+        else:
+            sha256 = file_sha256(input_path)
+        return {
+            'input_sha256': sha256,
+            'input_size': stat.st_size,
+            'input_mtime_ns': stat.st_mtime_ns,
+        }
+    
+    def lookup(self, output_name, fingerprint, params):
+        """
+        判断数据集是否可以跳过转换
+        
+        Args:
+            output_name: 输出文件名（缓存键）
+            fingerprint: input_fingerprint() 的返回值
+            params: 影响输出内容的转换参数（系统提示、转换器版本等）
+        
+        Returns:
+            缓存记录（命中时）或 None
+        """
+        entry = self.entries.get(output_name)
+        if not entry:
+            return None
+        if entry['input_sha256'] != fingerprint['input_sha256'] or entry['params'] != params:
+            return None
+        
+        output_dir = self.path.parent
+        for output in entry['outputs']:
+            output_path = output_dir / output['file']
+            if not output_path.exists() or output_path.stat().st_size != output['bytes']:
+                return None
+        
+        # 输入只是被 touch 过：更新修改时间，下次无需再计算哈希
+        if entry['input_mtime_ns'] != fingerprint['input_mtime_ns']:
+            entry['input_mtime_ns'] = fingerprint['input_mtime_ns']
+            self.save()
+        return entry
+    
+    def record(self, output_name, input_rel, fingerprint, params, output_files, converted, skipped,
+               shards=None):
+        """
+        记录一次成功的转换并立即写回缓存文件
+
+        shards 为输出分片 [(路径, 压缩前大小MB), ...]，命中缓存时原样返回，不必重新统计
+        """
+        self.entries[output_name] = {
+            'input': input_rel,
+            **fingerprint,
+            'params': params,
+            'outputs': [
+                {
+                    'file': Path(output_file).name,
+                    'bytes': Path(output_file).stat().st_size,
+                    'sha256': file_sha256(output_file),
+                }
+                for output_file in output_files
+            ],
+            'converted': converted,
+            'skipped': skipped,
+        }
+        if shards is not None:
+            self.entries[output_name]['shards'] = [
+                {'file': Path(shard_file).name, 'size_mb': size_mb} for shard_file, size_mb in shards
+            ]
+        self.save()
+    
+    def invalidate(self, output_name):
+        """删除一个数据集的缓存记录"""
+        if self.entries.pop(output_name, None) is not None:
+            self.save()
+    
+    def save(self):
+        """原子地写回缓存文件"""
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': CACHE_FORMAT_VERSION, 'entries': self.entries},
+                      f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
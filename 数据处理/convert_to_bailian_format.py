@@ -18,12 +18,64 @@
         {"role": "assistant", "content": "模型期望输出"}
     ]
 }
+
+输入和输出文件名以 .gz / .zst 结尾时按流解压和压缩（见 compressed_io.py），
+分片上限按解压后的大小计算。
 """
 
+import io
+import os
 import json
 import argparse
+from json.encoder import encode_basestring
 from pathlib import Path
 
+from compressed_io import (
+    compression_of,
+    compression_suffix,
+    open_input,
+    open_output,
+    strip_compression,
+    uncompressed_size,
+)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# 转换器版本：输出格式发生变化时递增，使 batch_convert 的增量缓存失效
+CONVERTER_VERSION = 1
+
+# 百炼平台单个训练文件的大小上限
+UPLOAD_LIMIT_MB = 300
+
+# 分片清单文件后缀：xxx.jsonl 分片后生成 xxx.manifest.json
+MANIFEST_SUFFIX = ".manifest.json"
+
+# batch_convert --dedup 在输出目录中生成的重复题目报告（不是训练数据）
+DEDUP_REPORT_FILE_NAME = "dedup_report.jsonl"
+
+# 读取输入文件的缓冲区大小
+READ_BUFFER_SIZE = 4 * 1024 * 1024
+
+# 写出时攒够该大小再一次性写入磁盘
+WRITE_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+# 快速路径的 JSON 后端：优先使用 orjson，未安装时退回标准库。
+# 两者对字符串的编码结果与 json.dumps(..., ensure_ascii=False) 完全一致。
+if orjson is not None:
+    _fast_json_loads = orjson.loads
+    _encode_json_string = orjson.dumps
+else:
+    def _fast_json_loads(raw):
+        return json.loads(raw.decode('utf-8'))
+    
+    def _encode_json_string(value):
+        return encode_basestring(value).encode('utf-8')
+
 
 def format_question_with_options(question, options):
     """将问题和选项格式化为完整的提示"""
@@ -33,7 +85,406 @@ def format_question_with_options(question, options):
     return formatted.strip()
 
 
-def convert_to_bailian_format(input_file, output_file, system_prompt=None):
+def shard_manifest_path(output_file):
+    """返回输出文件对应的分片清单路径（xxx.jsonl 和 xxx.jsonl.gz 都对应 xxx.manifest.json）"""
+    plain = strip_compression(output_file)
+    return plain.with_name(plain.stem + MANIFEST_SUFFIX)
+
+
+def shard_path(output_file, index):
+    """返回第 index 个分片（从 1 开始）的路径，如 xxx_part001.jsonl、xxx_part001.jsonl.gz"""
+    plain = strip_compression(output_file)
+    return plain.with_name(f"{plain.stem}_part{index:03d}{plain.suffix}{compression_suffix(output_file)}")
+
+
+def read_shard_manifest(manifest_file):
+    """
+    读取分片清单
+    
+    Returns:
+        清单字典，其中每个分片的 file 字段已解析为绝对路径
+    """
+    manifest_file = Path(manifest_file)
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    for shard in manifest['shards']:
+        shard['file'] = str(manifest_file.parent / shard['file'])
+    return manifest
+
+
+class ShardedJsonlWriter:
+    """
+    按大小自动分片的 JSONL 写入器
+    
+    边写边统计已写入的字节数，当下一行会使当前文件超过 max_bytes 时，
+    在行边界处切换到新的分片文件。未超限时只生成 output_file 本身；
+    一旦发生分片，所有分片命名为 xxx_part001.jsonl、xxx_part002.jsonl ...，
+    并在关闭时写出 xxx.manifest.json 记录各分片的行数和字节数。
+    
+    输出文件名以 .gz / .zst 结尾时写入压缩流（各分片同样压缩），
+    max_bytes 和清单中的字节数都按压缩前的大小计算。
+    """
+    
+    def __init__(self, output_file, max_bytes=None, chunk_size=WRITE_CHUNK_SIZE):
+        """
+        Args:
+            output_file: 输出文件路径
+            max_bytes: 单个分片的最大字节数（None 表示不分片）
+            chunk_size: 攒够多少字节后一次性写入磁盘
+        """
+        self.output_file = Path(output_file)
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.shards = []
+        self._pending = []
+        self._pending_bytes = 0
+        
+        # 清理上一次运行遗留的分片和清单，避免与本次输出混在一起
+        plain = strip_compression(self.output_file)
+        pattern = f"{plain.stem}_part[0-9][0-9][0-9]{plain.suffix}{compression_suffix(self.output_file)}"
+        for stale in self.output_file.parent.glob(pattern):
+            os.remove(stale)
+        manifest = shard_manifest_path(self.output_file)
+        if manifest.exists():
+            os.remove(manifest)
+        
+        self._open(self.output_file)
+    
+    def _open(self, path):
+        self._file = open_output(path)
+        self.shards.append({'file': path, 'rows': 0, 'bytes': 0})
+    
+    def _flush(self):
+        if self._pending:
+            self._file.write(b''.join(self._pending))
+            self._pending = []
+            self._pending_bytes = 0
+    
+    def _roll_over(self):
+        self._flush()
+        self._file.close()
+        if len(self.shards) == 1:
+            first = shard_path(self.output_file, 1)
+            os.replace(self.output_file, first)
+            self.shards[0]['file'] = first
+        self._open(shard_path(self.output_file, len(self.shards) + 1))
+    
+    def write(self, line):
+        """写入一行（bytes，包含结尾换行符）"""
+        current = self.shards[-1]
+        if (self.max_bytes is not None and current['rows'] > 0
+                and current['bytes'] + len(line) > self.max_bytes):
+            self._roll_over()
+            current = self.shards[-1]
+        self._pending.append(line)
+        self._pending_bytes += len(line)
+        if self._pending_bytes >= self.chunk_size:
+            self._flush()
+        current['rows'] += 1
+        current['bytes'] += len(line)
+    
+    @property
+    def total_bytes(self):
+        return sum(shard['bytes'] for shard in self.shards)
+    
+    def close(self):
+        """关闭文件；发生分片时写出分片清单"""
+        if self._file.closed:
+            return
+        self._flush()
+        self._file.close()
+        if len(self.shards) > 1:
+            manifest = {
+                'dataset': self.output_file.name,
+                'max_bytes': self.max_bytes,
+                'total_rows': sum(shard['rows'] for shard in self.shards),
+                'total_bytes': self.total_bytes,
+                'shards': [
+                    {'file': shard['file'].name, 'rows': shard['rows'], 'bytes': shard['bytes']}
+                    for shard in self.shards
+                ],
+            }
+            with open(shard_manifest_path(self.output_file), 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def iter_raw_lines(input_file, start=0, end=None, skip_offsets=None):
+    """
+    按字节范围读取输入文件的原始行（bytes，只按 \\n 切分）
+    
+    只返回起始位置落在 [start, end) 内的行。压缩文件边读边解压，偏移量指解压后的内容。
+    
+    Args:
+        input_file: 输入文件路径
+        start: 起始字节偏移（必须位于行首）
+        end: 结束字节偏移（None 表示读到文件末尾）
+        skip_offsets: 要丢弃的行的起始字节偏移集合（去重结果）；这些行按空行返回，
+            后续行的行号保持不变
+    """
+    with open_input(input_file, READ_BUFFER_SIZE) as f:
+        if start:
+            f.seek(start)
+        pos = start
+        for raw in f:
+            if end is not None and pos >= end:
+                break
+            if skip_offsets and pos in skip_offsets:
+                pos += len(raw)
+                yield b'\n'
+                continue
+            pos += len(raw)
+            yield raw
+
+
+def _split_universal_newlines(text):
+    """与文本模式一致：\\r\\n 和单独的 \\r 都视为换行"""
+    pieces = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    if pieces[-1] == '':
+        pieces.pop()
+    return [piece + '\n' for piece in pieces]
+
+
+def iter_input_lines(input_file, start=0, end=None, skip_offsets=None):
+    """
+    按字节范围读取输入文件的行
+    
+    只返回起始位置落在 [start, end) 内的行，换行符按文本模式的通用换行规则处理
+    （\\n、\\r\\n、\\r），保证分段读取与整文件读取得到完全相同的行。
+    
+    Args:
+        input_file: 输入文件路径
+        start: 起始字节偏移（必须位于行首）
+        end: 结束字节偏移（None 表示读到文件末尾）
+        skip_offsets: 要丢弃的行的起始字节偏移集合（见 iter_raw_lines）
+    """
+    if not start and end is None and not skip_offsets:
+        # 整文件读取时交给文本模式按大块解码，比逐行解码快
+        with io.TextIOWrapper(open_input(input_file, READ_BUFFER_SIZE), encoding='utf-8') as f:
+            yield from f
+        return
+    
+    for raw in iter_raw_lines(input_file, start, end, skip_offsets):
+        text = raw.decode('utf-8')
+        if '\r' in text:
+            yield from _split_universal_newlines(text)
+        else:
+            yield text
+
+
+def split_byte_ranges(input_file, num_ranges):
+    """
+    将文件切分为若干个按行对齐的字节范围
+    
+    Args:
+        input_file: 输入文件路径
+        num_ranges: 期望的分段数量
+    
+    Returns:
+        [(start, end), ...] 列表，相邻范围首尾相接且覆盖整个文件；
+        压缩文件无法按偏移定位，总是返回 [(0, None)]，由一个进程顺序解压
+    """
+    if compression_of(input_file):
+        return [(0, None)]
+    
+    file_size = Path(input_file).stat().st_size
+    if num_ranges <= 1 or file_size == 0:
+        return [(0, file_size)]
+    
+    step = file_size // num_ranges
+    boundaries = [0]
+    with open(input_file, 'rb') as f:
+        for i in range(1, num_ranges):
+            target = max(i * step, boundaries[-1])
+            if target >= file_size:
+                break
+            f.seek(target)
+            f.readline()  # 跳到下一个行首
+            boundary = f.tell()
+            if boundary >= file_size:
+                break
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+    boundaries.append(file_size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def count_lines(input_file, start=0, end=None):
+    """
+    统计字节范围 [start, end) 内的行数，换行规则与 iter_input_lines 一致
+    （\\n、\\r\\n、\\r）。列式缓存读取时用来按实际行数补齐空行的占位。
+    
+    Args:
+        input_file: 输入文件路径（未压缩）
+        start: 起始字节偏移（必须位于行首）
+        end: 结束字节偏移（None 表示读到文件末尾）
+    """
+    count = 0
+    last = b'\n'
+    remaining = end - start if end is not None else None
+    with open(input_file, 'rb') as f:
+        f.seek(start)
+        while remaining is None or remaining > 0:
+            chunk = f.read(READ_BUFFER_SIZE if remaining is None else min(READ_BUFFER_SIZE, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            count += chunk.count(b'\n') + chunk.count(b'\r') - chunk.count(b'\r\n')
+            # \r\n 被切在两块之间时前一块已按单独的 \r 计过一行
+            if last == b'\r' and chunk[:1] == b'\n':
+                count -= 1
+            last = chunk[-1:]
+    if last not in (b'\n', b'\r'):
+        count += 1  # 文件末尾没有换行符的最后一行
+    return count
+
+
+def format_record(data):
+    """
+    从一条 MedQA 记录生成用户输入和助手输出
+    
+    Returns:
+        (user_content, assistant_content)
+    """
+    # 提取字段
+    question = data.get('question', '')
+    options = data.get('options', {})
+    answer_idx = data.get('answer_idx', '')
+    answer_text = data.get('answer', '')
+    
+    # 格式化用户输入（问题 + 选项）
+    user_content = format_question_with_options(question, options)
+    
+    # 格式化助手输出（答案索引 + 答案文本）
+    assistant_content = f"答案是 {answer_idx}. {answer_text}"
+    
+    return user_content, assistant_content
+
+
+def convert_line(line, system_prompt):
+    """
+    将一行原始 JSON 转换为百炼格式的输出行（标准实现）
+    
+    Returns:
+        UTF-8 编码的输出行；空行返回 None
+    """
+    line = line.strip()
+    if not line:
+        return None
+    
+    data = json.loads(line)
+    user_content, assistant_content = format_record(data)
+    
+    # 构建百炼格式
+    bailian_format = {
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content},
+            {"role": "assistant", "content": assistant_content}
+        ]
+    }
+    
+    return (json.dumps(bailian_format, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+class FastLineEncoder:
+    """
+    高吞吐转换路径
+    
+    系统提示在构造时一次性编码为 bytes，每行输出由预编码的片段和两个字符串的
+    JSON 编码拼接而成，不再构建 messages 字典；安装了 orjson 时使用它解析和编码。
+    输出与 convert_line 逐字节一致：字段不全是字符串的记录、含 \\r 的行以及
+    快速解析失败的行都会交给 convert_line 处理。
+    """
+    
+    def __init__(self, system_prompt):
+        self.system_prompt = system_prompt
+        self.prefix = (
+            b'{"messages": [{"role": "system", "content": '
+            + _encode_json_string(system_prompt)
+            + b'}, {"role": "user", "content": '
+        )
+        self.middle = b'}, {"role": "assistant", "content": '
+        self.suffix = b'}]}\n'
+    
+    def convert(self, raw):
+        """
+        转换一行原始输入
+        
+        Args:
+            raw: 原始行（bytes；已按通用换行拆分过的行为 str；
+                来自列式缓存的行为 (user_content, assistant_content)）
+        
+        Returns:
+            UTF-8 编码的输出行；空行返回 None
+        """
+        if type(raw) is tuple:
+            return self.encode(*raw)
+        if type(raw) is str:
+            return convert_line(raw, self.system_prompt)
+        
+        stripped = raw.strip()
+        if not stripped:
+            return None
+        
+        try:
+            data = _fast_json_loads(stripped)
+        except ValueError:
+            return self._convert_fallback(raw)
+        
+        if type(data) is not dict:
+            return self._convert_fallback(raw)
+        question = data.get('question', '')
+        options = data.get('options', {})
+        answer_idx = data.get('answer_idx', '')
+        answer_text = data.get('answer', '')
+        if (type(question) is not str or type(options) is not dict
+                or type(answer_idx) is not str or type(answer_text) is not str
+                or not all(type(value) is str for value in options.values())):
+            return self._convert_fallback(raw)
+        
+        return self.encode(*format_record(data))
+    
+    def encode(self, user_content, assistant_content):
+        """由用户输入和助手输出拼接出一行百炼格式的输出"""
+        return b''.join((
+            self.prefix,
+            _encode_json_string(user_content),
+            self.middle,
+            _encode_json_string(assistant_content),
+            self.suffix,
+        ))
+    
+    def _convert_fallback(self, raw):
+        return convert_line(raw.decode('utf-8'), self.system_prompt)
+
+
+def iter_fast_lines(input_file, start=0, end=None, skip_offsets=None):
+    """
+    快速路径的行读取：普通行直接返回 bytes，不做解码；
+    含 \\r 的行（极少见）按文本模式规则拆分后以 str 返回
+    """
+    for raw in iter_raw_lines(input_file, start, end, skip_offsets):
+        if b'\r' in raw:
+            yield from _split_universal_newlines(raw.decode('utf-8'))
+        else:
+            yield raw
+
+
+def print_warning(line_num, message):
+    """打印转换警告（行号从 1 开始）"""
+    print(f"警告: 第 {line_num} 行 {message}")
+
+
+def convert_to_bailian_format(input_file, output_file, system_prompt=None, start=0, end=None,
+                              max_shard_bytes=None, fast=False, skip_offsets=None, columns=None,
+                              report=None):
     """
     转换单个 JSONL 文件为百炼格式
     
@@ -41,66 +492,83 @@ def convert_to_bailian_format(input_file, output_file, system_prompt=None):
         input_file: 输入文件路径
         output_file: 输出文件路径
         system_prompt: 系统提示（可选）
+        start: 起始字节偏移（可选，用于并行分段转换）
+        end: 结束字节偏移（可选，None 表示读到文件末尾）
+        max_shard_bytes: 单个输出分片的最大字节数（可选，None 表示不分片）
+        fast: 是否使用高吞吐转换路径（输出与标准路径逐字节一致）
+        skip_offsets: 要丢弃的输入行的起始字节偏移集合（可选，由 dedup 模块给出）
+        columns: medqa_columns.MedQAColumns（可选）；输入文件在列式缓存中时直接读取
+            已解析的字段，不再解码 JSON，输出不变
+        report: 字典（可选）；给出时不直接打印警告，而是把 (行号, 内容) 记入 report['warnings']，
+            读取的行数记入 report['lines']。并行分段转换时由主进程把分段内的行号换算为
+            整个文件的行号后按顺序打印，不必预先统计各分段的行数
     """
     if system_prompt is None:
         system_prompt = "你是一个专业的医学助手，擅长回答医学选择题。请根据题目和选项，给出正确答案及简要解释。"
     
     converted_count = 0
     skipped_count = 0
+    line_num = 0
+    if report is not None:
+        report['warnings'] = []
+        warn = lambda line_num, message: report['warnings'].append((line_num, message))
+    else:
+        warn = print_warning
+    
+    if columns is not None and columns.source_id(input_file) is not None:
+        lines = columns.iter_lines(input_file, start, end, skip_offsets)
+        convert = FastLineEncoder(system_prompt).convert
+    elif fast:
+        lines = iter_fast_lines(input_file, start, end, skip_offsets)
+        convert = FastLineEncoder(system_prompt).convert
+    else:
+        lines = iter_input_lines(input_file, start, end, skip_offsets)
+        convert = lambda line: convert_line(line, system_prompt)
     
-    with open(input_file, 'r', encoding='utf-8') as infile, \
-         open(output_file, 'w', encoding='utf-8') as outfile:
+    with ShardedJsonlWriter(output_file, max_shard_bytes) as outfile:
         
-        for line_num, line in enumerate(infile, 1):
-            line = line.strip()
-            if not line:
-                continue
-            
+        for line_num, line in enumerate(lines, 1):
             try:
-                data = json.loads(line)
-                
-                # 提取字段
-                question = data.get('question', '')
-                options = data.get('options', {})
-                answer_idx = data.get('answer_idx', '')
-                answer_text = data.get('answer', '')
-                
-                # 格式化用户输入（问题 + 选项）
-                user_content = format_question_with_options(question, options)
-                
-                # 格式化助手输出（答案索引 + 答案文本）
-                assistant_content = f"答案是 {answer_idx}. {answer_text}"
-                
-                # 构建百炼格式
-                bailian_format = {
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_content},
-                        {"role": "assistant", "content": assistant_content}
-                    ]
-                }
+                output_line = convert(line)
+                if output_line is None:
+                    continue
                 
                 # 写入输出文件
-                outfile.write(json.dumps(bailian_format, ensure_ascii=False) + '\n')
+                outfile.write(output_line)
                 converted_count += 1
                 
+            except UnicodeDecodeError:
+                # 与逐行读取文本时一致：编码错误直接中止转换
+                raise
             except json.JSONDecodeError as e:
-                print(f"警告: 第 {line_num} 行 JSON 解析错误: {e}")
+                warn(line_num, f"JSON 解析错误: {e}")
                 skipped_count += 1
             except Exception as e:
-                print(f"警告: 第 {line_num} 行处理错误: {e}")
+                warn(line_num, f"处理错误: {e}")
                 skipped_count += 1
     
+    if report is not None:
+        report['lines'] = line_num
     return converted_count, skipped_count
 
 
 def main():
     parser = argparse.ArgumentParser(description='转换 MedQA 数据集为百炼平台 SFT 格式')
-    parser.add_argument('input', help='输入 JSONL 文件路径')
-    parser.add_argument('output', help='输出 JSONL 文件路径')
+    parser.add_argument('input', help='输入 JSONL 文件路径（.gz / .zst 结尾时边读边解压）')
+    parser.add_argument('output', help='输出 JSONL 文件路径（.gz / .zst 结尾时压缩写出）')
     parser.add_argument('--system-prompt', 
                        default="你是一个专业的医学助手，擅长回答医学选择题。请根据题目和选项，给出正确答案及简要解释。",
                        help='系统提示词')
+    parser.add_argument('--max-shard-mb', type=float, default=UPLOAD_LIMIT_MB,
+                       help=f'单个输出文件的最大大小，超过时自动分片（默认 {UPLOAD_LIMIT_MB}，0 表示不分片）')
+    parser.add_argument('--fast', action='store_true',
+                       help='使用高吞吐转换路径（预编码系统提示、可选 orjson 后端、大块写入），输出与默认路径一致')
+    parser.add_argument('--metrics', metavar='FILE',
+                       help='把转换耗时、行/秒、MB/秒和内存峰值写入指标文件（.prom 结尾为 Prometheus textfile，'
+                            '否则为 JSON Lines；默认读取环境变量 METRICS_FILE）')
+    parser.add_argument('--profile', nargs='?', const='', metavar='PREFIX',
+                       help='用 cProfile 和 tracemalloc 分析转换循环，输出 PREFIX.prof 和 PREFIX.profile.txt'
+                            '（默认写入 datasets/MedQA_BaiLian/.profile/）')
     
     args = parser.parse_args()
     
@@ -117,22 +585,47 @@ def main():
     print(f"开始转换: {args.input} -> {args.output}")
     print(f"系统提示: {args.system_prompt}\n")
     
-    converted, skipped = convert_to_bailian_format(
-        args.input, 
-        args.output, 
-        args.system_prompt
-    )
+    max_shard_bytes = int(args.max_shard_mb * 1024 * 1024) if args.max_shard_mb > 0 else None
+    
+    from pipeline_metrics import PipelineMetrics, default_profile_prefix, profile_section
+    
+    metrics = PipelineMetrics.from_env("convert", args.metrics)
+    profile_prefix = (args.profile or default_profile_prefix("convert")) if args.profile is not None else None
+    
+    with metrics.phase("convert", dataset=input_path.name, fast=args.fast) as phase:
+        with profile_section(profile_prefix, enabled=profile_prefix is not None):
+            converted, skipped = convert_to_bailian_format(
+                args.input, 
+                args.output, 
+                args.system_prompt,
+                max_shard_bytes=max_shard_bytes,
+                fast=args.fast
+            )
+        phase.add(rows=converted, skipped=skipped, bytes=input_path.stat().st_size)
+    metrics.close()
     
     print(f"\n转换完成!")
     print(f"成功转换: {converted} 条")
     print(f"跳过: {skipped} 条")
+    
+    manifest_path = shard_manifest_path(output_path)
+    if manifest_path.exists():
+        manifest = read_shard_manifest(manifest_path)
+        print(f"输出已分片: {len(manifest['shards'])} 个文件（清单: {manifest_path}）")
+        for shard in manifest['shards']:
+            print(f"  - {Path(shard['file']).name}: {shard['rows']} 条, {shard['bytes'] / (1024 * 1024):.2f} MB")
+        return
+    
     print(f"输出文件: {args.output}")
     
-    # 显示文件大小
-    output_size_mb = output_path.stat().st_size / (1024 * 1024)
-    print(f"输出文件大小: {output_size_mb:.2f} MB")
+    # 显示文件大小（压缩输出按解压后的大小与上传限制比较）
+    output_size_mb = uncompressed_size(output_path) / (1024 * 1024)
+    if compression_of(output_path):
+        print(f"输出文件大小: {output_size_mb:.2f} MB（压缩后 {output_path.stat().st_size / (1024 * 1024):.2f} MB）")
+    else:
+        print(f"输出文件大小: {output_size_mb:.2f} MB")
     
-    if output_size_mb > 300:
+    if output_size_mb > UPLOAD_LIMIT_MB:
         print("\n警告: 文件大小超过 300MB，百炼平台限制单个文件最大 300MB")
         print("建议将数据分割成多个文件上传")
 
@@ -0,0 +1,178 @@
+"""
+DashScope HTTP 客户端
+
+FineTuneAutomation 的所有 HTTP 调用共用一个 requests.Session：
+- 连接池保持长连接，轮询任务状态时不再每次重新握手 TCP+TLS
+- 每个请求都有连接/读取超时，避免卡死在无响应的连接上
+- 429、5xx 和网络错误按带抖动的指数退避重试（优先遵循 Retry-After）
+- 记录每个请求的耗时、状态码和尝试次数
+"""
+
+import time
+import random
+import threading
+from collections import deque
+
+
+DEFAULT_TIMEOUT = (5.0, 30.0)
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    """第 attempt 次重试前的等待时间：带随机抖动的指数退避（full jitter）"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class RequestTiming:
+    """单个请求（含重试）的耗时记录"""
+    
+    __slots__ = ('method', 'path', 'status', 'elapsed', 'attempts')
+    
+    def __init__(self, method, path, status, elapsed, attempts):
+        self.method = method
+        self.path = path
+        self.status = status
+        self.elapsed = elapsed
+        self.attempts = attempts
+    
+    def __repr__(self):
+        return (f"RequestTiming({self.method} {self.path} -> {self.status}, "
+                f"{self.elapsed * 1000:.0f} ms, {self.attempts} 次尝试)")
+
+
+class DashScopeHTTPClient:
+    """带连接池、超时和重试的 DashScope HTTP 客户端"""
+    
+    def __init__(self, api_key, api_base, max_retries=3, timeout=DEFAULT_TIMEOUT,
+                 pool_size=10, history_size=1000):
+        """
+        Args:
+            api_key: DashScope API Key
+            api_base: API 地址，如 https://dashscope.aliyuncs.com/api/v1
+            max_retries: 最大重试次数
+            timeout: 默认超时 (连接超时, 读取超时)，单位秒
+            pool_size: 连接池大小（应不小于并发请求数）
+            history_size: 保留最近多少条请求耗时记录
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+        
+        self.api_base = api_base.rstrip("/")
+        self.max_retries = max_retries
+        self.timeout = timeout
+        
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {api_key}"
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        
+        self.timings = deque(maxlen=history_size)
+        self._lock = threading.Lock()
+    
+    def url(self, path):
+        return f"{self.api_base}/{path.lstrip('/')}"
+    
+    def request(self, method, path, timeout=None, idempotent=True, on_retry=None, **kwargs):
+        """
+        发送请求，必要时重试
+        
+        非幂等请求（如创建微调任务）只在确定服务端未处理时重试：
+        429 和连接建立超时；幂等请求还会在 5xx 和其他网络错误时重试。
+        
+        Args:
+            method: HTTP 方法
+            path: 相对 api_base 的路径
+            timeout: 超时 (连接, 读取)，默认使用客户端配置
+            idempotent: 请求是否可以安全重复
+            on_retry: 重试前的回调 on_retry(attempt, delay, reason)
+            **kwargs: 传给 requests.Session.request 的其他参数
+        
+        Returns:
+            requests.Response（重试用尽时返回最后一次响应）
+        
+        Raises:
+            requests.RequestException: 网络错误且重试用尽
+        """
+        import requests
+        
+        url = self.url(path)
+        timeout = timeout or self.timeout
+        start = time.perf_counter()
+        attempt = 0
+        
+        while True:
+            attempt += 1
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except requests.RequestException as e:
+                retryable = idempotent or isinstance(e, requests.ConnectTimeout)
+                if not retryable or attempt > self.max_retries:
+                    self._record(method, path, None, start, attempt)
+                    raise
+                reason = f"{type(e).__name__}: {e}"
+                delay = backoff_delay(attempt)
+            else:
+                retryable = response.status_code == 429 or (
+                    idempotent and response.status_code in RETRY_STATUS_CODES)
+                if not retryable or attempt > self.max_retries:
+                    self._record(method, path, response.status_code, start, attempt)
+                    return response
+                reason = f"HTTP {response.status_code}"
+                delay = self._retry_after(response) or backoff_delay(attempt)
+                response.close()
+            
+            if on_retry is not None:
+                on_retry(attempt, delay, reason)
+            time.sleep(delay)
+    
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+    
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+    
+    @staticmethod
+    def _retry_after(response):
+        """解析 Retry-After 头（秒数形式），无效时返回 None"""
+        value = response.headers.get("Retry-After")
+        try:
+            return min(float(value), 60.0) if value else None
+        except ValueError:
+            return None
+    
+    def _record(self, method, path, status, start, attempts):
+        timing = RequestTiming(method, path, status, time.perf_counter() - start, attempts)
+        with self._lock:
+            self.timings.append(timing)
+        return timing
+    
+    def timing_summary(self):
+        """
+        按 "方法 路径模板" 汇总请求耗时
+        
+        Returns:
+            {endpoint: {'count', 'errors', 'retries', 'avg_ms', 'max_ms'}}
+        """
+        with self._lock:
+            timings = list(self.timings)
+        
+        summary = {}
+        for timing in timings:
+            # fine-tunes/<job_id> 这类路径按第一段归类
+            endpoint = f"{timing.method} /{timing.path.strip('/').split('/')[0]}"
+            item = summary.setdefault(endpoint, {'count': 0, 'errors': 0, 'retries': 0,
+                                                 'total_ms': 0.0, 'max_ms': 0.0})
+            elapsed_ms = timing.elapsed * 1000
+            item['count'] += 1
+            item['errors'] += 0 if timing.status == 200 else 1
+            item['retries'] += timing.attempts - 1
+            item['total_ms'] += elapsed_ms
+            item['max_ms'] = max(item['max_ms'], elapsed_ms)
+        
+        for item in summary.values():
+            item['avg_ms'] = item.pop('total_ms') / item['count']
+        return summary
+    
+    def close(self):
+        self.session.close()
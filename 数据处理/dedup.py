@@ -0,0 +1,416 @@
+"""
+MedQA 近似重复题目检测（MinHash + LSH）
+
+对所有划分（train/dev/test）流式读取一遍，把 "题目 + 选项" 规范化后
+取字符 n-gram，计算 MinHash 签名，再用 LSH 分桶找出完全重复和近似重复的题目，
+包括同一划分内的重复和跨划分的重复（例如 test 中的题目出现在 train 里）。
+
+内存占用只与签名大小成正比（每行 num_perm 个 uint32），不保留题目文本。
+
+保留规则：同一组重复题目中优先保留 test，其次 dev，最后 train，
+同一划分内保留最先出现的一条；test 中的行只报告、从不删除，保证评测集不变。
+
+每行用它在输入文件中的起始字节偏移标识，batch_convert 把要删除的偏移集合
+传给转换器（convert_to_bailian_format 的 skip_offsets 参数）。
+"""
+
+import re
+import json
+import hashlib
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from convert_to_bailian_format import (
+    _fast_json_loads,
+    iter_raw_lines,
+    split_byte_ranges,
+)
+
+
+DEFAULT_NUM_PERM = 64
+DEFAULT_BANDS = 16
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_SHINGLE_SIZE = 5
+
+# 划分的保留优先级：数字越小越优先保留
+SPLIT_PRIORITY = {'test': 0, 'dev': 1, 'train': 2}
+
+# 每批计算签名的行数
+SIGNATURE_BATCH_ROWS = 4096
+
+# 一次参与向量化计算的 n-gram 数上限：临时矩阵 num_perm × N 保持在 CPU 缓存大小附近
+SIGNATURE_BATCH_VALUES = 1 << 13
+
+# n-gram 多项式哈希的基数
+_SHINGLE_BASE = np.uint64(1000003)
+
+_NON_WORD = re.compile(r'[\W_]+')
+
+
+def split_of(output_name):
+    """从输出文件名推断划分：mainland_4opt_test.jsonl（或 .jsonl.gz）-> test"""
+    stem = output_name.split('.', 1)[0]
+    for split in SPLIT_PRIORITY:
+        if stem.endswith(f"_{split}"):
+            return split
+    return 'train'
+
+
+def normalize_text(question, options):
+    """
+    规范化题目文本：NFKC、转小写、去掉空白和标点；
+    选项按内容排序后拼接，选项顺序被打乱的题目也能匹配
+    """
+    values = sorted(str(value) for value in options.values()) if isinstance(options, dict) else []
+    text = unicodedata.normalize('NFKC', ' '.join([str(question)] + values)).lower()
+    return _NON_WORD.sub('', text)
+
+
+def shingle_hashes(text, size=DEFAULT_SHINGLE_SIZE):
+    """
+    字符 n-gram 的 32 位哈希（uint64 数组，可能有重复，不影响 MinHash）
+
+    对 Unicode 码位做向量化的多项式滚动哈希，再用 splitmix64 的收尾步骤打散，
+    不需要为每个 n-gram 创建 Python 对象。
+    """
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    count = max(1, len(codes) - size + 1)
+    hashes = np.zeros(count, dtype=np.uint64)
+    for j in range(min(size, len(codes))):
+        hashes = hashes * _SHINGLE_BASE + codes[j:j + count]
+    hashes ^= hashes >> np.uint64(30)
+    hashes *= np.uint64(0xbf58476d1ce4e5b9)
+    hashes ^= hashes >> np.uint64(27)
+    hashes *= np.uint64(0x94d049bb133111eb)
+    hashes ^= hashes >> np.uint64(31)
+    return hashes >> np.uint64(32)
+
+
+class MinHasher:
+    """
+    固定随机种子的 MinHash，签名在不同进程间可比较
+
+    第 i 个哈希函数为 ((a_i * x + b_i) mod 2^64) >> 32（multiply-add-shift，
+    对 32 位输入是强通用哈希），只用乘加和移位，不需要取模运算。
+    """
+
+    def __init__(self, num_perm=DEFAULT_NUM_PERM, seed=1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.a = rng.integers(0, 1 << 64, size=(num_perm, 1), dtype=np.uint64, endpoint=False) | np.uint64(1)
+        self.b = rng.integers(0, 1 << 64, size=(num_perm, 1), dtype=np.uint64, endpoint=False)
+
+    def signatures(self, hash_arrays):
+        """
+        批量计算签名
+
+        Args:
+            hash_arrays: 每行一个 shingle_hashes 数组（不能为空）
+
+        Returns:
+            uint32[len(hash_arrays), num_perm]
+        """
+        result = np.empty((len(hash_arrays), self.num_perm), dtype=np.uint32)
+        i = 0
+        while i < len(hash_arrays):
+            # 攒一批行一起计算，用 reduceat 按行取最小值
+            j, total = i, 0
+            while j < len(hash_arrays) and (j == i or total + len(hash_arrays[j]) <= SIGNATURE_BATCH_VALUES):
+                total += len(hash_arrays[j])
+                j += 1
+            lengths = [len(h) for h in hash_arrays[i:j]]
+            starts = np.cumsum([0] + lengths[:-1])
+            values = np.multiply(self.a, np.concatenate(hash_arrays[i:j]))
+            values += self.b
+            # 右移是单调的，先取最小值再移位
+            result[i:j] = (np.minimum.reduceat(values, starts, axis=1) >> np.uint64(32)).T
+            i = j
+        return result
+
+
+def _raw_text(stripped):
+    """从原始行得到规范化文本；无法参与去重时返回 None"""
+    # 含 \r 的行在转换时可能拆成多条记录，不参与去重
+    if b'\r' in stripped:
+        return None
+    try:
+        data = _fast_json_loads(stripped)
+        return normalize_text(data.get('question', ''), data.get('options', {})) or None
+    except (ValueError, AttributeError, UnicodeDecodeError):
+        return None
+
+
+def _iter_range_texts(input_file, start, end, columns_location=None):
+    """
+    逐行给出 (字节偏移, 行号, 规范化文本)：空行的文本为 ''，无法参与去重的行为 None
+
+    给出列式缓存位置且输入文件在缓存中时直接读取已解析的字段，不解码 JSON；
+    此时行号是文件内的全局行号（调用方须把整个文件作为一个范围）。
+    """
+    columns = None
+    if columns_location is not None:
+        from medqa_columns import cached_columns
+        columns = cached_columns(*columns_location)
+    rows = columns.source_rows(input_file, start, end) if columns is not None else None
+
+    if rows is not None:
+        for row in rows.tolist():
+            if columns.fallback[row]:
+                text = _raw_text(columns.raw_line(row).strip())
+            else:
+                text = normalize_text(columns.question[row], columns.options(row)) or None
+            yield int(columns.offset[row]), int(columns.line[row]), text
+        return
+
+    pos = start
+    for line_index, raw in enumerate(iter_raw_lines(input_file, start, end)):
+        offset = pos
+        pos += len(raw)
+        stripped = raw.strip()
+        yield offset, line_index, _raw_text(stripped) if stripped else ''
+
+
+def fingerprint_range(task):
+    """
+    进程池工作函数：计算一个字节范围内每行的签名
+
+    Returns:
+        {'offsets': int64[n], 'lines': int64[n]（范围内的行号，从 0 开始）,
+         'digests': uint64[n]（规范化文本的精确哈希）, 'signatures': uint32[n, num_perm],
+         'line_count': 范围内的总行数, 'unparsed': 无法参与去重的行数}
+    """
+    input_file, start, end, num_perm, shingle_size, columns_location = task
+    hasher = MinHasher(num_perm)
+    offsets, lines, digests, signatures = [], [], [], []
+    pending = []
+    unparsed = 0
+
+    line_count = 0
+    for offset, line_index, text in _iter_range_texts(input_file, start, end, columns_location):
+        line_count = line_index + 1
+        if text == '':
+            continue
+        if text is None:
+            unparsed += 1
+            continue
+
+        offsets.append(offset)
+        lines.append(line_index)
+        digests.append(int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little'))
+        pending.append(shingle_hashes(text, shingle_size))
+        if len(pending) >= SIGNATURE_BATCH_ROWS:
+            signatures.append(hasher.signatures(pending))
+            pending = []
+
+    if pending:
+        signatures.append(hasher.signatures(pending))
+
+    return {
+        'offsets': np.array(offsets, dtype=np.int64),
+        'lines': np.array(lines, dtype=np.int64),
+        'digests': np.array(digests, dtype=np.uint64),
+        'signatures': (np.vstack(signatures) if signatures
+                       else np.empty((0, num_perm), dtype=np.uint32)),
+        'line_count': line_count,
+        'unparsed': unparsed,
+    }
+
+
+def _band_keys(signatures, bands):
+    """把签名分成 bands 段，每段压成一个 uint64 桶键"""
+    rows = signatures.shape[1] // bands
+    keys = np.zeros((signatures.shape[0], bands), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for band in range(bands):
+            key = np.zeros(signatures.shape[0], dtype=np.uint64)
+            for column in range(band * rows, (band + 1) * rows):
+                key = key * np.uint64(1000003) + signatures[:, column].astype(np.uint64)
+            keys[:, band] = key
+    return keys
+
+
+def find_duplicate_pairs(signatures, bands=DEFAULT_BANDS, threshold=DEFAULT_THRESHOLD, batch=1 << 20):
+    """
+    LSH 候选 + 签名相似度校验
+
+    每个桶里的行都与桶中序号最小的行比较，估计的 Jaccard 相似度
+    不低于 threshold 时连成一对。
+
+    Returns:
+        (rows, leaders)：两个等长数组，rows[i] 与 leaders[i] 是近似重复，leaders[i] < rows[i]
+    """
+    n = signatures.shape[0]
+    if n < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    keys = _band_keys(signatures, bands)
+    all_rows, all_leaders = [], []
+    for band in range(bands):
+        order = np.argsort(keys[:, band], kind='stable')
+        sorted_keys = keys[order, band]
+        group_start = np.ones(n, dtype=bool)
+        group_start[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        leader_pos = np.maximum.accumulate(np.where(group_start, np.arange(n), 0))
+        members = ~group_start
+        if not members.any():
+            continue
+
+        rows = order[members]
+        leaders = order[leader_pos[members]]
+        for i in range(0, len(rows), batch):
+            r, l = rows[i:i + batch], leaders[i:i + batch]
+            similar = (signatures[r] == signatures[l]).mean(axis=1) >= threshold
+            all_rows.append(r[similar])
+            all_leaders.append(l[similar])
+
+    if not all_rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    rows = np.concatenate(all_rows)
+    leaders = np.concatenate(all_leaders)
+    pairs = np.unique(np.stack([rows, leaders], axis=1), axis=0)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def _cluster_roots(n, rows, leaders):
+    """并查集：每个簇以序号最小的行作为根"""
+    parent = np.arange(n)
+
+    def find(x):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    for a, b in zip(rows.tolist(), leaders.tolist()):
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    return np.array([find(i) for i in range(n)]) if len(rows) else parent
+
+
+def deduplicate(datasets, workers=1, chunk_mb=32, num_perm=DEFAULT_NUM_PERM, bands=DEFAULT_BANDS,
+                threshold=DEFAULT_THRESHOLD, shingle_size=DEFAULT_SHINGLE_SIZE, columns=None):
+    """
+    在所有划分上检测重复题目
+
+    Args:
+        datasets: [(output_name, input_path), ...]
+        workers: 计算签名的进程数
+        chunk_mb: 大文件的分段大小（MB）
+        num_perm: MinHash 签名长度
+        bands: LSH 分段数（num_perm 必须能被整除）
+        threshold: 判定为近似重复的最低 Jaccard 相似度
+        shingle_size: 字符 n-gram 长度
+        columns: medqa_columns.MedQAColumns（可选）；给出时从列式缓存读取题目，
+            每个文件作为一个任务，不再解码 JSON
+
+    Returns:
+        {'drop': {output_name: set(字节偏移)},
+         'duplicates': [重复记录字典，见下], 'stats': {output_name: 统计}}
+    """
+    if num_perm % bands:
+        raise ValueError(f"num_perm ({num_perm}) 必须能被 bands ({bands}) 整除")
+
+    # 按保留优先级排序：序号越小越优先保留
+    ordered = sorted(datasets, key=lambda item: SPLIT_PRIORITY[split_of(item[0])])
+    chunk_bytes = max(1, int(chunk_mb * 1024 * 1024))
+
+    columns_location = columns.location if columns is not None else None
+
+    plans = []
+    for output_name, input_path in ordered:
+        if columns is not None or workers <= 1:
+            num_ranges = 1
+        else:
+            num_ranges = max(1, -(-input_path.stat().st_size // chunk_bytes))
+        plans.append((output_name, input_path, split_byte_ranges(input_path, num_ranges)))
+
+    tasks = [(str(input_path), start, end, num_perm, shingle_size, columns_location)
+             for _, input_path, ranges in plans for start, end in ranges]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(fingerprint_range, tasks))
+    else:
+        parts = [fingerprint_range(task) for task in tasks]
+
+    # 拼接各分段的结果，行号换算为文件内的全局行号
+    names, offsets, lines, digests, signatures = [], [], [], [], []
+    stats = {}
+    parts_iter = iter(parts)
+    for dataset_index, (output_name, _, ranges) in enumerate(plans):
+        line_base = 0
+        unparsed = 0
+        rows = 0
+        for _ in ranges:
+            part = next(parts_iter)
+            names.append(np.full(len(part['offsets']), dataset_index, dtype=np.int32))
+            offsets.append(part['offsets'])
+            lines.append(part['lines'] + line_base)
+            digests.append(part['digests'])
+            signatures.append(part['signatures'])
+            line_base += part['line_count']
+            unparsed += part['unparsed']
+            rows += len(part['offsets'])
+        stats[output_name] = {'rows': rows, 'unparsed': unparsed, 'exact': 0, 'near': 0,
+                              'within_split': 0, 'cross_split': 0, 'dropped': 0}
+
+    names = np.concatenate(names)
+    offsets = np.concatenate(offsets)
+    lines = np.concatenate(lines)
+    digests = np.concatenate(digests)
+    signatures = np.concatenate(signatures)
+
+    rows, leaders = find_duplicate_pairs(signatures, bands, threshold)
+    roots = _cluster_roots(len(signatures), rows, leaders)
+
+    drop = {output_name: set() for output_name, _, _ in plans}
+    duplicates = []
+    for row in np.nonzero(roots != np.arange(len(roots)))[0].tolist():
+        root = int(roots[row])
+        name = plans[names[row]][0]
+        kept_name = plans[names[root]][0]
+        exact = bool(digests[row] == digests[root])
+        similarity = float((signatures[row] == signatures[root]).mean())
+        dropped = split_of(name) != 'test'
+
+        item = stats[name]
+        item['exact' if exact else 'near'] += 1
+        item['within_split' if name == kept_name else 'cross_split'] += 1
+        if dropped:
+            item['dropped'] += 1
+            drop[name].add(int(offsets[row]))
+
+        duplicates.append({
+            'dataset': name,
+            'line': int(lines[row]) + 1,
+            'offset': int(offsets[row]),
+            'duplicate_of': {'dataset': kept_name, 'line': int(lines[root]) + 1, 'offset': int(offsets[root])},
+            'similarity': round(similarity, 4),
+            'kind': 'exact' if exact else 'near',
+            'dropped': dropped,
+        })
+
+    return {'drop': drop, 'duplicates': duplicates, 'stats': stats}
+
+
+def write_report(result, report_file):
+    """把重复记录逐行写入 JSONL 报告"""
+    with open(report_file, 'w', encoding='utf-8') as f:
+        for item in result['duplicates']:
+            f.write(json.dumps(item, ensure_ascii=False) + '\n')
+
+
+def print_summary(result):
+    """打印去重统计"""
+    print("=" * 60)
+    print("重复题目检测")
+    print("=" * 60)
+    print(f"{'数据集':<28} {'行数':>7} {'完全重复':>8} {'近似重复':>8} {'跨划分':>6} {'删除':>6}")
+    for name, item in result['stats'].items():
+        print(f"{name:<28} {item['rows']:>7} {item['exact']:>8} {item['near']:>8} "
+              f"{item['cross_split']:>6} {item['dropped']:>6}")
+    print()
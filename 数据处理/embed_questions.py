@@ -0,0 +1,710 @@
+"""
+MedQA 题目向量化与本地向量索引
+
+流式读取转换后的数据集（百炼格式 JSONL 或分片清单），取每条记录的用户问题
+（题干 + 选项）生成向量，建立本地向量索引，用于：
+- 相似题检索：评测时为每道题检索训练集中最相似的几道题作为少样本示例（RAG few-shot）
+- 数据审计：找出测试集与训练集之间、或同一数据集内部的近似重复题目
+
+向量来源二选一：
+- dashscope: 百炼 text-embedding-v4 等模型，按模型的批次上限（v4 每次 10 条）分批，
+  多个批次并发请求，可限速
+- local: 本地 sentence-transformers 模型，离线运行
+
+向量按 "模型 + 维度 + 文本" 的 SHA-256 缓存在 SQLite 中，重建索引或换一个数据集时
+已经算过的题目不再请求 API。
+
+索引保存在数据集旁边的 <数据集>.vectors/ 目录：
+- <模型>.npy   归一化后的 float32 向量矩阵（按行号排列，与 line_index.py 的行号一致），
+               以内存映射方式打开，检索时分块做矩阵乘法取 top-k（flat 后端）
+- <模型>.json  元数据（模型、维度、源文件大小和修改时间）
+- <模型>.qdrant/  可选的嵌入式 Qdrant 集合（qdrant 后端）
+
+用法：
+    python embed_questions.py ../datasets/MedQA_BaiLian/mainland_4opt_train.jsonl
+    python embed_questions.py <训练集> --query "患者男，45岁，突发胸痛…" -k 5
+    python embed_questions.py <训练集> --audit ../datasets/MedQA_BaiLian/mainland_4opt_test.jsonl --threshold 0.95
+    python embed_questions.py <训练集> --provider local --model BAAI/bge-small-zh-v1.5 --backend qdrant
+"""
+
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from evaluate_model import RateLimiter, iter_dataset_files, iter_eval_items
+from line_index import LineIndex, build_line_index
+from token_index import dataset_stem, source_state
+
+
+EMBEDDING_PATH = "services/embeddings/text-embedding/text-embedding"
+
+DEFAULT_PROVIDER = "dashscope"
+DEFAULT_MODEL = "text-embedding-v4"
+DEFAULT_DIMENSION = 1024
+DEFAULT_LOCAL_MODEL = "BAAI/bge-small-zh-v1.5"
+
+# 单次请求最多包含的文本条数（见 阿里云百炼官方doc/文本与多模态向量化.md）
+BATCH_LIMITS = {
+    'text-embedding-v4': 10,
+    'text-embedding-v3': 10,
+    'text-embedding-v2': 25,
+    'text-embedding-v1': 25,
+}
+
+# 维度固定、不接受 dimension 参数的模型
+FIXED_DIMENSIONS = {
+    'text-embedding-v2': 1536,
+    'text-embedding-v1': 1536,
+}
+
+DEFAULT_CACHE_FILE = Path(__file__).parent.parent / "datasets" / "MedQA_BaiLian" / ".embedding_cache.sqlite"
+
+VECTOR_INDEX_VERSION = 1
+
+# 建索引时每次向量化的行数
+DEFAULT_CHUNK_ROWS = 1000
+
+# 检索时每次参与矩阵乘法的查询条数
+SEARCH_BLOCK = 256
+
+QDRANT_COLLECTION = "questions"
+
+
+def question_text(messages):
+    """对话中最后一条用户消息（题干 + 选项），作为向量化的文本"""
+    return next((m['content'] for m in reversed(messages) if m['role'] == 'user'), '')
+
+
+def normalize(vectors):
+    """按行做 L2 归一化，归一化后内积即余弦相似度"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class DashScopeEmbedder:
+    """百炼文本向量化接口，分批并发请求"""
+
+    def __init__(self, model=DEFAULT_MODEL, dimension=DEFAULT_DIMENSION, api_key=None, api_base=None,
+                 concurrency=4, rps=None, max_retries=3):
+        """
+        Args:
+            model: 向量模型，如 text-embedding-v4
+            dimension: 向量维度（text-embedding-v1/v2 固定为 1536）
+            api_key: DashScope API Key（默认读取 DASHSCOPE_API_KEY）
+            api_base: API 地址（默认读取 DASHSCOPE_API_BASE）
+            concurrency: 同时进行的请求数
+            rps: 每秒最大请求数（None 表示不限速）
+            max_retries: 限流/服务端错误的重试次数
+        """
+        from dashscope_http import DashScopeHTTPClient
+
+        api_key = api_key or os.getenv("DASHSCOPE_API_KEY")
+        if not api_key:
+            raise ValueError("请在 .env 文件中设置 DASHSCOPE_API_KEY")
+        api_base = api_base or os.getenv("DASHSCOPE_API_BASE", "https://dashscope.aliyuncs.com/api/v1")
+
+        self.provider = "dashscope"
+        self.model = model
+        self.dimension = FIXED_DIMENSIONS.get(model, dimension)
+        self.batch_size = BATCH_LIMITS.get(model, 10)
+        self.name = f"dashscope/{model}/{self.dimension}"
+        self.client = DashScopeHTTPClient(api_key, api_base, max_retries=max_retries, pool_size=concurrency)
+        self.limiter = RateLimiter(rps)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.requests = 0
+        self.total_tokens = 0
+        self._lock = threading.Lock()
+
+    def _embed_batch(self, texts):
+        body = {'model': self.model, 'input': {'texts': texts}}
+        if self.model not in FIXED_DIMENSIONS:
+            body['parameters'] = {'dimension': self.dimension}
+
+        self.limiter.acquire()
+        response = self.client.post(EMBEDDING_PATH, json=body)
+        if response.status_code != 200:
+            try:
+                message = response.json().get('message', response.text)
+            except ValueError:
+                message = response.text
+            raise RuntimeError(f"HTTP {response.status_code}: {message}")
+
+        data = response.json()
+        embeddings = sorted(data['output']['embeddings'], key=lambda item: item['text_index'])
+        with self._lock:
+            self.requests += 1
+            self.total_tokens += data.get('usage', {}).get('total_tokens', 0)
+        return [item['embedding'] for item in embeddings]
+
+    def embed(self, texts):
+        """
+        向量化一组文本
+
+        Returns:
+            (len(texts), dimension) 的 float32 数组，已归一化
+        """
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1:
+            results = [self._embed_batch(batches[0])]
+        else:
+            results = list(self.executor.map(self._embed_batch, batches))
+        return normalize([vector for batch in results for vector in batch])
+
+    def print_stats(self):
+        print(f"🌐 向量化请求 {self.requests} 次，消耗 {self.total_tokens} tokens（{self.name}）")
+
+    def close(self):
+        self.executor.shutdown()
+        self.client.close()
+
+
+class LocalEmbedder:
+    """本地 sentence-transformers 模型，离线向量化"""
+
+    def __init__(self, model=DEFAULT_LOCAL_MODEL, device=None, batch_size=64):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError("本地向量化需要 sentence-transformers: pip install sentence-transformers")
+
+        self.provider = "local"
+        self.model = model
+        self.batch_size = batch_size
+        self.encoder = SentenceTransformer(model, device=device)
+        self.dimension = self.encoder.get_sentence_embedding_dimension()
+        self.name = f"local/{model}"
+
+    def embed(self, texts):
+        vectors = self.encoder.encode(texts, batch_size=self.batch_size, convert_to_numpy=True,
+                                      show_progress_bar=False)
+        return normalize(vectors)
+
+    def print_stats(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def load_embedder(provider=DEFAULT_PROVIDER, model=None, dimension=DEFAULT_DIMENSION, **options):
+    """
+    按名称创建向量化器
+
+    Args:
+        provider: dashscope 或 local
+        model: 模型名称（默认 text-embedding-v4 / BAAI/bge-small-zh-v1.5）
+        options: dashscope 的 concurrency、rps 等参数（local 忽略）
+    """
+    if provider == "local":
+        return LocalEmbedder(model or os.getenv("LOCAL_EMBEDDING_MODEL", DEFAULT_LOCAL_MODEL))
+    if provider == "dashscope":
+        return DashScopeEmbedder(model or DEFAULT_MODEL, dimension, **options)
+    raise ValueError(f"未知的向量来源: {provider}")
+
+
+def vector_cache_key(embedder_name, text):
+    """缓存键：向量化器名称（含模型和维度）+ 文本的 SHA-256"""
+    return hashlib.sha256(f"{embedder_name}\n{text}".encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """基于 SQLite 的向量缓存，向量以 float32 字节串保存，可在多个线程间共享"""
+
+    # 单条 SQL 中 IN (...) 的最大参数个数
+    LOOKUP_BATCH = 500
+
+    def __init__(self, cache_file=DEFAULT_CACHE_FILE):
+        self.path = Path(cache_file)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vectors ("
+            " key TEXT PRIMARY KEY,"
+            " embedder TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys):
+        """批量查询，返回 {key: 向量}（未命中的键不出现）"""
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for i in range(0, len(keys), self.LOOKUP_BATCH):
+                batch = keys[i:i + self.LOOKUP_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM vectors WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, embedder_name, items):
+        """批量保存 (key, 向量)"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO vectors (key, embedder, vector, created_at) VALUES (?, ?, ?, ?)",
+                [(key, embedder_name, np.asarray(vector, dtype=np.float32).tobytes(), now)
+                 for key, vector in items],
+            )
+            self._conn.commit()
+
+    def print_stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = f"{self.hits / lookups * 100:.1f}%" if lookups else "-"
+        print(f"🗄️  向量缓存: 命中 {self.hits}，未命中 {self.misses}（命中率 {hit_rate}）({self.path})")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def embed_texts(embedder, texts, cache=None):
+    """
+    向量化一组文本，先查缓存，只把未命中且去重后的文本交给 embedder
+
+    Returns:
+        (len(texts), dimension) 的 float32 数组
+    """
+    keys = [vector_cache_key(embedder.name, text) for text in texts]
+    found = cache.get_many(keys) if cache is not None else {}
+
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in found:
+            missing.setdefault(key, text)
+    if missing:
+        vectors = embedder.embed(list(missing.values()))
+        computed = dict(zip(missing.keys(), vectors))
+        if cache is not None:
+            cache.put_many(embedder.name, computed.items())
+        found.update(computed)
+
+    return np.stack([found[key] for key in keys]) if keys else np.empty((0, embedder.dimension), np.float32)
+
+
+def index_dir(dataset_path):
+    """数据集对应的向量索引目录"""
+    dataset_path = Path(dataset_path)
+    return dataset_path.with_name(dataset_stem(dataset_path) + ".vectors")
+
+
+def index_paths(dataset_path, embedder_name):
+    """某个向量化器对应的向量文件、元数据文件和 Qdrant 目录"""
+    slug = embedder_name.replace('/', '_')
+    directory = index_dir(dataset_path)
+    return directory / f"{slug}.npy", directory / f"{slug}.json", directory / f"{slug}.qdrant"
+
+
+def _read_meta(meta_file):
+    try:
+        with open(meta_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def build_vector_index(dataset_path, embedder, cache=None, backend='flat', chunk_rows=DEFAULT_CHUNK_ROWS,
+                       force=False):
+    """
+    建立（或复用）数据集的向量索引
+
+    Returns:
+        元数据字典
+    """
+    files = iter_dataset_files(dataset_path)
+    vector_file, meta_file, qdrant_dir = index_paths(dataset_path, embedder.name)
+    state = {'version': VECTOR_INDEX_VERSION, 'embedder': embedder.name,
+             'dimension': embedder.dimension, 'sources': source_state(files)}
+
+    meta = None if force else _read_meta(meta_file)
+    if meta is None or not vector_file.exists() or any(meta.get(k) != v for k, v in state.items()):
+        meta = _embed_dataset(dataset_path, embedder, cache, vector_file, chunk_rows)
+        meta.update(state, provider=embedder.provider, model=embedder.model)
+        if qdrant_dir.exists():
+            shutil.rmtree(qdrant_dir)
+        meta['backends'] = ['flat']
+        _write_meta(meta_file, meta)
+
+    if backend == 'qdrant' and 'qdrant' not in meta['backends']:
+        QdrantIndex.build(qdrant_dir, np.load(vector_file, mmap_mode='r'))
+        meta['backends'].append('qdrant')
+        _write_meta(meta_file, meta)
+    return meta
+
+
+def _write_meta(meta_file, meta):
+    with open(meta_file, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+
+def _embed_dataset(dataset_path, embedder, cache, vector_file, chunk_rows):
+    """流式向量化全部题目，按行号写入内存映射的向量文件"""
+    num_rows = len(build_line_index(dataset_path))
+    vector_file.parent.mkdir(parents=True, exist_ok=True)
+    temp_file = vector_file.with_name(vector_file.name + ".tmp")
+    vectors = np.lib.format.open_memmap(temp_file, mode='w+', dtype=np.float32,
+                                        shape=(num_rows, embedder.dimension))
+
+    start = time.perf_counter()
+    row = 0
+    texts = []
+
+    def flush():
+        nonlocal row
+        vectors[row:row + len(texts)] = embed_texts(embedder, texts, cache)
+        row += len(texts)
+        texts.clear()
+        print(f"   已向量化 {row}/{num_rows} 行")
+
+    for _, prompt, _ in iter_eval_items(dataset_path):
+        texts.append(question_text(prompt))
+        if len(texts) >= chunk_rows:
+            flush()
+    if texts:
+        flush()
+
+    vectors.flush()
+    del vectors
+    os.replace(temp_file, vector_file)
+    return {'rows': row, 'elapsed_seconds': round(time.perf_counter() - start, 2)}
+
+
+class FlatIndex:
+    """内存映射的向量矩阵上做精确检索（内积 = 余弦相似度）"""
+
+    def __init__(self, vector_file):
+        self.vectors = np.load(vector_file, mmap_mode='r')
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def search(self, queries, k):
+        """
+        Returns:
+            (scores, rows)：形状均为 (len(queries), min(k, 行数))，按相似度从高到低
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        k = min(k, len(self.vectors))
+        if k <= 0:
+            return np.empty((len(queries), 0), dtype=np.float32), np.empty((len(queries), 0), dtype=np.int64)
+        all_scores = np.empty((len(queries), k), dtype=np.float32)
+        all_rows = np.empty((len(queries), k), dtype=np.int64)
+        for i in range(0, len(queries), SEARCH_BLOCK):
+            scores = queries[i:i + SEARCH_BLOCK] @ self.vectors.T
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind='stable')
+            all_rows[i:i + SEARCH_BLOCK] = np.take_along_axis(top, order, axis=1)
+            all_scores[i:i + SEARCH_BLOCK] = np.take_along_axis(top_scores, order, axis=1)
+        return all_scores, all_rows
+
+    def close(self):
+        self.vectors = None
+
+
+class QdrantIndex:
+    """嵌入式 Qdrant（本地目录，无需单独部署服务）上的检索，点 ID 即行号"""
+
+    def __init__(self, path):
+        try:
+            from qdrant_client import QdrantClient
+        except ImportError:
+            raise ImportError("qdrant 后端需要 qdrant-client: pip install qdrant-client")
+        self.client = QdrantClient(path=str(path))
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.client.count(QDRANT_COLLECTION).count
+
+    @classmethod
+    def build(cls, path, vectors, batch_size=1024):
+        """用向量矩阵创建集合（已有集合会被替换）"""
+        from qdrant_client import models
+
+        index = cls(path)
+        client = index.client
+        if client.collection_exists(QDRANT_COLLECTION):
+            client.delete_collection(QDRANT_COLLECTION)
+        client.create_collection(
+            QDRANT_COLLECTION,
+            vectors_config=models.VectorParams(size=vectors.shape[1], distance=models.Distance.COSINE),
+        )
+        for start in range(0, len(vectors), batch_size):
+            block = np.asarray(vectors[start:start + batch_size])
+            client.upsert(QDRANT_COLLECTION, points=models.Batch(
+                ids=list(range(start, start + len(block))), vectors=block.tolist()))
+        index.close()
+
+    def search(self, queries, k):
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if k <= 0:
+            return np.empty((len(queries), 0), dtype=np.float32), np.empty((len(queries), 0), dtype=np.int64)
+        results = []
+        with self._lock:
+            for query in queries:
+                results.append(self.client.search(QDRANT_COLLECTION, query_vector=query.tolist(), limit=k))
+        k = min((len(hits) for hits in results), default=0)
+        scores = np.array([[hit.score for hit in hits[:k]] for hits in results], dtype=np.float32)
+        rows = np.array([[hit.id for hit in hits[:k]] for hits in results], dtype=np.int64)
+        return scores.reshape(len(queries), k), rows.reshape(len(queries), k)
+
+    def close(self):
+        self.client.close()
+
+
+def open_index(dataset_path, embedder_name, backend='flat'):
+    """打开已建立的向量索引"""
+    vector_file, _, qdrant_dir = index_paths(dataset_path, embedder_name)
+    if backend == 'qdrant':
+        return QdrantIndex(qdrant_dir)
+    return FlatIndex(vector_file)
+
+
+class FewShotRetriever:
+    """按题目相似度从已建索引的数据集（通常是训练集）中检索少样本示例"""
+
+    def __init__(self, dataset_path, embedder, cache=None, backend='flat'):
+        self.embedder = embedder
+        self.cache = cache
+        self.index = open_index(dataset_path, embedder.name, backend)
+        self.records = LineIndex(dataset_path)
+
+    def examples(self, messages, k):
+        """
+        与 messages 中的问题最相似的 k 道题
+
+        Returns:
+            [user 消息, assistant 消息, ...]，题干与当前问题完全相同的记录会被跳过
+            （训练集中有多条相同题目时扩大检索范围，仍然凑够 k 道）
+        """
+        question = question_text(messages)
+        query = embed_texts(self.embedder, [question], self.cache)
+
+        limit = k + 1
+        while True:
+            _, rows = self.index.search(query, limit)
+            shots = []
+            for row in rows[0]:
+                example = self.records[int(row)]['messages']
+                if question_text(example) == question:
+                    continue
+                shots.extend({'role': m['role'], 'content': m['content']}
+                             for m in example if m['role'] in ('user', 'assistant'))
+                if len(shots) >= 2 * k:
+                    break
+            if len(shots) >= 2 * k or rows.shape[1] < limit:
+                return shots
+            limit *= 2
+
+    def with_examples(self, messages, k):
+        """把示例插在系统消息之后、当前问题之前"""
+        head = [m for m in messages if m['role'] == 'system']
+        rest = [m for m in messages if m['role'] != 'system']
+        return head + self.examples(messages, k) + rest
+
+    def wrap(self, call, k):
+        """给 call(messages) 加上少样本示例"""
+        def few_shot_call(messages):
+            return call(self.with_examples(messages, k))
+        return few_shot_call
+
+    @classmethod
+    def open(cls, dataset_path, backend='flat', cache=None, model=None, **options):
+        """
+        按索引元数据中记录的向量化器打开（数据集必须已经用 build_vector_index 建过索引）
+
+        只考虑与数据集当前文件一致、且建有 backend 的索引；同一数据集用多个模型建过索引时
+        必须用 model 指定（模型名如 text-embedding-v4，或向量化器全名如 dashscope/text-embedding-v4/1024）。
+        """
+        sources = source_state(iter_dataset_files(dataset_path))
+        metas = []
+        for meta_file in sorted(index_dir(dataset_path).glob("*.json")):
+            meta = _read_meta(meta_file)
+            if (not meta or meta.get('version') != VECTOR_INDEX_VERSION or meta.get('sources') != sources
+                    or backend not in meta.get('backends', [])):
+                continue
+            if model is None or model in (meta.get('model'), meta.get('embedder')):
+                metas.append(meta)
+        if not metas:
+            wanted = f"（{model}，{backend}）" if model else f"（{backend}）"
+            raise FileNotFoundError(f"{dataset_path} 没有可用的向量索引{wanted}，请先运行 embed_questions.py")
+        if len(metas) > 1:
+            names = "、".join(meta['embedder'] for meta in metas)
+            raise ValueError(f"{dataset_path} 有多个向量索引（{names}），请指定使用哪个模型")
+        meta = metas[0]
+        embedder = load_embedder(meta['provider'], meta['model'], meta['dimension'], **options)
+        return cls(dataset_path, embedder, cache, backend)
+
+    def close(self):
+        self.index.close()
+        self.records.close()
+        self.embedder.close()
+
+
+def similar_pairs(index, queries, threshold, k=5, same_dataset=False):
+    """
+    找出相似度不低于 threshold 的 (查询行号, 索引行号, 相似度)
+
+    same_dataset 为 True 时查询与索引是同一数据集：跳过自身，每对按 (较小行号, 较大行号)
+    只保留一次。一对题目可能只出现在其中一道题的 top-k 里，结果与行的顺序无关。
+    """
+    if not same_dataset:
+        pairs = []
+        scores, rows = index.search(queries, k)
+        for query_row in range(len(queries)):
+            for score, row in zip(scores[query_row], rows[query_row]):
+                if score < threshold:
+                    break
+                pairs.append((query_row, int(row), float(score)))
+        pairs.sort(key=lambda pair: -pair[2])
+        return pairs
+
+    found = {}
+    scores, rows = index.search(queries, k + 1)
+    for query_row in range(len(queries)):
+        for score, row in zip(scores[query_row], rows[query_row]):
+            if score < threshold:
+                break
+            row = int(row)
+            if row == query_row:
+                continue
+            pair = (min(query_row, row), max(query_row, row))
+            found[pair] = max(found.get(pair, float(score)), float(score))
+    return sorted(((a, b, score) for (a, b), score in found.items()), key=lambda pair: (-pair[2], pair[0], pair[1]))
+
+
+def embed_dataset_queries(dataset_path, embedder, cache=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """流式向量化另一个数据集的全部题目（不建索引），用于审计"""
+    blocks, texts = [], []
+    for _, prompt, _ in iter_eval_items(dataset_path):
+        texts.append(question_text(prompt))
+        if len(texts) >= chunk_rows:
+            blocks.append(embed_texts(embedder, texts, cache))
+            texts = []
+    if texts:
+        blocks.append(embed_texts(embedder, texts, cache))
+    return np.concatenate(blocks) if blocks else np.empty((0, embedder.dimension), np.float32)
+
+
+def print_neighbors(records, scores, rows, preview=80):
+    for score, row in zip(scores, rows):
+        text = question_text(records[int(row)]['messages']).replace('\n', ' ')
+        print(f"   {score:.4f}  第 {int(row)} 行  {text[:preview]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MedQA 题目向量化与本地向量索引（相似题检索、数据审计）')
+    parser.add_argument('dataset', help='要建索引的数据集（百炼格式 JSONL 或分片清单）')
+    parser.add_argument('--provider', choices=('dashscope', 'local'), default=DEFAULT_PROVIDER,
+                        help='向量来源：dashscope 百炼接口（默认），local 本地 sentence-transformers 模型')
+    parser.add_argument('--model', help=f'向量模型（默认 {DEFAULT_MODEL} / {DEFAULT_LOCAL_MODEL}）')
+    parser.add_argument('--dimension', type=int, default=DEFAULT_DIMENSION,
+                        help=f'向量维度（默认 {DEFAULT_DIMENSION}，仅 text-embedding-v3/v4）')
+    parser.add_argument('--concurrency', type=int, default=4, help='并发请求数（默认 4）')
+    parser.add_argument('--rps', type=float, default=None, help='每秒最大请求数（默认不限速）')
+    parser.add_argument('--backend', choices=('flat', 'qdrant'), default='flat',
+                        help='检索后端：flat 内存映射矩阵（默认），qdrant 嵌入式 Qdrant')
+    parser.add_argument('--query', nargs='+', help='检索与给定文本最相似的题目')
+    parser.add_argument('--similar-to', type=int, nargs='+', help='检索与指定行号最相似的题目')
+    parser.add_argument('-k', type=int, default=5, help='每个查询返回的条数（默认 5）')
+    parser.add_argument('--audit', nargs='?', const='', metavar='DATASET',
+                        help='审计近似重复：给出另一数据集时查找它与本数据集之间的相似题，不给时查找本数据集内部的')
+    parser.add_argument('--threshold', type=float, default=0.95, help='审计的相似度阈值（默认 0.95）')
+    parser.add_argument('--output', help='审计结果输出文件（JSONL）')
+    parser.add_argument('--cache-file', default=str(DEFAULT_CACHE_FILE), help='向量缓存文件')
+    parser.add_argument('--no-cache', action='store_true', help='不使用向量缓存')
+    parser.add_argument('--force', action='store_true', help='忽略已有索引重新向量化')
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    try:
+        embedder = load_embedder(args.provider, args.model, args.dimension,
+                                 concurrency=args.concurrency, rps=args.rps)
+    except (ImportError, ValueError) as e:
+        print(f"❌ {e}")
+        return
+    cache = None if args.no_cache else EmbeddingCache(args.cache_file)
+
+    try:
+        meta = build_vector_index(args.dataset, embedder, cache, args.backend, force=args.force)
+        print(f"🧭 {Path(args.dataset).name}: {meta['rows']} 行，{embedder.name}（{args.backend}）")
+
+        index = open_index(args.dataset, embedder.name, args.backend)
+        records = LineIndex(args.dataset)
+
+        for text in args.query or []:
+            scores, rows = index.search(embed_texts(embedder, [text], cache), args.k)
+            print(f"\n🔍 {text[:80]}")
+            print_neighbors(records, scores[0], rows[0])
+
+        for row in args.similar_to or []:
+            if not 0 <= row < len(records):
+                print(f"❌ 行号超出范围: {row}（共 {len(records)} 行）")
+                continue
+            query = np.asarray(np.load(index_paths(args.dataset, embedder.name)[0], mmap_mode='r')[row:row + 1])
+            scores, rows = index.search(query, args.k + 1)
+            keep = rows[0] != row
+            print(f"\n🔍 第 {row} 行: {question_text(records[row]['messages']).replace(chr(10), ' ')[:80]}")
+            print_neighbors(records, scores[0][keep][:args.k], rows[0][keep][:args.k])
+
+        if args.audit is not None:
+            same = not args.audit or Path(args.audit).resolve() == Path(args.dataset).resolve()
+            if same:
+                queries = np.load(index_paths(args.dataset, embedder.name)[0], mmap_mode='r')
+                query_records = records
+            else:
+                queries = embed_dataset_queries(args.audit, embedder, cache)
+                query_records = LineIndex(args.audit)
+            pairs = similar_pairs(index, queries, args.threshold, args.k, same_dataset=same)
+
+            target = "内部" if same else f"{Path(args.audit).name} 与 {Path(args.dataset).name} 之间"
+            print(f"\n🧪 {target}相似度 ≥ {args.threshold} 的题目: {len(pairs)} 对"
+                  f"（涉及 {len({p[0] for p in pairs})} 道查询题）")
+            for query_row, row, score in pairs[:10]:
+                print(f"   {score:.4f}  {query_row} ↔ {row}")
+                print(f"      {question_text(query_records[query_row]['messages'])[:80]!r}")
+                print(f"      {question_text(records[row]['messages'])[:80]!r}")
+
+            if args.output:
+                with open(args.output, 'w', encoding='utf-8') as f:
+                    for query_row, row, score in pairs:
+                        f.write(json.dumps({'query_row': query_row, 'row': row, 'score': round(score, 6)}) + '\n')
+                print(f"✅ 审计结果: {args.output}")
+
+        records.close()
+        index.close()
+    except ValueError as e:
+        # 压缩的数据集等无法建立行索引的输入
+        print(f"❌ {e}")
+    finally:
+        embedder.print_stats()
+        if cache is not None:
+            cache.print_stats()
+            cache.close()
+        embedder.close()
+
+
+if __name__ == '__main__':
+    main()
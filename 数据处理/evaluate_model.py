@@ -0,0 +1,387 @@
+"""
+微调模型评测
+
+流式读取转换后的测试集（百炼格式 JSONL 或分片清单），在并发数上限和
+速率限制下并发调用模型，从 "答案是 X." 形式的回答中提取选项字母，
+统计准确率、错误数、p50/p95 延迟和吞吐量。
+
+每条结果写完即落盘，中途崩溃或 Ctrl+C 后用相同参数重新运行会跳过已完成的题目。
+
+用法：
+    python evaluate_model.py <model_id> ../datasets/MedQA_BaiLian/mainland_4opt_test.jsonl
+    python evaluate_model.py <model_id> <test_file> --concurrency 16 --rps 10 --limit 500
+    python evaluate_model.py <model_id> <test_file> --few-shot 3 --few-shot-index <训练集>   # 相似题少样本
+    python evaluate_model.py <model_id> <test_file> --stream --latency-json latency.json     # 统计首 token 延迟
+"""
+
+import os
+import re
+import math
+import json
+import time
+import argparse
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from compressed_io import open_input
+from convert_to_bailian_format import MANIFEST_SUFFIX, read_shard_manifest
+from dashscope_http import backoff_delay
+from response_cache import ResponseCache, served_from_cache
+
+
+# 模型回答中的答案字母：优先匹配 "答案是 X"，否则取开头的独立选项字母。
+# 开头字母后须是括号、标点、换行或结尾；后跟空格时只接受中文等非 ASCII 内容（"B 胸片"），
+# 避免把 "A 45-year-old ..."、"A patient ..." 这类英文句首的冠词当成答案
+ANSWER_PATTERN = re.compile(r"答案(?:是|为)\s*[:：]?\s*[\(（]?([A-Z])(?![A-Za-z])")
+LEADING_LETTER_PATTERN = re.compile(
+    r"^\s*(?:[\(（](?=[A-Z][\)）]))?([A-Z])(?:[\)）\.．、,，:：]|[ \t]*(?:\n|$)|\s+(?=[^\x00-\x7f]))")
+
+# 遇到这些状态码时重试调用
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def extract_answer(text):
+    """从回答文本中提取答案字母，无法识别时返回 None"""
+    if not text:
+        return None
+    match = ANSWER_PATTERN.search(text) or LEADING_LETTER_PATTERN.search(text)
+    return match.group(1) if match else None
+
+
+def iter_dataset_files(dataset_path):
+    """展开数据集路径：分片清单返回全部分片，否则返回文件本身"""
+    if str(dataset_path).endswith(MANIFEST_SUFFIX):
+        return [shard['file'] for shard in read_shard_manifest(dataset_path)['shards']]
+    return [str(dataset_path)]
+
+
+def iter_eval_items(dataset_path, limit=None):
+    """
+    流式读取评测题目
+    
+    Yields:
+        (index, messages, gold)：index 为题目在数据集中的序号，messages 为去掉
+        助手回答后的对话，gold 为标准答案字母
+    """
+    index = 0
+    for file_path in iter_dataset_files(dataset_path):
+        with open_input(file_path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                if limit is not None and index >= limit:
+                    return
+                
+                messages = json.loads(line)['messages']
+                prompt = [m for m in messages if m['role'] != 'assistant']
+                answer = next((m['content'] for m in messages if m['role'] == 'assistant'), '')
+                yield index, prompt, extract_answer(answer)
+                index += 1
+
+
+def percentile(values, p):
+    """最近秩法百分位数，values 为空时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class RateLimiter:
+    """线程安全的令牌桶限速器"""
+    
+    def __init__(self, rate, burst=None):
+        """
+        Args:
+            rate: 每秒允许的请求数（None 或 0 表示不限速）
+            burst: 令牌桶容量（默认等于 rate，至少为 1）
+        """
+        self.rate = rate
+        self.capacity = max(1.0, burst or rate or 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """阻塞直到拿到一个令牌"""
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def generation_call(model_id, api_key=None, max_retries=3, cache=None, **parameters):
+    """
+    构造调用 Generation.call 的函数
+    
+    Args:
+        cache: ResponseCache，提供时已缓存的问题不再调用 API
+    
+    Returns:
+        call(messages) -> 回答文本；调用失败时抛出 RuntimeError
+    """
+    from dashscope import Generation
+    
+    def call(messages):
+        for attempt in range(max_retries + 1):
+            response = Generation.call(model=model_id, api_key=api_key, messages=messages, **parameters)
+            if response.status_code == 200:
+                return response.output.text
+            if response.status_code not in RETRY_STATUS_CODES or attempt == max_retries:
+                raise RuntimeError(f"HTTP {response.status_code}: {response.message}")
+            time.sleep(backoff_delay(attempt + 1))
+    
+    if cache is not None:
+        return cache.wrap(call, model_id, parameters)
+    return call
+
+
+def load_results(output_file):
+    """读取已有结果文件，按题目序号去重（保留最后一条）"""
+    results = {}
+    if Path(output_file).exists():
+        with open(output_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 崩溃时可能留下写了一半的最后一行
+                    continue
+                results[record['index']] = record
+    return results
+
+
+def summarize(results, elapsed=None, session_requests=None):
+    """
+    汇总评测结果
+    
+    Args:
+        results: {index: record}
+        elapsed: 本次运行耗时（秒），用于计算吞吐量
+        session_requests: 本次运行完成的请求数
+    """
+    records = list(results.values())
+    answered = [r for r in records if r['error'] is None]
+    # Batch 接口的结果没有单题延迟；缓存命中的回答不是真实请求，不计入延迟
+    cached = sum(1 for r in answered if r.get('cached'))
+    latencies = [r['latency_ms'] for r in answered if r['latency_ms'] is not None and not r.get('cached')]
+    correct = sum(1 for r in answered if r['correct'])
+    
+    summary = {
+        'total': len(records),
+        'answered': len(answered),
+        'correct': correct,
+        'accuracy': correct / len(answered) if answered else None,
+        'errors': len(records) - len(answered),
+        'unparsed': sum(1 for r in answered if r['pred'] is None),
+        'cached': cached,
+        'p50_latency_ms': percentile(latencies, 50),
+        'p95_latency_ms': percentile(latencies, 95),
+    }
+    if elapsed and session_requests is not None:
+        summary['requests_per_second'] = session_requests / elapsed if elapsed > 0 else None
+    return summary
+
+
+def print_summary(summary, title="评测结果"):
+    """打印评测汇总"""
+    def fmt(value, spec):
+        return format(value, spec) if value is not None else "-"
+    
+    print("\n" + "=" * 60)
+    print(f"📊 {title}")
+    print("=" * 60)
+    print(f"题目数: {summary['total']}  已回答: {summary['answered']}  错误: {summary['errors']}  "
+          f"无法解析答案: {summary['unparsed']}")
+    accuracy = summary['accuracy'] * 100 if summary['accuracy'] is not None else None
+    print(f"准确率: {fmt(accuracy, '.2f')}% "
+          f"({summary['correct']}/{summary['answered']})")
+    cached_note = f"（另有 {summary['cached']} 个回答来自缓存，不计入延迟）" if summary.get('cached') else ""
+    print(f"延迟: p50 {fmt(summary['p50_latency_ms'], '.0f')} ms, p95 {fmt(summary['p95_latency_ms'], '.0f')} ms"
+          f"{cached_note}")
+    if 'requests_per_second' in summary:
+        print(f"吞吐量: {fmt(summary['requests_per_second'], '.2f')} 请求/秒")
+    print("=" * 60)
+
+
+def evaluate(call, dataset_path, output_file, concurrency=8, rate_limit=None, limit=None):
+    """
+    并发评测
+    
+    Args:
+        call: call(messages) -> 回答文本
+        dataset_path: 转换后的测试集（JSONL 或分片清单）
+        output_file: 逐条结果文件（JSONL，追加写入，用于断点续跑）
+        concurrency: 最大并发请求数
+        rate_limit: 每秒最大请求数（None 表示不限速）
+        limit: 只评测前 limit 道题
+    
+    Returns:
+        汇总字典（见 summarize）
+    """
+    output_file = Path(output_file)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    
+    results = load_results(output_file)
+    done = {index for index, record in results.items() if record['error'] is None}
+    if done:
+        print(f"♻️  从已有结果续跑，跳过 {len(done)} 道已完成的题目")
+    
+    limiter = RateLimiter(rate_limit)
+    write_lock = threading.Lock()
+    # 限制已提交但未完成的任务数，内存占用与测试集大小无关
+    in_flight = threading.BoundedSemaphore(concurrency * 2)
+    session = {'requests': 0, 'errors': 0, 'fatal': None}
+    
+    def run_one(index, messages, gold):
+        try:
+            limiter.acquire()
+            start = time.perf_counter()
+            try:
+                text = call(messages)
+                error = None
+            except Exception as e:
+                text, error = None, str(e)
+            latency_ms = (time.perf_counter() - start) * 1000
+            cached = error is None and served_from_cache()
+            
+            pred = extract_answer(text) if error is None else None
+            record = {
+                'index': index,
+                'gold': gold,
+                'pred': pred,
+                'correct': error is None and pred is not None and pred == gold,
+                'latency_ms': round(latency_ms, 1),
+                'cached': cached,
+                'error': error,
+                'response': text,
+            }
+            with write_lock:
+                outfile.write(json.dumps(record, ensure_ascii=False) + '\n')
+                outfile.flush()
+                results[index] = record
+                session['requests'] += 1
+                session['errors'] += error is not None
+                if session['requests'] % 100 == 0:
+                    print(f"   已完成 {session['requests']} 个请求（错误 {session['errors']}）")
+        except Exception as e:
+            # 写结果失败等非调用错误：记录下来，评测结束后抛出
+            with write_lock:
+                if session['fatal'] is None:
+                    session['fatal'] = e
+        finally:
+            in_flight.release()
+    
+    print(f"🧪 开始评测: {dataset_path}")
+    print(f"   并发数: {concurrency}  限速: {rate_limit or '不限'} 请求/秒  结果文件: {output_file}")
+    
+    start_time = time.perf_counter()
+    with open(output_file, 'a', encoding='utf-8') as outfile, \
+         ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for index, messages, gold in iter_eval_items(dataset_path, limit):
+            if index in done:
+                continue
+            in_flight.acquire()
+            executor.submit(run_one, index, messages, gold)
+    elapsed = time.perf_counter() - start_time
+    
+    if session['fatal'] is not None:
+        raise session['fatal']
+    
+    return summarize(results, elapsed, session['requests'])
+
+
+def default_output_file(dataset_path, model_id):
+    """默认结果文件：数据集目录下 eval_results/<数据集>.<模型>.jsonl"""
+    dataset_path = Path(dataset_path)
+    name = dataset_path.name.replace(MANIFEST_SUFFIX, '').replace('.jsonl', '')
+    safe_model = re.sub(r'[^\w.-]+', '_', model_id)
+    return dataset_path.parent / "eval_results" / f"{name}.{safe_model}.jsonl"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='在转换后的测试集上并发评测模型')
+    parser.add_argument('model_id', help='模型 ID（微调后的模型或基础模型）')
+    parser.add_argument('test_file', help='测试集路径（百炼格式 JSONL 或分片清单）')
+    parser.add_argument('--output', help='结果文件路径（默认: eval_results/<数据集>.<模型>.jsonl）')
+    parser.add_argument('--concurrency', type=int, default=8, help='最大并发请求数（默认 8）')
+    parser.add_argument('--rps', type=float, default=None, help='每秒最大请求数（默认不限速）')
+    parser.add_argument('--limit', type=int, default=None, help='只评测前 N 道题')
+    parser.add_argument('--max-retries', type=int, default=3, help='限流/服务端错误的重试次数（默认 3）')
+    parser.add_argument('--cache', action='store_true', help='启用回答缓存（也可在 .env 中设置 RESPONSE_CACHE）')
+    parser.add_argument('--stream', action='store_true', help='流式调用，统计首 token 延迟、token 间延迟和输出速度')
+    parser.add_argument('--latency-json', help='把流式延迟直方图导出为 JSON（配合 --stream）')
+    parser.add_argument('--few-shot', type=int, default=0, help='每道题前加入 N 道最相似的训练题作为示例')
+    parser.add_argument('--few-shot-index', help='检索示例的数据集（需先用 embed_questions.py 建立向量索引）')
+    parser.add_argument('--few-shot-model',
+                        help='检索示例使用的向量模型（数据集用多个模型建过索引时需要指定，如 text-embedding-v4）')
+    
+    args = parser.parse_args()
+    
+    from dotenv import load_dotenv
+    load_dotenv()
+    api_key = os.getenv("DASHSCOPE_API_KEY")
+    if not api_key:
+        print("❌ 请在 .env 文件中设置 DASHSCOPE_API_KEY")
+        return
+    
+    if args.few_shot and not args.few_shot_index:
+        parser.error("--few-shot 需要同时指定 --few-shot-index")
+    
+    output_file = args.output or default_output_file(args.test_file, args.model_id)
+    if args.few_shot and not args.output:
+        output_file = output_file.with_name(output_file.stem + f".{args.few_shot}shot.jsonl")
+    cache = ResponseCache.from_env(enabled=args.cache)
+    recorder = None
+    if args.stream:
+        from stream_inference import LatencyRecorder, streaming_call
+        recorder = LatencyRecorder(args.model_id)
+        call = streaming_call(args.model_id, api_key=api_key, recorder=recorder,
+                              max_retries=args.max_retries, cache=cache)
+    else:
+        call = generation_call(args.model_id, api_key=api_key, max_retries=args.max_retries, cache=cache)
+    
+    retriever = None
+    if args.few_shot:
+        from embed_questions import EmbeddingCache, FewShotRetriever
+        try:
+            retriever = FewShotRetriever.open(args.few_shot_index, cache=EmbeddingCache(), model=args.few_shot_model,
+                                              concurrency=args.concurrency, rps=args.rps)
+        except (FileNotFoundError, ImportError, ValueError) as e:
+            print(f"❌ {e}")
+            return
+        call = retriever.wrap(call, args.few_shot)
+    try:
+        summary = evaluate(call, args.test_file, output_file, args.concurrency, args.rps, args.limit)
+    except KeyboardInterrupt:
+        print("\n⚠️  评测已中断，重新运行相同命令即可从断点继续")
+        summary = summarize(load_results(output_file))
+    print_summary(summary)
+    if cache is not None:
+        cache.print_stats()
+    if recorder is not None:
+        recorder.print_summary()
+        if args.latency_json:
+            from stream_inference import export_json
+            export_json([recorder], args.latency_json)
+            print(f"✅ 延迟直方图: {args.latency_json}")
+    if retriever is not None:
+        retriever.close()
+
+
+if __name__ == '__main__':
+    main()
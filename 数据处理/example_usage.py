@@ -3,11 +3,15 @@
 """
 
 import os
+import sys
+import importlib.util
 from dotenv import load_dotenv
 
-try:
-    from dashscope import Generation
-except ImportError:
+from response_cache import ResponseCache
+from stream_inference import LatencyRecorder, export_json, stream_generation
+
+# 流式调用在 stream_inference 中按需导入 dashscope，这里先检查是否已安装
+if importlib.util.find_spec("dashscope") is None:
     print("❌ 未安装 dashscope SDK")
     print("请运行: pip install dashscope")
     exit(1)
@@ -15,8 +19,12 @@ except ImportError:
 # 加载配置
 load_dotenv()
 
-# 获取微调后的模型 ID
+# 获取微调后的模型 ID：.env 中未设置时使用状态库中最近训练成功的模型
 model_id = os.getenv("FINE_TUNED_MODEL_ID")
+if not model_id:
+    from state_store import StateStore
+    api_base = os.getenv("DASHSCOPE_API_BASE", "https://dashscope.aliyuncs.com/api/v1").rstrip("/")
+    model_id = StateStore.from_env(api_base, os.getenv("DASHSCOPE_API_KEY")).latest_model()
 if not model_id:
     print("❌ 请在 .env 文件中设置 FINE_TUNED_MODEL_ID")
     print("提示：在百炼控制台部署模型后可获取模型 ID")
@@ -30,6 +38,12 @@ if not api_key:
 
 print(f"🤖 使用微调模型: {model_id}\n")
 
+# 回答缓存（可选，.env 中设置 RESPONSE_CACHE=1 开启）
+cache = ResponseCache.from_env()
+
+# 流式延迟统计
+recorder = LatencyRecorder(model_id)
+
 # 测试问题
 test_questions = [
     """卧位腰椎穿刺，脑脊液压力正常值是（　　）。
@@ -62,25 +76,38 @@ for i, question in enumerate(test_questions, 1):
     print("模型回答:")
     print(f"{'─'*60}\n")
     
+    messages = [
+        {'role': 'system', 'content': system_prompt},
+        {'role': 'user', 'content': question}
+    ]
+    
     try:
-        response = Generation.call(
-            model=model_id,
-            api_key=api_key,
-            messages=[
-                {'role': 'system', 'content': system_prompt},
-                {'role': 'user', 'content': question}
-            ]
-        )
-        
-        if response.status_code == 200:
-            print(response.output.text)
+        text = cache.get(model_id, messages) if cache else None
+        if text is not None:
+            print(text)
         else:
-            print(f"❌ 调用失败: {response.message}")
+            # 流式调用：边收边输出
+            text, latency = stream_generation(
+                model_id, messages, api_key=api_key,
+                on_text=lambda piece: (sys.stdout.write(piece), sys.stdout.flush()),
+            )
+            recorder.record(latency)
+            print(f"\n\n⏱️  首 token {latency.ttft * 1000:.0f} ms，总计 {latency.total * 1000:.0f} ms")
+            if cache:
+                cache.put(model_id, messages, text)
     
     except Exception as e:
         print(f"❌ 发生错误: {str(e)}")
     
     print()
 
+recorder.print_summary()
+# 设置 LATENCY_REPORT 时把延迟直方图导出为 JSON
+if os.getenv("LATENCY_REPORT"):
+    export_json([recorder], os.getenv("LATENCY_REPORT"))
+
+if cache:
+    cache.print_stats()
+
 print("✅ 测试完成!")
 
@@ -0,0 +1,415 @@
+"""
+导出预分词、序列打包的本地训练数据
+
+把转换后的百炼格式数据集（JSONL 或分片清单）套用 ChatML 对话模板
+（<|im_start|>角色\\n内容<|im_end|>\\n，与 Qwen 一致），多进程分词后，
+把多条样本装进固定长度 seq_len 的序列（best-fit decreasing），
+避免本地训练时把每条短样本都补齐到 max_length。
+
+输出目录中的数组都用 numpy 内存映射格式保存，数据加载时直接切片，不需要逐条解析：
+- input_ids.npy    uint32 [序列数, seq_len]，空位填 pad_id
+- loss_mask.npy    uint8  [序列数, seq_len]，只有助手回答（含 <|im_end|>）为 1
+- segment_ids.npy  uint16 [序列数, seq_len]，序列内第几条样本（从 1 开始，0 为填充），
+                   用于构造块对角注意力和重置位置编码
+- samples.npy      每条样本所在的序列、起始位置、长度和在数据集中的序号
+                   （按非空行计，分片数据集跨分片连续编号，与 evaluate_model 的题目序号一致）
+- meta.json        分词器、seq_len、pad_id、装填率等
+
+分词器：--tokenizer byte 使用内置的字节级分词器（不依赖任何模型，便于在 CPU 上测试），
+其他值按 Hugging Face 模型名或本地路径加载（需要 transformers）。
+
+用法：
+    python export_packed.py ../datasets/MedQA_BaiLian/mainland_4opt_train.jsonl --tokenizer byte --seq-len 1024
+    python export_packed.py <数据集> --tokenizer Qwen/Qwen2.5-7B-Instruct --seq-len 2048 --workers 0
+    python export_packed.py <数据集> --tokenizer byte --show 1
+"""
+
+import os
+import json
+import bisect
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from convert_to_bailian_format import iter_raw_lines, split_byte_ranges
+from evaluate_model import iter_dataset_files
+from token_index import dataset_stem, source_state
+
+
+DEFAULT_OUTPUT_DIR = Path(__file__).parent.parent / "datasets" / "MedQA_packed"
+
+PACKED_VERSION = 1
+
+# ChatML 模板中的特殊标记
+IM_START = "<|im_start|>"
+IM_END = "<|im_end|>"
+END_OF_TEXT = "<|endoftext|>"
+
+# 单个分词任务处理的字节数
+DEFAULT_CHUNK_MB = 8
+
+SAMPLE_DTYPE = np.dtype([('seq', '<u4'), ('start', '<u4'), ('length', '<u4'), ('row', '<u8')])
+
+
+class ByteTokenizer:
+    """字节级分词器：UTF-8 字节 0-255，特殊标记依次排在后面"""
+
+    name = "byte"
+
+    def __init__(self):
+        self.special = {token: 256 + i for i, token in enumerate((IM_START, IM_END, END_OF_TEXT))}
+        self.pad_id = self.special[END_OF_TEXT]
+        self.vocab_size = 256 + len(self.special)
+
+    def encode(self, text):
+        if text in self.special:
+            return [self.special[text]]
+        return list(text.encode('utf-8'))
+
+    def decode(self, ids):
+        names = {i: token for token, i in self.special.items()}
+        out, pending = [], bytearray()
+        for i in ids:
+            if i in names:
+                out.append(pending.decode('utf-8', errors='replace'))
+                out.append(names[i])
+                pending = bytearray()
+            else:
+                pending.append(i)
+        out.append(pending.decode('utf-8', errors='replace'))
+        return ''.join(out)
+
+
+class HFTokenizer:
+    """Hugging Face 分词器（按模型名或本地路径加载）"""
+
+    def __init__(self, name):
+        from transformers import AutoTokenizer
+        self.name = name
+        self.tokenizer = AutoTokenizer.from_pretrained(name)
+        pad_id = self.tokenizer.pad_token_id
+        self.pad_id = pad_id if pad_id is not None else (self.tokenizer.eos_token_id or 0)
+        self.vocab_size = len(self.tokenizer)
+
+    def encode(self, text):
+        return self.tokenizer.encode(text, add_special_tokens=False)
+
+    def decode(self, ids):
+        return self.tokenizer.decode(ids)
+
+
+def load_tokenizer(name):
+    return ByteTokenizer() if name == "byte" else HFTokenizer(name)
+
+
+def chat_pieces(messages):
+    """
+    按 ChatML 模板拆分对话
+
+    Returns:
+        [(文本, 是否计算损失), ...]：只有助手回答和它结尾的 <|im_end|> 计算损失
+    """
+    pieces = []
+    for message in messages:
+        trainable = message['role'] == 'assistant'
+        pieces.extend([
+            (IM_START, False),
+            (f"{message['role']}\n", False),
+            (message.get('content') or '', trainable),
+            (IM_END, trainable),
+            ("\n", False),
+        ])
+    return pieces
+
+
+def tokenize_messages(tokenizer, messages):
+    """分词一条样本，返回 (token id 列表, 损失掩码列表)"""
+    ids, mask = [], []
+    for text, trainable in chat_pieces(messages):
+        piece = tokenizer.encode(text)
+        ids.extend(piece)
+        mask.extend([int(trainable)] * len(piece))
+    return ids, mask
+
+
+# 每个工作进程只加载一次分词器
+_worker_tokenizer = None
+
+
+def _tokenize_range(task):
+    """进程池工作函数：分词一个字节范围内的所有非空行，结果拼接成平铺数组"""
+    global _worker_tokenizer
+    file_path, start, end, tokenizer_name = task
+    if _worker_tokenizer is None or _worker_tokenizer.name != tokenizer_name:
+        _worker_tokenizer = load_tokenizer(tokenizer_name)
+
+    ids, mask, lengths = [], [], []
+    for raw in iter_raw_lines(file_path, start, end):
+        line = raw.strip()
+        if not line:
+            continue
+        sample_ids, sample_mask = tokenize_messages(_worker_tokenizer, json.loads(line)['messages'])
+        ids.extend(sample_ids)
+        mask.extend(sample_mask)
+        lengths.append(len(sample_ids))
+    return (np.array(ids, dtype=np.uint32), np.array(mask, dtype=np.uint8),
+            np.array(lengths, dtype=np.int64))
+
+
+def pack_lengths(lengths, seq_len):
+    """
+    best-fit decreasing 装箱：从长到短依次放入剩余空间最小且放得下的序列
+
+    Args:
+        lengths: 每条样本的 token 数（都不超过 seq_len）
+        seq_len: 序列长度
+
+    Returns:
+        (seq, start)：每条样本所在的序列号和起始位置
+    """
+    seq = np.empty(len(lengths), dtype=np.int64)
+    start = np.empty(len(lengths), dtype=np.int64)
+    # 按剩余空间升序排列的 (剩余空间, 序列号)
+    free = []
+    used = []
+    for i in np.argsort(-np.asarray(lengths), kind='stable').tolist():
+        length = int(lengths[i])
+        k = bisect.bisect_left(free, (length, -1))
+        if k < len(free):
+            remaining, target = free.pop(k)
+        else:
+            remaining, target = seq_len, len(used)
+            used.append(0)
+        seq[i] = target
+        start[i] = used[target]
+        used[target] += length
+        if remaining - length > 0:
+            bisect.insort(free, (remaining - length, target))
+    return seq, start
+
+
+def export_packed(dataset_path, output_dir, tokenizer_name="byte", seq_len=2048, workers=1,
+                  chunk_mb=DEFAULT_CHUNK_MB, force=False):
+    """
+    分词并打包一个数据集
+
+    超过 seq_len 的样本无法放进任何序列，会被跳过并计入 meta['dropped']
+    （可先用 token_index.py --policy truncate 处理）。
+
+    Returns:
+        meta 字典
+    """
+    output_dir = Path(output_dir)
+    files = iter_dataset_files(dataset_path)
+    tokenizer = load_tokenizer(tokenizer_name)
+    state = {
+        'version': PACKED_VERSION,
+        'tokenizer': tokenizer_name,
+        'seq_len': seq_len,
+        'sources': source_state(files),
+    }
+
+    meta_file = output_dir / "meta.json"
+    if not force and meta_file.exists():
+        try:
+            with open(meta_file, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if all(meta.get(key) == value for key, value in state.items()):
+                return meta
+        except (OSError, ValueError):
+            pass
+
+    chunk_bytes = max(1, int(chunk_mb * 1024 * 1024))
+    tasks = []
+    for file_path in files:
+        num_ranges = max(1, -(-os.path.getsize(file_path) // chunk_bytes)) if workers > 1 else 1
+        tasks.extend((str(file_path), start, end, tokenizer_name) for start, end in split_byte_ranges(file_path, num_ranges))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(_tokenize_range, tasks))
+    else:
+        parts = [_tokenize_range(task) for task in tasks]
+
+    ids = np.concatenate([p[0] for p in parts]) if parts else np.empty(0, dtype=np.uint32)
+    mask = np.concatenate([p[1] for p in parts]) if parts else np.empty(0, dtype=np.uint8)
+    lengths = np.concatenate([p[2] for p in parts]) if parts else np.empty(0, dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+
+    kept = np.flatnonzero(lengths <= seq_len)
+    seq, start = pack_lengths(lengths[kept], seq_len)
+    num_sequences = int(seq.max()) + 1 if len(seq) else 0
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if meta_file.exists():
+        os.remove(meta_file)
+    open_memmap = np.lib.format.open_memmap
+    input_ids = open_memmap(output_dir / "input_ids.npy", mode='w+', dtype=np.uint32, shape=(num_sequences, seq_len))
+    loss_mask = open_memmap(output_dir / "loss_mask.npy", mode='w+', dtype=np.uint8, shape=(num_sequences, seq_len))
+    segment_ids = open_memmap(output_dir / "segment_ids.npy", mode='w+', dtype=np.uint16, shape=(num_sequences, seq_len))
+    input_ids[:] = tokenizer.pad_id
+    loss_mask[:] = 0
+    segment_ids[:] = 0
+
+    samples = np.empty(len(kept), dtype=SAMPLE_DTYPE)
+    samples['seq'] = seq
+    samples['start'] = start
+    samples['length'] = lengths[kept]
+    samples['row'] = kept
+    for i, row in enumerate(kept.tolist()):
+        s, b, n = int(seq[i]), int(start[i]), int(lengths[row])
+        input_ids[s, b:b + n] = ids[offsets[row]:offsets[row] + n]
+        loss_mask[s, b:b + n] = mask[offsets[row]:offsets[row] + n]
+    # 序列内按起始位置编号：第 1、2、3 ... 条样本
+    order = np.lexsort((samples['start'], samples['seq']))
+    first = np.concatenate(([True], samples['seq'][order][1:] != samples['seq'][order][:-1])) if len(order) else order
+    group_start = np.maximum.accumulate(np.where(first, np.arange(len(order)), 0)) if len(order) else order
+    for position, i in zip((np.arange(len(order)) - group_start + 1).tolist(), order.tolist()):
+        s, b, n = int(samples['seq'][i]), int(samples['start'][i]), int(samples['length'][i])
+        segment_ids[s, b:b + n] = position
+    input_ids.flush()
+    loss_mask.flush()
+    segment_ids.flush()
+    del input_ids, loss_mask, segment_ids
+    np.save(output_dir / "samples.npy", samples)
+
+    real_tokens = int(lengths[kept].sum())
+    meta = dict(
+        state,
+        dataset=Path(dataset_path).name,
+        pad_id=int(tokenizer.pad_id),
+        vocab_size=int(tokenizer.vocab_size),
+        samples=int(len(kept)),
+        dropped=int(len(lengths) - len(kept)),
+        sequences=num_sequences,
+        tokens=real_tokens,
+        trainable_tokens=int(sum(int(mask[offsets[r]:offsets[r + 1]].sum()) for r in kept.tolist())),
+        fill_rate=real_tokens / (num_sequences * seq_len) if num_sequences else None,
+        padded_tokens_unpacked=int(len(kept)) * seq_len,
+    )
+    with open(meta_file, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+
+class PackedDataset:
+    """
+    读取 export_packed 的输出，按序列号返回训练所需的数组
+
+    所有数组以内存映射方式打开，__getitem__ 只做切片和少量向量化计算。
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / "meta.json", 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.input_ids = np.load(self.path / "input_ids.npy", mmap_mode='r')
+        self.loss_mask = np.load(self.path / "loss_mask.npy", mmap_mode='r')
+        self.segment_ids = np.load(self.path / "segment_ids.npy", mmap_mode='r')
+        self.samples = np.load(self.path / "samples.npy", mmap_mode='r')
+        self.seq_len = self.meta['seq_len']
+
+    def __len__(self):
+        return len(self.input_ids)
+
+    def __getitem__(self, i):
+        """
+        Returns:
+            {'input_ids', 'labels'（不计算损失的位置为 -100）, 'segment_ids',
+             'position_ids'（每条样本从 0 开始）, 'cu_seqlens'（各样本边界，可用于变长注意力）}
+        """
+        input_ids = np.asarray(self.input_ids[i], dtype=np.int64)
+        segments = np.asarray(self.segment_ids[i])
+        labels = np.where(self.loss_mask[i] == 1, input_ids, -100)
+
+        boundaries = np.flatnonzero(np.diff(segments, prepend=-1) != 0)
+        run_lengths = np.diff(np.append(boundaries, self.seq_len))
+        position_ids = np.arange(self.seq_len) - np.repeat(boundaries, run_lengths)
+        return {
+            'input_ids': input_ids,
+            'labels': labels,
+            'segment_ids': segments.astype(np.int64),
+            'position_ids': position_ids,
+            'cu_seqlens': np.append(boundaries, self.seq_len).astype(np.int32),
+        }
+
+    def iter_batches(self, batch_size, shuffle=True, seed=0):
+        """按批返回堆叠后的数组（cu_seqlens 除外）"""
+        order = np.random.default_rng(seed).permutation(len(self)) if shuffle else np.arange(len(self))
+        for begin in range(0, len(order), batch_size):
+            items = [self[i] for i in order[begin:begin + batch_size].tolist()]
+            yield {key: np.stack([item[key] for item in items])
+                   for key in ('input_ids', 'labels', 'segment_ids', 'position_ids')}
+
+
+def print_summary(meta, output_dir):
+    print("\n" + "=" * 60)
+    print(f"📦 打包完成: {meta['dataset']} -> {output_dir}")
+    print("=" * 60)
+    print(f"分词器: {meta['tokenizer']}  seq_len: {meta['seq_len']}")
+    print(f"样本: {meta['samples']}（超过 seq_len 跳过 {meta['dropped']}）  序列: {meta['sequences']}")
+    print(f"token: {meta['tokens']:,}，其中计算损失 {meta['trainable_tokens']:,}")
+    if meta['fill_rate'] is not None:
+        saved = 1 - meta['sequences'] * meta['seq_len'] / max(1, meta['padded_tokens_unpacked'])
+        print(f"装填率: {meta['fill_rate']:.1%}（逐条补齐到 seq_len 时为 "
+              f"{meta['tokens'] / max(1, meta['padded_tokens_unpacked']):.1%}，计算量减少 {saved:.1%}）")
+    print("=" * 60)
+
+
+def show_sequence(dataset, tokenizer, index):
+    """打印一个打包序列：每条样本单独一段，计算损失的部分用 【】 标出"""
+    item = dataset[index]
+    print(f"\n--- 序列 {index} ---")
+    for segment in range(1, int(item['segment_ids'].max()) + 1):
+        positions = np.flatnonzero(item['segment_ids'] == segment)
+        ids = item['input_ids'][positions].tolist()
+        trainable = (item['labels'][positions] != -100).tolist()
+        text, run, current = [], [], None
+        for token, flag in zip(ids, trainable):
+            if flag != current and run:
+                decoded = tokenizer.decode(run)
+                text.append(f"【{decoded}】" if current else decoded)
+                run = []
+            current = flag
+            run.append(token)
+        if run:
+            decoded = tokenizer.decode(run)
+            text.append(f"【{decoded}】" if current else decoded)
+        print(f"[样本 {segment}，{len(ids)} token]")
+        print(''.join(text))
+
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='导出预分词、序列打包的本地训练数据')
+    parser.add_argument('dataset', help='转换后的数据集（JSONL 或分片清单）')
+    parser.add_argument('--tokenizer', default='byte',
+                        help='分词器：byte（内置字节级，默认）或 Hugging Face 模型名/本地路径')
+    parser.add_argument('--seq-len', type=int, default=int(os.getenv("MAX_LENGTH", "2048")),
+                        help='打包序列长度（默认取 .env 中的 MAX_LENGTH，否则 2048）')
+    parser.add_argument('--output-dir', help='输出目录（默认 datasets/MedQA_packed/<数据集>_<分词器>_L<seq_len>）')
+    parser.add_argument('--workers', type=int, default=1, help='分词进程数（0 表示使用全部 CPU 核心）')
+    parser.add_argument('--show', type=int, default=0, help='打印前 N 个打包序列')
+    parser.add_argument('--force', action='store_true', help='忽略已有输出重新导出')
+    args = parser.parse_args()
+
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    tokenizer_tag = Path(args.tokenizer).name.replace('/', '_')
+    output_dir = Path(args.output_dir) if args.output_dir else (
+        DEFAULT_OUTPUT_DIR / f"{dataset_stem(args.dataset)}_{tokenizer_tag}_L{args.seq_len}")
+
+    meta = export_packed(args.dataset, output_dir, args.tokenizer, args.seq_len, workers=workers, force=args.force)
+    print_summary(meta, output_dir)
+
+    if args.show:
+        dataset = PackedDataset(output_dir)
+        tokenizer = load_tokenizer(args.tokenizer)
+        for index in range(min(args.show, len(dataset))):
+            show_sequence(dataset, tokenizer, index)
+
+
+if __name__ == '__main__':
+    main()
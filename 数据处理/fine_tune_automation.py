@@ -6,22 +6,55 @@
 3. 创建微调任务
 4. 查询任务状态
 5. 调用微调后的模型
+
+上传、任务、状态和训练出的模型记录在本地状态库中（见 state_store.py）。
+dashscope SDK、requests 和 asyncio 只在调用模型、访问 API、监控任务时才导入，
+--status 命中状态库缓存、--jobs 等只读本地数据的命令启动很快。
 """
 
 import os
 import sys
 import json
 import time
+import threading
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
-try:
-    import dashscope
-    from dashscope import Generation
-except ImportError:
-    print("❌ 未安装 dashscope SDK")
-    print("请运行: pip install dashscope")
-    sys.exit(1)
+from compressed_io import COMPRESSION_SUFFIXES, compression_of
+from convert_to_bailian_format import DEDUP_REPORT_FILE_NAME, MANIFEST_SUFFIX, UPLOAD_LIMIT_MB, read_shard_manifest
+from dashscope_http import DashScopeHTTPClient
+import evaluate_model as model_eval
+from pipeline_metrics import PipelineMetrics
+from response_cache import ResponseCache
+from state_store import DEFAULT_STATUS_TTL, TERMINAL_STATUSES, StateStore
+from stream_inference import stream_generation
+from upload_registry import REGISTRY_FILE_NAME, UploadRegistry
+from upload_stream import MultipartFileStream, UploadProgress
+
+
+# 任务状态显示文本
+JOB_STATUS_TEXT = {
+    "PENDING": "⏳ 等待中",
+    "RUNNING": "🏃 运行中",
+    "SUCCEEDED": "✅ 成功",
+    "FAILED": "❌ 失败",
+    "CANCELLED": "🚫 已取消",
+}
+
+# 上传前 token 预检最多使用的分词进程数（预检只是提示，不占满所有 CPU）
+ESTIMATE_WORKERS = 4
+
+
+def require_dashscope():
+    """导入 dashscope SDK（只有调用模型的路径需要），未安装时给出提示并退出"""
+    try:
+        import dashscope
+    except ImportError:
+        print("❌ 未安装 dashscope SDK")
+        print("请运行: pip install dashscope")
+        sys.exit(1)
+    return dashscope
 
 
 class FineTuneAutomation:
@@ -35,8 +68,19 @@ class FineTuneAutomation:
         if not self.api_key:
             raise ValueError("❌ 请在 .env 文件中设置 DASHSCOPE_API_KEY")
         
-        # 设置 API Key
-        dashscope.api_key = self.api_key
+        # API 地址（可指向本地替身服务做基准测试）
+        self.api_base = os.getenv("DASHSCOPE_API_BASE", "https://dashscope.aliyuncs.com/api/v1").rstrip("/")
+        
+        # 上传配置
+        self.upload_concurrency = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+        self.upload_timeout = (
+            float(os.getenv("UPLOAD_CONNECT_TIMEOUT", "10")),
+            float(os.getenv("UPLOAD_READ_TIMEOUT", "600")),
+        )
+        
+        # 所有 HTTP 调用共用的客户端（第一次访问 self.http 时创建）
+        self._http = None
+        self._http_lock = threading.Lock()
         
         # 微调配置
         self.base_model = os.getenv("FINE_TUNE_BASE_MODEL", "qwen2.5-7b-instruct")
@@ -64,6 +108,37 @@ class FineTuneAutomation:
         
         self.project_root = Path(__file__).parent.parent
         self.data_dir = self.project_root / "datasets" / "MedQA_BaiLian"
+        
+        # 已上传文件登记表：内容相同的文件直接复用 File ID
+        self.upload_registry = UploadRegistry(self.data_dir / REGISTRY_FILE_NAME, self.api_base, self.api_key)
+        
+        # 模型回答缓存（可选，.env 中设置 RESPONSE_CACHE 或命令行 --cache 开启）
+        self.response_cache = ResponseCache.from_env()
+        
+        # 各阶段的耗时和计数（.env 中设置 METRICS_FILE 或命令行 --metrics 时写出）
+        self.metrics = PipelineMetrics.from_env("fine_tune")
+        
+        # 上传、任务和模型记录；--status 在有效期内直接读取这里的缓存
+        self.state = StateStore.from_env(self.api_base, self.api_key)
+        self.status_ttl = float(os.getenv("STATUS_CACHE_TTL", str(DEFAULT_STATUS_TTL)))
+
+    @property
+    def http(self):
+        """连接池、超时、429/5xx 退避重试、请求计时；requests 在这里才导入"""
+        if self._http is None:
+            with self._http_lock:
+                if self._http is None:
+                    self._http = DashScopeHTTPClient(
+                        self.api_key,
+                        self.api_base,
+                        max_retries=int(os.getenv("HTTP_MAX_RETRIES", "3")),
+                        timeout=(
+                            float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")),
+                            float(os.getenv("HTTP_READ_TIMEOUT", "30")),
+                        ),
+                        pool_size=max(10, self.upload_concurrency),
+                    )
+        return self._http
 
     def list_available_datasets(self):
         """列出可用的数据集"""
@@ -75,95 +150,296 @@ class FineTuneAutomation:
             print("❌ 数据集目录不存在，请先运行 batch_convert.py 转换数据")
             return []
         
+        # 已分片的数据集以清单文件代表，分片文件本身不再单独列出
+        manifests = sorted(self.data_dir.glob(f"*{MANIFEST_SUFFIX}"))
+        shard_files = set()
+        for manifest_file in manifests:
+            shard_files.update(Path(shard['file']).name for shard in read_shard_manifest(manifest_file)['shards'])
+        
+        # 去重报告不是训练数据
+        shard_files.add(DEDUP_REPORT_FILE_NAME)
+        # 压缩的数据集（xxx.jsonl.gz / xxx.jsonl.zst）上传时边读边解压
+        patterns = ["*.jsonl"] + [f"*.jsonl{suffix}" for suffix in COMPRESSION_SUFFIXES]
+        files = [f for pattern in patterns for f in self.data_dir.glob(pattern) if f.name not in shard_files] + manifests
+        
         datasets = []
-        for i, file in enumerate(sorted(self.data_dir.glob("*.jsonl")), 1):
-            file_size = file.stat().st_size / (1024 * 1024)  # MB
+        for i, file in enumerate(sorted(files), 1):
             datasets.append(str(file))
-            print(f"{i}. {file.name} ({file_size:.2f} MB)")
+            if file.name.endswith(MANIFEST_SUFFIX):
+                manifest = read_shard_manifest(file)
+                file_size = manifest['total_bytes'] / (1024 * 1024)  # MB
+                print(f"{i}. {manifest['dataset']} ({file_size:.2f} MB, {len(manifest['shards'])} 个分片)")
+            else:
+                file_size = file.stat().st_size / (1024 * 1024)  # MB
+                compressed = f", {compression_of(file)} 压缩" if compression_of(file) else ""
+                print(f"{i}. {file.name} ({file_size:.2f} MB{compressed})")
         
         return datasets
 
-    def upload_file(self, file_path, description=""):
-        """上传文件到百炼平台"""
+    def upload_file(self, file_path, description="", force=False, show_progress=True):
+        """
+        上传文件到百炼平台
+        
+        如果 file_path 是分片清单（xxx.manifest.json），依次上传清单中的所有分片，
+        返回 File ID 列表（任一分片失败则返回 None），可直接作为一个训练集传给
+        create_fine_tune_job；否则返回单个 File ID。
+        
+        请求体按块流式发送并显示进度和吞吐量；连接错误、超时、429 和 5xx
+        会按指数退避重试。文件接口不支持断点续传，重试时从头发送该文件，
+        分片数据集中已上传成功的分片不会重复上传。
+        
+        内容（SHA-256 + 大小）与之前某次上传完全相同的文件直接复用登记的
+        File ID，不会重新传输；force=True 时忽略登记强制上传。
+        
+        并发上传时应传入 show_progress=False，避免多个进度行互相覆盖。
+        
+        压缩文件（.jsonl.gz / .jsonl.zst）边读边解压后上传，不在磁盘上生成解压文件；
+        解压后超过 300MB 的文件不上传。
+        """
+        if str(file_path).endswith(MANIFEST_SUFFIX):
+            manifest = read_shard_manifest(file_path)
+            print(f"\n📦 上传分片数据集: {manifest['dataset']} ({len(manifest['shards'])} 个分片)")
+            file_ids = []
+            for i, shard in enumerate(manifest['shards'], 1):
+                file_id = self.upload_file(shard['file'], f"{description} ({i}/{len(manifest['shards'])})", force)
+                if not file_id:
+                    if file_ids:
+                        print(f"   已上传的分片 File ID: {', '.join(file_ids)}")
+                    return None
+                file_ids.append(file_id)
+            return file_ids
+        return self._upload_single(file_path, description, force, show_progress)[0]
+
+    def _upload_single(self, file_path, description, force, show_progress):
+        """
+        上传单个文件（非分片清单）
+
+        Returns:
+            (File ID 或 None, 实际发送的字节数)：复用登记的文件或上传失败时为 0
+        """
+        if not force:
+            file_id = self.upload_registry.lookup(file_path)
+            if file_id:
+                print(f"\n♻️  内容未变化，复用已上传的文件: {Path(file_path).name} -> {file_id}")
+                self.metrics.count("uploads", result="reused")
+                return file_id, 0
+        
         print(f"\n⬆️  上传文件: {Path(file_path).name}")
         
         try:
             # 使用 HTTP API 方式上传文件
-            import requests
-            
-            url = "https://dashscope.aliyuncs.com/api/v1/files"
-            headers = {
-                "Authorization": f"Bearer {self.api_key}"
+            fields = {
+                'purpose': 'fine-tune',
+                'descriptions': description
             }
             
-            with open(file_path, 'rb') as f:
-                files = {
-                    'files': (Path(file_path).name, f, 'application/json')
-                }
-                data = {
-                    'purpose': 'fine-tune',
-                    'descriptions': description
-                }
-                
-                response = requests.post(url, headers=headers, files=files, data=data)
+            # 请求体可重复迭代，重试时由客户端直接重新发送
+            body = MultipartFileStream(file_path, 'files', fields, 'application/json')
+            if body.file_size > UPLOAD_LIMIT_MB * 1024 * 1024:
+                print(f"❌ 文件大小 {body.file_size / (1024 * 1024):.2f} MB（解压后）超过百炼平台 {UPLOAD_LIMIT_MB}MB 的限制，"
+                      f"请用 batch_convert.py --max-shard-mb 分片")
+                self.metrics.count("uploads", result="failed")
+                return None, 0
+            if show_progress:
+                body.progress = UploadProgress(len(body))
+            
+            start_time = time.perf_counter()
+            response = self.http.post(
+                "files",
+                data=body,
+                headers={"Content-Type": body.content_type},
+                timeout=self.upload_timeout,
+                on_retry=self._print_retry,
+            )
             
             if response.status_code == 200:
                 result = response.json()
                 if result.get('data', {}).get('uploaded_files'):
                     file_id = result['data']['uploaded_files'][0]['file_id']
-                    print(f"✅ 上传成功! File ID: {file_id}")
-                    return file_id
+                    elapsed = time.perf_counter() - start_time
+                    print(f"✅ 上传成功! {Path(file_path).name} -> File ID: {file_id}")
+                    print(f"   用时 {elapsed:.1f} 秒, "
+                          f"平均 {len(body) / max(elapsed, 1e-9) / (1024 * 1024):.2f} MB/s")
+                    self.upload_registry.register(file_path, file_id)
+                    self.metrics.count("uploads", result="ok")
+                    self.metrics.count("upload_bytes", len(body))
+                    return file_id, len(body)
                 else:
                     print(f"❌ 上传失败: {result}")
-                    return None
+                    self.metrics.count("uploads", result="failed")
+                    return None, 0
             else:
                 print(f"❌ 上传失败: HTTP {response.status_code}")
                 print(f"   响应内容: {response.text}")
-                return None
+                self.metrics.count("uploads", result="failed")
+                return None, 0
         except Exception as e:
+            self.metrics.count("uploads", result="failed")
             print(f"❌ 上传出错: {str(e)}")
             import traceback
             traceback.print_exc()
-            return None
+            return None, 0
 
-    def create_fine_tune_job(self, train_file_ids, validation_file_ids=None):
-        """创建微调任务"""
+    def upload_files(self, file_paths, descriptions=None, max_concurrency=None, force=False):
+        """
+        并发上传多个文件（如训练集和验证集）
+        
+        分片清单会展开为各个分片，所有文件统一放入线程池并发上传，
+        同时进行的上传数不超过 max_concurrency。
+        
+        Args:
+            file_paths: 文件或分片清单路径列表（None 会原样保留为 None）
+            descriptions: 与 file_paths 一一对应的描述
+            max_concurrency: 最大并发上传数（默认取 UPLOAD_CONCURRENCY，默认 4）
+            force: 忽略上传登记表，强制重新上传
+        
+        Returns:
+            与 file_paths 顺序一致的结果列表：普通文件为 File ID，分片清单为
+            File ID 列表，上传失败为 None；可直接传给 create_fine_tune_job
+        """
+        descriptions = descriptions or [""] * len(file_paths)
+        max_concurrency = max_concurrency or self.upload_concurrency
+        
+        # 展开为 (结果下标, 文件路径, 描述) 任务列表
+        tasks = []
+        is_manifest = []
+        for index, (file_path, description) in enumerate(zip(file_paths, descriptions)):
+            if file_path is None:
+                is_manifest.append(False)
+                continue
+            if str(file_path).endswith(MANIFEST_SUFFIX):
+                shards = read_shard_manifest(file_path)['shards']
+                is_manifest.append(True)
+                for i, shard in enumerate(shards, 1):
+                    tasks.append((index, shard['file'], f"{description} ({i}/{len(shards)})"))
+            else:
+                is_manifest.append(False)
+                tasks.append((index, file_path, description))
+        
+        print(f"\n⬆️  并发上传 {len(tasks)} 个文件（并发数 {max_concurrency}）")
+        start_time = time.perf_counter()
+        
+        with self.metrics.phase("upload", concurrency=max_concurrency) as phase:
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                futures = [
+                    executor.submit(self._upload_single, file_path, description, force, False)
+                    for _, file_path, description in tasks
+                ]
+                outcomes = [future.result() for future in futures]
+            file_ids = [file_id for file_id, _ in outcomes]
+            # 只统计实际发送的字节数，复用登记的文件不计入吞吐量
+            sent_bytes = sum(sent for _, sent in outcomes)
+            phase.add(files=len(tasks), failed=sum(1 for file_id in file_ids if not file_id), bytes=sent_bytes)
+        
+        results = [[] if manifest else None for manifest in is_manifest]
+        failed = set()
+        for (index, _, _), file_id in zip(tasks, file_ids):
+            if not file_id:
+                failed.add(index)
+            elif is_manifest[index]:
+                results[index].append(file_id)
+            else:
+                results[index] = file_id
+        for index in failed:
+            results[index] = None
+        
+        elapsed = time.perf_counter() - start_time
+        print(f"\n📊 上传完成: {sum(1 for file_id in file_ids if file_id)}/{len(tasks)} 个文件成功, "
+              f"发送 {sent_bytes / (1024 * 1024):.2f} MB, 用时 {elapsed:.1f} 秒")
+        return results
+
+    def verify_uploads(self):
+        """
+        在线校验登记表中的 File ID，删除远端已不存在的记录
+        
+        Returns:
+            删除的记录数
+        """
+        entries = self.upload_registry.entries()
+        print(f"\n🔍 校验已登记的上传文件 ({len(entries)} 个)...")
+        
+        removed = 0
+        for content_key, entry in entries:
+            file_id = entry['file_id']
+            try:
+                response = self.http.get(f"files/{file_id}")
+            except Exception as e:
+                print(f"⚠️  {entry['name']} ({file_id}): 查询出错 {e}")
+                continue
+            
+            if response.status_code == 404:
+                removed += self.upload_registry.forget(file_id)
+                print(f"🗑️  {entry['name']} ({file_id}): 远端已删除，已移除登记")
+            elif response.status_code == 200:
+                print(f"✅ {entry['name']} ({file_id})")
+            else:
+                print(f"⚠️  {entry['name']} ({file_id}): HTTP {response.status_code}")
+        
+        return removed
+
+    def _print_retry(self, attempt, delay, reason):
+        """HTTP 客户端重试前的提示"""
+        print(f"\n⚠️  请求失败 ({reason})，{delay:.1f} 秒后重试 ({attempt}/{self.http.max_retries})...")
+
+    def print_http_summary(self):
+        """打印本次运行中 HTTP 请求的耗时统计"""
+        if self._http is None:
+            return
+        summary = self.http.timing_summary()
+        if not summary:
+            return
+        print("\n" + "="*60)
+        print("📈 HTTP 请求统计")
+        print("="*60)
+        print(f"{'接口':<22} {'次数':>6} {'失败':>6} {'重试':>6} {'平均(ms)':>10} {'最大(ms)':>10}")
+        for endpoint, item in sorted(summary.items()):
+            print(f"{endpoint:<22} {item['count']:>6} {item['errors']:>6} {item['retries']:>6} "
+                  f"{item['avg_ms']:>10.1f} {item['max_ms']:>10.1f}")
+
+    def job_hyper_params(self, overrides=None):
+        """任务实际使用的超参数：self.hyper_params 加上 overrides 中的覆盖值"""
+        return dict(self.hyper_params, **(overrides or {}))
+
+    def create_fine_tune_job(self, train_file_ids, validation_file_ids=None, hyper_params=None):
+        """
+        创建微调任务
+        
+        Args:
+            train_file_ids: 训练集 File ID（分片数据集为列表）
+            validation_file_ids: 验证集 File ID（可选）
+            hyper_params: 覆盖部分超参数（如超参数搜索中的一组取值），其余取 self.hyper_params
+        """
+        hyper_params = self.job_hyper_params(hyper_params)
         print(f"\n🚀 创建微调任务...")
         print(f"   基础模型: {self.base_model}")
         print(f"   训练类型: {self.training_type}")
-        print(f"   超参数: {json.dumps(self.hyper_params, indent=2, ensure_ascii=False)}")
+        print(f"   超参数: {json.dumps(hyper_params, indent=2, ensure_ascii=False)}")
         
         try:
-            import requests
-            
             # 准备参数
-            url = "https://dashscope.aliyuncs.com/api/v1/fine-tunes"
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
             data = {
                 "model": self.base_model,
                 "training_file_ids": train_file_ids if isinstance(train_file_ids, list) else [train_file_ids],
-                "hyper_parameters": self.hyper_params,
+                "hyper_parameters": hyper_params,
                 "training_type": self.training_type,
             }
             
             if validation_file_ids:
                 data["validation_file_ids"] = validation_file_ids if isinstance(validation_file_ids, list) else [validation_file_ids]
             
-            # 创建任务
-            response = requests.post(url, headers=headers, json=data)
+            # 创建任务（非幂等，只在服务端确定未处理时重试）
+            response = self.http.post("fine-tunes", json=data, idempotent=False, on_retry=self._print_retry)
             
             if response.status_code == 200:
                 result = response.json()
                 job_id = result['output']['job_id']
+                self.state.record_job(job_id, self.base_model, self.training_type, hyper_params,
+                                      data["training_file_ids"], data.get("validation_file_ids"),
+                                      result['output'].get('status'))
                 print(f"\n✅ 微调任务创建成功!")
                 print(f"   Job ID: {job_id}")
                 print(f"   状态: {result['output'].get('status', 'UNKNOWN')}")
-                print(f"\n💡 提示: 请将以下内容保存到 .env 文件:")
-                print(f"   FINE_TUNE_JOB_ID={job_id}")
+                print(f"   已记录到状态库: {self.state.path}")
                 return job_id
             else:
                 print(f"❌ 创建失败: HTTP {response.status_code}")
@@ -178,18 +454,13 @@ class FineTuneAutomation:
     def get_job_status(self, job_id):
         """查询任务状态"""
         try:
-            import requests
-            
-            url = f"https://dashscope.aliyuncs.com/api/v1/fine-tunes/{job_id}"
-            headers = {
-                "Authorization": f"Bearer {self.api_key}"
-            }
-            
-            response = requests.get(url, headers=headers)
+            response = self.http.get(f"fine-tunes/{job_id}", on_retry=self._print_retry)
             
             if response.status_code == 200:
                 result = response.json()
-                return result.get('output', {})
+                status_data = result.get('output', {})
+                self.state.record_status(job_id, status_data)
+                return status_data
             else:
                 print(f"❌ 查询失败: HTTP {response.status_code}")
                 print(f"   响应内容: {response.text}")
@@ -198,60 +469,177 @@ class FineTuneAutomation:
             print(f"❌ 查询出错: {str(e)}")
             return None
 
-    def monitor_job(self, job_id, check_interval=30):
-        """监控任务进度"""
-        print(f"\n👀 监控微调任务: {job_id}")
-        print(f"   检查间隔: {check_interval}秒")
+    def job_status(self, job_id, refresh=False):
+        """
+        查询任务状态，优先使用状态库中的缓存
+        
+        任务已结束，或最近一次查询在 status_ttl 秒以内时不请求 API。
+        
+        Returns:
+            (状态数据, 缓存距今秒数)，直接查询 API 时秒数为 None；查询失败时状态数据为 None
+        """
+        if not refresh:
+            cached = self.state.cached_status(job_id, self.status_ttl)
+            if cached is not None:
+                return cached
+        return self.get_job_status(job_id), None
+
+    def list_jobs(self, limit=20):
+        """列出状态库中最近的任务（不请求 API）"""
+        jobs = self.state.jobs(limit)
+        if not jobs:
+            print("\n状态库中还没有任务记录")
+            return jobs
+        print("\n" + "="*60)
+        print(f"📋 最近的微调任务（{self.state.path.name}）")
+        print("="*60)
+        for job in jobs:
+            created = time.strftime('%Y-%m-%d %H:%M', time.localtime(job['created_at']))
+            status_text = JOB_STATUS_TEXT.get(job['status'], job['status'] or "-")
+            print(f"{job['job_id']:<24} {status_text:<10} {created}  {job['base_model'] or ''}")
+            if job['fine_tuned_model']:
+                print(f"   模型: {job['fine_tuned_model']}")
+            if job['hyper_params']:
+                params = job['hyper_params']
+                print("   " + ", ".join(f"{key}={params[key]}" for key in
+                                       ("n_epochs", "learning_rate", "lora_rank", "lora_alpha") if key in params))
+        return jobs
+
+    def monitor_job(self, job_id, check_interval=None):
+        """
+        监控单个任务进度
+        
+        Args:
+            job_id: 任务 ID
+            check_interval: 固定检查间隔（秒）；为 None 时使用自适应轮询
+        """
+        if check_interval is None:
+            return self.monitor_jobs([job_id])
+        return self.monitor_jobs([job_id], min_interval=check_interval, max_interval=check_interval)
+
+    def monitor_jobs(self, job_ids, min_interval=None, max_interval=None, backoff=1.5, on_finished=None):
+        """
+        在同一个事件循环中并发监控多个任务
+        
+        每个任务独立轮询，间隔自适应：状态刚变化时（包括刚提交）按 min_interval
+        快速轮询，状态保持不变时每次乘以 backoff，最长不超过 max_interval，
+        长时间 RUNNING 的任务会逐渐放慢。只在状态变化时输出，任务进入
+        SUCCEEDED、FAILED 或 CANCELLED 后停止对它的监控。
+        
+        Args:
+            job_ids: 任务 ID 列表
+            min_interval: 最短轮询间隔（秒，默认取 MONITOR_MIN_INTERVAL，默认 5）
+            max_interval: 最长轮询间隔（秒，默认取 MONITOR_MAX_INTERVAL，默认 120）
+            backoff: 状态未变化时间隔的增长倍数
+            on_finished: 任务结束时调用 on_finished(job_id, status_data)，返回需要接着监控的
+                新任务 ID 列表（超参数搜索用它在有任务结束时提交排队的组合）；回调抛出的
+                异常只打印，不中断对其他任务的监控
+        
+        Returns:
+            {job_id: 最后一次查询到的状态数据}（Ctrl+C 退出时只包含已查询到的任务）
+        """
+        import asyncio
+        
+        min_interval = min_interval or float(os.getenv("MONITOR_MIN_INTERVAL", "5"))
+        max_interval = max(max_interval or float(os.getenv("MONITOR_MAX_INTERVAL", "120")), min_interval)
+        
+        print(f"\n👀 监控 {len(job_ids)} 个微调任务: {', '.join(job_ids)}")
+        print(f"   轮询间隔: {min_interval:g}~{max_interval:g} 秒（状态不变时逐渐放慢）")
         print("   按 Ctrl+C 可退出监控（不影响训练任务）\n")
         
-        status_map = {
-            "PENDING": "⏳ 等待中",
-            "RUNNING": "🏃 运行中",
-            "SUCCEEDED": "✅ 成功",
-            "FAILED": "❌ 失败",
-            "CANCELLED": "🚫 已取消",
-        }
+        final_states = {}
+        watched = list(job_ids)
+        show_job_id = len(job_ids) > 1 or on_finished is not None
         
-        try:
+        async def watch(job_id):
+            last_status = None
+            interval = min_interval
             while True:
-                status_data = self.get_job_status(job_id)
+                status_data = await asyncio.to_thread(self.get_job_status, job_id)
+                self.metrics.count("job_polls")
                 
                 if status_data:
+                    final_states[job_id] = status_data
                     status = status_data.get('status', 'UNKNOWN')
-                    status_text = status_map.get(status, status)
                     
-                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 状态: {status_text}")
-                    
-                    # 显示额外信息
-                    if 'trained_tokens' in status_data:
-                        print(f"   已训练 tokens: {status_data['trained_tokens']}")
-                    if 'training_progress' in status_data:
-                        print(f"   训练进度: {status_data['training_progress']}%")
-                    
-                    # 检查是否完成
-                    if status in ["SUCCEEDED", "FAILED", "CANCELLED"]:
-                        print(f"\n{'='*60}")
-                        print(f"🎯 任务已完成: {status_text}")
-                        
-                        if status == "SUCCEEDED":
-                            model_id = status_data.get('fine_tuned_model', '')
-                            print(f"   微调后的模型 ID: {model_id}")
-                            print(f"\n💡 提示: 请将以下内容保存到 .env 文件:")
-                            print(f"   FINE_TUNED_MODEL_ID={model_id}")
-                            print(f"\n📝 下一步: 在百炼控制台部署模型")
-                            print(f"   控制台地址: https://bailian.console.aliyun.com/")
-                        elif status == "FAILED":
-                            error_msg = status_data.get('error_message', '未知错误')
-                            print(f"   错误信息: {error_msg}")
+                    if status != last_status:
+                        last_status = status
+                        interval = min_interval
+                        self._print_status_change(job_id, status_data, show_job_id)
                         
-                        print("="*60)
-                        break
+                        # 检查是否完成
+                        if status in TERMINAL_STATUSES:
+                            self._print_job_result(job_id, status_data)
+                            return job_id, status_data
+                    else:
+                        interval = min(interval * backoff, max_interval)
                 
-                time.sleep(check_interval)
+                await asyncio.sleep(interval)
+        
+        async def watch_all():
+            tasks = {asyncio.create_task(watch(job_id)) for job_id in job_ids}
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    job_id, status_data = task.result()
+                    if on_finished is None:
+                        continue
+                    try:
+                        new_ids = await asyncio.to_thread(on_finished, job_id, status_data)
+                    except Exception as e:
+                        # 回调出错只影响这一次补充任务，其余任务继续监控
+                        print(f"⚠️  任务 {job_id} 结束后的处理出错: {e}")
+                        continue
+                    for new_id in new_ids or []:
+                        print(f"\n👀 开始监控新任务: {new_id}")
+                        watched.append(new_id)
+                        tasks.add(asyncio.create_task(watch(new_id)))
+        
+        try:
+            asyncio.run(watch_all())
         except KeyboardInterrupt:
             print("\n\n⚠️  退出监控（训练任务仍在后台继续）")
             print(f"💡 使用以下命令继续查看状态:")
-            print(f"   python {Path(__file__).name} --status {job_id}")
+            for job_id in watched:
+                if final_states.get(job_id, {}).get('status') not in TERMINAL_STATUSES:
+                    print(f"   python {Path(__file__).name} --status {job_id}")
+        
+        return final_states
+
+    @staticmethod
+    def _print_status_change(job_id, status_data, show_job_id):
+        """输出一次状态变化"""
+        status = status_data.get('status', 'UNKNOWN')
+        status_text = JOB_STATUS_TEXT.get(status, status)
+        prefix = f"{job_id} " if show_job_id else ""
+        
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {prefix}状态: {status_text}")
+        
+        # 显示额外信息
+        if 'trained_tokens' in status_data:
+            print(f"   已训练 tokens: {status_data['trained_tokens']}")
+        if 'training_progress' in status_data:
+            print(f"   训练进度: {status_data['training_progress']}%")
+
+    @staticmethod
+    def _print_job_result(job_id, status_data):
+        """输出已结束任务的结果"""
+        status = status_data.get('status', 'UNKNOWN')
+        status_text = JOB_STATUS_TEXT.get(status, status)
+        
+        print(f"\n{'='*60}")
+        print(f"🎯 任务已完成: {job_id} {status_text}")
+        
+        if status == "SUCCEEDED":
+            model_id = status_data.get('fine_tuned_model', '')
+            print(f"   微调后的模型 ID: {model_id}（已记录到状态库）")
+            print(f"\n📝 下一步: 在百炼控制台部署模型")
+            print(f"   控制台地址: https://bailian.console.aliyun.com/")
+        elif status == "FAILED":
+            error_msg = status_data.get('error_message', '未知错误')
+            print(f"   错误信息: {error_msg}")
+        
+        print("="*60)
 
     def test_model(self, model_id, test_question=None):
         """测试微调后的模型"""
@@ -266,58 +654,192 @@ B. 50～70mmH2O（0.49～0.69kPa）
 C. 230～250mmH2O（2.25～2.45kPa）
 D. 260～280mmH2O（2.55～2.74kPa）"""
         
+        messages = [
+            {
+                'role': 'system',
+                'content': '你是一个专业的医学助手，擅长回答医学选择题。'
+            },
+            {
+                'role': 'user',
+                'content': test_question
+            }
+        ]
+        
         try:
-            response = Generation.call(
-                model=model_id,
-                messages=[
-                    {
-                        'role': 'system',
-                        'content': '你是一个专业的医学助手，擅长回答医学选择题。'
-                    },
-                    {
-                        'role': 'user',
-                        'content': test_question
-                    }
-                ]
-            )
-            
-            if response.status_code == 200:
+            text = self.response_cache.get(model_id, messages) if self.response_cache else None
+            if text is not None:
+                print("♻️  命中回答缓存")
                 print("📊 模型回答:")
                 print("-" * 60)
-                print(response.output.text)
+                print(text)
                 print("-" * 60)
-            else:
-                print(f"❌ 调用失败: {response.message}")
+                return
+            
+            # 流式调用，边收边输出，并记录首 token 延迟
+            require_dashscope()
+            print("📊 模型回答:")
+            print("-" * 60)
+            try:
+                text, latency = stream_generation(
+                    model_id, messages, api_key=self.api_key,
+                    on_text=lambda piece: (sys.stdout.write(piece), sys.stdout.flush()))
+            except RuntimeError as e:
+                print(f"❌ 调用失败: {e}")
+                return
+            print()
+            print("-" * 60)
+            speed = latency.tokens_per_second
+            self.metrics.gauge("test_ttft_ms", round(latency.ttft * 1000, 1), model=model_id)
+            self.metrics.gauge("test_total_ms", round(latency.total * 1000, 1), model=model_id)
+            print(f"⏱️  首 token {latency.ttft * 1000:.0f} ms，总计 {latency.total * 1000:.0f} ms，"
+                  f"{latency.output_tokens} tokens"
+                  + (f"，{speed:.1f} tokens/s" if speed is not None else ""))
+            if self.response_cache:
+                self.response_cache.put(model_id, messages, text)
         except Exception as e:
             print(f"❌ 测试出错: {str(e)}")
 
-    def update_env_file(self, key, value):
-        """更新 .env 文件"""
-        env_file = self.project_root / ".env"
+    def evaluate_model(self, model_id, test_file, output_file=None, concurrency=8, rate_limit=None, limit=None,
+                       batch=False):
+        """
+        在完整测试集上并发评测模型
         
-        # 读取现有内容
-        lines = []
-        if env_file.exists():
-            with open(env_file, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
+        Args:
+            model_id: 模型 ID
+            test_file: 转换后的测试集（JSONL 或分片清单）
+            output_file: 逐条结果文件（默认 eval_results/<数据集>.<模型>.jsonl，可断点续跑）
+            concurrency: 最大并发请求数
+            rate_limit: 每秒最大请求数（None 表示不限速）
+            limit: 只评测前 limit 道题
+            batch: 改用 Batch 接口离线评测（见 batch_eval.py），等待全部任务结束后返回
         
-        # 查找并更新
-        updated = False
-        for i, line in enumerate(lines):
-            if line.strip().startswith(f"{key}="):
-                lines[i] = f"{key}={value}\n"
-                updated = True
-                break
+        Returns:
+            汇总字典：准确率、错误数、p50/p95 延迟、吞吐量
+        """
+        output_file = output_file or model_eval.default_output_file(test_file, model_id)
+        if batch:
+            from batch_eval import run_batch_eval
+            try:
+                summary = run_batch_eval(model_id, test_file, output_file, self.api_key, limit)
+            except KeyboardInterrupt:
+                print("\n⚠️  已停止等待，Batch 任务仍在服务端运行，重新运行相同命令即可继续收取结果")
+                return None
+            model_eval.print_summary(summary, f"Batch 评测结果: {model_id}")
+            return summary
         
-        # 如果没找到，添加到末尾
-        if not updated:
-            lines.append(f"{key}={value}\n")
+        require_dashscope()
+        call = model_eval.generation_call(model_id, api_key=self.api_key, cache=self.response_cache)
+        try:
+            summary = model_eval.evaluate(call, test_file, output_file, concurrency, rate_limit, limit)
+        except KeyboardInterrupt:
+            print("\n⚠️  评测已中断，重新运行相同命令即可从断点继续")
+            summary = model_eval.summarize(model_eval.load_results(output_file))
+        model_eval.print_summary(summary, f"评测结果: {model_id}")
+        return summary
+
+    def estimate_training(self, train_file, validation_file=None, workers=None):
+        """
+        预检训练集的 token 长度并估算训练量
+        
+        按 hyper_params 中的 max_length 统计超长行，按 n_epochs 估算训练 token 数；
+        没有单独验证集时只有 split 比例的数据参与训练。
         
-        # 写回文件
-        with open(env_file, 'w', encoding='utf-8') as f:
-            f.writelines(lines)
+        预检只用于提示，不影响上传：缺少 numpy 等依赖或统计出错时打印警告后跳过。
+        训练集未变化时直接复用已有的 token 索引，否则最多用 ESTIMATE_WORKERS 个进程分词。
         
-        print(f"✅ 已更新 .env 文件: {key}={value}")
+        Returns:
+            (length_stats, estimate)，出错时返回 (None, None)
+        """
+        try:
+            import token_index
+            
+            counts, meta = token_index.build_token_index(
+                train_file, self.base_model, workers=workers or min(ESTIMATE_WORKERS, os.cpu_count() or 1))
+        except ImportError as e:
+            print(f"⚠️  跳过 token 预检（缺少依赖: {e.name}）")
+            return None, None
+        except Exception as e:
+            print(f"⚠️  token 统计失败: {str(e)}")
+            return None, None
+        
+        n_epochs = self.hyper_params["n_epochs"]
+        split = 1.0 if validation_file else self.hyper_params["split"]
+        stats = token_index.length_stats(counts, self.hyper_params["max_length"])
+        estimate = token_index.estimate_training(stats, n_epochs, split)
+        token_index.print_report(train_file, stats, estimate, n_epochs, meta['tokenizer'])
+        if stats['over_rows']:
+            print(f"💡 有 {stats['over_rows']} 行超过 max_length，训练时会被截断，"
+                  f"可用 token_index.py --policy filter/truncate 预先处理")
+        return stats, estimate
+
+
+def join_file_ids(file_ids):
+    """将 File ID（或分片数据集的 File ID 列表）编码为逗号分隔的字符串（与 .env 和手动输入的格式一致）"""
+    return ",".join(file_ids) if isinstance(file_ids, list) else file_ids
+
+
+def split_file_ids(value):
+    """解析逗号分隔的 File ID 字符串，单个 ID 原样返回"""
+    if not value or "," not in value:
+        return value
+    return [file_id.strip() for file_id in value.split(",") if file_id.strip()]
+
+
+def recorded_file_ids(automation):
+    """
+    状态库中最近一次上传的训练集和验证集，没有记录时读取 .env 中的 TRAIN_FILE_ID / VALIDATION_FILE_ID
+    
+    Returns:
+        (训练集, 验证集)，均为逗号分隔的字符串，没有时为 None
+    """
+    latest = automation.state.latest_upload_set()
+    if latest:
+        train_file_id, val_file_id, uploaded_at = latest
+        train_file_id, val_file_id = join_file_ids(train_file_id), join_file_ids(val_file_id)
+        print(f"\n📦 使用状态库中最近一次上传的文件"
+              f"（{time.strftime('%Y-%m-%d %H:%M', time.localtime(uploaded_at))}）: {train_file_id}")
+        return train_file_id, val_file_id
+    return os.getenv("TRAIN_FILE_ID"), os.getenv("VALIDATION_FILE_ID")
+
+
+def run_sweep(automation, args, uploaded_file_ids=None):
+    """按 --sweep 的搜索空间提交、监控并汇总一组微调任务"""
+    import hyper_sweep
+    
+    spec = hyper_sweep.load_spec(args.sweep)
+    configs = hyper_sweep.expand_configs(spec, automation.hyper_params)
+    max_concurrent = (args.sweep_concurrency or spec.get('max_concurrent')
+                      or int(os.getenv("SWEEP_MAX_CONCURRENT", str(hyper_sweep.DEFAULT_MAX_CONCURRENT))))
+    
+    if args.sweep_dry_run:
+        print(f"\n🔬 超参数搜索（{spec['method']}）: {len(configs)} 组，同时最多运行 {max_concurrent} 个任务")
+        for i, config in enumerate(configs, 1):
+            print(f"{i:>3}. {hyper_sweep.format_config(config)}")
+        return
+    
+    if uploaded_file_ids:
+        train_file_ids, val_file_ids = uploaded_file_ids
+    else:
+        train_file_id, val_file_id = recorded_file_ids(automation)
+        if not train_file_id:
+            print("❌ 没有已上传的训练集，请先运行 --upload（或在 .env 中设置 TRAIN_FILE_ID）")
+            return
+        train_file_ids, val_file_ids = split_file_ids(train_file_id), split_file_ids(val_file_id)
+    
+    sweep = hyper_sweep.HyperSweep(automation, configs, train_file_ids, val_file_ids, max_concurrent)
+    with automation.metrics.phase("sweep", method=spec['method'], concurrency=max_concurrent) as phase:
+        trials = sweep.run()
+        phase.add(jobs=sum(1 for trial in trials if trial['job_id']),
+                  succeeded=sum(1 for trial in trials if trial['status'] == "SUCCEEDED"))
+    
+    if args.sweep_eval:
+        eval_file = args.eval_file or str(automation.data_dir / "mainland_4opt_test.jsonl")
+        with automation.metrics.phase("sweep_evaluate"):
+            sweep.evaluate(eval_file, concurrency=args.eval_concurrency, rate_limit=args.eval_rps,
+                           limit=args.eval_limit)
+    
+    sweep.print_results()
+    sweep.save(args.sweep_output or hyper_sweep.default_results_file(automation.data_dir, args.sweep))
 
 
 def main():
@@ -327,18 +849,72 @@ def main():
     parser = argparse.ArgumentParser(description='阿里云百炼平台微调自动化工具')
     parser.add_argument('--upload', action='store_true', help='上传训练文件')
     parser.add_argument('--create', action='store_true', help='创建微调任务')
-    parser.add_argument('--status', type=str, help='查询任务状态（提供 job_id）')
-    parser.add_argument('--monitor', type=str, help='监控任务进度（提供 job_id）')
+    parser.add_argument('--status', type=str, nargs='?', const='',
+                        help='查询任务状态（提供 job_id，省略时为最近创建的任务）；'
+                             '任务已结束或最近 STATUS_CACHE_TTL 秒内查询过时直接使用状态库缓存')
+    parser.add_argument('--refresh', action='store_true', help='--status 时忽略缓存，直接查询 API')
+    parser.add_argument('--jobs', action='store_true', help='列出状态库中最近的微调任务（不请求 API）')
+    parser.add_argument('--monitor', type=str, nargs='+', help='监控任务进度（提供一个或多个 job_id）')
     parser.add_argument('--test', type=str, help='测试模型（提供 model_id）')
     parser.add_argument('--auto', action='store_true', help='自动执行完整流程')
+    parser.add_argument('--eval', type=str, help='在完整测试集上评测模型（提供 model_id，配合 --eval-file）')
+    parser.add_argument('--eval-file', type=str, help='评测用的测试集（默认 mainland_4opt_test.jsonl）')
+    parser.add_argument('--eval-concurrency', type=int, default=8, help='评测并发数（默认 8）')
+    parser.add_argument('--eval-rps', type=float, help='评测时每秒最大请求数（默认不限速）')
+    parser.add_argument('--eval-limit', type=int, help='只评测前 N 道题')
+    parser.add_argument('--eval-batch', action='store_true', help='用 Batch 接口离线评测（价格减半，需等待任务完成）')
+    parser.add_argument('--force-upload', action='store_true', help='忽略上传登记表，强制重新上传')
+    parser.add_argument('--upload-concurrency', type=int, help='最大并发上传数（默认 4，或 .env 中的 UPLOAD_CONCURRENCY）')
+    parser.add_argument('--forget-file', type=str, help='从上传登记表中删除某个 File ID（远端文件已删除时使用）')
+    parser.add_argument('--verify-uploads', action='store_true', help='在线校验上传登记表，清理远端已删除的文件')
+    parser.add_argument('--cache', action='store_true', help='启用模型回答缓存（--test/--eval 时重复的问题不再调用 API）')
+    parser.add_argument('--estimate', type=str, help='统计训练集的 token 长度并估算训练量（提供数据集路径）')
+    parser.add_argument('--metrics', type=str,
+                        help='把各阶段耗时、HTTP 延迟和重试次数写入指标文件（.prom 结尾为 Prometheus textfile，'
+                             '否则为 JSON Lines；默认读取 .env 中的 METRICS_FILE）')
+    parser.add_argument('--sweep', type=str, metavar='SPEC',
+                        help='超参数搜索：按 JSON 搜索空间（grid 或 random，见 hyper_sweep.py）用最近上传的文件'
+                             '提交多个任务，一起监控并输出结果表')
+    parser.add_argument('--sweep-concurrency', type=int,
+                        help='超参数搜索时同时运行的任务数上限（默认取搜索空间中的 max_concurrent，'
+                             '或 .env 中的 SWEEP_MAX_CONCURRENT，默认 2）')
+    parser.add_argument('--sweep-dry-run', action='store_true', help='只列出搜索空间展开后的各组超参数，不提交任务')
+    parser.add_argument('--sweep-eval', action='store_true',
+                        help='搜索结束后在 --eval-file 上评测每个训练成功的模型（可配合 --eval-limit）')
+    parser.add_argument('--sweep-output', type=str,
+                        help='搜索结果文件（默认 datasets/MedQA_BaiLian/sweeps/<搜索空间名>.results.jsonl）')
     
     args = parser.parse_args()
     
+    automation = None
     try:
         automation = FineTuneAutomation()
+        if args.metrics:
+            automation.metrics = PipelineMetrics("fine_tune", args.metrics)
+        if args.cache and automation.response_cache is None:
+            automation.response_cache = ResponseCache.from_env(enabled=True)
         
         # 如果没有参数，显示交互式菜单
-        if not any([args.upload, args.create, args.status, args.monitor, args.test, args.auto]):
+        if args.forget_file:
+            removed = automation.upload_registry.forget(args.forget_file)
+            print(f"✅ 已从上传登记表中删除 {removed} 条记录: {args.forget_file}")
+            return
+        
+        if args.verify_uploads:
+            removed = automation.verify_uploads()
+            print(f"\n✅ 校验完成，移除 {removed} 条失效记录")
+            return
+        
+        if args.estimate:
+            automation.estimate_training(args.estimate)
+            return
+        
+        if args.jobs:
+            automation.list_jobs()
+            return
+        
+        if not any([args.upload, args.create, args.status is not None, args.monitor, args.test, args.auto,
+                    args.eval, args.sweep]):
             print("\n" + "="*60)
             print("🎯 阿里云百炼平台微调自动化工具")
             print("="*60)
@@ -358,11 +934,11 @@ def main():
             elif choice == "2":
                 args.create = True
             elif choice == "3":
-                job_id = input("请输入 Job ID: ").strip()
+                job_id = input("请输入 Job ID（直接回车查询最近创建的任务）: ").strip()
                 args.status = job_id
             elif choice == "4":
-                job_id = input("请输入 Job ID: ").strip()
-                args.monitor = job_id
+                job_ids = input("请输入 Job ID（多个用空格或逗号分隔）: ").replace(",", " ").split()
+                args.monitor = job_ids
             elif choice == "5":
                 model_id = input("请输入 Model ID: ").strip()
                 args.test = model_id
@@ -376,6 +952,8 @@ def main():
                 return
         
         # 执行操作
+        uploaded_file_ids = None
+        
         if args.upload or args.auto:
             datasets = automation.list_available_datasets()
             if not datasets:
@@ -389,58 +967,113 @@ def main():
             val_idx = input("输入编号: ").strip()
             val_file = datasets[int(val_idx) - 1] if val_idx else None
             
-            # 上传文件
-            train_file_id = automation.upload_file(train_file, "训练集")
-            val_file_id = automation.upload_file(val_file, "验证集") if val_file else None
+            # 上传前先检查数据长度，估算训练量
+            with automation.metrics.phase("estimate"):
+                automation.estimate_training(train_file, val_file)
             
+            # 并发上传训练集和验证集
+            train_file_id, val_file_id = automation.upload_files(
+                [train_file, val_file],
+                ["训练集", "验证集"],
+                max_concurrency=args.upload_concurrency,
+                force=args.force_upload,
+            )
+            uploaded_file_ids = (train_file_id, val_file_id)
+            
+            # 分片数据集会得到多个 File ID，按分片顺序记录
             if train_file_id:
-                automation.update_env_file("TRAIN_FILE_ID", train_file_id)
-            if val_file_id:
-                automation.update_env_file("VALIDATION_FILE_ID", val_file_id)
+                automation.state.record_upload_set(train_file_id, val_file_id, str(train_file),
+                                                   str(val_file) if val_file else None)
+                print(f"✅ 已记录到状态库: 训练集 {join_file_ids(train_file_id)}"
+                      + (f"，验证集 {join_file_ids(val_file_id)}" if val_file_id else ""))
             
             # 如果是自动模式，继续创建任务
             if args.auto and train_file_id:
                 args.create = True
         
         if args.create:
-            # 从 .env 获取或从参数获取
-            train_file_id = os.getenv("TRAIN_FILE_ID")
-            val_file_id = os.getenv("VALIDATION_FILE_ID")
-            
-            if not train_file_id:
-                train_file_id = input("请输入训练集 File ID: ").strip()
-            
-            val_input = input(f"请输入验证集 File ID（当前: {val_file_id or '无'}，直接回车使用当前值）: ").strip()
-            if val_input:
-                val_file_id = val_input
+            if uploaded_file_ids:
+                # 直接使用本次上传得到的 File ID
+                train_file_ids, val_file_ids = uploaded_file_ids
+            else:
+                # 优先使用状态库中最近一次上传的文件，没有记录时读取 .env
+                train_file_id, val_file_id = recorded_file_ids(automation)
+                
+                if not train_file_id:
+                    train_file_id = input("请输入训练集 File ID: ").strip()
+                
+                val_input = input(f"请输入验证集 File ID（当前: {val_file_id or '无'}，直接回车使用当前值）: ").strip()
+                if val_input:
+                    val_file_id = val_input
+                
+                train_file_ids, val_file_ids = split_file_ids(train_file_id), split_file_ids(val_file_id)
             
-            job_id = automation.create_fine_tune_job(train_file_id, val_file_id)
+            with automation.metrics.phase("create_job") as phase:
+                job_id = automation.create_fine_tune_job(train_file_ids, val_file_ids)
+                phase.add(failed=0 if job_id else 1)
             
-            if job_id:
-                automation.update_env_file("FINE_TUNE_JOB_ID", job_id)
-                
-                # 如果是自动模式，开始监控
-                if args.auto:
-                    args.monitor = job_id
+            # 如果是自动模式，开始监控
+            if job_id and args.auto:
+                args.monitor = [job_id]
+        
+        if args.sweep:
+            run_sweep(automation, args, uploaded_file_ids)
         
-        if args.status:
-            status_data = automation.get_job_status(args.status)
+        if args.status is not None:
+            job_id = args.status or automation.state.latest_job_id() or os.getenv("FINE_TUNE_JOB_ID")
+            if not job_id:
+                print("❌ 状态库中没有任务记录，请提供 job_id")
+                return
+            status_data, age = automation.job_status(job_id, refresh=args.refresh)
             if status_data:
                 print("\n" + "="*60)
-                print(f"📊 任务状态: {args.status}")
+                print(f"📊 任务状态: {job_id}")
+                if age is not None:
+                    print(f"   （状态库缓存，{age:.0f} 秒前查询；--refresh 强制查询 API）")
                 print("="*60)
                 print(json.dumps(status_data, indent=2, ensure_ascii=False))
         
         if args.monitor:
-            automation.monitor_job(args.monitor)
+            with automation.metrics.phase("monitor") as phase:
+                final_states = automation.monitor_jobs(args.monitor)
+                phase.add(jobs=len(args.monitor),
+                          succeeded=sum(1 for state in final_states.values() if state.get('status') == "SUCCEEDED"))
         
         if args.test:
-            automation.test_model(args.test)
+            with automation.metrics.phase("test", model=args.test):
+                automation.test_model(args.test)
+        
+        if args.eval:
+            eval_file = args.eval_file or str(automation.data_dir / "mainland_4opt_test.jsonl")
+            with automation.metrics.phase("evaluate", model=args.eval, batch=args.eval_batch) as phase:
+                summary = automation.evaluate_model(
+                    args.eval,
+                    eval_file,
+                    concurrency=args.eval_concurrency,
+                    rate_limit=args.eval_rps,
+                    limit=args.eval_limit,
+                    batch=args.eval_batch,
+                )
+                if summary:
+                    phase.add(rows=summary['total'], errors=summary['errors'])
+            if summary and summary['accuracy'] is not None:
+                automation.metrics.gauge("eval_accuracy", round(summary['accuracy'], 4), model=args.eval)
+        
+        automation.print_http_summary()
+        if automation.response_cache:
+            automation.response_cache.print_stats()
     
     except Exception as e:
         print(f"\n❌ 发生错误: {str(e)}")
         import traceback
         traceback.print_exc()
+    
+    finally:
+        # 出错或提前返回时也写出已完成阶段的 HTTP 统计和汇总；没有发过请求时不创建 HTTP 客户端
+        if automation is not None:
+            if automation._http is not None:
+                automation.metrics.record_http(automation.http)
+            automation.metrics.close()
 
 
 if __name__ == "__main__":
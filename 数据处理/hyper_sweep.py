@@ -0,0 +1,363 @@
+"""
+超参数搜索
+
+比较 lora_rank、lora_alpha、learning_rate 等设置时，不再需要反复修改 .env 重新运行：
+搜索空间写在一个 JSON 文件中，所有组合共用同一组已上传的训练集和验证集
+（状态库中最近一次上传的文件），同时运行的任务数不超过 max_concurrent，
+其余组合排队，有任务结束时再提交下一组。所有任务在同一个事件循环中一起监控
+（FineTuneAutomation.monitor_jobs），结束后输出每组超参数的最终结果表。
+
+搜索空间示例（sweep.json）：
+
+    {
+      "method": "grid",
+      "parameters": {
+        "lora_rank": [16, 32, 64],
+        "lora_alpha": [16, 32],
+        "learning_rate": ["1e-4", "5e-5"]
+      },
+      "fixed": {"n_epochs": 2},
+      "max_concurrent": 2
+    }
+
+- method：grid 取全部组合；random 随机抽取 trials 组（seed 固定时结果可复现）
+- parameters：每个超参数的候选值列表；random 时也可以写成范围
+  {"min": 1e-5, "max": 1e-3, "log": true}，整数超参数按整数取值
+- fixed：所有组合共用的覆盖值
+- max_concurrent：同时运行的任务数上限（命令行 --sweep-concurrency 优先）
+
+每个任务照常记录到状态库。中途退出后用同一个搜索空间重新运行，已提交且未失败的
+组合直接沿用原来的任务，不会重复提交。
+
+用法：
+    python fine_tune_automation.py --sweep sweep.json --sweep-dry-run   # 只列出组合
+    python fine_tune_automation.py --sweep sweep.json --sweep-concurrency 3
+    python fine_tune_automation.py --sweep sweep.json --sweep-eval --eval-limit 200
+"""
+
+import os
+import json
+import math
+import random
+import time
+import threading
+import itertools
+from pathlib import Path
+from collections import deque
+
+from dashscope_http import backoff_delay
+from state_store import TERMINAL_STATUSES
+
+
+SWEEP_METHODS = ("grid", "random")
+
+DEFAULT_MAX_CONCURRENT = 2
+DEFAULT_TRIALS = 8
+
+# random 搜索抽到重复组合时最多重抽的倍数
+MAX_DRAWS_PER_TRIAL = 20
+
+# 创建任务失败时的重试次数和退避基数（秒）
+SUBMIT_RETRIES = 2
+SUBMIT_RETRY_BASE = 5.0
+
+# 结果表中从任务最终状态里取出的数值字段（平台返回的 loss、准确率等同样收录）
+RESULT_FIELDS = ("trained_tokens",)
+METRIC_KEYWORDS = ("loss", "acc")
+
+
+def load_spec(spec_file):
+    """读取并校验搜索空间，缺省字段补上默认值"""
+    with open(spec_file, 'r', encoding='utf-8') as f:
+        spec = json.load(f)
+
+    method = spec.setdefault('method', 'grid')
+    if method not in SWEEP_METHODS:
+        raise ValueError(f"不支持的搜索方式: {method}（可选 {', '.join(SWEEP_METHODS)}）")
+    parameters = spec.get('parameters')
+    if not isinstance(parameters, dict) or not parameters:
+        raise ValueError("搜索空间缺少 parameters")
+    for key, values in parameters.items():
+        if isinstance(values, dict) and method == 'random':
+            if 'min' not in values or 'max' not in values:
+                raise ValueError(f"{key} 的范围需要同时给出 min 和 max")
+            if values.get('log') and min(values['min'], values['max']) <= 0:
+                raise ValueError(f"{key} 按对数取值时 min 和 max 必须大于 0")
+        elif not isinstance(values, list) or not values:
+            raise ValueError(f"{key} 的候选值必须是非空列表" + ("或范围" if method == 'random' else ""))
+    spec.setdefault('fixed', {})
+    spec.setdefault('trials', DEFAULT_TRIALS)
+    return spec
+
+
+def _coerce(value, base):
+    """随机取到的数值保留 3 位有效数字，按 .env 中同名超参数的类型保存（learning_rate 为字符串）"""
+    if isinstance(base, str):
+        return f"{value:.3g}"
+    return float(f"{value:.3g}")
+
+
+def _sample(values, rng, base):
+    if isinstance(values, list):
+        return rng.choice(values)
+    low, high = values['min'], values['max']
+    if values.get('log'):
+        value = math.exp(rng.uniform(math.log(low), math.log(high)))
+    else:
+        value = rng.uniform(low, high)
+    if values.get('type') == 'int' or (isinstance(base, int) and not isinstance(base, bool)):
+        return int(round(value))
+    return _coerce(value, base)
+
+
+def expand_configs(spec, base_params):
+    """
+    展开搜索空间
+
+    Args:
+        spec: load_spec() 的返回值
+        base_params: 默认超参数（FineTuneAutomation.hyper_params），用于确定随机取值的类型
+
+    Returns:
+        每组的超参数覆盖值列表 [{key: value}]（包含 fixed），已去掉重复组合
+    """
+    parameters = spec['parameters']
+    keys = list(parameters)
+    fixed = spec['fixed']
+
+    if spec['method'] == 'grid':
+        combos = [dict(zip(keys, values)) for values in itertools.product(*(parameters[k] for k in keys))]
+    else:
+        rng = random.Random(spec.get('seed'))
+        combos = []
+        seen = set()
+        for _ in range(spec['trials'] * MAX_DRAWS_PER_TRIAL):
+            if len(combos) >= spec['trials']:
+                break
+            combo = {key: _sample(parameters[key], rng, base_params.get(key)) for key in keys}
+            digest = json.dumps(combo, sort_keys=True)
+            if digest not in seen:
+                seen.add(digest)
+                combos.append(combo)
+
+    configs = []
+    seen = set()
+    for combo in combos:
+        config = dict(fixed, **combo)
+        digest = json.dumps(config, sort_keys=True)
+        if digest not in seen:
+            seen.add(digest)
+            configs.append(config)
+    return configs
+
+
+def default_results_file(data_dir, spec_file):
+    """默认结果文件：数据集目录下 sweeps/<搜索空间文件名>.results.jsonl"""
+    return Path(data_dir) / "sweeps" / f"{Path(spec_file).stem}.results.jsonl"
+
+
+def final_metrics(status_data):
+    """从任务的最终状态中取出数值指标（已训练 token 数，以及平台返回的 loss、准确率等）"""
+    metrics = {}
+    for key, value in (status_data or {}).items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        if key in RESULT_FIELDS or any(word in key.lower() for word in METRIC_KEYWORDS):
+            metrics[key] = value
+    return metrics
+
+
+class HyperSweep:
+    """按并发上限提交一组超参数组合，监控到全部结束并汇总结果"""
+
+    def __init__(self, automation, configs, train_file_ids, validation_file_ids=None,
+                 max_concurrent=DEFAULT_MAX_CONCURRENT):
+        """
+        Args:
+            automation: FineTuneAutomation
+            configs: expand_configs() 得到的超参数覆盖值列表
+            train_file_ids: 所有组合共用的训练集 File ID
+            validation_file_ids: 所有组合共用的验证集 File ID（可选）
+            max_concurrent: 同时运行的任务数上限
+        """
+        self.automation = automation
+        self.train_file_ids = train_file_ids
+        self.validation_file_ids = validation_file_ids
+        self.max_concurrent = max(1, max_concurrent)
+        self.trials = [
+            {'index': i, 'overrides': config, 'job_id': None, 'status': 'QUEUED',
+             'fine_tuned_model': None, 'metrics': {}, 'resumed': False}
+            for i, config in enumerate(configs, 1)
+        ]
+        self._queue = deque(self.trials)
+        self._by_job = {}
+        self._lock = threading.Lock()
+
+    @property
+    def swept_keys(self):
+        """各组之间取值不同的超参数（结果表中逐列显示）"""
+        keys = []
+        for trial in self.trials:
+            for key in trial['overrides']:
+                if key not in keys and len({json.dumps(t['overrides'].get(key)) for t in self.trials}) > 1:
+                    keys.append(key)
+        return keys
+
+    def _finish(self, trial, status_data):
+        trial['status'] = status_data.get('status', 'UNKNOWN')
+        trial['fine_tuned_model'] = status_data.get('fine_tuned_model') or trial['fine_tuned_model']
+        trial['metrics'] = final_metrics(status_data)
+        if trial['status'] == 'FAILED':
+            trial['error_message'] = status_data.get('error_message')
+
+    def _submit_next(self):
+        """
+        提交队列中的下一组超参数
+
+        状态库中已有相同设置且未失败的任务时直接沿用；已结束的任务不占用并发名额，
+        继续处理下一组。创建任务失败时退避重试 SUBMIT_RETRIES 次，仍失败才记为 SUBMIT_FAILED。
+
+        Returns:
+            需要监控的任务 ID；队列已空时返回 None
+        """
+        automation = self.automation
+        while True:
+            with self._lock:
+                if not self._queue:
+                    return None
+                trial = self._queue.popleft()
+
+            print(f"\n🧪 超参数组合 {trial['index']}/{len(self.trials)}: {format_config(trial['overrides'])}")
+            existing = automation.state.find_job(
+                automation.base_model, automation.training_type, automation.job_hyper_params(trial['overrides']),
+                self.train_file_ids, self.validation_file_ids)
+            if existing:
+                trial.update(job_id=existing['job_id'], resumed=True)
+                self._by_job[existing['job_id']] = trial
+                print(f"   ♻️  状态库中已有相同设置的任务，直接沿用: {existing['job_id']}")
+                if existing['status'] in TERMINAL_STATUSES:
+                    cached = automation.state.cached_status(existing['job_id'])
+                    self._finish(trial, cached[0] if cached else {'status': existing['status'],
+                                                                   'fine_tuned_model': existing['fine_tuned_model']})
+                    continue
+                trial['status'] = existing['status'] or 'PENDING'
+                return existing['job_id']
+
+            job_id = None
+            for attempt in range(SUBMIT_RETRIES + 1):
+                if attempt:
+                    delay = backoff_delay(attempt, base=SUBMIT_RETRY_BASE)
+                    print(f"   ⏳ 创建任务失败，{delay:.1f} 秒后重试（{attempt}/{SUBMIT_RETRIES}）")
+                    time.sleep(delay)
+                job_id = automation.create_fine_tune_job(self.train_file_ids, self.validation_file_ids,
+                                                         hyper_params=trial['overrides'])
+                if job_id:
+                    break
+            if not job_id:
+                trial['status'] = 'SUBMIT_FAILED'
+                continue
+            trial.update(job_id=job_id, status='PENDING')
+            self._by_job[job_id] = trial
+            return job_id
+
+    def _on_finished(self, job_id, status_data):
+        """有任务结束时记录结果，并从队列中补上一个任务"""
+        trial = self._by_job.get(job_id)
+        if trial is not None:
+            self._finish(trial, status_data)
+        next_job = self._submit_next()
+        return [next_job] if next_job else []
+
+    def run(self):
+        """
+        提交并监控全部组合，直到都结束（或 Ctrl+C 退出监控）
+
+        Returns:
+            各组的结果（同 self.trials）
+        """
+        print(f"\n🔬 超参数搜索: {len(self.trials)} 组，同时最多运行 {self.max_concurrent} 个任务")
+        running = []
+        while len(running) < self.max_concurrent:
+            job_id = self._submit_next()
+            if job_id is None:
+                break
+            running.append(job_id)
+
+        if running:
+            final_states = self.automation.monitor_jobs(running, on_finished=self._on_finished)
+            # Ctrl+C 退出监控时，记下仍在运行的任务最后一次查询到的状态
+            for job_id, status_data in final_states.items():
+                trial = self._by_job.get(job_id)
+                if trial is not None and trial['status'] not in TERMINAL_STATUSES:
+                    trial['status'] = status_data.get('status', trial['status'])
+
+        queued = sum(1 for trial in self.trials if trial['status'] == 'QUEUED')
+        if queued:
+            print(f"\n⚠️  还有 {queued} 组未提交，用同一个搜索空间重新运行即可继续（已提交的任务不会重复提交）")
+        return self.trials
+
+    def evaluate(self, test_file, concurrency=8, rate_limit=None, limit=None):
+        """在测试集上评测每个训练成功的模型，准确率写入结果"""
+        for trial in self.trials:
+            if trial['status'] != 'SUCCEEDED' or not trial['fine_tuned_model']:
+                continue
+            summary = self.automation.evaluate_model(trial['fine_tuned_model'], test_file, concurrency=concurrency,
+                                                     rate_limit=rate_limit, limit=limit)
+            if summary:
+                trial['accuracy'] = summary['accuracy']
+
+    def print_results(self):
+        """输出每组超参数的最终结果表（有评测准确率时按准确率从高到低排序）"""
+        if not self.trials:
+            return
+        keys = self.swept_keys or list(self.trials[0]['overrides'])
+        metric_keys = []
+        for trial in self.trials:
+            metric_keys.extend(key for key in trial['metrics'] if key not in metric_keys)
+        has_accuracy = any(trial.get('accuracy') is not None for trial in self.trials)
+
+        header = ['#'] + keys + ['状态'] + metric_keys + (['准确率'] if has_accuracy else []) + ['任务 / 模型']
+        rows = []
+        trials = self.trials
+        if has_accuracy:
+            trials = sorted(trials, key=lambda t: -1 if t.get('accuracy') is None else t['accuracy'], reverse=True)
+        for trial in trials:
+            row = [str(trial['index'])]
+            row += [str(trial['overrides'].get(key, '')) for key in keys]
+            row.append(trial['status'])
+            row += [str(trial['metrics'].get(key, '')) for key in metric_keys]
+            if has_accuracy:
+                row.append(f"{trial['accuracy']:.2%}" if trial.get('accuracy') is not None else '')
+            row.append(trial['fine_tuned_model'] or trial['job_id'] or '')
+            rows.append(row)
+
+        widths = [max(len(cell) for cell in column) for column in zip(header, *rows)]
+        print("\n" + "=" * 60)
+        print("📋 超参数搜索结果")
+        print("=" * 60)
+        print("  ".join(cell.ljust(width) for cell, width in zip(header, widths)))
+        print("  ".join("-" * width for width in widths))
+        for row in rows:
+            print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)))
+
+        counts = {}
+        for trial in self.trials:
+            counts[trial['status']] = counts.get(trial['status'], 0) + 1
+        print("\n" + "，".join(f"{status}: {count}" for status, count in counts.items()))
+
+    def save(self, results_file):
+        """把每组的超参数、任务、状态和指标写成 JSON Lines（覆盖旧文件）"""
+        results_file = Path(results_file)
+        results_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = results_file.with_name(results_file.name + ".tmp")
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            for trial in self.trials:
+                record = dict(trial, hyper_params=self.automation.job_hyper_params(trial['overrides']))
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(temp_file, results_file)
+        print(f"\n💾 结果已保存: {results_file}")
+
+
+def format_config(overrides):
+    """一组超参数的简短描述：lora_rank=32, learning_rate=1e-4"""
+    return ", ".join(f"{key}={value}" for key, value in overrides.items())
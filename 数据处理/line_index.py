@@ -0,0 +1,401 @@
+"""
+转换后数据集的行偏移索引：随机访问、打乱、抽样和本地训练/验证划分
+
+为每个数据集（JSONL 或分片清单）建立旁路索引 xxx.lines.npy，逐行记录
+所在文件、起始字节和长度，以内存映射方式打开，不需要把数据读进内存：
+- 按行号 O(1) 读取任意一条
+- 按种子打乱、均匀抽样、按答案字母分层抽样
+- 按种子确定性地划分训练集和验证集（可分层），在本地就能看到并复现
+  平台 split 超参数的效果
+输出时直接从源文件的内存映射中切片写出，不解析 JSON。
+
+索引的行顺序与 token_index.py 的 token 数索引一致（都只计非空行），
+两者可以按行号对应。
+
+索引记录的是文件中的字节偏移，压缩的数据集（.jsonl.gz / .jsonl.zst）无法随机访问，
+需要先解压；只抽样时可以用 --method reservoir 直接流式读取压缩文件。
+
+用法：
+    python line_index.py ../datasets/MedQA_BaiLian/mainland_4opt_train.jsonl --show 0
+    python line_index.py <数据集> --sample 500 --stratify --seed 42
+    python line_index.py <数据集> --split 0.9 --stratify
+    python line_index.py <数据集> --shuffle
+    python line_index.py <数据集> --sample 500 --method reservoir    # 不建索引，单遍流式抽样
+"""
+
+import os
+import json
+import mmap
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from compressed_io import compression_of
+from convert_to_bailian_format import (
+    UPLOAD_LIMIT_MB,
+    ShardedJsonlWriter,
+    iter_raw_lines,
+    shard_manifest_path,
+)
+from evaluate_model import extract_answer, iter_dataset_files
+from token_index import dataset_stem, source_state
+
+
+LINE_INDEX_SUFFIX = ".lines.npy"
+LINE_META_SUFFIX = ".lines.json"
+
+LINE_INDEX_VERSION = 1
+
+# 每行一条记录：所在文件序号（分片清单中的第几个分片）、起始字节、长度（含换行符）
+LINE_DTYPE = np.dtype([('file', '<u2'), ('start', '<u8'), ('length', '<u4')])
+
+# 建索引时每次扫描的字节数
+SCAN_BLOCK_BYTES = 64 * 1024 * 1024
+
+# 与 str.strip() 一致视为空白的字节
+_WHITESPACE = np.array([9, 10, 11, 12, 13, 32], dtype=np.uint8)
+
+DEFAULT_SEED = 42
+
+
+def index_paths(dataset_path):
+    """数据集对应的行索引文件和元数据文件路径"""
+    dataset_path = Path(dataset_path)
+    stem = dataset_stem(dataset_path)
+    return (dataset_path.with_name(stem + LINE_INDEX_SUFFIX),
+            dataset_path.with_name(stem + LINE_META_SUFFIX))
+
+
+def _require_uncompressed(files):
+    """行索引按字节偏移读取原文件，压缩文件直接报错，不把压缩字节当作行扫描"""
+    compressed = [Path(f).name for f in files if compression_of(f)]
+    if compressed:
+        raise ValueError(f"行索引不支持压缩文件: {', '.join(compressed)}（请先解压；只抽样时可用 --method reservoir）")
+
+
+def scan_lines(file_path, block_bytes=SCAN_BLOCK_BYTES):
+    """
+    扫描一个文件中所有非空行的位置
+
+    Returns:
+        (starts, lengths)：两个 numpy 数组，长度包含行尾换行符
+
+    Raises:
+        ValueError: 文件是压缩文件
+    """
+    _require_uncompressed([file_path])
+    size = os.path.getsize(file_path)
+    if size == 0:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.uint32)
+
+    data = np.memmap(file_path, dtype=np.uint8, mode='r')
+    starts, lengths = [], []
+    pos = 0
+    while pos < size:
+        end = min(pos + block_bytes, size)
+        # 块尾落在行中间时退回到最后一个换行符之后；整块都没有换行符时继续向后扩大
+        while end < size:
+            newlines = np.flatnonzero(data[pos:end] == 10)
+            if len(newlines):
+                end = pos + int(newlines[-1]) + 1
+                break
+            end = min(end + block_bytes, size)
+
+        chunk = data[pos:end]
+        line_ends = np.flatnonzero(chunk == 10) + 1
+        if chunk[-1] != 10:
+            line_ends = np.append(line_ends, len(chunk))
+        line_starts = np.concatenate(([0], line_ends[:-1]))
+
+        # 行内非空白字节数为 0 的是空行
+        content = np.concatenate(([0], np.cumsum(~np.isin(chunk, _WHITESPACE), dtype=np.int64)))
+        keep = content[line_ends] > content[line_starts]
+
+        starts.append(line_starts[keep].astype(np.uint64) + pos)
+        lengths.append((line_ends - line_starts)[keep].astype(np.uint32))
+        pos = end
+
+    del data
+    return np.concatenate(starts), np.concatenate(lengths)
+
+
+def build_line_index(dataset_path, force=False):
+    """
+    建立（或复用）行偏移索引
+
+    Returns:
+        以只读内存映射方式打开的索引数组（dtype 为 LINE_DTYPE）
+
+    Raises:
+        ValueError: 数据集（或其中某个分片）是压缩文件
+    """
+    files = iter_dataset_files(dataset_path)
+    _require_uncompressed(files)
+    index_file, meta_file = index_paths(dataset_path)
+    state = {'version': LINE_INDEX_VERSION, 'sources': source_state(files)}
+
+    if not force and index_file.exists() and meta_file.exists():
+        try:
+            with open(meta_file, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if all(meta.get(key) == value for key, value in state.items()):
+                return np.load(index_file, mmap_mode='r')
+        except (OSError, ValueError):
+            pass
+
+    parts = []
+    for file_no, file_path in enumerate(files):
+        starts, lengths = scan_lines(file_path)
+        part = np.empty(len(starts), dtype=LINE_DTYPE)
+        part['file'] = file_no
+        part['start'] = starts
+        part['length'] = lengths
+        parts.append(part)
+    index = np.concatenate(parts) if parts else np.empty(0, dtype=LINE_DTYPE)
+
+    np.save(index_file, index)
+    with open(meta_file, 'w', encoding='utf-8') as f:
+        json.dump(dict(state, rows=int(len(index))), f, ensure_ascii=False, indent=2)
+    return np.load(index_file, mmap_mode='r')
+
+
+class LineIndex:
+    """按行号随机访问转换后的数据集"""
+
+    def __init__(self, dataset_path, force=False):
+        self.dataset_path = Path(dataset_path)
+        self.files = iter_dataset_files(dataset_path)
+        self.index = build_line_index(dataset_path, force=force)
+        self._maps = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def _map(self, file_no):
+        if file_no not in self._maps:
+            with open(self.files[file_no], 'rb') as f:
+                self._maps[file_no] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._maps[file_no]
+
+    def view(self, row):
+        """第 row 行的原始字节（内存映射上的 memoryview，不复制）"""
+        entry = self.index[row]
+        start = int(entry['start'])
+        return memoryview(self._map(int(entry['file'])))[start:start + int(entry['length'])]
+
+    def __getitem__(self, row):
+        """第 row 行解析后的记录"""
+        return json.loads(bytes(self.view(row)))
+
+    def answers(self):
+        """每行的标准答案字母（无法识别时为空字符串），用于分层"""
+        labels = []
+        for row in range(len(self)):
+            messages = self[row]['messages']
+            answer = next((m['content'] for m in messages if m['role'] == 'assistant'), '')
+            labels.append(extract_answer(answer) or '')
+        return np.array(labels)
+
+    def write(self, rows, output_file, max_shard_mb=UPLOAD_LIMIT_MB):
+        """
+        按 rows 的顺序把若干行写到新文件
+
+        Returns:
+            输出路径（发生分片时为分片清单）
+        """
+        max_shard_bytes = int(max_shard_mb * 1024 * 1024) if max_shard_mb else None
+        with ShardedJsonlWriter(output_file, max_shard_bytes) as writer:
+            for row in rows:
+                line = self.view(int(row))
+                if line[-1] != 10:
+                    line = bytes(line) + b'\n'
+                writer.write(line)
+        if len(writer.shards) > 1:
+            return shard_manifest_path(writer.output_file)
+        return writer.output_file
+
+    def close(self):
+        for m in self._maps.values():
+            m.close()
+        self._maps = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def shuffled_rows(num_rows, seed=DEFAULT_SEED):
+    """按种子打乱的行号"""
+    return np.random.default_rng(seed).permutation(num_rows)
+
+
+def _allocate(counts, total):
+    """按比例把 total 分配到各层（最大余数法），每层不超过该层行数"""
+    counts = np.asarray(counts, dtype=np.float64)
+    quotas = counts / counts.sum() * total
+    allocated = np.floor(quotas).astype(np.int64)
+    for i in np.argsort(-(quotas - allocated), kind='stable')[:total - allocated.sum()]:
+        allocated[i] += 1
+    return np.minimum(allocated, counts.astype(np.int64))
+
+
+def sample_rows(num_rows, k, seed=DEFAULT_SEED, labels=None):
+    """
+    不放回抽取 k 行
+
+    Args:
+        num_rows: 总行数
+        k: 抽取行数（不超过总行数）
+        seed: 随机种子
+        labels: 每行的分层标签；给出时各层按原比例抽取
+
+    Returns:
+        升序排列的行号（保持原文件中的顺序，写出时顺序读取源文件）
+    """
+    rng = np.random.default_rng(seed)
+    k = min(k, num_rows)
+    if labels is None:
+        return np.sort(rng.choice(num_rows, size=k, replace=False))
+
+    strata, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    chosen = []
+    for stratum, take in enumerate(_allocate(counts, k)):
+        members = np.flatnonzero(inverse == stratum)
+        chosen.append(rng.choice(members, size=take, replace=False))
+    return np.sort(np.concatenate(chosen))
+
+
+def split_rows(num_rows, train_ratio, seed=DEFAULT_SEED, labels=None):
+    """
+    确定性地划分训练集和验证集
+
+    Args:
+        num_rows: 总行数
+        train_ratio: 训练集比例（与平台的 split 超参数含义相同）
+        seed: 随机种子，相同种子和输入得到相同划分
+        labels: 每行的分层标签；给出时各层按相同比例划分
+
+    Returns:
+        (train_rows, val_rows)，均为升序行号
+    """
+    rng = np.random.default_rng(seed)
+    if labels is None:
+        order = rng.permutation(num_rows)
+        cut = int(round(num_rows * train_ratio))
+        return np.sort(order[:cut]), np.sort(order[cut:])
+
+    strata, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    train_counts = _allocate(counts, int(round(num_rows * train_ratio)))
+    train, val = [], []
+    for stratum, take in enumerate(train_counts):
+        members = rng.permutation(np.flatnonzero(inverse == stratum))
+        train.append(members[:take])
+        val.append(members[take:])
+    return np.sort(np.concatenate(train)), np.sort(np.concatenate(val))
+
+
+def reservoir_sample(dataset_path, k, seed=DEFAULT_SEED):
+    """
+    蓄水池抽样：不建索引，单遍流式读取数据集抽取 k 行
+
+    Returns:
+        抽中的原始行（bytes），按在数据集中的顺序排列
+    """
+    rng = np.random.default_rng(seed)
+    reservoir = []
+    seen = 0
+    for file_path in iter_dataset_files(dataset_path):
+        for raw in iter_raw_lines(file_path):
+            if not raw.strip():
+                continue
+            if len(reservoir) < k:
+                reservoir.append((seen, raw))
+            else:
+                slot = int(rng.integers(0, seen + 1))
+                if slot < k:
+                    reservoir[slot] = (seen, raw)
+            seen += 1
+    return [raw if raw.endswith(b'\n') else raw + b'\n' for _, raw in sorted(reservoir)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='转换后数据集的行偏移索引：随机访问、打乱、抽样和训练/验证划分')
+    parser.add_argument('dataset', help='转换后的数据集（JSONL 或分片清单）')
+    parser.add_argument('--show', type=int, nargs='+', help='打印指定行号的记录')
+    parser.add_argument('--shuffle', action='store_true', help='按种子打乱后写出')
+    parser.add_argument('--sample', type=int, help='不放回抽取 N 行写出')
+    parser.add_argument('--method', choices=('index', 'reservoir'), default='index',
+                        help='抽样方式：index 基于行索引（默认），reservoir 不建索引单遍流式抽样')
+    parser.add_argument('--split', type=float, help='按比例划分训练集和验证集（如 0.9）')
+    parser.add_argument('--stratify', action='store_true', help='抽样和划分时按答案字母分层')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help=f'随机种子（默认 {DEFAULT_SEED}）')
+    parser.add_argument('--output-dir', type=str, help='输出目录（默认与数据集相同）')
+    parser.add_argument('--max-shard-mb', type=float, default=UPLOAD_LIMIT_MB,
+                        help=f'输出文件的分片上限（MB，默认 {UPLOAD_LIMIT_MB}，0 表示不分片）')
+    parser.add_argument('--force', action='store_true', help='忽略已有索引重新扫描')
+    args = parser.parse_args()
+
+    stem = dataset_stem(args.dataset)
+    output_dir = Path(args.output_dir) if args.output_dir else Path(args.dataset).parent
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    if args.sample and args.method == 'reservoir':
+        if args.stratify:
+            parser.error("--method reservoir 不支持 --stratify")
+        output_file = output_dir / f"{stem}_sample{args.sample}.jsonl"
+        lines = reservoir_sample(args.dataset, args.sample, args.seed)
+        with ShardedJsonlWriter(output_file) as writer:
+            for line in lines:
+                writer.write(line)
+        print(f"✅ 蓄水池抽样 {len(lines)} 行: {output_file}")
+        return
+
+    try:
+        index = LineIndex(args.dataset, force=args.force)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return
+
+    with index:
+        print(f"📑 {Path(args.dataset).name}: {len(index)} 行（索引 {index_paths(args.dataset)[0].name}）")
+        labels = index.answers() if args.stratify else None
+
+        if args.show:
+            for row in args.show:
+                if not 0 <= row < len(index):
+                    print(f"❌ 行号超出范围: {row}（共 {len(index)} 行）")
+                    continue
+                print(f"\n--- 第 {row} 行 ---")
+                print(json.dumps(index[row], ensure_ascii=False, indent=2))
+
+        if args.shuffle:
+            output = index.write(shuffled_rows(len(index), args.seed),
+                                 output_dir / f"{stem}_shuffled.jsonl", args.max_shard_mb)
+            print(f"✅ 已打乱: {output}")
+
+        if args.sample:
+            rows = sample_rows(len(index), args.sample, args.seed, labels)
+            output = index.write(rows, output_dir / f"{stem}_sample{args.sample}.jsonl", args.max_shard_mb)
+            print(f"✅ 抽样 {len(rows)} 行: {output}")
+
+        if args.split:
+            if not 0 < args.split < 1:
+                parser.error("--split 应在 0 和 1 之间")
+            train_rows, val_rows = split_rows(len(index), args.split, args.seed, labels)
+            percent = int(round(args.split * 100))
+            train_output = index.write(train_rows, output_dir / f"{stem}_split{percent}_train.jsonl", args.max_shard_mb)
+            val_output = index.write(val_rows, output_dir / f"{stem}_split{percent}_val.jsonl", args.max_shard_mb)
+            print(f"✅ 训练集 {len(train_rows)} 行: {train_output}")
+            print(f"✅ 验证集 {len(val_rows)} 行: {val_output}")
+            if labels is not None:
+                for name, rows in (("训练集", train_rows), ("验证集", val_rows)):
+                    letters, counts = np.unique(labels[rows], return_counts=True)
+                    share = ", ".join(f"{l or '?'} {c / len(rows):.1%}" for l, c in zip(letters, counts))
+                    print(f"   {name}答案分布: {share}")
+
+
+if __name__ == '__main__':
+    main()
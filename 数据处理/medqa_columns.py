@@ -0,0 +1,499 @@
+"""
+MedQA 原始题目的列式缓存
+
+把 datasets/MedQA/questions 下所有 JSONL 解析一次，按列保存题目的
+question、options、answer、answer_idx、meta_info，以及每行所在的源文件、
+字节偏移和行号。之后的转换（batch_convert.py --columns）、去重和统计
+直接读取这些列，不再逐行解码 JSON，并可以按地区、划分、选项数向量化筛选。
+
+存储格式：
+- 安装了 pyarrow 时写成一个 Parquet 文件（medqa.parquet）
+- 否则每列一个 .npy 文件，字符串列保存为 UTF-8 字节串加偏移数组，以内存映射方式打开
+两种格式加载后都是同样的 numpy 数组，调用方不需要区分。
+
+源文件的大小或修改时间变化后缓存自动失效并重建。
+
+无法按标准字段解析的行（JSON 错误、字段不是字符串、含 \\r 等）标记为 fallback，
+使用时回到源文件读取原始行，保证转换输出与逐行解析完全一致。
+
+用法：
+    python medqa_columns.py                       # 建立（或复用）缓存并打印统计
+    python medqa_columns.py --region Mainland --num-options 4 --split test --show 3
+    python medqa_columns.py --force
+"""
+
+import os
+import json
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from convert_to_bailian_format import (
+    _fast_json_loads,
+    _split_universal_newlines,
+    count_lines,
+    format_question_with_options,
+    iter_raw_lines,
+)
+from token_index import source_state
+
+
+QUESTIONS_DIR = Path(__file__).parent.parent / "datasets" / "MedQA" / "questions"
+DEFAULT_COLUMNS_DIR = Path(__file__).parent.parent / "datasets" / "MedQA" / ".columns"
+
+COLUMNS_VERSION = 1
+
+META_FILE_NAME = "meta.json"
+PARQUET_FILE_NAME = "medqa.parquet"
+
+STRING_FIELDS = ("question", "answer", "answer_idx", "meta_info")
+
+SPLITS = ("train", "dev", "test")
+
+NUMERIC_COLUMNS = ("source", "offset", "line", "fallback", "option_offsets")
+STRING_COLUMNS = STRING_FIELDS + ("option_keys", "option_values")
+
+
+def cache_file_names():
+    """缓存目录中由本模块写入的全部文件名（重建时只删除这些文件）"""
+    return ([META_FILE_NAME, PARQUET_FILE_NAME]
+            + [f"{name}.npy" for name in NUMERIC_COLUMNS]
+            + [f"{name}.{part}.npy" for name in STRING_COLUMNS for part in ("data", "offsets")])
+
+
+class StringColumn:
+    """UTF-8 字节串 + 偏移数组表示的字符串列：第 i 个值为 data[offsets[i]:offsets[i + 1]]"""
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, values):
+        encoded = [value.encode('utf-8') for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(item) for item in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+    def byte_lengths(self):
+        return np.diff(self.offsets)
+
+
+def _source_info(rel_path):
+    """从相对路径推断地区、选项数和划分：Mainland/4_options/train.jsonl -> (Mainland, 4, train)"""
+    parts = Path(rel_path).parts
+    num_options = next((int(p.split('_')[0]) for p in parts[1:-1] if p.endswith('_options')), 0)
+    stem = Path(rel_path).stem
+    split = next((s for s in SPLITS if stem == s or stem.endswith(f"_{s}")), '')
+    return {'file': str(Path(rel_path).as_posix()), 'region': parts[0], 'num_options': num_options, 'split': split}
+
+
+def _parse_row(raw):
+    """
+    解析一行原始题目
+
+    Returns:
+        (question, option_items, answer, answer_idx, meta_info)；
+        无法按标准字段解析时返回 None（标记为 fallback）
+    """
+    if b'\r' in raw:
+        return None
+    try:
+        data = _fast_json_loads(raw)
+    except ValueError:
+        return None
+    if type(data) is not dict:
+        return None
+    question = data.get('question', '')
+    options = data.get('options', {})
+    answer = data.get('answer', '')
+    answer_idx = data.get('answer_idx', '')
+    if (type(question) is not str or type(options) is not dict
+            or type(answer_idx) is not str or type(answer) is not str
+            or not all(type(value) is str for value in options.values())):
+        return None
+    meta_info = data.get('meta_info', '')
+    if type(meta_info) is not str:
+        meta_info = json.dumps(meta_info, ensure_ascii=False)
+    return question, list(options.items()), answer, answer_idx, meta_info
+
+
+def _scan_source(file_path):
+    """逐行解析一个源文件，返回各列的 Python 列表"""
+    columns = {name: [] for name in ('offset', 'line', 'fallback', 'option_keys', 'option_values') + STRING_FIELDS}
+    pos = 0
+    for line, raw in enumerate(iter_raw_lines(file_path)):
+        offset = pos
+        pos += len(raw)
+        stripped = raw.strip()
+        if not stripped:
+            continue
+        parsed = _parse_row(stripped)
+        columns['offset'].append(offset)
+        columns['line'].append(line)
+        columns['fallback'].append(parsed is None)
+        question, option_items, answer, answer_idx, meta_info = parsed or ('', [], '', '', '')
+        columns['question'].append(question)
+        columns['answer'].append(answer)
+        columns['answer_idx'].append(answer_idx)
+        columns['meta_info'].append(meta_info)
+        columns['option_keys'].append([key for key, _ in option_items])
+        columns['option_values'].append([value for _, value in option_items])
+    return columns
+
+
+class MedQAColumns:
+    """列式缓存加载后的数据：每行一条题目，所有列均为 numpy 数组或 StringColumn"""
+
+    def __init__(self, questions_dir, columns_dir, sources, arrays):
+        self.questions_dir = Path(questions_dir)
+        self.columns_dir = Path(columns_dir)
+        self.sources = sources
+        self.source = arrays['source']
+        self.offset = arrays['offset']
+        self.line = arrays['line']
+        self.fallback = arrays['fallback']
+        self.num_options = np.diff(arrays['option_offsets'])
+        self.option_offsets = arrays['option_offsets']
+        self.option_keys = arrays['option_keys']
+        self.option_values = arrays['option_values']
+        for name in STRING_FIELDS:
+            setattr(self, name, arrays[name])
+        self._source_ids = {
+            os.path.realpath(self.questions_dir / source['file']): i for i, source in enumerate(sources)
+        }
+
+    def __len__(self):
+        return len(self.source)
+
+    @property
+    def location(self):
+        """(题目目录, 缓存目录)，传给工作进程后用 cached_columns 重新打开"""
+        return str(self.questions_dir), str(self.columns_dir)
+
+    def source_id(self, file_path):
+        """源文件在缓存中的序号，不在缓存中时返回 None"""
+        return self._source_ids.get(os.path.realpath(file_path))
+
+    def select(self, region=None, split=None, num_options=None, source=None):
+        """
+        按条件筛选行
+
+        Args:
+            region: 地区（Mainland/Taiwan/US）
+            split: 划分（train/dev/test）
+            num_options: 每题的选项数
+            source: 源文件路径
+
+        Returns:
+            满足所有条件的行号（升序）
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if region is not None or split is not None:
+            wanted = np.array([
+                (region is None or s['region'] == region) and (split is None or s['split'] == split)
+                for s in self.sources
+            ], dtype=bool)
+            mask &= wanted[self.source] if len(wanted) else False
+        if num_options is not None:
+            mask &= self.num_options == num_options
+        if source is not None:
+            mask &= self.source == self.source_id(source)
+        return np.flatnonzero(mask)
+
+    def options(self, row):
+        """第 row 行的选项字典（保持原始顺序）"""
+        start, end = self.option_offsets[row], self.option_offsets[row + 1]
+        return {self.option_keys[i]: self.option_values[i] for i in range(start, end)}
+
+    def record(self, row):
+        """第 row 行还原为原始字段的字典；fallback 行从源文件重新解析"""
+        if self.fallback[row]:
+            return json.loads(self.raw_line(row))
+        return {
+            'question': self.question[row],
+            'options': self.options(row),
+            'answer': self.answer[row],
+            'meta_info': self.meta_info[row],
+            'answer_idx': self.answer_idx[row],
+        }
+
+    def raw_line(self, row):
+        """从源文件读取第 row 行的原始字节"""
+        path = self.questions_dir / self.sources[self.source[row]]['file']
+        with open(path, 'rb') as f:
+            f.seek(int(self.offset[row]))
+            return f.readline()
+
+    def source_rows(self, file_path, start=0, end=None):
+        """源文件中起始偏移落在 [start, end) 内的行号；文件不在缓存中时返回 None"""
+        source = self.source_id(file_path)
+        if source is None:
+            return None
+        rows = np.flatnonzero(self.source == source)
+        offsets = self.offset[rows]
+        lo = np.searchsorted(offsets, start, side='left')
+        hi = len(rows) if end is None else np.searchsorted(offsets, end, side='left')
+        return rows[lo:hi]
+
+    def iter_lines(self, file_path, start=0, end=None, skip_offsets=None):
+        """
+        供 convert_to_bailian_format 使用的行迭代器，行号与逐行读取源文件一致
+
+        正常行返回 (user_content, assistant_content)，不再解析 JSON；
+        fallback 行返回原始行（与 iter_fast_lines 相同）；
+        空行和 skip_offsets 中的行返回 b'\\n' 占位。范围开头、题目之间和范围末尾的
+        空行都按源文件中的实际行数占位，分段读取时的行数与 iter_input_lines 相同。
+        """
+        rows = self.source_rows(file_path, start, end)
+        path = self.questions_dir / self.sources[self.source_id(file_path)]['file']
+        limit = os.path.getsize(path) if end is None else end
+        # pos 为上一题之后的字节位置；只有存在空行时才需要读取上一题的长度
+        pos = start
+        previous = None
+        for row in rows.tolist():
+            offset = int(self.offset[row])
+            line = int(self.line[row])
+            if previous is not None and line - int(self.line[previous]) > 1:
+                pos = int(self.offset[previous]) + len(self.raw_line(previous))
+            if previous is None or line - int(self.line[previous]) > 1:
+                for _ in range(count_lines(path, pos, offset)):
+                    yield b'\n'
+            previous = row
+
+            if skip_offsets and int(self.offset[row]) in skip_offsets:
+                yield b'\n'
+            elif self.fallback[row]:
+                raw = self.raw_line(row)
+                if b'\r' in raw:
+                    yield from _split_universal_newlines(raw.decode('utf-8'))
+                else:
+                    yield raw
+            else:
+                user_content = format_question_with_options(self.question[row], self.options(row))
+                yield user_content, f"答案是 {self.answer_idx[row]}. {self.answer[row]}"
+
+        if previous is not None:
+            pos = int(self.offset[previous]) + len(self.raw_line(previous))
+        for _ in range(count_lines(path, pos, limit) if limit > pos else 0):
+            yield b'\n'
+
+
+def _arrow_strings(array):
+    """large_string 数组零拷贝转换为 StringColumn"""
+    _, offsets, data = array.buffers()
+    offsets = np.frombuffer(offsets, dtype=np.int64)[array.offset:array.offset + len(array) + 1]
+    data = np.frombuffer(data, dtype=np.uint8) if data is not None else np.empty(0, dtype=np.uint8)
+    return StringColumn(data, offsets)
+
+
+def _save_parquet(columns_dir, arrays):
+    list_offsets = pa.array(arrays['option_offsets'], type=pa.int64())
+    table = pa.table({
+        'source': pa.array(arrays['source'], type=pa.uint16()),
+        'offset': pa.array(arrays['offset'], type=pa.int64()),
+        'line': pa.array(arrays['line'], type=pa.int64()),
+        'fallback': pa.array(arrays['fallback'], type=pa.bool_()),
+        **{name: pa.array(arrays[name], type=pa.large_string()) for name in STRING_FIELDS},
+        'option_keys': pa.LargeListArray.from_arrays(list_offsets, pa.array(arrays['option_keys'], type=pa.large_string())),
+        'option_values': pa.LargeListArray.from_arrays(list_offsets, pa.array(arrays['option_values'], type=pa.large_string())),
+    })
+    pq.write_table(table, columns_dir / PARQUET_FILE_NAME)
+
+
+def _load_parquet(columns_dir):
+    table = pq.read_table(columns_dir / PARQUET_FILE_NAME, memory_map=True)
+    column = lambda name: table.column(name).combine_chunks()
+    option_keys = column('option_keys')
+    return {
+        'source': column('source').to_numpy(),
+        'offset': column('offset').to_numpy(),
+        'line': column('line').to_numpy(),
+        'fallback': column('fallback').to_numpy(zero_copy_only=False),
+        **{name: _arrow_strings(column(name)) for name in STRING_FIELDS},
+        'option_offsets': option_keys.offsets.to_numpy(),
+        'option_keys': _arrow_strings(option_keys.values),
+        'option_values': _arrow_strings(column('option_values').values),
+    }
+
+
+def _save_numpy(columns_dir, arrays):
+    for name, value in arrays.items():
+        if isinstance(value, StringColumn):
+            np.save(columns_dir / f"{name}.data.npy", value.data)
+            np.save(columns_dir / f"{name}.offsets.npy", value.offsets)
+        else:
+            np.save(columns_dir / f"{name}.npy", value)
+
+
+def _load_numpy(columns_dir):
+    arrays = {}
+    for name in NUMERIC_COLUMNS:
+        arrays[name] = np.load(columns_dir / f"{name}.npy", mmap_mode='r')
+    for name in STRING_COLUMNS:
+        arrays[name] = StringColumn(np.load(columns_dir / f"{name}.data.npy", mmap_mode='r'),
+                                    np.load(columns_dir / f"{name}.offsets.npy", mmap_mode='r'))
+    return arrays
+
+
+def build_columns(questions_dir=QUESTIONS_DIR, columns_dir=DEFAULT_COLUMNS_DIR, force=False):
+    """
+    建立（或复用）列式缓存
+
+    Args:
+        questions_dir: MedQA 原始题目目录
+        columns_dir: 缓存目录
+        force: 忽略已有缓存重新解析
+
+    Returns:
+        MedQAColumns
+    """
+    questions_dir = Path(questions_dir)
+    columns_dir = Path(columns_dir)
+    files = sorted(questions_dir.rglob("*.jsonl"))
+    sources = [_source_info(path.relative_to(questions_dir)) for path in files]
+    state = {'version': COLUMNS_VERSION, 'sources': sources, 'files': source_state(files)}
+
+    meta_file = columns_dir / META_FILE_NAME
+    if not force and meta_file.exists():
+        try:
+            with open(meta_file, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if all(meta.get(key) == value for key, value in state.items()):
+                return load_columns(questions_dir, columns_dir)
+        except (OSError, ValueError, KeyError):
+            pass
+
+    scanned = [_scan_source(path) for path in files]
+    merged = {name: [] for name in ('source', 'offset', 'line', 'fallback', 'option_keys', 'option_values') + STRING_FIELDS}
+    option_counts = []
+    for source, columns in enumerate(scanned):
+        merged['source'].extend([source] * len(columns['offset']))
+        for name in ('offset', 'line', 'fallback') + STRING_FIELDS:
+            merged[name].extend(columns[name])
+        for keys, values in zip(columns['option_keys'], columns['option_values']):
+            merged['option_keys'].extend(keys)
+            merged['option_values'].extend(values)
+            option_counts.append(len(keys))
+
+    option_offsets = np.zeros(len(option_counts) + 1, dtype=np.int64)
+    np.cumsum(option_counts, out=option_offsets[1:])
+    arrays = {
+        'source': np.array(merged['source'], dtype=np.uint16),
+        'offset': np.array(merged['offset'], dtype=np.int64),
+        'line': np.array(merged['line'], dtype=np.int64),
+        'fallback': np.array(merged['fallback'], dtype=bool),
+        'option_offsets': option_offsets,
+    }
+
+    # 只删除上一次写入的缓存文件（先删 meta，中途失败时缓存视为无效），目录中的其他文件保持不变
+    columns_dir.mkdir(parents=True, exist_ok=True)
+    for name in cache_file_names():
+        stale = columns_dir / name
+        if stale.is_file():
+            os.remove(stale)
+    if pa is not None:
+        arrays.update({name: merged[name] for name in STRING_COLUMNS})
+        _save_parquet(columns_dir, arrays)
+        storage = 'parquet'
+    else:
+        arrays.update({name: StringColumn.from_strings(merged[name]) for name in STRING_COLUMNS})
+        _save_numpy(columns_dir, arrays)
+        storage = 'numpy'
+
+    with open(meta_file, 'w', encoding='utf-8') as f:
+        json.dump(dict(state, storage=storage, rows=len(merged['offset'])), f, ensure_ascii=False, indent=2)
+    return load_columns(questions_dir, columns_dir)
+
+
+def load_columns(questions_dir=QUESTIONS_DIR, columns_dir=DEFAULT_COLUMNS_DIR):
+    """加载已建立的列式缓存（不检查是否过期，见 build_columns）"""
+    columns_dir = Path(columns_dir)
+    with open(columns_dir / META_FILE_NAME, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta['storage'] == 'parquet':
+        if pa is None:
+            raise RuntimeError("列式缓存为 Parquet 格式，需要安装 pyarrow（或使用 --force 重建）")
+        arrays = _load_parquet(columns_dir)
+    else:
+        arrays = _load_numpy(columns_dir)
+    return MedQAColumns(questions_dir, columns_dir, meta['sources'], arrays)
+
+
+# 每个进程只加载一次列式缓存
+_cached = {}
+
+
+def cached_columns(questions_dir, columns_dir):
+    """进程内缓存的 load_columns，供进程池工作函数使用"""
+    key = (str(questions_dir), str(columns_dir))
+    if key not in _cached:
+        _cached[key] = load_columns(questions_dir, columns_dir)
+    return _cached[key]
+
+
+def print_stats(columns, rows=None):
+    """按来源打印题目数、选项数分布、答案分布和题目长度（全部向量化统计）"""
+    rows = np.arange(len(columns)) if rows is None else rows
+    print("\n" + "=" * 72)
+    print("📊 MedQA 题目统计（列式缓存）")
+    print("=" * 72)
+    print(f"{'来源':<42} {'题目':>7} {'选项数':>8} {'题长p50':>8} {'fallback':>9}")
+
+    question_lengths = columns.question.byte_lengths()
+    for source_id, source in enumerate(columns.sources):
+        selected = rows[columns.source[rows] == source_id]
+        if not len(selected):
+            continue
+        counts = np.unique(columns.num_options[selected])
+        lengths = np.median(question_lengths[selected])
+        print(f"{source['file']:<42} {len(selected):>7} {'/'.join(map(str, counts)):>8} "
+              f"{lengths:>8.0f} {int(columns.fallback[selected].sum()):>9}")
+
+    answers = np.array([columns.answer_idx[row] for row in rows.tolist()])
+    letters, counts = np.unique(answers[answers != ''], return_counts=True)
+    print("-" * 72)
+    print(f"共 {len(rows)} 题；答案分布: " + ", ".join(
+        f"{letter} {count / max(1, counts.sum()):.1%}" for letter, count in zip(letters, counts)))
+    print("=" * 72)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='建立 MedQA 原始题目的列式缓存，并按地区/划分/选项数筛选统计')
+    parser.add_argument('--questions-dir', default=str(QUESTIONS_DIR), help='MedQA 原始题目目录')
+    parser.add_argument('--columns-dir', default=str(DEFAULT_COLUMNS_DIR), help='缓存目录')
+    parser.add_argument('--region', help='只统计该地区（Mainland/Taiwan/US）')
+    parser.add_argument('--split', choices=SPLITS, help='只统计该划分')
+    parser.add_argument('--num-options', type=int, help='只统计选项数为 N 的题目')
+    parser.add_argument('--show', type=int, help='打印筛选结果中的前 N 题')
+    parser.add_argument('--force', action='store_true', help='忽略已有缓存重新解析')
+    args = parser.parse_args()
+
+    columns = build_columns(args.questions_dir, args.columns_dir, force=args.force)
+    rows = columns.select(region=args.region, split=args.split, num_options=args.num_options)
+    print_stats(columns, rows)
+
+    for row in rows[:args.show or 0].tolist():
+        source = columns.sources[columns.source[row]]
+        print(f"\n--- {source['file']} 第 {int(columns.line[row]) + 1} 行 ---")
+        try:
+            print(json.dumps(columns.record(row), ensure_ascii=False, indent=2))
+        except ValueError as e:
+            print(f"⚠️  无法解析: {e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,498 @@
+"""
+本地 DashScope 替身服务（FastAPI）
+
+实现 FineTuneAutomation 和评测用到的接口，用于在没有线上服务的环境中做负载和延迟基准测试：
+- POST /api/v1/files                      上传文件（流式读取请求体）
+- GET  /api/v1/files/{file_id}            查询文件
+- POST /api/v1/fine-tunes                 创建微调任务
+- GET  /api/v1/fine-tunes/{job_id}        查询任务状态（PENDING → RUNNING → SUCCEEDED/FAILED）
+- POST /api/v1/services/aigc/text-generation/generation   文本生成（Generation.call，支持 SSE 流式输出）
+- POST /api/v1/services/embeddings/text-embedding/text-embedding   文本向量化
+- POST /compatible-mode/v1/files                  上传 Batch 请求文件（purpose=batch）
+- GET  /compatible-mode/v1/files/{file_id}/content  下载 Batch 结果文件
+- POST /compatible-mode/v1/batches                创建 Batch 任务
+- GET  /compatible-mode/v1/batches/{batch_id}     查询 Batch 任务（validating → in_progress → finalizing → completed）
+
+可配置延迟、错误率（503）、限流（超出每秒请求数时返回 429 和 Retry-After）以及任务各阶段的时长。
+Batch 任务复用微调任务的阶段时长，错误率同时作为 Batch 中单个请求的失败概率。
+
+用法：
+    python mock_dashscope.py --port 8000 --latency-ms 50 --error-rate 0.05 --rps 20
+    # 然后在 .env 中设置
+    DASHSCOPE_API_BASE=http://127.0.0.1:8000/api/v1
+    DASHSCOPE_HTTP_BASE_URL=http://127.0.0.1:8000/api/v1
+"""
+
+import re
+import json
+import time
+import uuid
+import random
+import socket
+import asyncio
+import hashlib
+import argparse
+import threading
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+
+GENERATION_PATH = "/api/v1/services/aigc/text-generation/generation"
+EMBEDDING_PATH = "/api/v1/services/embeddings/text-embedding/text-embedding"
+COMPATIBLE_PREFIX = "/compatible-mode/v1"
+
+# 题目中的选项行，如 "A. 80～180mmH2O"
+OPTION_PATTERN = re.compile(r"^([A-Z])[\.．、]", re.MULTILINE)
+
+
+class MockSettings:
+    """替身服务的行为配置"""
+
+    def __init__(self, latency_ms=20.0, jitter_ms=10.0, generation_latency_ms=200.0,
+                 error_rate=0.0, rps=None, pending_seconds=2.0, running_seconds=10.0,
+                 job_fail_rate=0.0, token_latency_ms=20.0):
+        """
+        Args:
+            latency_ms: 文件和任务接口的基础延迟（毫秒）
+            jitter_ms: 延迟抖动的平均值（毫秒，指数分布，产生长尾）
+            generation_latency_ms: 文本生成接口的基础延迟（毫秒）
+            error_rate: 返回 503 的概率
+            rps: 每秒允许的请求数，超出时返回 429（None 表示不限流）
+            pending_seconds: 任务处于 PENDING 的时长
+            running_seconds: 任务处于 RUNNING 的时长
+            job_fail_rate: 任务最终失败的概率
+            token_latency_ms: 流式输出时相邻两段文本的间隔（毫秒）；首段的等待为 generation_latency_ms
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.generation_latency_ms = generation_latency_ms
+        self.error_rate = error_rate
+        self.rps = rps
+        self.pending_seconds = pending_seconds
+        self.running_seconds = running_seconds
+        self.job_fail_rate = job_fail_rate
+        self.token_latency_ms = token_latency_ms
+
+
+class _TokenBucket:
+    """非阻塞令牌桶：拿不到令牌时返回需要等待的秒数"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+
+def _error(status, code, message, headers=None):
+    return JSONResponse(
+        {'code': code, 'message': message, 'request_id': uuid.uuid4().hex},
+        status_code=status,
+        headers=headers,
+    )
+
+
+def _job_state(job, now):
+    """根据创建后经过的时间计算任务状态"""
+    elapsed = now - job['created_at']
+    settings = job['settings']
+    if elapsed < settings.pending_seconds:
+        return {'status': 'PENDING'}
+
+    running = elapsed - settings.pending_seconds
+    if running < settings.running_seconds:
+        progress = int(running / settings.running_seconds * 100)
+        return {
+            'status': 'RUNNING',
+            'training_progress': progress,
+            'trained_tokens': progress * 1000,
+        }
+
+    if job['will_fail']:
+        return {'status': 'FAILED', 'error_message': 'mock: training diverged'}
+    return {
+        'status': 'SUCCEEDED',
+        'training_progress': 100,
+        'trained_tokens': 100 * 1000,
+        'fine_tuned_model': f"{job['model']}-ft-{job['job_id'][-8:]}",
+    }
+
+
+def _batch_state(batch, now):
+    """根据创建后经过的时间计算 Batch 任务状态和进度"""
+    elapsed = now - batch['created_at']
+    settings = batch['settings']
+    total = len(batch['requests'])
+    if elapsed < settings.pending_seconds:
+        return 'validating', 0
+    running = elapsed - settings.pending_seconds
+    if running < settings.running_seconds:
+        return 'in_progress', int(total * running / settings.running_seconds)
+    return 'completed', total
+
+
+def _multipart_file(body, content_type):
+    """从 multipart/form-data 请求体中取出文件部分的内容"""
+    boundary = content_type.split('boundary=', 1)[1].strip('"').encode()
+    for part in body.split(b'--' + boundary):
+        head, sep, content = part.partition(b'\r\n\r\n')
+        if sep and b'filename=' in head:
+            return content[:-2] if content.endswith(b'\r\n') else content
+    return None
+
+
+def mock_answer(messages):
+    """按题目内容确定性地选一个选项，回答格式与训练数据一致"""
+    question = next((m['content'] for m in reversed(messages) if m.get('role') == 'user'), '')
+    options = OPTION_PATTERN.findall(question) or ['A', 'B', 'C', 'D']
+    digest = hashlib.md5(question.encode('utf-8')).digest()
+    letter = options[digest[0] % len(options)]
+    return f"答案是 {letter}. （mock 回答）"
+
+
+def mock_embedding(text, dimension=1024):
+    """按字符二元组哈希到各维度的确定性向量：字面相近的文本向量也相近"""
+    vector = [0.0] * dimension
+    for i in range(max(1, len(text) - 1)):
+        digest = hashlib.md5(text[i:i + 2].encode('utf-8')).digest()
+        index = int.from_bytes(digest[:4], 'little') % dimension
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+
+def create_app(settings=None):
+    """创建替身服务应用，状态（已上传文件、任务、请求计数）保存在 app.state 上"""
+    settings = settings or MockSettings()
+    app = FastAPI(title="DashScope mock")
+    app.state.settings = settings
+    app.state.files = {}
+    app.state.jobs = {}
+    app.state.batch_files = {}
+    app.state.batches = {}
+    app.state.counters = {'requests': 0, 'throttled': 0, 'errors': 0}
+    bucket = _TokenBucket(settings.rps) if settings.rps else None
+
+    async def simulate(base_ms):
+        """模拟服务端延迟、限流和随机错误；需要返回错误时返回响应对象"""
+        app.state.counters['requests'] += 1
+        if bucket is not None:
+            wait = bucket.take()
+            if wait > 0:
+                app.state.counters['throttled'] += 1
+                return _error(429, 'Throttling.RateQuota', 'Requests rate limit exceeded',
+                              headers={'Retry-After': f"{wait:.3f}"})
+
+        delay_ms = base_ms + (random.expovariate(1 / settings.jitter_ms) if settings.jitter_ms else 0)
+        await asyncio.sleep(delay_ms / 1000)
+
+        if random.random() < settings.error_rate:
+            app.state.counters['errors'] += 1
+            return _error(503, 'ServiceUnavailable', 'mock: injected failure')
+        return None
+
+    @app.post("/api/v1/files")
+    async def upload_file(request: Request):
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+
+        failure = await simulate(settings.latency_ms)
+        if failure is not None:
+            return failure
+
+        file_id = f"file-{uuid.uuid4().hex[:16]}"
+        app.state.files[file_id] = {'file_id': file_id, 'size': size, 'created_at': time.time()}
+        return {'request_id': uuid.uuid4().hex,
+                'data': {'uploaded_files': [{'file_id': file_id}], 'failed_uploads': []}}
+
+    @app.get("/api/v1/files/{file_id}")
+    async def get_file(file_id: str):
+        failure = await simulate(settings.latency_ms)
+        if failure is not None:
+            return failure
+        if file_id not in app.state.files:
+            return _error(404, 'NotFound', f'file {file_id} not found')
+        return {'request_id': uuid.uuid4().hex, 'data': app.state.files[file_id]}
+
+    @app.post("/api/v1/fine-tunes")
+    async def create_job(request: Request):
+        body = await request.json()
+        failure = await simulate(settings.latency_ms)
+        if failure is not None:
+            return failure
+
+        missing = [f for f in body.get('training_file_ids', []) if f not in app.state.files]
+        if not body.get('training_file_ids') or missing:
+            return _error(400, 'InvalidParameter', f'unknown training files: {missing}')
+
+        job_id = f"ft-{uuid.uuid4().hex[:20]}"
+        app.state.jobs[job_id] = {
+            'job_id': job_id,
+            'model': body.get('model', 'mock-model'),
+            'hyper_parameters': body.get('hyper_parameters', {}),
+            'training_file_ids': body['training_file_ids'],
+            'validation_file_ids': body.get('validation_file_ids', []),
+            'created_at': time.time(),
+            'will_fail': random.random() < settings.job_fail_rate,
+            'settings': settings,
+        }
+        return {'request_id': uuid.uuid4().hex, 'output': {'job_id': job_id, 'status': 'PENDING'}}
+
+    @app.get("/api/v1/fine-tunes/{job_id}")
+    async def get_job(job_id: str):
+        failure = await simulate(settings.latency_ms)
+        if failure is not None:
+            return failure
+        job = app.state.jobs.get(job_id)
+        if job is None:
+            return _error(404, 'NotFound', f'job {job_id} not found')
+
+        output = {
+            'job_id': job_id,
+            'model': job['model'],
+            'hyper_parameters': job['hyper_parameters'],
+            'training_file_ids': job['training_file_ids'],
+            'validation_file_ids': job['validation_file_ids'],
+        }
+        output.update(_job_state(job, time.time()))
+        return {'request_id': uuid.uuid4().hex, 'output': output}
+
+    @app.post(GENERATION_PATH)
+    async def generation(request: Request):
+        body = await request.json()
+        failure = await simulate(settings.generation_latency_ms)
+        if failure is not None:
+            return failure
+
+        messages = body.get('input', {}).get('messages', [])
+        text = mock_answer(messages)
+        input_tokens = sum(len(m.get('content', '')) for m in messages)
+        if request.headers.get('X-DashScope-SSE') == 'enable':
+            incremental = body.get('parameters', {}).get('incremental_output', False)
+            return StreamingResponse(stream_text(text, input_tokens, incremental),
+                                     media_type='text/event-stream')
+        return {
+            'request_id': uuid.uuid4().hex,
+            'output': {'text': text, 'finish_reason': 'stop'},
+            'usage': {'input_tokens': input_tokens, 'output_tokens': len(text),
+                      'total_tokens': input_tokens + len(text)},
+        }
+
+    async def stream_text(text, input_tokens, incremental, piece_chars=2):
+        """按 DashScope 的 SSE 格式逐段输出回答，每段 piece_chars 个字符计为 1 个 token"""
+        request_id = uuid.uuid4().hex
+        pieces = [text[i:i + piece_chars] for i in range(0, len(text), piece_chars)]
+        for i, piece in enumerate(pieces, 1):
+            if i > 1:
+                await asyncio.sleep(random.expovariate(1 / settings.token_latency_ms) / 1000
+                                    if settings.token_latency_ms else 0)
+            data = {
+                'request_id': request_id,
+                'output': {'text': piece if incremental else ''.join(pieces[:i]),
+                           'finish_reason': 'stop' if i == len(pieces) else 'null'},
+                'usage': {'input_tokens': input_tokens, 'output_tokens': i, 'total_tokens': input_tokens + i},
+            }
+            yield f"id:{i}\nevent:result\n:HTTP_STATUS/200\ndata:{json.dumps(data, ensure_ascii=False)}\n\n"
+
+    @app.post(EMBEDDING_PATH)
+    async def embedding(request: Request):
+        body = await request.json()
+        failure = await simulate(settings.latency_ms)
+        if failure is not None:
+            return failure
+
+        texts = body.get('input', {}).get('texts', [])
+        if isinstance(texts, str):
+            texts = [texts]
+        if not texts or len(texts) > 25:
+            return _error(400, 'InvalidParameter', f'batch size {len(texts)} out of range')
+        dimension = body.get('parameters', {}).get('dimension', 1024)
+        return {
+            'request_id': uuid.uuid4().hex,
+            'output': {'embeddings': [{'text_index': i, 'embedding': mock_embedding(text, dimension)}
+                                      for i, text in enumerate(texts)]},
+            'usage': {'total_tokens': sum(len(text) for text in texts)},
+        }
+
+    def finish_batch(batch):
+        """任务完成时按请求逐条生成结果文件和错误文件"""
+        outputs, errors = [], []
+        for request in batch['requests']:
+            messages = request.get('body', {}).get('messages', [])
+            if random.random() < settings.error_rate:
+                errors.append({'id': uuid.uuid4().hex, 'custom_id': request['custom_id'],
+                               'response': {'status_code': 503, 'request_id': uuid.uuid4().hex,
+                                            'body': {'error': {'code': 'ServiceUnavailable',
+                                                               'message': 'mock: injected failure'}}},
+                               'error': None})
+                continue
+            text = mock_answer(messages)
+            outputs.append({'id': uuid.uuid4().hex, 'custom_id': request['custom_id'], 'error': None,
+                            'response': {'status_code': 200, 'request_id': uuid.uuid4().hex, 'body': {
+                                'object': 'chat.completion',
+                                'model': request.get('body', {}).get('model'),
+                                'choices': [{'index': 0, 'finish_reason': 'stop',
+                                             'message': {'role': 'assistant', 'content': text}}]}}})
+        for key, lines in (('output_file_id', outputs), ('error_file_id', errors)):
+            if lines:
+                file_id = f"file-batch_output-{uuid.uuid4().hex[:12]}"
+                app.state.batch_files[file_id] = b''.join(
+                    json.dumps(line, ensure_ascii=False).encode('utf-8') + b'\n' for line in lines)
+                batch[key] = file_id
+        batch['failed'] = len(errors)
+
+    @app.post(COMPATIBLE_PREFIX + "/files")
+    async def upload_batch_file(request: Request):
+        body = await request.body()
+        failure = await simulate(settings.latency_ms)
+        if failure is not None:
+            return failure
+
+        content = _multipart_file(body, request.headers.get('content-type', ''))
+        if content is None:
+            return _error(400, 'InvalidParameter', 'missing file part')
+        file_id = f"file-batch-{uuid.uuid4().hex[:16]}"
+        app.state.batch_files[file_id] = content
+        return {'id': file_id, 'object': 'file', 'bytes': len(content), 'purpose': 'batch',
+                'created_at': int(time.time())}
+
+    @app.get(COMPATIBLE_PREFIX + "/files/{file_id}/content")
+    async def batch_file_content(file_id: str):
+        failure = await simulate(settings.latency_ms)
+        if failure is not None:
+            return failure
+        if file_id not in app.state.batch_files:
+            return _error(404, 'NotFound', f'file {file_id} not found')
+        return Response(app.state.batch_files[file_id], media_type='application/jsonl')
+
+    @app.post(COMPATIBLE_PREFIX + "/batches")
+    async def create_batch(request: Request):
+        body = await request.json()
+        failure = await simulate(settings.latency_ms)
+        if failure is not None:
+            return failure
+
+        content = app.state.batch_files.get(body.get('input_file_id'))
+        if content is None:
+            return _error(400, 'InvalidParameter', f"unknown input file: {body.get('input_file_id')}")
+        batch_id = f"batch_{uuid.uuid4().hex[:20]}"
+        app.state.batches[batch_id] = {
+            'id': batch_id,
+            'input_file_id': body['input_file_id'],
+            'endpoint': body.get('endpoint'),
+            'metadata': body.get('metadata'),
+            'requests': [json.loads(line) for line in content.splitlines() if line.strip()],
+            'created_at': time.time(),
+            'settings': settings,
+        }
+        return batch_view(app.state.batches[batch_id])
+
+    @app.get(COMPATIBLE_PREFIX + "/batches/{batch_id}")
+    async def get_batch(batch_id: str):
+        failure = await simulate(settings.latency_ms)
+        if failure is not None:
+            return failure
+        batch = app.state.batches.get(batch_id)
+        if batch is None:
+            return _error(404, 'NotFound', f'batch {batch_id} not found')
+        return batch_view(batch)
+
+    def batch_view(batch):
+        status, completed = _batch_state(batch, time.time())
+        if status == 'completed' and 'failed' not in batch:
+            finish_batch(batch)
+        failed = batch.get('failed', 0) if status == 'completed' else 0
+        return {
+            'id': batch['id'],
+            'object': 'batch',
+            'endpoint': batch['endpoint'],
+            'input_file_id': batch['input_file_id'],
+            'completion_window': '24h',
+            'status': status,
+            'output_file_id': batch.get('output_file_id'),
+            'error_file_id': batch.get('error_file_id'),
+            'created_at': int(batch['created_at']),
+            'metadata': batch['metadata'],
+            'request_counts': {'total': len(batch['requests']), 'completed': completed - failed, 'failed': failed},
+        }
+
+    @app.get("/mock/stats")
+    async def stats():
+        return {**app.state.counters, 'files': len(app.state.files), 'jobs': len(app.state.jobs),
+                'batches': len(app.state.batches)}
+
+    return app
+
+
+def start_server(settings=None, host='127.0.0.1', port=0):
+    """
+    在后台线程中启动替身服务
+
+    Returns:
+        (server, api_base)：server 为 uvicorn.Server，应用对象为 server.config.app，
+        设置 server.should_exit = True 即可停止
+    """
+    import uvicorn
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+
+    server = uvicorn.Server(uvicorn.Config(create_app(settings), log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("替身服务启动失败")
+        time.sleep(0.01)
+
+    return server, f"http://{host}:{sock.getsockname()[1]}/api/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地 DashScope 替身服务')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=8000, help='监听端口（默认 8000）')
+    parser.add_argument('--latency-ms', type=float, default=20, help='文件/任务接口基础延迟（毫秒）')
+    parser.add_argument('--jitter-ms', type=float, default=10, help='延迟抖动平均值（毫秒）')
+    parser.add_argument('--generation-latency-ms', type=float, default=200, help='生成接口基础延迟（毫秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回 503 的概率')
+    parser.add_argument('--rps', type=float, default=None, help='每秒允许的请求数，超出返回 429')
+    parser.add_argument('--pending-seconds', type=float, default=2, help='任务 PENDING 时长（秒）')
+    parser.add_argument('--running-seconds', type=float, default=10, help='任务 RUNNING 时长（秒）')
+    parser.add_argument('--job-fail-rate', type=float, default=0.0, help='任务最终失败的概率')
+    parser.add_argument('--token-latency-ms', type=float, default=20, help='流式输出的 token 间隔（毫秒）')
+    args = parser.parse_args()
+
+    import uvicorn
+
+    settings = MockSettings(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        generation_latency_ms=args.generation_latency_ms,
+        error_rate=args.error_rate,
+        rps=args.rps,
+        pending_seconds=args.pending_seconds,
+        running_seconds=args.running_seconds,
+        job_fail_rate=args.job_fail_rate,
+        token_latency_ms=args.token_latency_ms,
+    )
+    print(f"🧪 DashScope 替身服务: http://{args.host}:{args.port}/api/v1")
+    uvicorn.run(create_app(settings), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+"""
+流水线各阶段的指标与性能分析
+
+转换（convert_to_bailian_format / batch_convert）和上传、创建任务、监控、测试
+（FineTuneAutomation）共用一套计时和计数：
+
+    metrics = PipelineMetrics.from_env("batch_convert", args.metrics)
+    with metrics.phase("convert", dataset="mainland_4opt_train.jsonl") as phase:
+        converted, skipped = convert_to_bailian_format(...)
+        phase.add(rows=converted, skipped=skipped, bytes=output_size)
+    metrics.close()
+
+每个阶段结束时记录耗时、计数、行/秒、MB/秒和进程内存峰值（RSS）；HTTP 客户端的
+请求耗时、错误和重试次数可用 record_http 汇入。输出格式二选一：
+- JSON Lines（默认）：每个阶段结束时追加一行，close() 时再追加一行汇总
+- Prometheus textfile（文件名以 .prom 结尾）：close() 时整体写出，同一阶段和标签的
+  多次记录合并为一条序列，可交给 node_exporter 的 textfile collector 采集
+
+未指定输出文件（命令行 --metrics 或环境变量 METRICS_FILE）时只在内存中统计，
+不写任何文件。
+
+profile_section 用 cProfile 和 tracemalloc 分析一段代码（如转换循环），输出
+<前缀>.prof（可用 snakeviz 等工具查看）和 <前缀>.profile.txt（耗时最多的函数、
+分配内存最多的代码行）。
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from pathlib import Path
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Windows 没有 resource 模块，不统计内存峰值
+    resource = None
+
+
+METRIC_PREFIX = "medqa"
+
+DEFAULT_PROFILE_DIR = Path(__file__).parent.parent / "datasets" / "MedQA_BaiLian" / ".profile"
+
+# profile.txt 中列出的函数和代码行数
+PROFILE_TOP = 25
+
+
+def peak_rss_bytes(children=False):
+    """当前进程（children=True 时为已结束的子进程中最大的）内存峰值，无法获取时返回 None"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # Linux 上单位为 KB，macOS 上为字节
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+
+class Phase:
+    """一个进行中的阶段，add() 累加计数"""
+
+    __slots__ = ('name', 'labels', 'counts')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.counts = {}
+
+    def add(self, **counts):
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+
+
+class PipelineMetrics:
+    """阶段计时、计数器和观测值，线程安全"""
+
+    def __init__(self, component, output=None):
+        """
+        Args:
+            component: 组件名，如 batch_convert、fine_tune
+            output: 输出文件（.prom 结尾为 Prometheus textfile，否则为 JSON Lines），None 表示不输出
+        """
+        self.component = component
+        self.output = Path(output) if output else None
+        self.prometheus = self.output is not None and self.output.suffix == '.prom'
+        self.phases = []
+        self.counters = {}
+        self.gauges = {}
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+        if self.output is not None:
+            self.output.parent.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, component, output=None):
+        """命令行给出的输出文件优先，否则读取 METRICS_FILE"""
+        return cls(component, output or os.getenv("METRICS_FILE") or None)
+
+    @contextmanager
+    def phase(self, name, **labels):
+        """
+        记录一个阶段：耗时、计数、速率和内存峰值
+
+        阶段内抛出的异常照常传出，记录中 status 为 error。
+        """
+        phase = Phase(name, labels)
+        start = time.perf_counter()
+        status, error = 'ok', None
+        try:
+            yield phase
+        except BaseException as e:
+            status, error = 'error', f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            event = {
+                'ts': round(time.time(), 3),
+                'component': self.component,
+                'phase': name,
+                'labels': labels,
+                'status': status,
+                'seconds': round(seconds, 6),
+                **phase.counts,
+            }
+            if seconds > 0:
+                if 'rows' in phase.counts:
+                    event['rows_per_s'] = round(phase.counts['rows'] / seconds, 2)
+                if 'bytes' in phase.counts:
+                    event['mb_per_s'] = round(phase.counts['bytes'] / seconds / (1024 * 1024), 3)
+            rss = peak_rss_bytes()
+            if rss is not None:
+                event['peak_rss_mb'] = round(rss / (1024 * 1024), 1)
+                children = peak_rss_bytes(children=True)
+                if children:
+                    event['children_peak_rss_mb'] = round(children / (1024 * 1024), 1)
+            if error:
+                event['error'] = error
+            self._emit(event)
+
+    def count(self, name, value=1, **labels):
+        """累加计数器"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        """设置观测值（如平均延迟），同名同标签的旧值被覆盖"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.gauges[key] = value
+
+    def record_http(self, client):
+        """
+        汇入 DashScopeHTTPClient 记录的请求次数、错误、重试次数和耗时
+
+        按接口累加到计数器，运行结束时调用一次。
+        """
+        for endpoint, item in client.timing_summary().items():
+            self.count('http_requests', item['count'], endpoint=endpoint)
+            self.count('http_errors', item['errors'], endpoint=endpoint)
+            self.count('http_retries', item['retries'], endpoint=endpoint)
+            self.gauge('http_request_avg_ms', round(item['avg_ms'], 3), endpoint=endpoint)
+            self.gauge('http_request_max_ms', round(item['max_ms'], 3), endpoint=endpoint)
+
+    def _emit(self, event):
+        with self._lock:
+            self.phases.append(event)
+            if self.output is not None and not self.prometheus:
+                with open(self.output, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+    def summary(self):
+        """本次运行的汇总：总耗时、内存峰值、计数器和观测值"""
+        with self._lock:
+            rss = peak_rss_bytes()
+            return {
+                'ts': round(time.time(), 3),
+                'component': self.component,
+                'phase': '_summary',
+                'seconds': round(time.time() - self.start_time, 3),
+                'peak_rss_mb': round(rss / (1024 * 1024), 1) if rss is not None else None,
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in self.counters.items()],
+                'gauges': [{'name': name, 'labels': dict(labels), 'value': value}
+                           for (name, labels), value in self.gauges.items()],
+            }
+
+    def _merged_phases(self):
+        """
+        按阶段名和标签合并多次记录（如多次上传）：耗时和计数相加，内存峰值取最大，
+        任何一次出错即记为失败
+
+        Returns:
+            {(阶段名, 标签元组): {'runs', 'seconds', 'ok', 'counts'}}，按首次出现的顺序
+        """
+        merged = {}
+        for event in self.phases:
+            if event['phase'] == '_summary':
+                continue
+            key = (event['phase'], tuple(event['labels'].items()))
+            total = merged.setdefault(key, {'runs': 0, 'seconds': 0.0, 'ok': True, 'counts': {}})
+            total['runs'] += 1
+            total['seconds'] += event['seconds']
+            total['ok'] = total['ok'] and event['status'] == 'ok'
+            counts = total['counts']
+            for field, value in event.items():
+                if field in _EVENT_FIELDS or field in _RATE_FIELDS or not isinstance(value, (int, float)):
+                    continue
+                if field in _PEAK_FIELDS:
+                    counts[field] = max(counts.get(field, value), value)
+                else:
+                    counts[field] = counts.get(field, 0) + value
+        return merged
+
+    def prometheus_text(self):
+        """
+        Prometheus 文本格式
+
+        同一阶段和标签的多次记录合并为一条序列，速率按合计的计数和耗时重新计算；
+        同名指标的各条序列写在一起并带 TYPE 行。node_exporter 遇到重复的序列会
+        拒绝整个文件。
+        """
+        families = {}
+
+        def sample(metric, labels, value, kind='gauge'):
+            family = families.setdefault(metric, (kind, {}))
+            family[1][tuple(labels.items())] = value
+
+        base = {'component': self.component}
+        with self._lock:
+            for (name, labels), total in self._merged_phases().items():
+                labels = dict(base, phase=name, **dict(labels))
+                seconds = round(total['seconds'], 6)
+                sample('phase_duration_seconds', labels, seconds)
+                sample('phase_success', labels, 1 if total['ok'] else 0)
+                sample('phase_runs', labels, total['runs'])
+                counts = total['counts']
+                for key, value in counts.items():
+                    sample(f'phase_{key}', labels, value)
+                if seconds > 0:
+                    if 'rows' in counts:
+                        sample('phase_rows_per_s', labels, round(counts['rows'] / seconds, 2))
+                    if 'bytes' in counts:
+                        sample('phase_mb_per_s', labels, round(counts['bytes'] / seconds / (1024 * 1024), 3))
+            for (name, labels), value in self.counters.items():
+                sample(f'{name}_total', dict(base, **dict(labels)), value, 'counter')
+            for (name, labels), value in self.gauges.items():
+                sample(name, dict(base, **dict(labels)), value)
+        rss = peak_rss_bytes()
+        if rss is not None:
+            sample('peak_rss_bytes', base, rss)
+        sample('last_run_timestamp_seconds', base, round(time.time(), 3))
+
+        lines = []
+        for metric, (kind, series) in families.items():
+            lines.append(f"# TYPE {METRIC_PREFIX}_{metric} {kind}")
+            for labels, value in series.items():
+                label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+                lines.append(f"{METRIC_PREFIX}_{metric}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        """写出汇总（JSON Lines 追加一行；Prometheus 原子地整体替换文件）"""
+        if self.output is None:
+            return
+        if self.prometheus:
+            temp_file = self.output.with_name(self.output.name + ".tmp")
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                f.write(self.prometheus_text())
+            os.replace(temp_file, self.output)
+        else:
+            self._emit(self.summary())
+        print(f"📈 指标已写入: {self.output}")
+
+
+# 阶段记录中不作为 Prometheus 样本输出的字段
+_EVENT_FIELDS = {'ts', 'seconds', 'labels', 'status', 'error', 'component', 'phase'}
+
+# 合并多次记录时按合计重新计算的速率，以及取最大值的内存峰值
+_RATE_FIELDS = {'rows_per_s', 'mb_per_s'}
+_PEAK_FIELDS = {'peak_rss_mb', 'children_peak_rss_mb'}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def default_profile_prefix(component):
+    """默认的性能分析输出前缀：datasets/MedQA_BaiLian/.profile/<组件>_<时间>"""
+    return DEFAULT_PROFILE_DIR / f"{component}_{time.strftime('%Y%m%d_%H%M%S')}"
+
+
+@contextmanager
+def profile_section(prefix, enabled=True, quiet=False):
+    """
+    用 cProfile 和 tracemalloc 分析一段代码
+
+    输出 <prefix>.prof 和 <prefix>.profile.txt；quiet=False 时打印最耗时的几个函数
+    和 tracemalloc 统计的内存峰值。enabled=False 时什么也不做。
+    """
+    if not enabled:
+        yield
+        return
+
+    prefix = Path(prefix)
+    prefix.parent.mkdir(parents=True, exist_ok=True)
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        profiler.dump_stats(str(prefix) + ".prof")
+        with open(str(prefix) + ".profile.txt", 'w', encoding='utf-8') as f:
+            f.write(_profile_report(pstats.Stats(profiler), snapshot, traced_peak))
+        if not quiet:
+            print_profile(pstats.Stats(profiler), traced_peak, prefix)
+
+
+def _profile_report(stats, snapshot, traced_peak):
+    buffer = io.StringIO()
+    stats.stream = buffer
+    stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+    buffer.write(f"\ntracemalloc 峰值: {traced_peak / (1024 * 1024):.1f} MB\n")
+    buffer.write(f"分配内存最多的 {PROFILE_TOP} 行:\n")
+    for stat in snapshot.statistics('lineno')[:PROFILE_TOP]:
+        buffer.write(f"  {stat}\n")
+    return buffer.getvalue()
+
+
+def merge_profiles(prof_files, prefix):
+    """合并多个进程的 .prof 文件，写出 <prefix>.prof 并打印汇总"""
+    prof_files = [str(p) for p in prof_files if Path(p).exists()]
+    if not prof_files:
+        return
+    stats = pstats.Stats(*prof_files)
+    stats.dump_stats(str(prefix) + ".prof")
+    print_profile(stats, None, prefix)
+
+
+def print_profile(stats, traced_peak, prefix, top=8):
+    """打印累计耗时最多的几个函数"""
+    print(f"\n🔬 性能分析: {prefix}.prof")
+    stats.sort_stats('cumulative')
+    width = 60
+    for func in stats.fcn_list[:top]:
+        _, _, total_time, cumulative, _ = stats.stats[func]
+        filename, line, name = func
+        location = f"{Path(filename).name}:{line}({name})" if line else name
+        print(f"   {cumulative:8.3f}s 累计  {total_time:8.3f}s 自身  {location[:width]}")
+    if traced_peak is not None:
+        print(f"   tracemalloc 峰值: {traced_peak / (1024 * 1024):.1f} MB")
@@ -0,0 +1,209 @@
+"""
+模型回答的持久化缓存
+
+把 Generation.call 的回答保存在单个 SQLite 文件中，键为
+模型 ID + 规范化后的 messages + 生成参数 的 SHA-256。
+对同一模型重复运行 test_model、example_usage.py 或评测时，
+已经问过的问题直接返回缓存的回答，只有新的输入才会调用 API。
+
+缓存是可选的：设置环境变量 RESPONSE_CACHE（缓存文件路径，或 1 表示默认路径）
+或在命令行使用 --cache 开启。超过 RESPONSE_CACHE_MAX_ENTRIES 条时淘汰最久未使用的记录，
+超过 RESPONSE_CACHE_MAX_AGE_DAYS 天的记录视为过期。
+
+注意：temperature 等采样参数大于 0 时，命中缓存意味着复用上一次的采样结果。
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+
+
+DEFAULT_CACHE_FILE = Path(__file__).parent.parent / "datasets" / "MedQA_BaiLian" / ".response_cache.sqlite"
+
+DEFAULT_MAX_ENTRIES = 100000
+
+# 每写入多少条记录检查一次容量
+EVICT_EVERY = 500
+
+# 不参与缓存键的调用参数
+IGNORED_PARAMS = ("api_key", "stream", "incremental_output")
+
+
+# 记录每个线程最近一次经过缓存的调用是否命中，评测时命中的回答不计入延迟统计
+_local = threading.local()
+
+
+def served_from_cache():
+    """当前线程最近一次经过缓存的调用是否直接返回了缓存的回答"""
+    return getattr(_local, 'hit', False)
+
+
+def normalize_messages(messages):
+    """只保留 role 和 content，去掉其他可能影响键但不影响回答的字段"""
+    return [{'role': m['role'], 'content': m['content']} for m in messages]
+
+
+def cache_key(model, messages, params=None):
+    """计算缓存键：模型 ID + 规范化 messages + 生成参数"""
+    params = {k: v for k, v in (params or {}).items() if k not in IGNORED_PARAMS and v is not None}
+    payload = json.dumps(
+        {'model': model, 'messages': normalize_messages(messages), 'params': params},
+        ensure_ascii=False, sort_keys=True, separators=(',', ':'),
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """基于 SQLite 的回答缓存，可在多个线程间共享"""
+
+    def __init__(self, cache_file=DEFAULT_CACHE_FILE, max_entries=DEFAULT_MAX_ENTRIES, max_age_days=None):
+        """
+        Args:
+            cache_file: SQLite 文件路径
+            max_entries: 最多保留的记录数（None 表示不限），超出时淘汰最久未使用的记录
+            max_age_days: 记录的最长保留天数（None 表示永不过期）
+        """
+        self.path = Path(cache_file)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 86400 if max_age_days else None
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " response TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL,"
+            " hit_count INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed_at)")
+        self._conn.commit()
+        self.evict()
+
+    @classmethod
+    def from_env(cls, enabled=False):
+        """
+        按环境变量打开缓存
+
+        Args:
+            enabled: 命令行已显式开启缓存时为 True
+
+        Returns:
+            ResponseCache，未开启时返回 None
+        """
+        setting = os.getenv("RESPONSE_CACHE", "").strip()
+        if setting.lower() in ("0", "false", "no"):
+            setting = ""
+        if not (enabled or setting):
+            return None
+        cache_file = DEFAULT_CACHE_FILE if setting.lower() in ("", "1", "true", "yes") else setting
+        max_entries = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", str(DEFAULT_MAX_ENTRIES))) or None
+        max_age_days = float(os.getenv("RESPONSE_CACHE_MAX_AGE_DAYS", "0")) or None
+        return cls(cache_file, max_entries=max_entries, max_age_days=max_age_days)
+
+    def get(self, model, messages, params=None):
+        """查询缓存，未命中或已过期时返回 None"""
+        key = cache_key(model, messages, params)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.max_age and now - row[1] > self.max_age):
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE responses SET accessed_at = ?, hit_count = hit_count + 1 WHERE key = ?",
+                (now, key),
+            )
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, model, messages, response, params=None):
+        """保存一条回答；调用失败或回答为空（None 或空字符串）时不缓存"""
+        if not response:
+            return
+        key = cache_key(model, messages, params)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created_at, accessed_at, hit_count)"
+                " VALUES (?, ?, ?, ?, ?, 0)",
+                (key, model, response, now, now),
+            )
+            self._conn.commit()
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self._evict_locked()
+
+    def evict(self):
+        """删除过期记录，并把记录数压到 max_entries 以内（先淘汰最久未使用的）"""
+        with self._lock:
+            return self._evict_locked()
+
+    def _evict_locked(self):
+        removed = 0
+        if self.max_age:
+            removed += self._conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age,)
+            ).rowcount
+        if self.max_entries:
+            removed += self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+        self._conn.commit()
+        return removed
+
+    def wrap(self, call, model, params=None):
+        """
+        给 call(messages) -> 回答文本 加上缓存
+
+        只缓存成功的回答，调用抛出的异常原样传出。是否命中可以在同一线程中
+        用 served_from_cache() 查询。
+        """
+        def cached_call(messages):
+            response = self.get(model, messages, params)
+            _local.hit = response is not None
+            if response is None:
+                response = call(messages)
+                self.put(model, messages, response, params)
+            return response
+
+        return cached_call
+
+    def stats(self):
+        """本次运行的命中统计和缓存中的总记录数"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else None,
+            'entries': entries,
+        }
+
+    def print_stats(self):
+        """打印命中统计"""
+        stats = self.stats()
+        hit_rate = f"{stats['hit_rate'] * 100:.1f}%" if stats['hit_rate'] is not None else "-"
+        print(f"🗄️  回答缓存: 命中 {stats['hits']}，未命中 {stats['misses']}（命中率 {hit_rate}），"
+              f"共 {stats['entries']} 条记录 ({self.path})")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,382 @@
+"""
+微调流程的本地状态库
+
+把上传得到的 File ID、创建的微调任务及其超参数、每次查询到的任务状态和训练出的
+fine_tuned_model 保存在一个 SQLite 文件中（WAL 模式）。每次上传、每个任务都是
+单独的一行，同时运行的多个脚本各自追加记录，不会像改写 .env 那样互相覆盖。
+
+- uploads：每次上传的一组文件（训练集、验证集，分片数据集按分片顺序各占一行）
+- hyper_params：超参数组合，按内容去重
+- jobs：微调任务，包括最近一次查询到的状态和完整响应
+- job_snapshots：任务状态的变化历史（状态不变时只更新 jobs 中的最近一次查询）
+
+--status 先查这里：任务已结束，或最近一次查询在 STATUS_CACHE_TTL 秒（默认 60）以内时
+直接返回，不请求 API。
+
+状态库默认位于 datasets/MedQA_BaiLian/.pipeline_state.sqlite，可用环境变量
+PIPELINE_STATE_FILE 指定其他位置。不同 API 地址（如本地替身服务）和不同账号
+（API Key 的摘要）的记录互不影响：File ID 和任务只对创建它们的账号可见，任务按
+（任务 ID, API 地址, 账号）区分，重启后的替身服务再次返回同一个任务 ID 也不会覆盖之前的记录。
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+
+from upload_registry import account_id
+
+
+DEFAULT_STATE_FILE = Path(__file__).parent.parent / "datasets" / "MedQA_BaiLian" / ".pipeline_state.sqlite"
+
+DEFAULT_STATUS_TTL = 60
+
+# 任务结束状态，进入后不再变化
+TERMINAL_STATUSES = ("SUCCEEDED", "FAILED", "CANCELLED")
+
+# 任务按 (任务 ID, API 地址, 账号) 区分；早期版本只以任务 ID 为主键，见 _migrate_job_key
+JOBS_TABLE = """CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT NOT NULL,
+    api_base TEXT NOT NULL,
+    account TEXT,
+    base_model TEXT,
+    training_type TEXT,
+    hyper_params_id INTEGER REFERENCES hyper_params(id),
+    training_file_ids TEXT,
+    validation_file_ids TEXT,
+    status TEXT,
+    fine_tuned_model TEXT,
+    last_payload TEXT,
+    fetched_at REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (job_id, api_base, account)
+)"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    set_id TEXT NOT NULL,
+    api_base TEXT NOT NULL,
+    account TEXT,
+    role TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    file_id TEXT NOT NULL,
+    source TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_uploads_api_created ON uploads(api_base, created_at);
+CREATE INDEX IF NOT EXISTS idx_uploads_file_id ON uploads(file_id);
+
+CREATE TABLE IF NOT EXISTS hyper_params (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    digest TEXT NOT NULL UNIQUE,
+    params TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+
+{jobs_table};
+CREATE INDEX IF NOT EXISTS idx_jobs_api_created ON jobs(api_base, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);
+CREATE INDEX IF NOT EXISTS idx_jobs_model ON jobs(fine_tuned_model);
+CREATE INDEX IF NOT EXISTS idx_jobs_params ON jobs(hyper_params_id);
+
+CREATE TABLE IF NOT EXISTS job_snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    api_base TEXT,
+    account TEXT,
+    status TEXT,
+    payload TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_snapshots_job ON job_snapshots(job_id, fetched_at);
+""".format(jobs_table=JOBS_TABLE)
+
+
+# 早期版本的状态库没有 account 列（状态快照也没有 api_base 列），打开时补上
+# （旧记录的 account 为 NULL，不属于任何账号）
+MIGRATIONS = (
+    ("uploads", "account", "ALTER TABLE uploads ADD COLUMN account TEXT"),
+    ("jobs", "account", "ALTER TABLE jobs ADD COLUMN account TEXT"),
+    ("job_snapshots", "api_base", "ALTER TABLE job_snapshots ADD COLUMN api_base TEXT"),
+    ("job_snapshots", "account", "ALTER TABLE job_snapshots ADD COLUMN account TEXT"),
+)
+
+
+def _migrate_job_key(conn):
+    """
+    早期版本的 jobs 表只以 job_id 为主键，重建为以 (job_id, api_base, account) 为主键，
+    保留原有记录（多个进程同时打开时只有一个进行重建）
+    """
+    def single_key():
+        return [row[1] for row in conn.execute("PRAGMA table_info(jobs)") if row[5]] == ["job_id"]
+
+    if not single_key():
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if single_key():
+            columns = ", ".join(row[1] for row in conn.execute("PRAGMA table_info(jobs)"))
+            conn.execute("ALTER TABLE jobs RENAME TO jobs_single_key")
+            # 旧表的索引随旧表一起删除，之后按 SCHEMA 重新创建
+            for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'"
+                                        " AND tbl_name = 'jobs_single_key' AND sql IS NOT NULL").fetchall():
+                conn.execute(f"DROP INDEX {name}")
+            conn.execute(JOBS_TABLE)
+            conn.execute(f"INSERT INTO jobs ({columns}) SELECT {columns} FROM jobs_single_key")
+            conn.execute("DROP TABLE jobs_single_key")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def _file_id_list(file_ids):
+    """File ID、File ID 列表或 None 统一为列表"""
+    if not file_ids:
+        return []
+    return list(file_ids) if isinstance(file_ids, (list, tuple)) else [file_ids]
+
+
+def _params_digest(hyper_params):
+    """超参数的规范化 JSON 及其 SHA-256"""
+    params = json.dumps(hyper_params, ensure_ascii=False, sort_keys=True)
+    return params, hashlib.sha256(params.encode('utf-8')).hexdigest()
+
+
+def _file_id_value(file_ids):
+    """与 split_file_ids 一致：只有一个 File ID 时返回字符串，多个时返回列表，没有时返回 None"""
+    if not file_ids:
+        return None
+    return file_ids[0] if len(file_ids) == 1 else file_ids
+
+
+class StateStore:
+    """基于 SQLite（WAL）的上传、任务和模型记录，可在多个线程和进程间共享"""
+
+    def __init__(self, state_file=DEFAULT_STATE_FILE, api_base="", api_key=None):
+        """
+        Args:
+            state_file: SQLite 文件路径
+            api_base: 当前使用的 API 地址，查询最近的上传和任务时只看该地址的记录
+            api_key: 当前使用的 API Key，查询时只看该账号的记录（只保存摘要）
+        """
+        self.path = Path(state_file)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.api_base = api_base
+        self.account = account_id(api_key)
+        self._lock = threading.Lock()
+
+        # 另一个进程正在写入时最多等待 30 秒
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        for table, column, statement in MIGRATIONS:
+            columns = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                self._conn.execute(statement)
+        self._conn.commit()
+        _migrate_job_key(self._conn)
+        self._conn.executescript(SCHEMA)
+
+    @classmethod
+    def from_env(cls, api_base="", api_key=None):
+        """按环境变量 PIPELINE_STATE_FILE 打开状态库（未设置时使用默认路径）"""
+        return cls(os.getenv("PIPELINE_STATE_FILE") or DEFAULT_STATE_FILE, api_base, api_key)
+
+    def record_upload_set(self, train_file_ids, validation_file_ids=None, train_source=None,
+                          validation_source=None):
+        """
+        记录一次上传得到的训练集和验证集 File ID
+
+        Returns:
+            本组上传的 set_id
+        """
+        now = time.time()
+        set_id = uuid.uuid4().hex[:16]
+        rows = [
+            (set_id, self.api_base, self.account, role, position, file_id, source, now)
+            for role, file_ids, source in (("train", train_file_ids, train_source),
+                                           ("validation", validation_file_ids, validation_source))
+            for position, file_id in enumerate(_file_id_list(file_ids))
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO uploads (set_id, api_base, account, role, position, file_id, source, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return set_id
+
+    def latest_upload_set(self):
+        """
+        最近一次上传的训练集和验证集
+
+        Returns:
+            (train_file_ids, validation_file_ids, created_at)，单个 File ID 为字符串，
+            分片数据集为列表；没有记录时返回 None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT set_id, created_at FROM uploads WHERE api_base = ? AND account = ? AND role = 'train'"
+                " ORDER BY created_at DESC, id DESC LIMIT 1", (self.api_base, self.account)).fetchone()
+            if row is None:
+                return None
+            set_id, created_at = row
+            files = self._conn.execute(
+                "SELECT role, file_id FROM uploads WHERE set_id = ? ORDER BY role, position", (set_id,)).fetchall()
+        train = [file_id for role, file_id in files if role == "train"]
+        validation = [file_id for role, file_id in files if role == "validation"]
+        return _file_id_value(train), _file_id_value(validation), created_at
+
+    def _hyper_params_id(self, hyper_params):
+        params, digest = _params_digest(hyper_params)
+        self._conn.execute("INSERT OR IGNORE INTO hyper_params (digest, params, created_at) VALUES (?, ?, ?)",
+                           (digest, params, time.time()))
+        return self._conn.execute("SELECT id FROM hyper_params WHERE digest = ?", (digest,)).fetchone()[0]
+
+    def record_job(self, job_id, base_model, training_type, hyper_params, train_file_ids,
+                   validation_file_ids=None, status=None):
+        """记录新创建的微调任务"""
+        now = time.time()
+        with self._lock, self._conn:
+            params_id = self._hyper_params_id(hyper_params)
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, api_base, account, base_model, training_type, hyper_params_id,"
+                " training_file_ids, validation_file_ids, status, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(job_id, api_base, account) DO UPDATE SET base_model = excluded.base_model,"
+                " training_type = excluded.training_type, hyper_params_id = excluded.hyper_params_id,"
+                " training_file_ids = excluded.training_file_ids,"
+                " validation_file_ids = excluded.validation_file_ids, updated_at = excluded.updated_at",
+                (job_id, self.api_base, self.account, base_model, training_type, params_id,
+                 json.dumps(_file_id_list(train_file_ids)), json.dumps(_file_id_list(validation_file_ids)),
+                 status, now, now))
+
+    def find_job(self, base_model, training_type, hyper_params, train_file_ids, validation_file_ids=None):
+        """
+        基础模型、训练方法、超参数和训练文件都相同的最近一个任务（失败或取消的除外），
+        超参数搜索重新运行时据此跳过已提交的组合
+
+        Returns:
+            {job_id, status, fine_tuned_model}，没有时返回 None
+        """
+        _, digest = _params_digest(hyper_params)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT j.job_id, j.status, j.fine_tuned_model FROM jobs j"
+                " JOIN hyper_params h ON h.id = j.hyper_params_id"
+                " WHERE h.digest = ? AND j.api_base = ? AND j.account = ? AND j.base_model = ?"
+                " AND j.training_type = ?"
+                " AND j.training_file_ids = ? AND j.validation_file_ids = ?"
+                " AND (j.status IS NULL OR j.status NOT IN ('FAILED', 'CANCELLED'))"
+                " ORDER BY j.created_at DESC LIMIT 1",
+                (digest, self.api_base, self.account, base_model, training_type,
+                 json.dumps(_file_id_list(train_file_ids)), json.dumps(_file_id_list(validation_file_ids)))).fetchone()
+        if row is None:
+            return None
+        job_id, status, model = row
+        return {'job_id': job_id, 'status': status, 'fine_tuned_model': model}
+
+    def record_status(self, job_id, status_data):
+        """
+        记录一次查询到的任务状态
+
+        总是更新任务的最近一次查询；状态与上一次不同时追加一条历史快照。
+        不是本机创建的任务也会被记录（记在当前 API 地址和账号下）。
+        """
+        now = time.time()
+        status = status_data.get('status')
+        payload = json.dumps(status_data, ensure_ascii=False)
+        key = (job_id, self.api_base, self.account)
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT status FROM jobs WHERE job_id = ? AND api_base = ? AND account = ?", key).fetchone()
+            if row is None:
+                self._conn.execute(
+                    "INSERT INTO jobs (job_id, api_base, account, base_model, created_at, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?)", key + (status_data.get('model'), now, now))
+            if row is None or row[0] != status:
+                self._conn.execute(
+                    "INSERT INTO job_snapshots (job_id, api_base, account, status, payload, fetched_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?)", key + (status, payload, now))
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, fine_tuned_model = COALESCE(?, fine_tuned_model),"
+                " last_payload = ?, fetched_at = ?, updated_at = ? WHERE job_id = ? AND api_base = ? AND account = ?",
+                (status, status_data.get('fine_tuned_model') or None, payload, now, now) + key)
+
+    def cached_status(self, job_id, max_age=DEFAULT_STATUS_TTL):
+        """
+        最近一次查询到的任务状态
+
+        任务已结束（状态不会再变）或查询时间在 max_age 秒以内时返回 (状态数据, 距今秒数)，
+        否则返回 None。
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, last_payload, fetched_at FROM jobs WHERE job_id = ? AND api_base = ? AND account = ?",
+                (job_id, self.api_base, self.account)).fetchone()
+        if row is None or row[1] is None:
+            return None
+        status, payload, fetched_at = row
+        age = time.time() - fetched_at
+        if status in TERMINAL_STATUSES or age <= max_age:
+            return json.loads(payload), age
+        return None
+
+    def latest_job_id(self):
+        """最近创建的任务 ID，没有时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id FROM jobs WHERE api_base = ? AND account = ? ORDER BY created_at DESC LIMIT 1",
+                (self.api_base, self.account)).fetchone()
+        return row[0] if row else None
+
+    def latest_model(self):
+        """最近一个训练成功的任务得到的 fine_tuned_model，没有时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fine_tuned_model FROM jobs WHERE api_base = ? AND account = ?"
+                " AND fine_tuned_model IS NOT NULL ORDER BY updated_at DESC LIMIT 1",
+                (self.api_base, self.account)).fetchone()
+        return row[0] if row else None
+
+    def jobs(self, limit=20, status=None):
+        """
+        最近的任务列表（新的在前）
+
+        Returns:
+            [{job_id, status, base_model, fine_tuned_model, hyper_params, created_at, fetched_at}]
+        """
+        query = ("SELECT j.job_id, j.status, j.base_model, j.fine_tuned_model, h.params, j.created_at,"
+                 " j.fetched_at FROM jobs j LEFT JOIN hyper_params h ON h.id = j.hyper_params_id"
+                 " WHERE j.api_base = ? AND j.account = ?")
+        params = [self.api_base, self.account]
+        if status:
+            query += " AND j.status = ?"
+            params.append(status)
+        query += " ORDER BY j.created_at DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [
+            {'job_id': job_id, 'status': status, 'base_model': base_model, 'fine_tuned_model': model,
+             'hyper_params': json.loads(params) if params else None, 'created_at': created_at,
+             'fetched_at': fetched_at}
+            for job_id, status, base_model, model, params, created_at, fetched_at in rows
+        ]
+
+    def snapshots(self, job_id):
+        """任务状态的变化历史 [(status, fetched_at)]，按时间排序"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT status, fetched_at FROM job_snapshots WHERE job_id = ? AND api_base = ? AND account = ?"
+                " ORDER BY fetched_at", (job_id, self.api_base, self.account)).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,323 @@
+"""
+流式推理与延迟统计
+
+以流式方式（stream=True, incremental_output=True）调用 Generation.call，边收边输出，
+并记录每个请求的：
+- 首 token 延迟（TTFT）：发出请求到收到第一段文本
+- token 间延迟（ITL）：相邻两段文本的间隔按该段的 token 数平均
+- 总延迟
+- 输出速度：首 token 之后每秒生成的 token 数
+
+LatencyRecorder 把这些指标汇总成直方图（固定桶 + p50/p90/p95/p99），可导出为 JSON，
+用于上线前比较不同模型（如基础模型和微调模型）的延迟。
+
+用法：
+    python stream_inference.py <model_id>                                  # 单题流式输出
+    python stream_inference.py <model_a> <model_b> --test-file ../datasets/MedQA_BaiLian/mainland_4opt_test.jsonl \\
+        --limit 100 --concurrency 4 --json latency.json                   # 同一批题目比较多个模型
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dashscope_http import backoff_delay
+from evaluate_model import RETRY_STATUS_CODES, iter_eval_items, percentile
+
+
+# 延迟直方图的桶上界（毫秒）
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+# 输出速度直方图的桶上界（token/秒）
+THROUGHPUT_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 200, 500)
+
+SAMPLE_QUESTION = """卧位腰椎穿刺，脑脊液压力正常值是（　　）。
+
+选项：
+A. 80～180mmH2O（0.78～1.76kPa）
+B. 50～70mmH2O（0.49～0.69kPa）
+C. 230～250mmH2O（2.25～2.45kPa）
+D. 260～280mmH2O（2.55～2.74kPa）"""
+
+SYSTEM_PROMPT = "你是一个专业的医学助手，擅长回答医学选择题。"
+
+
+class RequestLatency:
+    """单个流式请求的延迟记录（时间单位为秒）"""
+
+    __slots__ = ('ttft', 'total', 'token_gaps', 'output_tokens', 'chunks')
+
+    def __init__(self, ttft, total, token_gaps, output_tokens, chunks):
+        self.ttft = ttft
+        self.total = total
+        self.token_gaps = token_gaps
+        self.output_tokens = output_tokens
+        self.chunks = chunks
+
+    @property
+    def tokens_per_second(self):
+        """首 token 之后的生成速度；只有一段输出时为 None"""
+        decode = self.total - self.ttft
+        if self.output_tokens <= 1 or decode <= 0:
+            return None
+        return (self.output_tokens - 1) / decode
+
+    def __repr__(self):
+        return (f"RequestLatency(ttft {self.ttft * 1000:.0f} ms, total {self.total * 1000:.0f} ms, "
+                f"{self.output_tokens} tokens)")
+
+
+class Histogram:
+    """固定桶直方图，同时保留原始值以计算精确百分位数"""
+
+    def __init__(self, buckets, unit):
+        self.buckets = tuple(buckets)
+        self.unit = unit
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.values = []
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.values.append(value)
+
+    def to_dict(self):
+        values = self.values
+        bounds = [str(b) for b in self.buckets] + ['+Inf']
+        return {
+            'unit': self.unit,
+            'count': len(values),
+            'mean': sum(values) / len(values) if values else None,
+            'min': min(values) if values else None,
+            'max': max(values) if values else None,
+            'p50': percentile(values, 50),
+            'p90': percentile(values, 90),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99),
+            'buckets': [{'le': le, 'count': count} for le, count in zip(bounds, self.counts)],
+        }
+
+
+class LatencyRecorder:
+    """线程安全的流式延迟汇总"""
+
+    def __init__(self, model_id=None):
+        self.model_id = model_id
+        self.errors = 0
+        self.histograms = {
+            'ttft_ms': Histogram(LATENCY_BUCKETS_MS, 'ms'),
+            'inter_token_ms': Histogram(LATENCY_BUCKETS_MS, 'ms'),
+            'total_ms': Histogram(LATENCY_BUCKETS_MS, 'ms'),
+            'output_tokens_per_s': Histogram(THROUGHPUT_BUCKETS, 'tokens/s'),
+        }
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        with self._lock:
+            self.histograms['ttft_ms'].observe(latency.ttft * 1000)
+            self.histograms['total_ms'].observe(latency.total * 1000)
+            for gap in latency.token_gaps:
+                self.histograms['inter_token_ms'].observe(gap * 1000)
+            if latency.tokens_per_second is not None:
+                self.histograms['output_tokens_per_s'].observe(latency.tokens_per_second)
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def summary(self):
+        with self._lock:
+            return {
+                'model': self.model_id,
+                'requests': len(self.histograms['total_ms'].values),
+                'errors': self.errors,
+                'metrics': {name: hist.to_dict() for name, hist in self.histograms.items()},
+            }
+
+    def print_summary(self, title=None):
+        summary = self.summary()
+
+        def fmt(value, spec='.0f'):
+            return format(value, spec) if value is not None else "-"
+
+        print("\n" + "=" * 60)
+        print(f"⏱️  {title or '流式延迟'}: {summary['model'] or ''}")
+        print("=" * 60)
+        print(f"请求数: {summary['requests']}  错误: {summary['errors']}")
+        for name, label, spec in (('ttft_ms', '首 token 延迟', '.0f'), ('inter_token_ms', 'token 间延迟', '.1f'),
+                                  ('total_ms', '总延迟', '.0f'), ('output_tokens_per_s', '输出速度', '.1f')):
+            hist = summary['metrics'][name]
+            print(f"{label}: p50 {fmt(hist['p50'], spec)}  p95 {fmt(hist['p95'], spec)}  "
+                  f"p99 {fmt(hist['p99'], spec)}  最大 {fmt(hist['max'], spec)} {hist['unit']}")
+        print("=" * 60)
+
+
+def export_json(recorders, output_file):
+    """把一个或多个模型的延迟汇总写成 JSON"""
+    report = {'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'models': [recorder.summary() for recorder in recorders]}
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def stream_generation(model_id, messages, api_key=None, on_text=None, **parameters):
+    """
+    流式调用一次模型
+
+    Args:
+        on_text: 每收到一段新文本时调用 on_text(piece)，用于边收边输出
+
+    Returns:
+        (完整回答, RequestLatency)
+
+    Raises:
+        RuntimeError: 服务端返回错误，异常的 status_code 属性为 HTTP 状态码
+    """
+    from dashscope import Generation
+
+    start = time.perf_counter()
+    responses = Generation.call(model=model_id, api_key=api_key, messages=messages,
+                                stream=True, incremental_output=True, **parameters)
+    pieces, gaps = [], []
+    first = last = None
+    tokens = 0
+    for response in responses:
+        if response.status_code != 200:
+            error = RuntimeError(f"HTTP {response.status_code}: {response.message}")
+            error.status_code = response.status_code
+            raise error
+
+        now = time.perf_counter()
+        usage = getattr(response, 'usage', None) or {}
+        chunk_tokens = usage.get('output_tokens', tokens + 1) - tokens
+        piece = response.output.text if response.output else None
+        if not piece:
+            continue
+        if first is None:
+            first = now
+        else:
+            # 一段可能包含多个 token，平均到每个 token
+            gaps.append((now - last) / max(chunk_tokens, 1))
+        last = now
+        tokens += max(chunk_tokens, 1)
+        pieces.append(piece)
+        if on_text is not None:
+            on_text(piece)
+
+    total = time.perf_counter() - start
+    latency = RequestLatency(first - start if first is not None else total, total, gaps, tokens, len(pieces))
+    return ''.join(pieces), latency
+
+
+def streaming_call(model_id, api_key=None, recorder=None, max_retries=3, cache=None, **parameters):
+    """
+    构造流式调用的 call(messages) -> 回答文本，可直接交给 evaluate_model.evaluate
+
+    限流/服务端错误和网络错误（连接失败、超时、流中断）整个请求重新发送；每个成功请求的
+    延迟记入 recorder，最终失败的请求记为错误。命中缓存的问题不发请求，也不计入延迟统计。
+    """
+    import requests
+
+    network_errors = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                      ConnectionError, TimeoutError)
+
+    def call(messages):
+        for attempt in range(max_retries + 1):
+            try:
+                text, latency = stream_generation(model_id, messages, api_key, **parameters)
+            except Exception as e:
+                retryable = (isinstance(e, network_errors)
+                             or getattr(e, 'status_code', None) in RETRY_STATUS_CODES)
+                if not retryable or attempt == max_retries:
+                    if recorder is not None:
+                        recorder.record_error()
+                    raise
+                time.sleep(backoff_delay(attempt + 1))
+                continue
+            if recorder is not None:
+                recorder.record(latency)
+            return text
+
+    if cache is not None:
+        return cache.wrap(call, model_id, parameters)
+    return call
+
+
+def compare_models(model_ids, items, api_key=None, concurrency=4):
+    """
+    用同一批题目依次测量多个模型的流式延迟
+
+    Returns:
+        [LatencyRecorder]，与 model_ids 顺序一致
+    """
+    recorders = []
+    for model_id in model_ids:
+        recorder = LatencyRecorder(model_id)
+        call = streaming_call(model_id, api_key=api_key, recorder=recorder)
+
+        def run_one(messages):
+            try:
+                call(messages)
+            except Exception:
+                pass
+
+        print(f"🧪 测量 {model_id}: {len(items)} 个请求，并发 {concurrency}")
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(run_one, items))
+        recorders.append(recorder)
+    return recorders
+
+
+def main():
+    parser = argparse.ArgumentParser(description='流式调用模型并统计首 token 延迟、token 间延迟和输出速度')
+    parser.add_argument('model_ids', nargs='+', help='一个或多个模型 ID')
+    parser.add_argument('--test-file', help='测试集（百炼格式 JSONL 或分片清单），不指定时只问一道示例题')
+    parser.add_argument('--limit', type=int, default=50, help='从测试集中取前 N 道题（默认 50）')
+    parser.add_argument('--concurrency', type=int, default=1, help='并发请求数（默认 1，并发会抬高延迟）')
+    parser.add_argument('--json', help='把延迟直方图导出为 JSON')
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    api_key = os.getenv("DASHSCOPE_API_KEY")
+    if not api_key:
+        print("❌ 请在 .env 文件中设置 DASHSCOPE_API_KEY")
+        return
+
+    if args.test_file:
+        items = [messages for _, messages, _ in iter_eval_items(args.test_file, args.limit)]
+        recorders = compare_models(args.model_ids, items, api_key, args.concurrency)
+    else:
+        messages = [{'role': 'system', 'content': SYSTEM_PROMPT}, {'role': 'user', 'content': SAMPLE_QUESTION}]
+        recorders = []
+        for model_id in args.model_ids:
+            recorder = LatencyRecorder(model_id)
+            print(f"\n🤖 {model_id}:")
+            try:
+                _, latency = stream_generation(model_id, messages, api_key,
+                                               on_text=lambda piece: (sys.stdout.write(piece), sys.stdout.flush()))
+                recorder.record(latency)
+                print(f"\n   首 token {latency.ttft * 1000:.0f} ms，总计 {latency.total * 1000:.0f} ms，"
+                      f"{latency.output_tokens} tokens")
+            except Exception as e:
+                recorder.record_error()
+                print(f"❌ 调用失败: {e}")
+            recorders.append(recorder)
+
+    for recorder in recorders:
+        recorder.print_summary()
+    if args.json:
+        export_json(recorders, args.json)
+        print(f"✅ 延迟直方图: {args.json}")
+
+
+if __name__ == '__main__':
+    main()
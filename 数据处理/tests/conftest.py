@@ -0,0 +1,85 @@
+"""
+测试公共设置
+
+数据处理/ 下的模块按扁平名称互相导入（from convert_to_bailian_format import ...），
+这里把该目录加入 sys.path，并按固定种子生成合成 MedQA 数据（中英文题目、4/5 个选项，
+含需要转义的字符和少量坏行）。
+
+运行：
+    python -m pytest 数据处理/tests -q
+"""
+
+import json
+import random
+import re
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+ZH_TERMS = ("患者", "男性", "女性", "岁", "发热", "咳嗽", "腹痛", "胸痛", "头痛", "血压", "心率", "白细胞",
+            "心电图", "诊断", "治疗", "首选", "最可能", "急性", "慢性", "肺炎", "糖尿病", "贫血", "手术")
+EN_TERMS = ("patient", "presents", "with", "fever", "cough", "chest", "pain", "blood", "pressure", "ECG",
+            "shows", "most", "likely", "diagnosis", "next", "best", "step", "acute", "pneumonia", "anemia")
+SPECIAL_PIECES = ('"引号"', "\\", "\n", "\t", "5～10℃", "μg", "'single'", "α/β")
+
+
+def synthetic_record(rng):
+    """一条合成 MedQA 原始记录"""
+    english = rng.random() < 0.3
+    terms, joiner = (EN_TERMS, " ") if english else (ZH_TERMS, "")
+    question = joiner.join(rng.choices(terms, k=rng.randint(6, 40))) + ("?" if english else "（　　）。")
+    if rng.random() < 0.02:
+        position = rng.randint(0, len(question))
+        question = question[:position] + rng.choice(SPECIAL_PIECES) + question[position:]
+    labels = "ABCDE"[:5 if rng.random() < 0.15 else 4]
+    options = {label: joiner.join(rng.choices(terms, k=rng.randint(1, 6))) for label in labels}
+    answer_idx = rng.choice(labels)
+    return {"question": question, "options": options, "answer": options[answer_idx],
+            "meta_info": "step1" if english else "第一部分", "answer_idx": answer_idx}
+
+
+def generate_dataset(path, rows, seed):
+    """按固定种子写出 rows 行原始 MedQA 数据，约千分之三是坏行"""
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        for _ in range(rows):
+            if rng.random() < 0.003:
+                f.write("{bad json\n")
+            else:
+                f.write(json.dumps(synthetic_record(rng), ensure_ascii=False) + "\n")
+
+
+@pytest.fixture(scope="session")
+def medqa_file(tmp_path_factory):
+    """3000 行合成原始 MedQA 数据"""
+    path = tmp_path_factory.mktemp("medqa") / "train.jsonl"
+    generate_dataset(path, 3000, seed=7)
+    return path
+
+
+@pytest.fixture(scope="session")
+def converted_file(tmp_path_factory, medqa_file):
+    """medqa_file 转换后的百炼格式数据"""
+    from convert_to_bailian_format import convert_to_bailian_format
+
+    path = tmp_path_factory.mktemp("converted") / "train.jsonl"
+    convert_to_bailian_format(str(medqa_file), str(path))
+    return path
+
+
+@pytest.fixture
+def isolated_env(tmp_path, monkeypatch):
+    """状态库、缓存等旁路文件都放到临时目录，不触碰仓库中的 datasets/"""
+    monkeypatch.setenv("DASHSCOPE_API_KEY", "sk-test")
+    monkeypatch.setenv("PIPELINE_STATE_FILE", str(tmp_path / "state.sqlite"))
+    monkeypatch.delenv("METRICS_FILE", raising=False)
+    monkeypatch.delenv("RESPONSE_CACHE", raising=False)
+    return tmp_path
+
+
+def warning_lines(text):
+    """输出中警告提到的行号"""
+    return sorted(int(n) for n in re.findall(r"第 (\d+) 行", text))
@@ -0,0 +1,129 @@
+"""Batch 接口评测：请求文件拆分、结果与错误文件解析，以及基于替身服务的提交、收取和续跑"""
+
+import json
+import sys
+
+import pytest
+
+from batch_eval import (
+    BatchClient,
+    batch_state_file,
+    compatible_base,
+    parse_result_line,
+    run_batch_eval,
+    write_request_files,
+)
+from evaluate_model import load_results
+
+pytest.importorskip("fastapi")
+pytest.importorskip("uvicorn")
+
+import mock_dashscope  # noqa: E402
+from mock_dashscope import MockSettings, start_server  # noqa: E402
+
+
+def _record(i, gold="A"):
+    return json.dumps({"messages": [
+        {"role": "system", "content": "你是医学助手"},
+        {"role": "user", "content": f"第 {i} 题\nA. 甲\nB. 乙"},
+        {"role": "assistant", "content": f"答案是 {gold}. 甲"},
+    ]}, ensure_ascii=False) + '\n'
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    path = tmp_path / "test.jsonl"
+    path.write_text("".join(_record(i) for i in range(10)), encoding='utf-8')
+    return path
+
+
+def test_request_files_split_by_count_and_size(dataset, tmp_path):
+    files = write_request_files(dataset, "qwen-mock", tmp_path / "inputs", "test", skip={2}, max_requests=4)
+    assert [f['requests'] for f in files] == [4, 4, 1]
+    lines = [json.loads(line) for f in files for line in open(f['input_file'], encoding='utf-8')]
+    assert [line['custom_id'] for line in lines] == [f"item-{i}" for i in range(10) if i != 2]
+    assert lines[0]['url'] == "/v1/chat/completions" and lines[0]['body']['model'] == "qwen-mock"
+    assert [m['role'] for m in lines[0]['body']['messages']] == ["system", "user"]
+
+    size = len(open(files[0]['input_file'], 'rb').readline())
+    files = write_request_files(dataset, "qwen-mock", tmp_path / "small", "test", limit=6,
+                                max_file_mb=(2 * size + 1) / (1024 * 1024))
+    assert [f['requests'] for f in files] == [2, 2, 2]
+
+
+def test_parse_result_line():
+    ok = {"custom_id": "item-3", "error": None, "response": {"status_code": 200, "body": {
+        "choices": [{"message": {"role": "assistant", "content": "答案是 B."}}]}}}
+    assert parse_result_line(json.dumps(ok)) == (3, "答案是 B.", None)
+
+    failed = {"custom_id": "item-4", "error": None, "response": {"status_code": 503, "body": {
+        "error": {"code": "ServiceUnavailable", "message": "busy"}}}}
+    assert parse_result_line(json.dumps(failed)) == (4, None, "HTTP 503: busy")
+
+    rejected = {"custom_id": "item-12", "response": None, "error": {"code": "invalid_request", "message": "bad"}}
+    assert parse_result_line(json.dumps(rejected)) == (12, None, "invalid_request: bad")
+
+
+class FailEveryOther:
+    """替身服务的随机数：只让生成 Batch 结果时每隔一个请求失败，其余请求都成功"""
+
+    def __init__(self):
+        self.enabled = True
+        self.calls = 0
+
+    def random(self):
+        if sys._getframe(1).f_code.co_name != "finish_batch" or not self.enabled:
+            return 1.0
+        self.calls += 1
+        return 0.0 if self.calls % 2 == 0 else 1.0
+
+    def expovariate(self, rate):
+        return 0.0
+
+
+@pytest.fixture
+def mock_server(monkeypatch):
+    failures = FailEveryOther()
+    monkeypatch.setattr(mock_dashscope, "random", failures)
+    settings = MockSettings(latency_ms=1, jitter_ms=0, error_rate=0.5, pending_seconds=0.05, running_seconds=0.1)
+    server, api_base = start_server(settings)
+    yield server.config.app, api_base, failures
+    server.should_exit = True
+
+
+def test_submit_collect_and_resume(dataset, tmp_path, mock_server, capsys):
+    app, api_base, failures = mock_server
+    client = BatchClient("sk-test", compatible_base(api_base))
+    output = tmp_path / "results" / "test.qwen-mock.jsonl"
+
+    def run(wait=True):
+        return run_batch_eval("qwen-mock", dataset, output, wait=wait, max_requests=4,
+                              min_interval=0.02, max_interval=0.05, client=client)
+
+    try:
+        # 只提交：10 道题拆成 3 个请求文件
+        assert run(wait=False) is None
+        state = json.loads(batch_state_file(output).read_text(encoding='utf-8'))
+        assert [batch['requests'] for batch in state['batches']] == [4, 4, 2]
+        assert all(batch['batch_id'] for batch in state['batches'])
+        assert len(app.state.batches) == 3
+
+        # 再次运行继续跟踪已提交的任务，不重复提交
+        summary = run()
+        assert len(app.state.batches) == 3
+        assert not batch_state_file(output).exists()
+        assert (summary['total'], summary['errors']) == (10, 5)
+        records = load_results(output)
+        errors = [index for index, record in records.items() if record['error']]
+        assert all(records[index]['error'] == "HTTP 503: mock: injected failure" for index in errors)
+        assert all(records[index]['pred'] in ("A", "B") for index in records if index not in errors)
+
+        # 全部收回后再运行：只为出错的 5 道题提交新的任务
+        failures.enabled = False
+        summary = run()
+        assert len(app.state.batches) == 5
+        assert (summary['total'], summary['errors']) == (10, 0)
+        assert "只为其余题目提交任务" in capsys.readouterr().out
+        assert not list((output.parent / "batch_inputs").iterdir())
+    finally:
+        client.close()
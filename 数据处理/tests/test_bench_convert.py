@@ -0,0 +1,61 @@
+"""转换基准测试：规模参数、合成数据的确定性、基线合并与退化判断"""
+
+import json
+
+import pytest
+
+from bench_convert import (
+    compare,
+    dataset_path,
+    format_scale,
+    generate_dataset,
+    load_baseline,
+    parse_scale,
+    save_baseline,
+)
+
+
+@pytest.mark.parametrize("text, rows", [("10k", 10000), ("1m", 1000000), ("2.5k", 2500), ("300", 300)])
+def test_scales(text, rows):
+    assert parse_scale(text) == rows
+    assert parse_scale(format_scale(rows)) == rows
+
+
+def test_generated_data_is_deterministic(tmp_path, capsys):
+    generate_dataset(tmp_path / "a.jsonl", 500, seed=3)
+    generate_dataset(tmp_path / "b.jsonl", 500, seed=3)
+    data = (tmp_path / "a.jsonl").read_bytes()
+    assert data == (tmp_path / "b.jsonl").read_bytes()
+    lines = data.decode('utf-8').splitlines()
+    assert len(lines) == 500
+    record = json.loads(next(line for line in lines if line.startswith('{"')))
+    assert record['answer'] == record['options'][record['answer_idx']]
+
+    # 同一规模和种子只生成一次
+    path = dataset_path(tmp_path / "data", 200, 1)
+    mtime = path.stat().st_mtime_ns
+    assert dataset_path(tmp_path / "data", 200, 1).stat().st_mtime_ns == mtime
+    assert capsys.readouterr().out.count("生成合成数据") == 1
+
+
+def _result(rows_per_s, peak_rss_mb=100.0, output_mb=10.0):
+    return {'rows': 1000, 'seconds': 1000 / rows_per_s, 'rows_per_s': rows_per_s, 'mb_per_s': 1.0,
+            'spread': 0.05, 'peak_rss_mb': peak_rss_mb, 'output_mb': output_mb}
+
+
+def test_compare_with_baseline(tmp_path):
+    reference = _result(1000)
+    assert compare(_result(950), reference, 0.10) == ("-5.0%", False)
+    assert compare(_result(800), reference, 0.10)[1]
+    note, regressed = compare(_result(1000, peak_rss_mb=150), reference, 0.10)
+    assert regressed and "内存" in note
+    assert compare(_result(1000, output_mb=11), reference, 0.10) == ("+0.0% 输出大小变化", False)
+    assert compare(_result(1000), None, 0.10) == ("-", False)
+
+    # 合并进已有基线，同一用例覆盖旧值
+    path = tmp_path / "baseline.json"
+    assert load_baseline(path) is None
+    save_baseline(path, {"convert@10k": _result(1000), "convert@100k": _result(900)}, {'python': "3"})
+    save_baseline(path, {"convert@10k": _result(1200)}, {'python': "3"})
+    results = load_baseline(path)['results']
+    assert results["convert@10k"]['rows_per_s'] == 1200 and results["convert@100k"]['rows_per_s'] == 900
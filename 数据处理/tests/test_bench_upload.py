@@ -0,0 +1,25 @@
+"""上传基准测试：替身接口的 File ID 和任务只写入临时目录，不触碰真实的状态库和上传登记表"""
+
+import sys
+
+import pytest
+
+pytest.importorskip("requests")
+
+import bench_upload
+import state_store
+
+
+def test_bench_does_not_touch_real_state(isolated_env, monkeypatch, capsys):
+    real_state = isolated_env / "real" / ".pipeline_state.sqlite"
+    monkeypatch.setattr(state_store, "DEFAULT_STATE_FILE", real_state)
+    # main 会改写这些环境变量，先登记以便测试结束后恢复
+    monkeypatch.delenv("PIPELINE_STATE_FILE")
+    monkeypatch.setenv("DASHSCOPE_API_BASE", "http://unused")
+    monkeypatch.setattr(sys, "argv", ["bench_upload.py", "--size-mb", "0.1", "--runs", "1"])
+
+    bench_upload.main()
+
+    assert "流式上传结果" in capsys.readouterr().out
+    assert not real_state.exists()
+    assert not real_state.parent.exists()
@@ -0,0 +1,118 @@
+"""压缩输入输出：.gz / .zst 流式读写、转换结果与未压缩时一致，以及不支持压缩文件的索引给出明确错误"""
+
+import gzip
+import shutil
+
+import numpy as np
+import pytest
+
+import compressed_io
+from batch_convert import batch_convert
+from compressed_io import open_input, open_output, strip_compression, uncompressed_size
+from convert_to_bailian_format import shard_manifest_path
+from line_index import LineIndex, reservoir_sample
+from token_index import build_token_index, dataset_stem
+
+SUFFIXES = [".gz", pytest.param(".zst", marks=pytest.mark.skipif(compressed_io.zstandard is None,
+                                                                 reason="未安装 zstandard"))]
+
+
+def _decompressed(path):
+    with open_input(path) as f:
+        return f.read()
+
+
+def _compress(source, target):
+    with open(source, 'rb') as src, open_output(target) as dst:
+        shutil.copyfileobj(src, dst)
+
+
+def _convert(input_dir, output_dir, **options):
+    batch_convert(input_dir=input_dir, output_dir=output_dir, datasets=[("train.jsonl", "train.jsonl")],
+                  **options)
+
+
+@pytest.fixture(scope="module")
+def plain_output(tmp_path_factory, medqa_file):
+    """未压缩输入、未压缩输出的转换结果"""
+    root = tmp_path_factory.mktemp("plain")
+    (root / "questions").mkdir()
+    shutil.copy(medqa_file, root / "questions" / "train.jsonl")
+    _convert(root / "questions", root / "out")
+    return (root / "out" / "train.jsonl").read_bytes()
+
+
+@pytest.mark.parametrize("suffix", SUFFIXES)
+def test_round_trip(tmp_path, suffix):
+    data = "".join(f'{{"i": {i}, "text": "第{i}题"}}\n' for i in range(5000)).encode('utf-8')
+    path = tmp_path / f"data.jsonl{suffix}"
+    with open_output(path) as f:
+        f.write(data)
+    assert path.stat().st_size < len(data)
+    assert _decompressed(path) == data
+    assert uncompressed_size(path) == len(data)
+    with open_input(path) as f:
+        assert sum(1 for _ in f) == 5000
+
+    # 压缩结果不含文件名和时间戳，相同内容得到相同字节
+    again = tmp_path / f"again.jsonl{suffix}"
+    with open_output(again) as f:
+        f.write(data)
+    assert again.read_bytes() == path.read_bytes()
+
+
+def test_names():
+    assert strip_compression("a/train.jsonl.gz").name == "train.jsonl"
+    assert strip_compression("a/train.jsonl").name == "train.jsonl"
+    assert dataset_stem("a/train_part001.jsonl.zst") == "train_part001"
+
+
+@pytest.mark.parametrize("suffix", SUFFIXES)
+@pytest.mark.parametrize("workers", [1, 2])
+def test_compressed_input_is_identical(tmp_path, medqa_file, plain_output, capsys, suffix, workers):
+    input_dir = tmp_path / "questions"
+    input_dir.mkdir()
+    # 只有压缩文件时自动使用它
+    _compress(medqa_file, input_dir / f"train.jsonl{suffix}")
+    _convert(input_dir, tmp_path / "out", workers=workers, chunk_mb=0.1)
+    capsys.readouterr()
+    assert (tmp_path / "out" / "train.jsonl").read_bytes() == plain_output
+
+
+@pytest.mark.parametrize("suffix", SUFFIXES)
+def test_compressed_output(tmp_path, medqa_file, plain_output, capsys, suffix):
+    input_dir = tmp_path / "questions"
+    input_dir.mkdir()
+    shutil.copy(medqa_file, input_dir / "train.jsonl")
+    compress = suffix.lstrip('.')
+    _convert(input_dir, tmp_path / "out", compress=compress)
+    assert _decompressed(tmp_path / "out" / f"train.jsonl{suffix}") == plain_output
+
+    # 分片上限按解压后的大小计算
+    _convert(input_dir, tmp_path / "sharded", compress=compress, max_shard_mb=0.5)
+    capsys.readouterr()
+    shards = sorted((tmp_path / "sharded").glob(f"train_part*.jsonl{suffix}"))
+    assert len(shards) > 1
+    assert shard_manifest_path(tmp_path / "sharded" / f"train.jsonl{suffix}").exists()
+    assert all(uncompressed_size(shard) <= 0.5 * 1024 * 1024 for shard in shards)
+    assert b''.join(_decompressed(shard) for shard in shards) == plain_output
+
+
+def test_indexes_on_compressed_dataset(tmp_path, converted_file):
+    plain = tmp_path / "plain" / "train.jsonl"
+    plain.parent.mkdir()
+    shutil.copy(converted_file, plain)
+    packed = tmp_path / "train.jsonl.gz"
+    _compress(converted_file, packed)
+
+    counts, _ = build_token_index(packed)
+    assert np.array_equal(counts, build_token_index(plain)[0])
+    assert (tmp_path / "train.tokens.npy").exists()
+
+    # 蓄水池抽样流式读取，可以直接用于压缩文件
+    assert reservoir_sample(packed, 50, seed=1) == reservoir_sample(plain, 50, seed=1)
+
+    with pytest.raises(ValueError, match="压缩文件"):
+        LineIndex(packed)
+    assert not (tmp_path / "train.lines.npy").exists()
+    assert gzip.decompress(packed.read_bytes()) == converted_file.read_bytes()
@@ -0,0 +1,88 @@
+"""batch_convert 的增量缓存：未变化的数据集跳过，输入、参数或输出变化时重新转换，命中时沿用记录的大小"""
+
+import os
+import json
+import shutil
+
+import pytest
+
+import batch_convert as batch
+from batch_convert import batch_convert
+from conversion_cache import CACHE_FILE_NAME
+
+
+@pytest.fixture
+def layout(tmp_path, medqa_file):
+    input_dir, output_dir = tmp_path / "questions", tmp_path / "out"
+    input_dir.mkdir()
+    shutil.copy(medqa_file, input_dir / "train.jsonl")
+    return input_dir, output_dir
+
+
+def _run(layout, capsys, **options):
+    input_dir, output_dir = layout
+    batch_convert(input_dir=input_dir, output_dir=output_dir, datasets=[("train.jsonl", "train.jsonl")],
+                  **options)
+    return capsys.readouterr().out
+
+
+def test_unchanged_input_is_skipped(layout, capsys):
+    _run(layout, capsys)
+    output = layout[1] / "train.jsonl"
+    converted = output.read_bytes()
+
+    assert "未变化，跳过" in _run(layout, capsys)
+    assert output.read_bytes() == converted
+
+    # 只修改时间不修改内容：按 SHA-256 仍然命中
+    source = layout[0] / "train.jsonl"
+    os.utime(source, ns=(source.stat().st_atime_ns, source.stat().st_mtime_ns + 10 ** 9))
+    assert "未变化，跳过" in _run(layout, capsys)
+
+
+def test_changes_trigger_reconversion(layout, capsys):
+    _run(layout, capsys)
+    source, output = layout[0] / "train.jsonl", layout[1] / "train.jsonl"
+
+    with open(source, 'ab') as f:
+        f.write(b'{"question": "new", "options": {"A": "a"}, "answer_idx": "A", "answer": "a"}\n')
+    assert "未变化，跳过" not in _run(layout, capsys)
+    assert "未变化，跳过" in _run(layout, capsys)
+
+    # 分片上限属于转换参数
+    assert "未变化，跳过" not in _run(layout, capsys, max_shard_mb=1)
+    assert "未变化，跳过" in _run(layout, capsys, max_shard_mb=1)
+
+    # 输出被删除或改动
+    for shard in layout[1].glob("train_part*.jsonl"):
+        shard.write_bytes(b'')
+    assert "未变化，跳过" not in _run(layout, capsys, max_shard_mb=1)
+    assert "未变化，跳过" not in _run(layout, capsys, force=True, max_shard_mb=1)
+    assert not output.exists()
+
+
+@pytest.mark.parametrize("max_shard_mb", [None, 0.5])
+def test_cache_hit_reuses_recorded_sizes(layout, capsys, monkeypatch, max_shard_mb):
+    first = batch_convert(input_dir=layout[0], output_dir=layout[1], datasets=[("train.jsonl", "train.jsonl")],
+                          compress="gz", max_shard_mb=max_shard_mb)
+    capsys.readouterr()
+
+    # 命中缓存时大小取自缓存记录，不再解压输出或读取分片清单
+    def fail(*args):
+        pytest.fail("命中缓存时重新统计了输出大小")
+    monkeypatch.setattr(batch, "_output_shards", fail)
+    again = batch_convert(input_dir=layout[0], output_dir=layout[1], datasets=[("train.jsonl", "train.jsonl")],
+                          compress="gz", max_shard_mb=max_shard_mb)
+    assert "未变化，跳过" in capsys.readouterr().out
+    assert again == first
+    assert (first[0]['shards'] > 1) == (max_shard_mb is not None)
+
+    # 早期的缓存记录没有分片大小时重新统计
+    monkeypatch.undo()
+    cache_file = layout[1] / CACHE_FILE_NAME
+    data = json.loads(cache_file.read_text(encoding='utf-8'))
+    (entry,) = data['entries'].values()
+    del entry['shards']
+    cache_file.write_text(json.dumps(data), encoding='utf-8')
+    assert batch_convert(input_dir=layout[0], output_dir=layout[1], datasets=[("train.jsonl", "train.jsonl")],
+                         compress="gz", max_shard_mb=max_shard_mb) == first
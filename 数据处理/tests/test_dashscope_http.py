@@ -0,0 +1,125 @@
+"""DashScope HTTP 客户端：重试与退避、非幂等请求不重复提交，以及请求耗时汇总"""
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+import dashscope_http
+from dashscope_http import DashScopeHTTPClient
+
+API_BASE = "http://dashscope.test/api/v1"
+
+
+class ScriptedAdapter(BaseAdapter):
+    """按脚本依次返回状态码（可带响应头）或抛出网络异常，不访问网络"""
+
+    def __init__(self, outcomes):
+        super().__init__()
+        self.outcomes = list(outcomes)
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        status, headers = outcome if isinstance(outcome, tuple) else (outcome, {})
+        response = requests.Response()
+        response.status_code = status
+        response.headers.update(headers)
+        response._content = b'{}'
+        response.request = request
+        response.url = request.url
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    """不真正等待；退避取抖动区间的上限，便于核对"""
+    recorded = []
+    monkeypatch.setattr(dashscope_http.time, "sleep", recorded.append)
+    monkeypatch.setattr(dashscope_http.random, "uniform", lambda low, high: high)
+    return recorded
+
+
+def _client(outcomes, **options):
+    client = DashScopeHTTPClient("sk-test", API_BASE + "/", **options)
+    adapter = ScriptedAdapter(outcomes)
+    client.session.mount("http://", adapter)
+    return client, adapter
+
+
+def test_retries_with_backoff(delays):
+    client, adapter = _client([503, (429, {"Retry-After": "7"}), requests.ConnectionError("reset"), 200])
+    retries = []
+    response = client.get("fine-tunes/ft-1", on_retry=lambda *args: retries.append(args))
+
+    assert response.status_code == 200
+    assert [r.url for r in adapter.requests] == [f"{API_BASE}/fine-tunes/ft-1"] * 4
+    assert adapter.requests[0].headers["Authorization"] == "Bearer sk-test"
+    # 指数退避 2、4、8 秒，429 优先遵循 Retry-After
+    assert delays == [2, 7, 8]
+    assert [(attempt, reason) for attempt, _, reason in retries] == [
+        (1, "HTTP 503"), (2, "HTTP 429"), (3, "ConnectionError: reset")]
+
+
+def test_retries_are_bounded(delays):
+    client, adapter = _client([500] * 3, max_retries=2)
+    assert client.get("files").status_code == 500
+    assert len(adapter.requests) == 3
+
+    client, adapter = _client([requests.ReadTimeout("slow")] * 3, max_retries=2)
+    with pytest.raises(requests.ReadTimeout):
+        client.get("files")
+    assert len(adapter.requests) == 3
+    assert delays == [2, 4, 2, 4]
+
+    # 4xx（429 除外）不重试
+    client, adapter = _client([404])
+    assert client.get("files/missing").status_code == 404
+    assert len(adapter.requests) == 1
+
+
+def test_non_idempotent_requests(delays):
+    # 服务端可能已经处理过的请求不重试，避免重复创建任务
+    for outcome in (500, 503):
+        client, adapter = _client([outcome, 200])
+        assert client.post("fine-tunes", idempotent=False).status_code == outcome
+        assert len(adapter.requests) == 1
+    for error in (requests.ConnectionError("reset"), requests.ReadTimeout("slow")):
+        client, adapter = _client([error, 200])
+        with pytest.raises(type(error)):
+            client.post("fine-tunes", idempotent=False)
+        assert len(adapter.requests) == 1
+    assert delays == []
+
+    # 429 和连接建立超时说明请求没有被处理，可以重试
+    for outcome in (429, requests.ConnectTimeout("connect")):
+        client, adapter = _client([outcome, 200])
+        assert client.post("fine-tunes", idempotent=False).status_code == 200
+        assert len(adapter.requests) == 2
+
+
+def test_timing_summary(delays):
+    client, _ = _client([200, 502, 200, 404], history_size=10)
+    client.get("fine-tunes/ft-1")
+    client.get("fine-tunes/ft-2")
+    client.post("files")
+
+    summary = client.timing_summary()
+    assert set(summary) == {"GET /fine-tunes", "POST /files"}
+    assert {key: summary["GET /fine-tunes"][key] for key in ('count', 'errors', 'retries')} == \
+        {'count': 2, 'errors': 0, 'retries': 1}
+    assert {key: summary["POST /files"][key] for key in ('count', 'errors', 'retries')} == \
+        {'count': 1, 'errors': 1, 'retries': 0}
+    for item in summary.values():
+        assert 0 <= item['avg_ms'] <= item['max_ms']
+
+    # 只保留最近 history_size 条记录
+    client, _ = _client([200] * 5, history_size=3)
+    for _ in range(5):
+        client.get("files")
+    assert client.timing_summary()["GET /files"]['count'] == 3
@@ -0,0 +1,148 @@
+"""MinHash 去重：完全重复、近似重复、跨划分保留规则，以及并行与串行结果一致"""
+
+import json
+import random
+
+import numpy as np
+import pytest
+
+from batch_convert import batch_convert
+from dedup import MinHasher, deduplicate, normalize_text, shingle_hashes, split_of
+
+WORDS = ("patient fever cough pain chest kidney liver blood pressure dose acute chronic infection "
+         "therapy symptom diagnosis nerve muscle bone skin heart lung").split()
+
+
+def _question(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(60))
+
+
+def _record(question, options=None):
+    options = options or {"A": "alpha", "B": "beta", "C": "gamma", "D": "delta"}
+    return json.dumps({"question": question, "options": options, "answer_idx": "A",
+                       "answer": options["A"]}, ensure_ascii=False)
+
+
+@pytest.fixture
+def splits(tmp_path):
+    """
+    test: 5 道不同的题，第 4 行与第 2 行完全相同（test 内重复只报告）
+    train: 10 道不同的题，外加
+      第 11 行 = test 第 1 行（跨划分完全重复），
+      第 12 行 = train 第 1 行改了一个词（近似重复），
+      第 13 行 = train 第 2 行打乱选项顺序、改变大小写和标点（规范化后完全重复）
+    """
+    rng = random.Random(3)
+    test_q = [_question(rng) for _ in range(5)]
+    train_q = [_question(rng) for _ in range(10)]
+
+    test_lines = [_record(q) for q in test_q]
+    test_lines[3] = test_lines[1]
+
+    near = train_q[0].split(' ')
+    near[30] = "unrelated"
+    shuffled = {"A": "delta", "B": "gamma", "C": "beta", "D": "alpha"}
+    train_lines = [_record(q) for q in train_q] + [
+        _record(test_q[0]),
+        _record(' '.join(near)),
+        _record(train_q[1].upper() + "!!", shuffled),
+    ]
+
+    test_path, train_path = tmp_path / "test.jsonl", tmp_path / "train.jsonl"
+    test_path.write_text('\n'.join(test_lines) + '\n', encoding='utf-8')
+    train_path.write_text('\n'.join(train_lines) + '\n', encoding='utf-8')
+    return [("mainland_train.jsonl", train_path), ("mainland_test.jsonl", test_path)]
+
+
+def _line_offset(path, line):
+    return sum(len(raw) for raw in path.read_bytes().splitlines(keepends=True)[:line - 1])
+
+
+def test_split_and_normalization():
+    assert split_of("mainland_4opt_test.jsonl.gz") == "test"
+    assert split_of("mainland_dev.jsonl") == "dev"
+    assert split_of("mainland_4opt.jsonl") == "train"
+    assert normalize_text("A, b!", {"B": "y", "A": "x"}) == normalize_text("a b", {"A": "y", "B": "x"})
+
+
+def test_signatures_are_deterministic():
+    hashes = [shingle_hashes(normalize_text(f"question {i} " * 5, {})) for i in range(20)]
+    first = MinHasher(64).signatures(hashes)
+    assert first.shape == (20, 64) and first.dtype == np.uint32
+    assert np.array_equal(first, MinHasher(64).signatures(hashes))
+    # 逐行计算与成批计算一致
+    assert np.array_equal(first[:1], MinHasher(64).signatures(hashes[:1]))
+    assert not np.array_equal(first, MinHasher(64, seed=2).signatures(hashes))
+
+
+def test_duplicates_and_keep_priority(splits):
+    result = deduplicate(splits)
+    train_path, test_path = splits[0][1], splits[1][1]
+    found = {(item['dataset'], item['line']): item for item in result['duplicates']}
+    assert set(found) == {
+        ("mainland_test.jsonl", 4),
+        ("mainland_train.jsonl", 11),
+        ("mainland_train.jsonl", 12),
+        ("mainland_train.jsonl", 13),
+    }
+
+    # test 中的重复只报告
+    assert found[("mainland_test.jsonl", 4)]['dropped'] is False
+    assert found[("mainland_test.jsonl", 4)]['duplicate_of']['line'] == 2
+
+    # 与 test 重复时保留 test 中的那一行
+    cross = found[("mainland_train.jsonl", 11)]
+    assert cross['kind'] == 'exact'
+    assert cross['duplicate_of'] == {'dataset': "mainland_test.jsonl", 'line': 1,
+                                     'offset': _line_offset(test_path, 1)}
+
+    assert found[("mainland_train.jsonl", 12)]['kind'] == 'near'
+    assert 0.8 <= found[("mainland_train.jsonl", 12)]['similarity'] < 1
+    assert found[("mainland_train.jsonl", 13)]['kind'] == 'exact'
+
+    assert result['drop'] == {
+        "mainland_test.jsonl": set(),
+        "mainland_train.jsonl": {_line_offset(train_path, line) for line in (11, 12, 13)},
+    }
+    assert result['stats']["mainland_train.jsonl"]['cross_split'] == 1
+    assert result['stats']["mainland_train.jsonl"]['dropped'] == 3
+
+
+def test_parallel_matches_serial(splits):
+    serial = deduplicate(splits)
+    parallel = deduplicate(splits, workers=2, chunk_mb=0.001)
+
+    def key(result):
+        return sorted(json.dumps(item, sort_keys=True) for item in result['duplicates'])
+
+    assert key(parallel) == key(serial)
+    assert parallel['drop'] == serial['drop']
+    assert parallel['stats'] == serial['stats']
+
+
+def test_invalid_bands(splits):
+    with pytest.raises(ValueError):
+        deduplicate(splits, num_perm=64, bands=7)
+
+
+def test_batch_convert_drops_duplicates(splits, tmp_path, capsys):
+    input_dir = splits[0][1].parent
+    output_dir = tmp_path / "out"
+    datasets = [("train.jsonl", "mainland_train.jsonl"), ("test.jsonl", "mainland_test.jsonl")]
+    batch_convert(input_dir=input_dir, output_dir=output_dir, datasets=datasets, dedup='drop')
+    capsys.readouterr()
+
+    assert len((output_dir / "mainland_train.jsonl").read_text(encoding='utf-8').splitlines()) == 10
+    assert len((output_dir / "mainland_test.jsonl").read_text(encoding='utf-8').splitlines()) == 5
+    report = (output_dir / "dedup_report.jsonl").read_text(encoding='utf-8').splitlines()
+    assert len(report) == 4
+
+
+def test_report_is_not_listed_as_dataset(isolated_env, capsys):
+    from fine_tune_automation import FineTuneAutomation
+
+    automation = FineTuneAutomation()
+    automation.data_dir = isolated_env
+    for name in ("mainland_train.jsonl", "dedup_report.jsonl"):
+        (isolated_env / name).write_text('{}\n', encoding='utf-8')
+    assert automation.list_available_datasets() == [str(isolated_env / "mainland_train.jsonl")]
@@ -0,0 +1,156 @@
+"""向量索引：缓存去重、索引复用、精确检索、相似题目对和少样本检索器的索引选择"""
+
+import json
+
+import numpy as np
+import pytest
+
+from embed_questions import (
+    EmbeddingCache,
+    FewShotRetriever,
+    FlatIndex,
+    build_vector_index,
+    embed_texts,
+    index_paths,
+    normalize,
+    question_text,
+    similar_pairs,
+)
+
+
+class FakeEmbedder:
+    """按字符统计的确定性向量化器，记录实际请求的文本"""
+
+    provider = "dashscope"
+
+    def __init__(self, model="fake-embedding", dimension=16):
+        self.model = model
+        self.dimension = dimension
+        self.name = f"{self.provider}/{model}/{dimension}"
+        self.calls = []
+
+    def embed(self, texts):
+        self.calls.append(list(texts))
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for ch in text:
+                vectors[i, ord(ch) % self.dimension] += 1
+        return normalize(vectors + 1e-3)
+
+    def close(self):
+        pass
+
+
+def _record(question, answer="A"):
+    return json.dumps({"messages": [
+        {"role": "system", "content": "你是医学助手"},
+        {"role": "user", "content": question},
+        {"role": "assistant", "content": f"答案是 {answer}. x"},
+    ]}, ensure_ascii=False)
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    questions = ["aaaa bbbb", "aaaa bbbc", "cccc dddd", "eeee ffff", "gggg hhhh", "cccc dddd"]
+    path = tmp_path / "train.jsonl"
+    path.write_text('\n'.join(_record(q) for q in questions) + '\n', encoding='utf-8')
+    return path
+
+
+def test_embed_texts_uses_cache(tmp_path):
+    embedder = FakeEmbedder()
+    cache = EmbeddingCache(tmp_path / "cache.sqlite")
+    try:
+        first = embed_texts(embedder, ["x", "y", "x"], cache)
+        assert embedder.calls == [["x", "y"]]
+        assert np.array_equal(first[0], first[2])
+
+        again = embed_texts(embedder, ["y", "x", "z"], cache)
+        assert embedder.calls[-1] == ["z"]
+        assert np.allclose(again[:2], first[[1, 0]])
+        assert embed_texts(embedder, [], cache).shape == (0, embedder.dimension)
+    finally:
+        cache.close()
+
+
+def test_build_reuse_and_search(dataset):
+    embedder = FakeEmbedder()
+    meta = build_vector_index(dataset, embedder)
+    assert meta['rows'] == 6 and meta['backends'] == ['flat']
+    calls = len(embedder.calls)
+    assert build_vector_index(dataset, embedder) == meta
+    assert len(embedder.calls) == calls
+
+    vector_file = index_paths(dataset, embedder.name)[0]
+    index = FlatIndex(vector_file)
+    queries = np.load(vector_file)
+    scores, rows = index.search(queries, 3)
+    brute = queries @ queries.T
+    assert np.array_equal(rows[:, 0], np.argmax(brute, axis=1))
+    assert np.all(np.diff(scores, axis=1) <= 1e-6)
+    assert index.search(queries, 10)[1].shape == (6, 6)
+
+    empty_scores, empty_rows = index.search(queries, 0)
+    assert empty_scores.shape == (6, 0) and empty_rows.dtype == np.int64
+
+
+def test_similar_pairs_same_dataset(tmp_path):
+    vectors = normalize([[1, 0, 0], [1, 0, 0], [0.99, 0.1, 0], [0, 1, 0], [0, 0, 1]])
+    np.save(tmp_path / "v.npy", vectors)
+    index = FlatIndex(tmp_path / "v.npy")
+
+    pairs = similar_pairs(index, vectors, threshold=0.95, k=2, same_dataset=True)
+    assert [(a, b) for a, b, _ in pairs] == [(0, 1), (0, 2), (1, 2)]
+    assert all(a < b for a, b, _ in pairs)
+    # 与行的顺序无关
+    order = np.array([4, 2, 3, 1, 0])
+    np.save(tmp_path / "p.npy", vectors[order])
+    permuted = similar_pairs(FlatIndex(tmp_path / "p.npy"), vectors[order], 0.95, k=2, same_dataset=True)
+    assert sorted(tuple(sorted((int(order[a]), int(order[b])))) for a, b, _ in permuted) == [(0, 1), (0, 2), (1, 2)]
+
+    cross = similar_pairs(index, vectors[3:4], threshold=0.95, k=3)
+    assert [(q, r) for q, r, _ in cross] == [(0, 3)]
+
+
+def test_retriever_examples(dataset):
+    embedder = FakeEmbedder()
+    build_vector_index(dataset, embedder)
+    retriever = FewShotRetriever(dataset, embedder)
+    try:
+        messages = [{"role": "system", "content": "s"}, {"role": "user", "content": "cccc dddd"}]
+        shots = retriever.examples(messages, 2)
+        assert len(shots) == 4
+        # 与当前问题完全相同的训练题被跳过
+        assert "cccc dddd" not in [m['content'] for m in shots if m['role'] == 'user']
+
+        wrapped = retriever.with_examples(messages, 1)
+        assert wrapped[0]['role'] == 'system' and wrapped[-1] == messages[-1]
+        assert [m['role'] for m in wrapped[1:-1]] == ['user', 'assistant']
+        assert question_text(wrapped) == "cccc dddd"
+    finally:
+        retriever.close()
+
+
+def test_retriever_open_selects_index(dataset, isolated_env):
+    build_vector_index(dataset, FakeEmbedder("text-embedding-v4", 8))
+    with FewShotRetriever.open(dataset, model=None).records as records:
+        assert len(records) == 6
+
+    build_vector_index(dataset, FakeEmbedder("text-embedding-v3", 8))
+    with pytest.raises(ValueError):
+        FewShotRetriever.open(dataset)
+    retriever = FewShotRetriever.open(dataset, model="text-embedding-v3")
+    assert retriever.embedder.name == "dashscope/text-embedding-v3/8"
+    retriever.close()
+    retriever = FewShotRetriever.open(dataset, model="dashscope/text-embedding-v4/8")
+    assert retriever.embedder.model == "text-embedding-v4"
+    retriever.close()
+
+    with pytest.raises(FileNotFoundError):
+        FewShotRetriever.open(dataset, backend="qdrant")
+
+    # 数据集变化后旧索引不再使用
+    with open(dataset, 'a', encoding='utf-8') as f:
+        f.write(_record("iiii jjjj") + '\n')
+    with pytest.raises(FileNotFoundError):
+        FewShotRetriever.open(dataset, model="text-embedding-v4")
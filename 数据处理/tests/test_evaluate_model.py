@@ -0,0 +1,162 @@
+"""评测：答案字母提取、并发评测的汇总与断点续跑、分片测试集"""
+
+import json
+import threading
+import time
+
+import pytest
+
+from convert_to_bailian_format import ShardedJsonlWriter, shard_manifest_path
+from evaluate_model import evaluate, extract_answer, iter_eval_items, load_results, percentile
+from response_cache import ResponseCache
+
+
+@pytest.mark.parametrize("text, letter", [
+    ("答案是 B. 胸片", "B"),
+    ("根据症状，答案为：（C）", "C"),
+    ("综上，答案是E", "E"),
+    ("D. 胸片", "D"),
+    ("（A）", "A"),
+    ("B", "B"),
+    ("C、心电图", "C"),
+    ("B 胸片", "B"),
+    ("A) 阿司匹林", "A"),
+    ("D\n解析：患者有胸痛", "D"),
+    # 英文句首的冠词和代词不是答案
+    ("A 45-year-old man presents with chest pain.", None),
+    ("A patient with fever should first receive a chest X-ray.", None),
+    ("I think the answer is unclear.", None),
+    ("(A 45-year-old man)", None),
+    ("答案是 Aspirin", None),
+    ("无法判断", None),
+    ("", None),
+    (None, None),
+])
+def test_extract_answer(text, letter):
+    assert extract_answer(text) == letter
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([30, 10, 20], 50) == 20
+    assert percentile(list(range(1, 101)), 95) == 95
+    assert percentile([7], 99) == 7
+
+
+def _record(i, gold):
+    return json.dumps({"messages": [
+        {"role": "system", "content": "你是医学助手"},
+        {"role": "user", "content": f"第 {i} 题"},
+        {"role": "assistant", "content": f"答案是 {gold}. 选项{gold}"},
+    ]}, ensure_ascii=False) + '\n'
+
+
+GOLD = "ABCDE" * 8
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    path = tmp_path / "test.jsonl"
+    path.write_text("".join(_record(i, gold) for i, gold in enumerate(GOLD)), encoding='utf-8')
+    return path
+
+
+class ScriptedModel:
+    """第 3 题答错、第 5 题答非所问；第 7、11 题第一次调用失败"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, messages):
+        index = int(messages[-1]['content'].split()[1])
+        with self._lock:
+            self.calls.append(index)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            first_call = self.calls.count(index) == 1
+        try:
+            time.sleep(self.delay)
+            if index in (7, 11) and first_call:
+                raise RuntimeError("HTTP 503: busy")
+            if index == 3:
+                return "答案是 A."
+            if index == 5:
+                return "无法判断"
+            return f"答案是 {GOLD[index]}."
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+def test_iter_eval_items(dataset):
+    items = list(iter_eval_items(dataset, limit=3))
+    assert [(index, gold) for index, _, gold in items] == [(0, "A"), (1, "B"), (2, "C")]
+    assert [m['role'] for m in items[0][1]] == ["system", "user"]
+
+
+def test_evaluate_and_resume(dataset, tmp_path, capsys):
+    output = tmp_path / "results" / "test.model.jsonl"
+    model = ScriptedModel(delay=0.005)
+    summary = evaluate(model, dataset, output, concurrency=4)
+
+    assert 1 < model.max_running <= 4
+    assert sorted(model.calls) == list(range(len(GOLD)))
+    assert summary['total'] == len(GOLD)
+    assert (summary['answered'], summary['errors'], summary['unparsed']) == (len(GOLD) - 2, 2, 1)
+    assert summary['correct'] == len(GOLD) - 4
+    assert summary['accuracy'] == pytest.approx((len(GOLD) - 4) / (len(GOLD) - 2))
+    assert summary['p50_latency_ms'] <= summary['p95_latency_ms']
+
+    records = load_results(output)
+    assert records[7]['error'] == "HTTP 503: busy" and records[7]['pred'] is None
+    assert records[3]['pred'] == "A" and not records[3]['correct']
+
+    # 重新运行只补做失败的题目；崩溃留下的半行被忽略
+    with open(output, 'a', encoding='utf-8') as f:
+        f.write('{"index": 0, "gold"')
+    rerun = ScriptedModel()
+    rerun.calls = list(model.calls)
+    summary = evaluate(rerun, dataset, output, concurrency=4)
+    assert sorted(rerun.calls[len(model.calls):]) == [7, 11]
+    assert (summary['total'], summary['errors'], summary['correct']) == (len(GOLD), 0, len(GOLD) - 2)
+    assert "跳过 38 道已完成的题目" in capsys.readouterr().out
+
+
+def test_sharded_dataset_and_limit(dataset, tmp_path):
+    sharded = tmp_path / "sharded" / "test.jsonl"
+    sharded.parent.mkdir()
+    with ShardedJsonlWriter(sharded, max_bytes=1000) as writer:
+        with open(dataset, 'rb') as f:
+            for line in f:
+                writer.write(line)
+    manifest = shard_manifest_path(sharded)
+    assert len(writer.shards) > 1
+
+    model = ScriptedModel()
+    summary = evaluate(model, manifest, tmp_path / "sharded.jsonl", concurrency=2, limit=12)
+    assert sorted(model.calls) == list(range(12))
+    assert summary['total'] == 12
+
+
+def test_write_errors_are_raised(dataset, tmp_path):
+    # 结果无法写入（回答不是字符串）不是调用错误，评测结束后抛出
+    with pytest.raises(TypeError):
+        evaluate(lambda messages: object(), dataset, tmp_path / "results.jsonl", concurrency=4)
+
+
+def test_cached_answers_are_left_out_of_latency(dataset, tmp_path):
+    cache = ResponseCache(tmp_path / "responses.sqlite")
+    try:
+        evaluate(cache.wrap(ScriptedModel(), "m"), dataset, tmp_path / "first.jsonl", concurrency=4)
+        summary = evaluate(cache.wrap(ScriptedModel(), "m"), dataset, tmp_path / "second.jsonl", concurrency=4)
+    finally:
+        cache.close()
+    # 第二次运行中成功的回答全部来自缓存（第 7、11 题重新调用后仍然失败），没有可统计的延迟
+    assert (summary['cached'], summary['errors']) == (len(GOLD) - 2, 2)
+    assert all(record['cached'] for index, record in load_results(tmp_path / "second.jsonl").items()
+               if index not in (7, 11))
+    assert summary['p50_latency_ms'] is None
@@ -0,0 +1,116 @@
+"""序列打包导出：多进程与串行一致、损失掩码只覆盖助手回答、位置编码和样本边界"""
+
+import json
+
+import numpy as np
+import pytest
+
+from export_packed import IM_END, ByteTokenizer, PackedDataset, export_packed, pack_lengths
+
+SEQ_LEN = 1024
+
+
+@pytest.fixture(scope="module")
+def dataset(tmp_path_factory, converted_file):
+    """转换结果的前 300 行，中间夹一个空行和一条超过 seq_len 的样本"""
+    lines = converted_file.read_text(encoding='utf-8').splitlines(keepends=True)[:300]
+    long_record = json.dumps({"messages": [{"role": "user", "content": "长" * SEQ_LEN},
+                                           {"role": "assistant", "content": "答案是 A. x"}]},
+                             ensure_ascii=False) + '\n'
+    lines[100:100] = ['\n', long_record]
+    path = tmp_path_factory.mktemp("packed") / "train.jsonl"
+    path.write_text(''.join(lines), encoding='utf-8')
+    return path
+
+
+@pytest.fixture(scope="module")
+def packed(dataset, tmp_path_factory):
+    output_dir = tmp_path_factory.mktemp("packed") / "serial"
+    meta = export_packed(dataset, output_dir, "byte", SEQ_LEN)
+    return meta, PackedDataset(output_dir)
+
+
+def _records(dataset):
+    return [json.loads(line) for line in dataset.read_text(encoding='utf-8').splitlines() if line.strip()]
+
+
+def test_pack_lengths_fits_without_overlap():
+    lengths = np.random.default_rng(0).integers(1, 300, size=500)
+    seq, start = pack_lengths(lengths, 512)
+    used = {}
+    for s, b, n in zip(seq.tolist(), start.tolist(), lengths.tolist()):
+        assert b + n <= 512
+        used.setdefault(s, []).append((b, n))
+    for spans in used.values():
+        spans.sort()
+        assert all(b1 + n1 <= b2 for (b1, n1), (b2, _) in zip(spans, spans[1:]))
+    assert sorted(used) == list(range(len(used)))
+
+
+def test_parallel_matches_serial(dataset, packed, tmp_path):
+    meta, _ = packed
+    parallel_meta = export_packed(dataset, tmp_path / "parallel", "byte", SEQ_LEN, workers=2, chunk_mb=0.02)
+    assert parallel_meta == meta
+    for name in ("input_ids.npy", "loss_mask.npy", "segment_ids.npy", "samples.npy"):
+        assert np.array_equal(np.load(tmp_path / "parallel" / name), np.load(packed[1].path / name)), name
+
+
+def test_samples_and_loss_mask(dataset, packed):
+    meta, data = packed
+    records = _records(dataset)
+    tokenizer = ByteTokenizer()
+    assert meta['samples'] == len(records) - 1 and meta['dropped'] == 1
+    assert 0.5 < meta['fill_rate'] <= 1
+
+    samples = np.asarray(data.samples)
+    # 超长的一条（第 101 条非空行）被跳过
+    assert sorted(samples['row'].tolist()) == [row for row in range(len(records)) if row != 100]
+    for sample in samples[::7]:
+        s, b, n = int(sample['seq']), int(sample['start']), int(sample['length'])
+        ids = data.input_ids[s, b:b + n].tolist()
+        mask = data.loss_mask[s, b:b + n].astype(bool)
+        messages = records[int(sample['row'])]['messages']
+        assistant = next(m['content'] for m in messages if m['role'] == 'assistant')
+        # 计算损失的只有助手回答和它结尾的 <|im_end|>
+        assert tokenizer.decode(np.array(ids)[mask].tolist()) == assistant + IM_END
+        assert tokenizer.decode(ids).startswith("<|im_start|>system\n")
+
+
+def test_positions_and_boundaries(packed):
+    meta, data = packed
+    samples = np.asarray(data.samples)
+    pad_id = meta['pad_id']
+    for index in range(len(data)):
+        item = data[index]
+        mine = np.sort(samples[samples['seq'] == index], order='start')
+        starts, lengths = mine['start'].astype(int), mine['length'].astype(int)
+        end = int(starts[-1] + lengths[-1])
+
+        # 样本首尾相接，末尾是填充
+        assert np.array_equal(starts[1:], (starts + lengths)[:-1]) and starts[0] == 0
+        assert np.all(item['input_ids'][end:] == pad_id) and np.all(item['segment_ids'][end:] == 0)
+        assert np.all(item['labels'][end:] == -100)
+        # 位置编码在每条样本开头归零
+        for segment, (b, n) in enumerate(zip(starts, lengths), 1):
+            assert np.array_equal(item['position_ids'][b:b + n], np.arange(n))
+            assert np.all(item['segment_ids'][b:b + n] == segment)
+        # cu_seqlens 是各样本（以及末尾填充）的边界
+        expected = list(starts) + ([end] if end < SEQ_LEN else []) + [SEQ_LEN]
+        assert item['cu_seqlens'].tolist() == expected
+        assert np.diff(item['cu_seqlens'])[:len(lengths)].tolist() == lengths.tolist()
+
+    batch = next(data.iter_batches(4, shuffle=False))
+    assert batch['input_ids'].shape == (4, SEQ_LEN)
+
+
+def test_reuse_and_rebuild(dataset, tmp_path):
+    output_dir = tmp_path / "out"
+    meta = export_packed(dataset, output_dir, "byte", SEQ_LEN)
+    mtime = (output_dir / "input_ids.npy").stat().st_mtime_ns
+    assert export_packed(dataset, output_dir, "byte", SEQ_LEN) == meta
+    assert (output_dir / "input_ids.npy").stat().st_mtime_ns == mtime
+
+    # 参数变化后重新导出
+    smaller = export_packed(dataset, output_dir, "byte", SEQ_LEN // 2)
+    assert smaller['seq_len'] == SEQ_LEN // 2 and smaller['dropped'] > meta['dropped']
+    assert np.load(output_dir / "input_ids.npy").shape[1] == SEQ_LEN // 2
@@ -0,0 +1,81 @@
+"""--fast 转换路径与标准路径逐字节一致（orjson 和标准库两种 JSON 后端）"""
+
+import json
+from json.encoder import encode_basestring
+
+import pytest
+
+import convert_to_bailian_format as converter
+from conftest import warning_lines
+from convert_to_bailian_format import FastLineEncoder, convert_line, convert_to_bailian_format
+
+SYSTEM_PROMPT = '系统提示 "quoted" \\   😀'
+
+EDGE_LINES = [
+    '{"question": "患者（　　）。", "options": {"A": "甲", "B": "乙"}, "answer_idx": "A", "answer": "甲"}',
+    '{"question": "tab\\there \\"q\\" back\\\\slash", "options": {"A": "<0.05", "B": "μg α/β ©"}, '
+    '"answer_idx": "B", "answer": "μg α/β ©"}',
+    '{"question": "control \\u0001 \\u001f and \\u2028 \\u2029", "options": {"A": "😀"}, "answer_idx": "A"}',
+    '{"question": "no options"}',
+    '{"question": "numeric option", "options": {"A": 1, "B": 2.5}, "answer_idx": "A", "answer": 1}',
+    '{"question": "nested", "options": {"A": {"x": 1}}, "answer_idx": "A", "answer": "x"}',
+    '{"question": "NaN", "options": {"A": NaN}, "answer_idx": "A", "answer": "a"}',
+    '{"question": "dup", "question": "second wins", "options": {}, "answer_idx": "", "answer": ""}',
+    '{"question": "big", "options": {"A": 123456789012345678901234567890}, "answer_idx": "A"}',
+    '{"question": "options list", "options": ["a", "b"], "answer_idx": "A"}',
+    '{"question": null, "options": {"A": "a"}, "answer_idx": "A", "answer": "a"}',
+    '   {"question": "padded", "options": {"A": "a"}, "answer_idx": "A", "answer": "a"}   \t',
+    '[1, 2, 3]',
+    '"just a string"',
+    '{bad json',
+    '',
+    '   ',
+]
+
+
+def _outcome(func, *args):
+    try:
+        return func(*args)
+    except Exception as e:
+        return type(e).__name__
+
+
+@pytest.fixture(params=["orjson", "stdlib"])
+def json_backend(request, monkeypatch):
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+        if converter.orjson is None:
+            pytest.skip("convert_to_bailian_format 未使用 orjson")
+    else:
+        monkeypatch.setattr(converter, "_fast_json_loads", lambda raw: json.loads(raw.decode('utf-8')))
+        monkeypatch.setattr(converter, "_encode_json_string", lambda value: encode_basestring(value).encode('utf-8'))
+    return request.param
+
+
+@pytest.mark.parametrize("line", EDGE_LINES)
+def test_fast_encoder_matches_convert_line(json_backend, line):
+    encoder = FastLineEncoder(SYSTEM_PROMPT)
+    raw = (line + '\n').encode('utf-8')
+    assert _outcome(encoder.convert, raw) == _outcome(convert_line, line + '\n', SYSTEM_PROMPT)
+
+
+def test_fast_conversion_is_byte_identical(json_backend, tmp_path, medqa_file, capfd):
+    standard = tmp_path / "standard.jsonl"
+    fast = tmp_path / "fast.jsonl"
+
+    counts = convert_to_bailian_format(str(medqa_file), str(standard), SYSTEM_PROMPT)
+    standard_warnings = warning_lines(capfd.readouterr().out)
+    assert convert_to_bailian_format(str(medqa_file), str(fast), SYSTEM_PROMPT, fast=True) == counts
+    assert warning_lines(capfd.readouterr().out) == standard_warnings
+    assert fast.read_bytes() == standard.read_bytes()
+
+
+def test_fast_conversion_handles_mixed_newlines(tmp_path):
+    source = tmp_path / "crlf.jsonl"
+    record = '{"question": "q", "options": {"A": "a"}, "answer_idx": "A", "answer": "a"}'
+    source.write_bytes(f'{record}\r\n{record}\r{record}\n\r\n{record}'.encode())
+
+    standard, fast = tmp_path / "standard.jsonl", tmp_path / "fast.jsonl"
+    assert convert_to_bailian_format(str(source), str(standard)) == (4, 0)
+    assert convert_to_bailian_format(str(source), str(fast), fast=True) == (4, 0)
+    assert fast.read_bytes() == standard.read_bytes()
@@ -0,0 +1,166 @@
+"""超参数搜索：搜索空间校验与展开、并发上限、重试、续跑，以及结果汇总"""
+
+import json
+
+import pytest
+
+import hyper_sweep
+from hyper_sweep import HyperSweep, expand_configs, final_metrics, load_spec
+from state_store import StateStore
+
+BASE_PARAMS = {"n_epochs": 1, "learning_rate": "1e-4", "lora_rank": 8, "batch_size": 16}
+
+
+def _spec(tmp_path, spec):
+    path = tmp_path / "sweep.json"
+    path.write_text(json.dumps(spec), encoding='utf-8')
+    return load_spec(path)
+
+
+@pytest.mark.parametrize("spec", [
+    {"method": "bayes", "parameters": {"lora_rank": [8]}},
+    {"parameters": {}},
+    {"parameters": {"lora_rank": []}},
+    {"parameters": {"lora_rank": {"min": 8, "max": 64}}},
+    {"method": "random", "parameters": {"learning_rate": {"min": 1e-5}}},
+    {"method": "random", "parameters": {"learning_rate": {"min": 0, "max": 1e-3, "log": True}}},
+])
+def test_invalid_specs(tmp_path, spec):
+    with pytest.raises(ValueError):
+        _spec(tmp_path, spec)
+
+
+def test_grid_expansion(tmp_path):
+    spec = _spec(tmp_path, {"parameters": {"lora_rank": [16, 32], "learning_rate": ["1e-4", "5e-5"]},
+                            "fixed": {"n_epochs": 2}})
+    configs = expand_configs(spec, BASE_PARAMS)
+    assert configs == [
+        {"n_epochs": 2, "lora_rank": 16, "learning_rate": "1e-4"},
+        {"n_epochs": 2, "lora_rank": 16, "learning_rate": "5e-5"},
+        {"n_epochs": 2, "lora_rank": 32, "learning_rate": "1e-4"},
+        {"n_epochs": 2, "lora_rank": 32, "learning_rate": "5e-5"},
+    ]
+
+    # 重复的候选值只产生一组
+    spec = _spec(tmp_path, {"parameters": {"lora_rank": [16, 16, 32]}})
+    assert expand_configs(spec, BASE_PARAMS) == [{"lora_rank": 16}, {"lora_rank": 32}]
+
+
+def test_random_expansion(tmp_path):
+    spec = _spec(tmp_path, {
+        "method": "random", "trials": 6, "seed": 3,
+        "parameters": {
+            "learning_rate": {"min": 1e-5, "max": 1e-3, "log": True},
+            "lora_rank": {"min": 8, "max": 64},
+            "lora_dropout": {"min": 0.0, "max": 0.2},
+            "batch_size": [8, 16],
+        },
+    })
+    configs = expand_configs(spec, BASE_PARAMS)
+    assert len(configs) == 6
+    assert configs == expand_configs(spec, BASE_PARAMS)
+    assert len({json.dumps(c, sort_keys=True) for c in configs}) == 6
+    for config in configs:
+        # 类型与 .env 中的同名超参数一致
+        assert isinstance(config["learning_rate"], str) and 1e-5 <= float(config["learning_rate"]) <= 1e-3
+        assert isinstance(config["lora_rank"], int) and 8 <= config["lora_rank"] <= 64
+        assert isinstance(config["lora_dropout"], float)
+        assert config["batch_size"] in (8, 16)
+
+    # 候选组合不足 trials 组时不会无限抽取
+    spec = _spec(tmp_path, {"method": "random", "trials": 10, "seed": 1, "parameters": {"lora_rank": [8, 16]}})
+    assert sorted(c["lora_rank"] for c in expand_configs(spec, BASE_PARAMS)) == [8, 16]
+
+
+def test_final_metrics():
+    status = {"status": "SUCCEEDED", "trained_tokens": 1200, "final_loss": 0.4, "val_acc": 0.8,
+              "usage": 3, "succeeded": True, "model": "qwen-turbo"}
+    assert final_metrics(status) == {"trained_tokens": 1200, "final_loss": 0.4, "val_acc": 0.8}
+    assert final_metrics(None) == {}
+
+
+class FakeAutomation:
+    """按顺序结束任务的替身：create 可以先失败若干次，监控时记录同时运行的任务数"""
+
+    base_model = "qwen-turbo"
+    training_type = "efficient_sft"
+
+    def __init__(self, state, failures=0):
+        self.state = state
+        self.failures = failures
+        self.created = []
+        self.max_running = 0
+
+    def job_hyper_params(self, overrides):
+        return dict(BASE_PARAMS, **overrides)
+
+    def create_fine_tune_job(self, train_file_ids, validation_file_ids=None, hyper_params=None):
+        if self.failures:
+            self.failures -= 1
+            return None
+        job_id = f"ft-{len(self.created) + 1}"
+        self.created.append(job_id)
+        self.state.record_job(job_id, self.base_model, self.training_type, self.job_hyper_params(hyper_params),
+                              train_file_ids, validation_file_ids)
+        return job_id
+
+    def monitor_jobs(self, job_ids, on_finished=None):
+        running = list(job_ids)
+        finished = {}
+        while running:
+            self.max_running = max(self.max_running, len(running))
+            job_id = running.pop(0)
+            status = {"status": "SUCCEEDED", "fine_tuned_model": f"model-{job_id}", "trained_tokens": 100}
+            self.state.record_status(job_id, status)
+            finished[job_id] = status
+            running.extend(on_finished(job_id, status))
+        return finished
+
+
+@pytest.fixture
+def state(tmp_path):
+    state = StateStore(tmp_path / "state.sqlite", "http://mock", "sk-test")
+    yield state
+    state.close()
+
+
+CONFIGS = [{"lora_rank": rank} for rank in (8, 16, 32, 64, 128)]
+
+
+def test_run_respects_concurrency_and_resumes(state, tmp_path, capsys):
+    automation = FakeAutomation(state)
+    sweep = HyperSweep(automation, CONFIGS, "file-train", max_concurrent=2)
+    trials = sweep.run()
+    assert [trial['status'] for trial in trials] == ["SUCCEEDED"] * 5
+    assert [trial['fine_tuned_model'] for trial in trials] == [f"model-ft-{i}" for i in range(1, 6)]
+    assert automation.max_running == 2
+    assert sweep.swept_keys == ["lora_rank"]
+
+    sweep.print_results()
+    assert "SUCCEEDED: 5" in capsys.readouterr().out
+    sweep.save(tmp_path / "results.jsonl")
+    records = [json.loads(line) for line in (tmp_path / "results.jsonl").read_text(encoding='utf-8').splitlines()]
+    assert records[0]['hyper_params'] == dict(BASE_PARAMS, lora_rank=8)
+    assert records[0]['metrics'] == {"trained_tokens": 100}
+
+    # 同一个搜索空间重新运行：已完成的组合全部沿用，不再创建任务
+    rerun = FakeAutomation(state)
+    trials = HyperSweep(rerun, CONFIGS, "file-train", max_concurrent=2).run()
+    assert rerun.created == []
+    assert all(trial['resumed'] and trial['status'] == "SUCCEEDED" for trial in trials)
+    assert trials[0]['fine_tuned_model'] == "model-ft-1"
+
+
+def test_submit_retries(state, monkeypatch, capsys):
+    monkeypatch.setattr(hyper_sweep, "SUBMIT_RETRY_BASE", 0)
+    monkeypatch.setattr(hyper_sweep.time, "sleep", lambda seconds: None)
+
+    automation = FakeAutomation(state, failures=hyper_sweep.SUBMIT_RETRIES)
+    trials = HyperSweep(automation, CONFIGS[:2], "file-train", max_concurrent=1).run()
+    assert [trial['status'] for trial in trials] == ["SUCCEEDED", "SUCCEEDED"]
+    assert capsys.readouterr().out.count("创建任务失败") == hyper_sweep.SUBMIT_RETRIES
+
+    # 重试用尽后记为 SUBMIT_FAILED，继续提交下一组
+    automation = FakeAutomation(state, failures=hyper_sweep.SUBMIT_RETRIES + 1)
+    trials = HyperSweep(automation, [{"lora_rank": 256}, {"lora_rank": 512}], "file-train").run()
+    assert [trial['status'] for trial in trials] == ["SUBMIT_FAILED", "SUCCEEDED"]
@@ -0,0 +1,117 @@
+"""行偏移索引：分块扫描、按行随机访问、分片数据集，以及确定性的抽样与划分"""
+
+import json
+import shutil
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from convert_to_bailian_format import ShardedJsonlWriter, shard_manifest_path
+from line_index import (
+    LineIndex,
+    build_line_index,
+    index_paths,
+    reservoir_sample,
+    sample_rows,
+    scan_lines,
+    shuffled_rows,
+    split_rows,
+)
+
+
+def _non_empty_lines(data):
+    return [line for line in data.splitlines(keepends=True) if line.strip()]
+
+
+@pytest.fixture
+def dataset(tmp_path, converted_file):
+    path = tmp_path / "train.jsonl"
+    shutil.copy(converted_file, path)
+    return path
+
+
+@pytest.mark.parametrize("block_bytes", [7, 64, 1 << 20])
+def test_scan_lines_block_boundaries(tmp_path, block_bytes):
+    data = b'{"a": 1}\n\n  \t\n' + b'x' * 200 + b'\r\n\n{"b": 2}\n   {"c": 3}'
+    path = tmp_path / "mixed.jsonl"
+    path.write_bytes(data)
+
+    starts, lengths = scan_lines(path, block_bytes=block_bytes)
+    lines = [data[s:s + n] for s, n in zip(starts.tolist(), lengths.tolist())]
+    assert lines == _non_empty_lines(data)
+
+    path.write_bytes(b'')
+    assert len(scan_lines(path)[0]) == 0
+
+
+def test_rows_match_lines(dataset):
+    lines = _non_empty_lines(dataset.read_bytes())
+    with LineIndex(dataset) as index:
+        assert len(index) == len(lines)
+        for row in (0, 1, len(lines) // 2, len(lines) - 1):
+            assert bytes(index.view(row)) == lines[row]
+            assert index[row] == json.loads(lines[row])
+        assert set(index.answers()) <= set("ABCDE") | {''}
+    assert all(path.exists() for path in index_paths(dataset))
+
+
+def test_index_reuse_and_rebuild(dataset):
+    first = build_line_index(dataset)
+    assert isinstance(first, np.memmap)
+    assert np.array_equal(build_line_index(dataset), first)
+
+    with open(dataset, 'ab') as f:
+        f.write(b'{"messages": []}\n')
+    assert len(build_line_index(dataset)) == len(first) + 1
+
+
+def test_sharded_dataset_and_write(tmp_path, dataset):
+    lines = _non_empty_lines(dataset.read_bytes())
+    sharded = tmp_path / "sharded" / "train.jsonl"
+    sharded.parent.mkdir()
+    with ShardedJsonlWriter(sharded, 200 * 1024) as writer:
+        for line in lines:
+            writer.write(line)
+    assert len(writer.shards) > 1
+    manifest = shard_manifest_path(sharded)
+
+    rows = shuffled_rows(len(lines), seed=1)[:500]
+    with LineIndex(manifest) as index:
+        assert len(index) == len(lines)
+        assert [bytes(index.view(int(row))) for row in rows[:50]] == [lines[row] for row in rows[:50]]
+        written = index.write(rows, tmp_path / "subset.jsonl", max_shard_mb=None)
+    assert written.read_bytes() == b''.join(lines[row] for row in rows)
+
+
+def test_sampling_is_deterministic_and_stratified():
+    labels = np.array(list("A" * 600 + "B" * 300 + "C" * 100))
+    assert np.array_equal(shuffled_rows(1000, seed=3), shuffled_rows(1000, seed=3))
+    assert not np.array_equal(shuffled_rows(1000, seed=3), shuffled_rows(1000, seed=4))
+
+    rows = sample_rows(len(labels), 100, seed=5, labels=labels)
+    assert np.array_equal(rows, sample_rows(len(labels), 100, seed=5, labels=labels))
+    assert np.all(np.diff(rows) > 0)
+    assert Counter(labels[rows].tolist()) == {"A": 60, "B": 30, "C": 10}
+    assert len(sample_rows(10, 50)) == 10
+
+    train, val = split_rows(len(labels), 0.9, seed=5, labels=labels)
+    assert len(train) == 900 and len(val) == 100
+    assert np.array_equal(np.sort(np.concatenate([train, val])), np.arange(len(labels)))
+    assert Counter(labels[val].tolist()) == {"A": 60, "B": 30, "C": 10}
+    again = split_rows(len(labels), 0.9, seed=5, labels=labels)
+    assert np.array_equal(again[0], train) and np.array_equal(again[1], val)
+
+    train, val = split_rows(10, 0.7)
+    assert len(train) == 7 and not set(train.tolist()) & set(val.tolist())
+
+
+def test_reservoir_sample(dataset):
+    lines = _non_empty_lines(dataset.read_bytes())
+    sample = reservoir_sample(dataset, 100, seed=9)
+    assert sample == reservoir_sample(dataset, 100, seed=9)
+    assert len(sample) == 100 and len(set(sample)) == 100
+    # 按在数据集中的顺序排列
+    positions = [lines.index(line) for line in sample]
+    assert positions == sorted(positions)
+    assert reservoir_sample(dataset, len(lines) + 10) == lines
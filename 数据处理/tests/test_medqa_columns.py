@@ -0,0 +1,139 @@
+"""MedQA 列式缓存：字段还原、筛选、复用与重建，以及基于缓存的转换和去重与逐行解析一致"""
+
+import json
+import shutil
+
+import numpy as np
+import pytest
+
+import medqa_columns
+from batch_convert import batch_convert
+from conftest import warning_lines
+from dedup import deduplicate
+from medqa_columns import META_FILE_NAME, build_columns
+
+# 需要回到源文件的行：\r、非字符串字段、非对象；空行只占行号
+EDGE_LINES = [
+    '{"question": "Q1", "options": {"A": "x", "B": "y"}, "answer": "x", "answer_idx": "A", "meta_info": "step1"}',
+    '',
+    '{"question": "Q2\\r", "options": {"A": "x\\ry"}, "answer": "x", "answer_idx": "A"}',
+    '   ',
+    '{"question": 3, "options": {"A": "x"}, "answer": "x", "answer_idx": "A"}',
+    '{"question": "Q4", "options": {"A": "x"}, "answer": "x", "answer_idx": "A", "meta_info": {"k": 1}}',
+    '[1, 2]',
+    '{"question": "Q5", "options": {"B": "b", "A": "a"}, "answer": "a", "answer_idx": "A"}',
+]
+
+
+@pytest.fixture
+def questions(tmp_path, medqa_file):
+    """datasets/MedQA/questions 的目录结构：一个大的 train 和一个含各种边界行的 test"""
+    root = tmp_path / "questions"
+    train = root / "Mainland" / "4_options" / "phrases_no_exclude_train.jsonl"
+    test = root / "Mainland" / "4_options" / "phrases_no_exclude_test.jsonl"
+    other = root / "US" / "test.jsonl"
+    for path in (train, test, other):
+        path.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copy(medqa_file, train)
+    test.write_text('\n'.join(EDGE_LINES) + '\n\n', encoding='utf-8')
+    other.write_text(EDGE_LINES[0] + '\n', encoding='utf-8')
+    return root
+
+
+def _source_records(root):
+    """按缓存的行顺序逐行解析源文件（空行跳过）"""
+    records = []
+    for path in sorted(root.rglob("*.jsonl")):
+        for line in path.read_bytes().splitlines():
+            if line.strip():
+                records.append(line)
+    return records
+
+
+@pytest.mark.parametrize("storage", ["parquet", "numpy"])
+def test_records_round_trip(questions, tmp_path, monkeypatch, storage):
+    if storage == "numpy":
+        monkeypatch.setattr(medqa_columns, "pa", None)
+    elif medqa_columns.pa is None:
+        pytest.skip("未安装 pyarrow")
+
+    columns = build_columns(questions, tmp_path / ".columns")
+    meta = json.loads((tmp_path / ".columns" / META_FILE_NAME).read_text(encoding='utf-8'))
+    assert meta['storage'] == storage
+
+    lines = _source_records(questions)
+    assert len(columns) == len(lines)
+    for row, line in enumerate(lines):
+        if columns.fallback[row]:
+            assert columns.raw_line(row).strip() == line
+            continue
+        data = json.loads(line)
+        if not isinstance(data.get('meta_info', ''), str):
+            data['meta_info'] = json.dumps(data['meta_info'], ensure_ascii=False)
+        assert columns.record(row) == dict({'meta_info': ''}, **data)
+    # 选项保持原始顺序
+    row = next(row for row, line in enumerate(lines) if b'"Q5"' in line)
+    assert list(columns.options(row)) == ["B", "A"]
+    assert int(columns.fallback.sum()) >= 3
+
+
+def test_select(questions, tmp_path):
+    columns = build_columns(questions, tmp_path / ".columns")
+    train = questions / "Mainland" / "4_options" / "phrases_no_exclude_train.jsonl"
+    assert np.array_equal(columns.select(split="train"), columns.select(source=train))
+    assert len(columns.select(region="US")) == 1
+    assert len(columns.select(region="Mainland", split="test")) == len([l for l in EDGE_LINES if l.strip()])
+    assert len(columns.select(region="Taiwan")) == 0
+    assert np.all(columns.num_options[columns.select(num_options=2)] == 2)
+
+
+def test_reuse_and_rebuild_keep_other_files(questions, tmp_path, monkeypatch):
+    columns_dir = tmp_path / ".columns"
+    build_columns(questions, columns_dir)
+    (columns_dir / "notes.txt").write_text("keep me", encoding='utf-8')
+
+    def fail(path):
+        raise AssertionError("缓存应被复用")
+
+    monkeypatch.setattr(medqa_columns, "_scan_source", fail)
+    rows = len(build_columns(questions, columns_dir))
+    monkeypatch.undo()
+
+    other = questions / "US" / "test.jsonl"
+    with open(other, 'a', encoding='utf-8') as f:
+        f.write(EDGE_LINES[0] + '\n')
+    assert len(build_columns(questions, columns_dir)) == rows + 1
+    assert (columns_dir / "notes.txt").read_text(encoding='utf-8') == "keep me"
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_conversion_with_columns_is_identical(questions, tmp_path, capsys, workers):
+    datasets = [
+        ("Mainland/4_options/phrases_no_exclude_train.jsonl", "mainland_4opt_train.jsonl"),
+        ("Mainland/4_options/phrases_no_exclude_test.jsonl", "mainland_4opt_test.jsonl"),
+    ]
+    plain, cached = tmp_path / "plain", tmp_path / "cached"
+    batch_convert(input_dir=questions, output_dir=plain, datasets=datasets, workers=workers, chunk_mb=0.1)
+    plain_log = capsys.readouterr().out
+    batch_convert(input_dir=questions, output_dir=cached, datasets=datasets, workers=workers, chunk_mb=0.1,
+                  use_columns=True)
+    cached_log = capsys.readouterr().out
+
+    assert "使用列式缓存" in cached_log
+    assert (tmp_path / ".columns" / META_FILE_NAME).exists()
+    for _, output_name in datasets:
+        assert (cached / output_name).read_bytes() == (plain / output_name).read_bytes()
+    assert warning_lines(cached_log) == warning_lines(plain_log)
+
+
+def test_dedup_with_columns_is_identical(questions, tmp_path):
+    columns = build_columns(questions, tmp_path / ".columns")
+    datasets = [
+        ("mainland_4opt_train.jsonl", questions / "Mainland" / "4_options" / "phrases_no_exclude_train.jsonl"),
+        ("mainland_4opt_test.jsonl", questions / "Mainland" / "4_options" / "phrases_no_exclude_test.jsonl"),
+    ]
+    plain = deduplicate(datasets)
+    cached = deduplicate(datasets, columns=columns)
+    assert cached['duplicates'] == plain['duplicates']
+    assert cached['drop'] == plain['drop']
+    assert cached['stats'] == plain['stats']
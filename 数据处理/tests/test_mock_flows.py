@@ -0,0 +1,110 @@
+"""基于本地替身服务（mock_dashscope）的端到端流程：上传、复用、创建任务、监控、评测和流式调用"""
+
+import json
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("uvicorn")
+dashscope = pytest.importorskip("dashscope")
+
+from convert_to_bailian_format import convert_to_bailian_format, shard_manifest_path
+from mock_dashscope import MockSettings, start_server
+from upload_registry import UploadRegistry
+
+
+@pytest.fixture(scope="module")
+def mock_server():
+    settings = MockSettings(latency_ms=1, jitter_ms=0, generation_latency_ms=1, pending_seconds=0.2,
+                            running_seconds=0.4, token_latency_ms=1)
+    server, api_base = start_server(settings)
+    yield server, api_base
+    server.should_exit = True
+
+
+@pytest.fixture
+def automation(isolated_env, mock_server, monkeypatch):
+    server, api_base = mock_server
+    server.config.app.state.settings.error_rate = 0.0
+    monkeypatch.setenv("DASHSCOPE_API_BASE", api_base)
+    monkeypatch.setenv("DASHSCOPE_HTTP_BASE_URL", api_base)
+    monkeypatch.setattr(dashscope, "base_http_api_url", api_base)
+
+    from fine_tune_automation import FineTuneAutomation
+
+    automation = FineTuneAutomation()
+    automation.response_cache = None
+    automation.upload_registry = UploadRegistry(isolated_env / "registry.json", automation.api_base,
+                                                automation.api_key)
+    yield automation
+    automation.http.close()
+    automation.state.close()
+
+
+def _requests(mock_server):
+    return mock_server[0].config.app.state.counters['requests']
+
+
+def test_upload_reuse_create_and_monitor(automation, mock_server, converted_file, tmp_path):
+    validation = tmp_path / "validation.jsonl"
+    validation.write_bytes(b''.join(converted_file.read_bytes().splitlines(keepends=True)[:50]))
+
+    train_id, validation_id = automation.upload_files([converted_file, validation])
+    assert train_id and validation_id and train_id != validation_id
+
+    # 内容未变化的文件直接复用登记的 File ID，不再发请求
+    before = _requests(mock_server)
+    assert automation.upload_files([converted_file, validation]) == [train_id, validation_id]
+    assert _requests(mock_server) == before
+    upload_phases = [phase for phase in automation.metrics.phases if phase['phase'] == 'upload']
+    assert upload_phases[0]['bytes'] > 0 and upload_phases[1]['bytes'] == 0
+
+    job_id = automation.create_fine_tune_job(train_id, validation_id)
+    assert automation.state.latest_job_id() == job_id
+
+    final = automation.monitor_jobs([job_id], min_interval=0.05, max_interval=0.1)
+    assert final[job_id]['status'] == "SUCCEEDED"
+    assert automation.state.latest_model() == final[job_id]['fine_tuned_model']
+
+
+def test_sharded_dataset_uploads_every_shard(automation, medqa_file, tmp_path):
+    output = tmp_path / "train.jsonl"
+    convert_to_bailian_format(str(medqa_file), str(output), max_shard_bytes=512 * 1024)
+    manifest = shard_manifest_path(output)
+    with open(manifest, encoding='utf-8') as f:
+        shards = json.load(f)['shards']
+
+    [file_ids] = automation.upload_files([manifest])
+    assert len(file_ids) == len(shards) > 1
+    assert len(set(file_ids)) == len(file_ids)
+
+
+def test_evaluate_against_mock(automation, converted_file, tmp_path):
+    output = tmp_path / "eval.jsonl"
+    summary = automation.evaluate_model("qwen-mock", str(converted_file), output_file=str(output),
+                                        concurrency=4, limit=20)
+
+    assert summary['total'] == 20 and summary['errors'] == 0
+    assert summary['accuracy'] is not None
+    with open(output, encoding='utf-8') as f:
+        assert len(f.readlines()) == 20
+
+    # 已完成的题目续跑时跳过
+    assert automation.evaluate_model("qwen-mock", str(converted_file), output_file=str(output), limit=20)['total'] == 20
+    with open(output, encoding='utf-8') as f:
+        assert len(f.readlines()) == 20
+
+
+def test_streaming_call_records_latency_and_errors(automation, mock_server):
+    from stream_inference import LatencyRecorder, streaming_call
+
+    messages = [{'role': 'user', 'content': "题目\nA. 甲\nB. 乙"}]
+    recorder = LatencyRecorder("qwen-mock")
+    text = streaming_call("qwen-mock", api_key="sk-test", recorder=recorder)(messages)
+    assert text
+    assert recorder.summary()['requests'] == 1
+
+    mock_server[0].config.app.state.settings.error_rate = 1.0
+    with pytest.raises(Exception):
+        streaming_call("qwen-mock", api_key="sk-test", recorder=recorder, max_retries=0)(messages)
+    assert recorder.errors == 1
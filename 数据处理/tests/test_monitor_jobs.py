@@ -0,0 +1,117 @@
+"""多任务监控：自适应轮询间隔（按倍数放慢、最短/最长间隔限制）、结束条件和任务结束后补充新任务"""
+
+import asyncio
+import threading
+
+import pytest
+
+from fine_tune_automation import FineTuneAutomation
+
+
+@pytest.fixture
+def automation(isolated_env):
+    return FineTuneAutomation()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """记录每次轮询前的等待时间，不真正等待（只替换运行监控的线程中的等待）"""
+    recorded = []
+    real_sleep = asyncio.sleep
+    thread_id = threading.get_ident()
+
+    async def sleep(delay, *args, **kwargs):
+        if threading.get_ident() != thread_id:
+            return await real_sleep(delay, *args, **kwargs)
+        recorded.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    return recorded
+
+
+def _script(automation, monkeypatch, scripts):
+    """get_job_status 按任务依次返回脚本中的状态（None 表示查询失败）"""
+    polls = {job_id: 0 for job_id in scripts}
+
+    def get_job_status(job_id):
+        status = scripts[job_id][polls[job_id]]
+        polls[job_id] += 1
+        return None if status is None else {"status": status, "fine_tuned_model": f"model-{job_id}"}
+
+    monkeypatch.setattr(automation, "get_job_status", get_job_status)
+    return polls
+
+
+def test_interval_backs_off_and_resets_on_change(automation, monkeypatch, sleeps):
+    script = ["PENDING", "PENDING", None, "PENDING", "RUNNING"] + ["RUNNING"] * 5 + ["SUCCEEDED"]
+    polls = _script(automation, monkeypatch, {"ft-1": script})
+
+    final = automation.monitor_jobs(["ft-1"], min_interval=5, max_interval=30, backoff=2)
+    assert final["ft-1"]["status"] == "SUCCEEDED"
+    assert polls["ft-1"] == len(script)
+    # 状态不变时翻倍，查询失败时保持，状态变化时回到最短间隔，最长不超过 30 秒
+    assert sleeps == [5, 10, 10, 20, 5, 10, 20, 30, 30, 30]
+
+
+def test_intervals_from_env_and_clamped(automation, monkeypatch, sleeps):
+    monkeypatch.setenv("MONITOR_MIN_INTERVAL", "8")
+    monkeypatch.setenv("MONITOR_MAX_INTERVAL", "3")
+    _script(automation, monkeypatch, {"ft-1": ["RUNNING"] * 4 + ["FAILED"]})
+
+    final = automation.monitor_jobs(["ft-1"])
+    assert final["ft-1"]["status"] == "FAILED"
+    # 最长间隔小于最短间隔时按最短间隔轮询
+    assert sleeps == [8] * 4
+
+
+def test_jobs_are_watched_independently(automation, monkeypatch, sleeps, capsys):
+    polls = _script(automation, monkeypatch, {
+        "ft-1": ["RUNNING", "SUCCEEDED"],
+        "ft-2": ["PENDING"] * 6 + ["CANCELLED"],
+    })
+
+    final = automation.monitor_jobs(["ft-1", "ft-2"], min_interval=1, max_interval=4)
+    assert {job_id: data["status"] for job_id, data in final.items()} == {"ft-1": "SUCCEEDED", "ft-2": "CANCELLED"}
+    # 结束的任务不再查询
+    assert polls == {"ft-1": 2, "ft-2": 7}
+    # 只在状态变化时输出，多个任务时带上任务 ID
+    out = capsys.readouterr().out
+    assert out.count("ft-2 状态: ⏳ 等待中") == 1
+    assert "ft-1 状态: ✅ 成功" in out
+
+
+def test_finished_jobs_queue_new_ones(automation, monkeypatch, sleeps, capsys):
+    polls = _script(automation, monkeypatch, {
+        "ft-1": ["RUNNING", "SUCCEEDED"],
+        "ft-2": ["RUNNING", "FAILED"],
+        "ft-3": ["PENDING", "SUCCEEDED"],
+    })
+    finished = []
+
+    def on_finished(job_id, status_data):
+        finished.append((job_id, status_data["status"]))
+        # 第一个任务结束后提交排队中的任务
+        return ["ft-3"] if job_id == "ft-1" else []
+
+    final = automation.monitor_jobs(["ft-1", "ft-2"], min_interval=1, on_finished=on_finished)
+    assert sorted(finished) == [("ft-1", "SUCCEEDED"), ("ft-2", "FAILED"), ("ft-3", "SUCCEEDED")]
+    assert set(final) == {"ft-1", "ft-2", "ft-3"}
+    assert polls == {"ft-1": 2, "ft-2": 2, "ft-3": 2}
+    assert "开始监控新任务: ft-3" in capsys.readouterr().out
+
+
+def test_failing_callback_does_not_stop_monitoring(automation, monkeypatch, sleeps, capsys):
+    _script(automation, monkeypatch, {
+        "ft-1": ["SUCCEEDED"],
+        "ft-2": ["RUNNING", "RUNNING", "SUCCEEDED"],
+    })
+
+    def on_finished(job_id, status_data):
+        if job_id == "ft-1":
+            raise RuntimeError("创建任务失败")
+        return []
+
+    final = automation.monitor_jobs(["ft-1", "ft-2"], min_interval=1, on_finished=on_finished)
+    assert {job_id: data["status"] for job_id, data in final.items()} == {"ft-1": "SUCCEEDED", "ft-2": "SUCCEEDED"}
+    assert "任务 ft-1 结束后的处理出错: 创建任务失败" in capsys.readouterr().out
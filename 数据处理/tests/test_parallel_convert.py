@@ -0,0 +1,92 @@
+"""batch_convert 多进程分段转换：输出、计数和警告行号与串行转换一致"""
+
+import re
+
+import pytest
+
+import batch_convert as batch
+import convert_to_bailian_format as converter
+from batch_convert import SYSTEM_PROMPT, batch_convert
+from conftest import warning_lines
+from convert_to_bailian_format import convert_to_bailian_format, count_lines, split_byte_ranges
+
+
+def test_split_byte_ranges_are_line_aligned_and_cover_file(medqa_file):
+    data = medqa_file.read_bytes()
+    ranges = split_byte_ranges(medqa_file, 7)
+
+    assert len(ranges) == 7
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+        assert data[start - 1:start] == b'\n'
+
+
+@pytest.mark.parametrize("buffer_size", [1, 2, 3, 1 << 20])
+def test_count_lines_matches_text_mode(tmp_path, monkeypatch, buffer_size):
+    monkeypatch.setattr(converter, "READ_BUFFER_SIZE", buffer_size)
+    data = b'a\nb\r\nc\rd\r\n\r\n\re\n\nlast'
+    path = tmp_path / "mixed.jsonl"
+    path.write_bytes(data)
+    with open(path, 'r', encoding='utf-8') as f:
+        expected = len(f.readlines())
+
+    assert count_lines(path) == expected
+    # 在每个行首切开，两段之和仍是总行数（读缓冲很小时 \r\n 会被切在两次读取之间）
+    line_starts = [cut for cut in range(1, len(data))
+                   if data[cut - 1:cut] == b'\n' or (data[cut - 1:cut] == b'\r' and data[cut:cut + 1] != b'\n')]
+    assert len(line_starts) == expected - 1
+    for cut in line_starts:
+        assert count_lines(path, 0, cut) + count_lines(path, cut) == expected
+
+
+def _run_batch(medqa_file, output_dir, workers, chunk_mb, fast):
+    return batch_convert(workers=workers, chunk_mb=chunk_mb, max_shard_mb=None, fast=fast, force=True,
+                         input_dir=medqa_file.parent, output_dir=output_dir,
+                         datasets=[(medqa_file.name, "train.jsonl")])
+
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_parallel_output_matches_serial(tmp_path, medqa_file, capfd, fast):
+    serial = tmp_path / "serial.jsonl"
+    converted, skipped = convert_to_bailian_format(str(medqa_file), str(serial), SYSTEM_PROMPT, fast=fast)
+    serial_warnings = warning_lines(capfd.readouterr().out)
+
+    # 约 1MB 的输入按 0.1MB 切成十来个分段
+    results = _run_batch(medqa_file, tmp_path / "parallel", workers=2, chunk_mb=0.1, fast=fast)
+    parallel_warnings = warning_lines(capfd.readouterr().out)
+
+    assert len(results) == 1
+    assert (results[0]['converted'], results[0]['skipped']) == (converted, skipped)
+    assert (tmp_path / "parallel" / "train.jsonl").read_bytes() == serial.read_bytes()
+    assert skipped > 0
+    assert parallel_warnings == serial_warnings
+
+
+def test_parallel_warning_line_numbers_are_file_relative(tmp_path, capfd, monkeypatch):
+    input_dir = tmp_path / "in"
+    input_dir.mkdir()
+    good = ('{"question": "q", "options": {"A": "a", "B": "b"}, "answer_idx": "A"}\n' * 2000).encode()
+    # 坏行分布在多个分段，CRLF 和空行使字节偏移与行号不成比例
+    (input_dir / "data.jsonl").write_bytes(b'{bad\n' + good + b'\r\n\n' + good + b'{bad json\n' + good + b'[]\n')
+    # 各分段自己返回行数，不再预先统计
+    def count_lines(*args):
+        pytest.fail("多统计了一遍行数")
+    monkeypatch.setattr(converter, "count_lines", count_lines)
+    monkeypatch.setattr(batch, "count_lines", count_lines, raising=False)
+
+    batch_convert(workers=2, chunk_mb=0.05, max_shard_mb=None, force=True, input_dir=input_dir,
+                  output_dir=tmp_path / "out", datasets=[("data.jsonl", "data.jsonl")])
+
+    # 按文件中的顺序打印
+    assert [int(n) for n in re.findall(r"第 (\d+) 行", capfd.readouterr().out)] == [1, 4004, 6005]
+
+
+def test_report_collects_warnings(tmp_path, capfd):
+    path = tmp_path / "data.jsonl"
+    path.write_bytes(b'\n{bad\n{"question": "q", "options": {"A": "a"}, "answer_idx": "A"}\n\n')
+    report = {}
+    assert convert_to_bailian_format(str(path), str(tmp_path / "out.jsonl"), report=report) == (1, 1)
+    assert report['lines'] == 4
+    assert [line_num for line_num, _ in report['warnings']] == [2]
+    assert capfd.readouterr().out == ""
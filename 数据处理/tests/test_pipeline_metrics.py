@@ -0,0 +1,162 @@
+"""流水线指标：阶段记录、计数器与观测值、JSON Lines 与 Prometheus 输出，以及性能分析文件"""
+
+import contextlib
+import json
+
+import pytest
+
+from pipeline_metrics import PipelineMetrics, profile_section
+
+
+class FakeClient:
+    def timing_summary(self):
+        return {"POST /files": {"count": 3, "errors": 1, "retries": 2, "avg_ms": 12.5, "max_ms": 30.0}}
+
+
+def _lines(path):
+    return [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+
+
+def test_phases_to_json_lines(tmp_path):
+    output = tmp_path / "metrics" / "convert.jsonl"
+    metrics = PipelineMetrics("batch_convert", output)
+    with metrics.phase("convert", dataset="train.jsonl") as phase:
+        phase.add(rows=100, skipped=2)
+        phase.add(rows=50, bytes=2048)
+    with pytest.raises(ValueError):
+        with metrics.phase("upload", dataset="train.jsonl"):
+            raise ValueError("boom")
+    metrics.count("files", 2)
+    metrics.gauge("avg_ms", 1.5)
+    metrics.record_http(FakeClient())
+
+    # 每个阶段结束时立即追加一行
+    convert, upload = _lines(output)
+    assert convert['labels'] == {"dataset": "train.jsonl"} and convert['status'] == "ok"
+    assert (convert['rows'], convert['skipped'], convert['bytes']) == (150, 2, 2048)
+    assert 'rows_per_s' in convert and 'mb_per_s' in convert
+    assert upload['status'] == "error" and upload['error'] == "ValueError: boom"
+
+    metrics.close()
+    summary = _lines(output)[-1]
+    assert summary['phase'] == "_summary"
+    counters = {(c['name'], c['labels'].get('endpoint')): c['value'] for c in summary['counters']}
+    assert counters == {("files", None): 2, ("http_requests", "POST /files"): 3,
+                        ("http_errors", "POST /files"): 1, ("http_retries", "POST /files"): 2}
+    assert {g['name'] for g in summary['gauges']} == {"avg_ms", "http_request_avg_ms", "http_request_max_ms"}
+
+
+def _samples(path):
+    lines = path.read_text(encoding='utf-8').splitlines()
+    samples = [line.rsplit(" ", 1) for line in lines if not line.startswith("#")]
+    # 每条序列只出现一次
+    assert len({name for name, _ in samples}) == len(samples)
+    return dict(samples), [line for line in lines if line.startswith("# TYPE")]
+
+
+def test_prometheus_textfile(tmp_path):
+    output = tmp_path / "fine_tune.prom"
+    metrics = PipelineMetrics("fine_tune", output)
+    with metrics.phase("upload", file='say "hi"') as phase:
+        phase.add(bytes=10)
+    metrics.count("http_requests", 3, endpoint="GET /jobs")
+    # 阶段结束时不写文件，close() 时整体写出
+    assert not output.exists()
+    metrics.close()
+
+    samples, types = _samples(output)
+    labels = '{component="fine_tune",phase="upload",file="say \\"hi\\""}'
+    assert samples[f"medqa_phase_bytes{labels}"] == "10"
+    assert samples[f"medqa_phase_success{labels}"] == "1"
+    assert samples[f"medqa_phase_runs{labels}"] == "1"
+    assert f"medqa_phase_duration_seconds{labels}" in samples
+    assert samples['medqa_http_requests_total{component="fine_tune",endpoint="GET /jobs"}'] == "3"
+    assert 'medqa_last_run_timestamp_seconds{component="fine_tune"}' in samples
+    assert "# TYPE medqa_http_requests_total counter" in types
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_prometheus_merges_repeated_phases(tmp_path, monkeypatch):
+    output = tmp_path / "fine_tune.prom"
+    metrics = PipelineMetrics("fine_tune", output)
+    clock = [0.0]
+    monkeypatch.setattr("pipeline_metrics.time.perf_counter", lambda: clock[0])
+    for sent, seconds, fails in ((1024 * 1024, 1.0, False), (0, 0.5, False), (3 * 1024 * 1024, 2.5, True)):
+        with pytest.raises(RuntimeError) if fails else contextlib.nullcontext():
+            with metrics.phase("upload", concurrency=4) as phase:
+                clock[0] += seconds
+                phase.add(files=1, bytes=sent)
+                if fails:
+                    raise RuntimeError("HTTP 500")
+    with metrics.phase("upload", concurrency=2) as phase:
+        phase.add(files=1)
+    metrics.close()
+
+    samples, types = _samples(output)
+    labels = '{component="fine_tune",phase="upload",concurrency="4"}'
+    # 同一阶段和标签的三次上传合并为一条序列
+    assert samples[f"medqa_phase_runs{labels}"] == "3"
+    assert samples[f"medqa_phase_files{labels}"] == "3"
+    assert samples[f"medqa_phase_bytes{labels}"] == str(4 * 1024 * 1024)
+    assert samples[f"medqa_phase_duration_seconds{labels}"] == "4.0"
+    assert samples[f"medqa_phase_mb_per_s{labels}"] == "1.0"
+    assert samples[f"medqa_phase_success{labels}"] == "0"
+    assert samples['medqa_phase_runs{component="fine_tune",phase="upload",concurrency="2"}'] == "1"
+
+    # 同名指标的序列连续写出，每个指标只有一行 TYPE
+    lines = [line for line in output.read_text(encoding='utf-8').splitlines() if not line.startswith("#")]
+    names = [line.split("{", 1)[0] for line in lines]
+    groups = [name for i, name in enumerate(names) if i == 0 or names[i - 1] != name]
+    assert len(groups) == len(set(names)) == len(types)
+
+    # JSON Lines 仍然每次记录一行
+    jsonl = PipelineMetrics("fine_tune", tmp_path / "fine_tune.jsonl")
+    for _ in range(2):
+        with jsonl.phase("upload", concurrency=4) as phase:
+            phase.add(files=1)
+    jsonl.close()
+    records = _lines(tmp_path / "fine_tune.jsonl")
+    assert [record['phase'] for record in records] == ["upload", "upload", "_summary"]
+
+
+def test_from_env_and_memory_only(tmp_path, monkeypatch, capsys):
+    monkeypatch.delenv("METRICS_FILE", raising=False)
+    metrics = PipelineMetrics.from_env("batch_convert")
+    with metrics.phase("convert"):
+        pass
+    metrics.close()
+    assert metrics.output is None and len(metrics.phases) == 1
+    assert capsys.readouterr().out == ""
+
+    monkeypatch.setenv("METRICS_FILE", str(tmp_path / "env.prom"))
+    assert PipelineMetrics.from_env("batch_convert").prometheus
+    assert PipelineMetrics.from_env("batch_convert", tmp_path / "cli.jsonl").output == tmp_path / "cli.jsonl"
+
+
+def test_profile_section(tmp_path, capsys):
+    prefix = tmp_path / "profile" / "convert"
+    with profile_section(prefix):
+        sorted(str(i) for i in range(10000))
+    assert (tmp_path / "profile" / "convert.prof").exists()
+    assert "tracemalloc 峰值" in (tmp_path / "profile" / "convert.profile.txt").read_text(encoding='utf-8')
+    assert "性能分析" in capsys.readouterr().out
+
+    with profile_section(tmp_path / "off", enabled=False):
+        pass
+    assert not list(tmp_path.glob("off*"))
+
+
+def test_cli_without_requests_skips_http_summary(isolated_env, monkeypatch, capsys):
+    import fine_tune_automation
+
+    def no_client(*args, **kwargs):
+        raise AssertionError("不发请求的命令不应创建 HTTP 客户端")
+
+    output = isolated_env / "fine_tune.jsonl"
+    monkeypatch.setattr(fine_tune_automation, "DashScopeHTTPClient", no_client)
+    monkeypatch.setattr("sys.argv", ["fine_tune_automation.py", "--jobs", "--metrics", str(output)])
+    fine_tune_automation.main()
+
+    assert "发生错误" not in capsys.readouterr().out
+    summary = _lines(output)[-1]
+    assert summary['phase'] == "_summary" and summary['counters'] == []
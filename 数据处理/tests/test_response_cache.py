@@ -0,0 +1,97 @@
+"""回答缓存：缓存键、命中标记、空回答不缓存、容量与过期淘汰，以及按环境变量开启"""
+
+import threading
+
+import pytest
+
+import response_cache
+from response_cache import ResponseCache, cache_key, served_from_cache
+
+MESSAGES = [{"role": "user", "content": "发热咳嗽三天，首选哪项检查？"}]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(tmp_path / "responses.sqlite")
+    yield cache
+    cache.close()
+
+
+def test_cache_key():
+    assert cache_key("m", MESSAGES) == cache_key("m", [dict(MESSAGES[0], name="extra")])
+    assert cache_key("m", MESSAGES, {"stream": True, "api_key": "sk", "seed": None}) == cache_key("m", MESSAGES)
+    assert cache_key("m", MESSAGES, {"temperature": 0}) != cache_key("m", MESSAGES)
+    assert cache_key("m2", MESSAGES) != cache_key("m", MESSAGES)
+
+
+def test_wrap_marks_hits_and_skips_empty(cache):
+    answers = iter(["", None, "答案是 A. 胸片"])
+    calls = []
+
+    def call(messages):
+        calls.append(messages)
+        return next(answers)
+
+    cached = cache.wrap(call, "qwen-turbo")
+    # 失败（空回答）不缓存，下一次重新调用
+    assert cached(MESSAGES) == "" and not served_from_cache()
+    assert cached(MESSAGES) is None and not served_from_cache()
+    assert cached(MESSAGES) == "答案是 A. 胸片" and not served_from_cache()
+    assert cached(MESSAGES) == "答案是 A. 胸片" and served_from_cache()
+    assert len(calls) == 3
+    assert cache.stats() == {'hits': 1, 'misses': 3, 'hit_rate': 0.25, 'entries': 1}
+
+    # 命中标记按线程记录
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(served_from_cache()))
+    thread.start()
+    thread.join()
+    assert seen == [False]
+
+    def fail(messages):
+        raise RuntimeError("HTTP 500")
+
+    with pytest.raises(RuntimeError):
+        cache.wrap(fail, "qwen-plus")(MESSAGES)
+
+
+def test_eviction(tmp_path, monkeypatch):
+    cache = ResponseCache(tmp_path / "responses.sqlite", max_entries=3)
+    clock = [1000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: clock[0])
+    try:
+        for i in range(5):
+            clock[0] += 1
+            cache.put("m", [{"role": "user", "content": str(i)}], f"answer {i}")
+        clock[0] += 1
+        assert cache.get("m", [{"role": "user", "content": "0"}]) == "answer 0"
+        assert cache.evict() == 2
+        # 最近访问过的第 0 条保留，最久未使用的第 1、2 条被淘汰
+        assert [cache.get("m", [{"role": "user", "content": str(i)}]) is not None for i in range(5)] == \
+            [True, False, False, True, True]
+    finally:
+        cache.close()
+
+    expiring = ResponseCache(tmp_path / "expiring.sqlite", max_age_days=1)
+    try:
+        expiring.put("m", MESSAGES, "old")
+        clock[0] += 2 * 86400
+        assert expiring.get("m", MESSAGES) is None
+        assert expiring.evict() == 1
+    finally:
+        expiring.close()
+
+
+def test_from_env(tmp_path, monkeypatch):
+    monkeypatch.delenv("RESPONSE_CACHE", raising=False)
+    assert ResponseCache.from_env() is None
+    monkeypatch.setenv("RESPONSE_CACHE", "0")
+    assert ResponseCache.from_env() is None
+
+    monkeypatch.setenv("RESPONSE_CACHE", str(tmp_path / "env.sqlite"))
+    monkeypatch.setenv("RESPONSE_CACHE_MAX_ENTRIES", "10")
+    cache = ResponseCache.from_env()
+    try:
+        assert cache.path == tmp_path / "env.sqlite" and cache.max_entries == 10
+    finally:
+        cache.close()
@@ -0,0 +1,85 @@
+"""ShardedJsonlWriter 按大小分片、清单和遗留分片清理"""
+
+import json
+
+from convert_to_bailian_format import (
+    ShardedJsonlWriter,
+    convert_to_bailian_format,
+    read_shard_manifest,
+    shard_manifest_path,
+    shard_path,
+)
+
+
+def _lines(count, width=20):
+    return [f'{{"n": {i:0{width}d}}}\n'.encode() for i in range(count)]
+
+
+def test_small_output_is_not_sharded(tmp_path):
+    output = tmp_path / "out.jsonl"
+    with ShardedJsonlWriter(output, max_bytes=10_000) as writer:
+        for line in _lines(10):
+            writer.write(line)
+
+    assert [p.name for p in tmp_path.iterdir()] == ["out.jsonl"]
+    assert len(writer.shards) == 1
+
+
+def test_rolls_over_at_line_boundaries(tmp_path):
+    output = tmp_path / "out.jsonl"
+    lines = _lines(100)
+    max_bytes = len(lines[0]) * 7 + 3
+    with ShardedJsonlWriter(output, max_bytes=max_bytes, chunk_size=50) as writer:
+        for line in lines:
+            writer.write(line)
+
+    assert not output.exists()
+    manifest = read_shard_manifest(shard_manifest_path(output))
+    assert manifest['total_rows'] == 100
+    assert [shard['rows'] for shard in manifest['shards']] == [7] * 14 + [2]
+    data = b''
+    for i, shard in enumerate(manifest['shards'], 1):
+        assert shard['file'] == str(shard_path(output, i))
+        content = open(shard['file'], 'rb').read()
+        assert len(content) == shard['bytes'] <= max_bytes
+        data += content
+    assert data == b''.join(lines)
+
+
+def test_oversized_line_gets_its_own_shard(tmp_path):
+    output = tmp_path / "out.jsonl"
+    with ShardedJsonlWriter(output, max_bytes=30) as writer:
+        writer.write(b'short\n')
+        writer.write(b'x' * 100 + b'\n')
+        writer.write(b'short\n')
+
+    assert [shard['rows'] for shard in writer.shards] == [1, 1, 1]
+
+
+def test_rewrite_removes_stale_shards_and_manifest(tmp_path):
+    output = tmp_path / "out.jsonl"
+    with ShardedJsonlWriter(output, max_bytes=50) as writer:
+        for line in _lines(20):
+            writer.write(line)
+    assert shard_manifest_path(output).exists()
+
+    with ShardedJsonlWriter(output, max_bytes=50) as writer:
+        writer.write(b'{}\n')
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["out.jsonl"]
+
+
+def test_sharded_conversion_concatenates_to_unsharded(tmp_path, medqa_file):
+    whole = tmp_path / "whole.jsonl"
+    convert_to_bailian_format(str(medqa_file), str(whole))
+    sharded = tmp_path / "sharded" / "train.jsonl"
+    sharded.parent.mkdir()
+    converted, _ = convert_to_bailian_format(str(medqa_file), str(sharded), max_shard_bytes=256 * 1024)
+
+    manifest = read_shard_manifest(shard_manifest_path(sharded))
+    assert len(manifest['shards']) > 1
+    assert manifest['total_rows'] == converted
+    assert b''.join(open(shard['file'], 'rb').read() for shard in manifest['shards']) == whole.read_bytes()
+    with open(shard_manifest_path(sharded), encoding='utf-8') as f:
+        # 清单中的文件名是相对路径，整个目录可以移动
+        assert all('/' not in shard['file'] for shard in json.load(f)['shards'])
@@ -0,0 +1,168 @@
+"""微调流程状态库：上传组、任务查找、状态缓存、账号隔离和旧版状态库的迁移"""
+
+import sqlite3
+
+import pytest
+
+from state_store import StateStore
+
+API_BASE = "http://127.0.0.1:8000/api/v1"
+PARAMS = {"n_epochs": 3, "learning_rate": "1e-4"}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = StateStore(tmp_path / "state.sqlite", API_BASE, "sk-a")
+    yield store
+    store.close()
+
+
+def test_upload_sets(store):
+    assert store.latest_upload_set() is None
+    store.record_upload_set("file-train", "file-val")
+    train, validation, _ = store.latest_upload_set()
+    assert (train, validation) == ("file-train", "file-val")
+
+    # 分片数据集按分片顺序返回列表
+    store.record_upload_set(["part-0", "part-1", "part-2"], train_source="train.manifest.json")
+    train, validation, _ = store.latest_upload_set()
+    assert (train, validation) == (["part-0", "part-1", "part-2"], None)
+
+
+def test_find_job(store):
+    store.record_job("ft-1", "qwen-turbo", "efficient_sft", PARAMS, ["part-0", "part-1"], "file-val")
+    found = store.find_job("qwen-turbo", "efficient_sft", dict(reversed(list(PARAMS.items()))),
+                           ["part-0", "part-1"], "file-val")
+    assert found == {'job_id': "ft-1", 'status': None, 'fine_tuned_model': None}
+
+    assert store.find_job("qwen-turbo", "efficient_sft", dict(PARAMS, n_epochs=4),
+                          ["part-0", "part-1"], "file-val") is None
+    assert store.find_job("qwen-turbo", "efficient_sft", PARAMS, ["part-1", "part-0"], "file-val") is None
+    assert store.find_job("qwen-turbo", "sft", PARAMS, ["part-0", "part-1"], "file-val") is None
+
+    # 失败的任务不算已提交
+    store.record_status("ft-1", {"status": "FAILED"})
+    assert store.find_job("qwen-turbo", "efficient_sft", PARAMS, ["part-0", "part-1"], "file-val") is None
+
+
+def test_status_history_and_models(store):
+    store.record_job("ft-1", "qwen-turbo", "efficient_sft", PARAMS, "file-train")
+    for status in ("PENDING", "RUNNING", "RUNNING", "SUCCEEDED"):
+        store.record_status("ft-1", {"status": status, "fine_tuned_model":
+                                     "qwen-turbo-ft-1" if status == "SUCCEEDED" else ""})
+    assert [status for status, _ in store.snapshots("ft-1")] == ["PENDING", "RUNNING", "SUCCEEDED"]
+    assert store.latest_model() == "qwen-turbo-ft-1"
+    assert store.latest_job_id() == "ft-1"
+
+    # 已结束的任务总是从缓存返回
+    payload, _ = store.cached_status("ft-1", max_age=0)
+    assert payload['status'] == "SUCCEEDED"
+
+    store.record_job("ft-2", "qwen-turbo", "efficient_sft", PARAMS, "file-train")
+    store.record_status("ft-2", {"status": "RUNNING"})
+    assert store.cached_status("ft-2", max_age=60)[0]['status'] == "RUNNING"
+    assert store.cached_status("ft-2", max_age=-1) is None
+    assert store.cached_status("ft-unknown") is None
+
+    assert [job['job_id'] for job in store.jobs()] == ["ft-2", "ft-1"]
+    assert [job['job_id'] for job in store.jobs(status="SUCCEEDED")] == ["ft-1"]
+    assert store.jobs()[0]['hyper_params'] == PARAMS
+
+
+def test_accounts_and_api_bases_are_isolated(store, tmp_path):
+    store.record_upload_set("file-a")
+    store.record_job("ft-a", "qwen-turbo", "efficient_sft", PARAMS, "file-a")
+    store.record_status("ft-a", {"status": "SUCCEEDED", "fine_tuned_model": "model-a"})
+
+    for api_base, api_key in ((API_BASE, "sk-b"), ("https://dashscope.aliyuncs.com/api/v1", "sk-a")):
+        other = StateStore(tmp_path / "state.sqlite", api_base, api_key)
+        try:
+            assert other.latest_upload_set() is None
+            assert other.latest_job_id() is None
+            assert other.latest_model() is None
+            assert other.jobs() == []
+            assert other.find_job("qwen-turbo", "efficient_sft", PARAMS, "file-a") is None
+        finally:
+            other.close()
+
+
+def test_status_is_scoped_to_api_base_and_account(store, tmp_path):
+    store.record_job("ft-1", "qwen-turbo", "efficient_sft", PARAMS, "file-a")
+    store.record_status("ft-1", {"status": "SUCCEEDED", "fine_tuned_model": "model-a"})
+
+    # 另一个账号或重启后的替身服务返回同一个任务 ID：各自记录，互不覆盖
+    for api_base, api_key in ((API_BASE, "sk-b"), ("http://127.0.0.1:9000/api/v1", "sk-a")):
+        other = StateStore(tmp_path / "state.sqlite", api_base, api_key)
+        try:
+            assert other.cached_status("ft-1", max_age=3600) is None
+            assert other.snapshots("ft-1") == []
+            other.record_job("ft-1", "qwen-plus", "sft", PARAMS, "file-b")
+            other.record_status("ft-1", {"status": "RUNNING"})
+            assert other.cached_status("ft-1")[0]['status'] == "RUNNING"
+            assert [status for status, _ in other.snapshots("ft-1")] == ["RUNNING"]
+            assert other.latest_model() is None
+        finally:
+            other.close()
+
+    assert store.cached_status("ft-1", max_age=0)[0]['status'] == "SUCCEEDED"
+    assert [status for status, _ in store.snapshots("ft-1")] == ["SUCCEEDED"]
+    assert store.latest_model() == "model-a"
+    assert [(job['job_id'], job['base_model']) for job in store.jobs()] == [("ft-1", "qwen-turbo")]
+
+
+def test_from_env(isolated_env):
+    store = StateStore.from_env(API_BASE, "sk-test")
+    try:
+        assert store.path == isolated_env / "state.sqlite"
+    finally:
+        store.close()
+
+
+def test_migrates_schema_without_account(tmp_path):
+    path = tmp_path / "old.sqlite"
+    conn = sqlite3.connect(str(path))
+    conn.executescript("""
+        CREATE TABLE uploads (id INTEGER PRIMARY KEY AUTOINCREMENT, set_id TEXT NOT NULL,
+            api_base TEXT NOT NULL, role TEXT NOT NULL, position INTEGER NOT NULL,
+            file_id TEXT NOT NULL, source TEXT, created_at REAL NOT NULL);
+        CREATE TABLE jobs (job_id TEXT PRIMARY KEY, api_base TEXT NOT NULL, base_model TEXT,
+            training_type TEXT, hyper_params_id INTEGER, training_file_ids TEXT, validation_file_ids TEXT,
+            status TEXT, fine_tuned_model TEXT, last_payload TEXT, fetched_at REAL,
+            created_at REAL NOT NULL, updated_at REAL NOT NULL);
+        CREATE INDEX idx_jobs_status ON jobs(status);
+        CREATE TABLE job_snapshots (id INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL,
+            status TEXT, payload TEXT NOT NULL, fetched_at REAL NOT NULL);
+    """)
+    conn.execute("INSERT INTO uploads (set_id, api_base, role, position, file_id, created_at)"
+                 " VALUES ('old', ?, 'train', 0, 'file-old', 1)", (API_BASE,))
+    conn.execute("INSERT INTO jobs (job_id, api_base, fine_tuned_model, created_at, updated_at)"
+                 " VALUES ('ft-old', ?, 'model-old', 1, 1)", (API_BASE,))
+    conn.commit()
+    conn.close()
+
+    store = StateStore(path, API_BASE, "sk-a")
+    try:
+        # 旧记录不属于任何账号，不会被当作当前账号的上传或模型
+        assert store.latest_upload_set() is None
+        assert store.latest_model() is None
+        store.record_upload_set("file-new")
+        assert store.latest_upload_set()[0] == "file-new"
+        # 旧任务再次查询到状态时记在当前账号下，旧记录保留且仍不属于任何账号
+        store.record_status("ft-old", {"status": "SUCCEEDED"})
+        assert store.cached_status("ft-old")[0]['status'] == "SUCCEEDED"
+        assert [status for status, _ in store.snapshots("ft-old")] == ["SUCCEEDED"]
+    finally:
+        store.close()
+
+    conn = sqlite3.connect(str(path))
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM jobs WHERE job_id = 'ft-old'").fetchone()[0] == 2
+        assert conn.execute("SELECT fine_tuned_model FROM jobs WHERE account IS NULL").fetchall() == [("model-old",)]
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE tbl_name = 'jobs'"
+                                                  " AND type = 'index' AND sql IS NOT NULL")}
+        assert {"idx_jobs_status", "idx_jobs_api_created"} <= indexes
+    finally:
+        conn.close()
+
+    # 迁移只进行一次
+    StateStore(path, API_BASE, "sk-a").close()
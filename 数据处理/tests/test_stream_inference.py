@@ -0,0 +1,73 @@
+"""流式延迟统计：单请求速度、直方图分桶与百分位数、汇总导出，以及流式调用的重试"""
+
+import json
+
+import pytest
+import requests
+
+import stream_inference
+from stream_inference import Histogram, LatencyRecorder, RequestLatency, export_json, streaming_call
+
+
+def test_tokens_per_second():
+    assert RequestLatency(0.2, 1.2, [0.1] * 10, 11, 11).tokens_per_second == 10
+    # 只有一段输出，或首 token 之后没有耗时，无法计算速度
+    assert RequestLatency(0.2, 0.2, [], 1, 1).tokens_per_second is None
+    assert RequestLatency(0.2, 0.2, [0.0], 2, 2).tokens_per_second is None
+
+
+def test_histogram_buckets_and_percentiles():
+    hist = Histogram((10, 100), 'ms')
+    for value in (5, 10, 11, 100, 1000):
+        hist.observe(value)
+    stats = hist.to_dict()
+    assert stats['buckets'] == [{'le': '10', 'count': 2}, {'le': '100', 'count': 2}, {'le': '+Inf', 'count': 1}]
+    assert (stats['count'], stats['min'], stats['max'], stats['p50']) == (5, 5, 1000, 11)
+
+    empty = Histogram((10,), 'ms').to_dict()
+    assert empty['count'] == 0 and empty['mean'] is None and empty['p99'] is None
+
+
+def test_recorder_summary_and_export(tmp_path):
+    recorder = LatencyRecorder("qwen-mock")
+    recorder.record(RequestLatency(0.05, 0.25, [0.02] * 10, 11, 6))
+    recorder.record(RequestLatency(0.1, 0.1, [], 1, 1))
+    recorder.record_error()
+
+    summary = recorder.summary()
+    assert (summary['requests'], summary['errors']) == (2, 1)
+    metrics = summary['metrics']
+    assert metrics['ttft_ms']['count'] == 2 and metrics['ttft_ms']['max'] == 100
+    assert metrics['inter_token_ms']['count'] == 10
+    assert metrics['output_tokens_per_s']['count'] == 1
+
+    output = tmp_path / "latency.json"
+    export_json([recorder, LatencyRecorder("other")], output)
+    report = json.loads(output.read_text(encoding='utf-8'))
+    assert [model['model'] for model in report['models']] == ["qwen-mock", "other"]
+
+
+def test_streaming_call_retries_network_errors(monkeypatch):
+    outcomes = [requests.ConnectionError("reset"), requests.exceptions.ChunkedEncodingError("cut"),
+                ("答案是 A", RequestLatency(0.01, 0.02, [], 1, 1)), ValueError("bad request")]
+    calls = []
+
+    def stream_generation(model_id, messages, api_key=None, **parameters):
+        calls.append(model_id)
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(stream_inference, "stream_generation", stream_generation)
+    monkeypatch.setattr(stream_inference.time, "sleep", lambda seconds: None)
+    recorder = LatencyRecorder("qwen-mock")
+    call = streaming_call("qwen-mock", recorder=recorder, max_retries=2)
+
+    # 连接失败和流中断时整个请求重新发送
+    assert call([{"role": "user", "content": "q"}]) == "答案是 A"
+    assert len(calls) == 3 and recorder.summary()['requests'] == 1
+    # 其他错误不重试，记为失败
+    with pytest.raises(ValueError):
+        call([{"role": "user", "content": "q"}])
+    assert len(calls) == 4 and recorder.errors == 1
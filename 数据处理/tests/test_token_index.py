@@ -0,0 +1,117 @@
+"""token 长度索引：逐行计数、复用与失效、多进程一致，以及超长行的处理方式"""
+
+import json
+import shutil
+
+import numpy as np
+import pytest
+
+import token_index
+from token_index import (
+    TokenCounter,
+    apply_length_policy,
+    build_token_index,
+    dataset_stem,
+    estimate_training,
+    index_paths,
+    length_stats,
+)
+
+
+@pytest.fixture
+def dataset(tmp_path, converted_file):
+    path = tmp_path / "train.jsonl"
+    shutil.copy(converted_file, path)
+    return path
+
+
+def _expected(path):
+    counter = TokenCounter()
+    return [counter.count_messages(json.loads(line)['messages'])
+            for line in path.read_text(encoding='utf-8').splitlines() if line.strip()]
+
+
+def test_dataset_stem():
+    assert dataset_stem("a/mainland_train.jsonl") == "mainland_train"
+    assert dataset_stem("a/mainland_train.jsonl.gz") == "mainland_train"
+    assert dataset_stem("a/mainland_train.jsonl.zst") == "mainland_train"
+    assert dataset_stem("a/mainland_train.manifest.json") == "mainland_train"
+
+
+def test_counts_and_reuse(dataset, monkeypatch):
+    counts, meta = build_token_index(dataset)
+    assert counts.dtype == np.uint32
+    assert counts.tolist() == _expected(dataset)
+    assert meta['rows'] == len(counts) and meta['total_tokens'] == int(counts.sum())
+    assert all(path.exists() for path in index_paths(dataset))
+
+    # 输入未变化时直接读取索引
+    def fail(task):
+        raise AssertionError("索引应被复用")
+
+    monkeypatch.setattr(token_index, "_count_range", fail)
+    reused, _ = build_token_index(dataset)
+    assert np.array_equal(reused, counts)
+
+    # 输入变化后重新统计
+    monkeypatch.undo()
+    with open(dataset, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({"messages": [{"role": "user", "content": "x" * 400}]}) + '\n')
+    rebuilt, meta = build_token_index(dataset)
+    assert len(rebuilt) == len(counts) + 1
+    assert meta['rows'] == len(rebuilt)
+
+
+def test_parallel_matches_serial(dataset):
+    serial, _ = build_token_index(dataset)
+    parallel, _ = build_token_index(dataset, workers=2, chunk_mb=0.1, force=True)
+    assert np.array_equal(parallel, serial)
+
+
+def test_length_stats_and_estimate():
+    counts = np.array([10, 20, 30, 400], dtype=np.uint32)
+    stats = length_stats(counts, 100)
+    assert stats['rows'] == 4 and stats['total_tokens'] == 460
+    assert stats['over_rows'] == 1 and stats['max'] == 400
+    assert stats['effective_tokens'] == 160
+
+    estimate = estimate_training(stats, n_epochs=3, split=0.5, price_per_1k=2, tokens_per_second=240)
+    assert estimate['trained_tokens'] == 240
+    assert estimate['cost'] == pytest.approx(0.48)
+    assert estimate['hours'] == pytest.approx(1 / 3600)
+
+
+def test_length_policies(dataset):
+    counts, _ = build_token_index(dataset)
+    max_length = int(np.percentile(counts, 75))
+    lines = [line for line in dataset.read_bytes().splitlines(keepends=True) if line.strip()]
+
+    outputs = apply_length_policy(dataset, counts, max_length, "filter")
+    (path, info), = outputs.items()
+    kept = [line for line, count in zip(lines, counts.tolist()) if count <= max_length]
+    assert open(path, 'rb').read() == b''.join(kept)
+    assert info['rows'] == len(kept)
+
+    counter = TokenCounter()
+    outputs = apply_length_policy(dataset, counts, max_length, "truncate", counter=counter)
+    (path, info), = outputs.items()
+    truncated = open(path, 'rb').read().splitlines()
+    assert len(kept) <= info['rows'] == len(truncated) <= len(lines)
+    assert all(counter.count_messages(json.loads(line)['messages']) <= max_length for line in truncated)
+
+    outputs = apply_length_policy(dataset, counts, max_length, "bucket")
+    assert sum(info['rows'] for info in outputs.values()) == len(lines)
+    assert sum(info['tokens'] for info in outputs.values()) == int(counts.sum())
+
+    with pytest.raises(ValueError):
+        apply_length_policy(dataset, counts, max_length, "drop")
+
+
+def test_small_dataset_is_counted_in_process(dataset, monkeypatch):
+    # 只有一个分词任务时不启动进程池
+    def no_pool(*args, **kwargs):
+        raise AssertionError("不应启动进程池")
+
+    monkeypatch.setattr(token_index, "ProcessPoolExecutor", no_pool)
+    counts, _ = build_token_index(dataset, workers=4)
+    assert counts.tolist() == _expected(dataset)
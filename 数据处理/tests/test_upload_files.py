@@ -0,0 +1,81 @@
+"""并发上传：分片清单展开为各个分片、结果按输入顺序返回、失败记为 None、并发数不超过上限，只统计实际发送的字节"""
+
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from convert_to_bailian_format import ShardedJsonlWriter, shard_manifest_path
+from fine_tune_automation import FineTuneAutomation
+
+
+@pytest.fixture
+def automation(isolated_env):
+    return FineTuneAutomation()
+
+
+@pytest.fixture
+def fake_upload(automation, monkeypatch):
+    """记录同时进行的上传数；文件名含 bad 的上传失败，含 reused 的复用登记的 File ID"""
+    lock = threading.Lock()
+    state = {'running': 0, 'max_running': 0, 'uploaded': []}
+
+    def upload(file_path, description, force, show_progress):
+        assert not show_progress
+        with lock:
+            state['running'] += 1
+            state['max_running'] = max(state['max_running'], state['running'])
+        time.sleep(0.05)
+        with lock:
+            state['running'] -= 1
+            state['uploaded'].append(Path(file_path).name)
+        name = Path(file_path).name
+        if "bad" in name:
+            return None, 0
+        return f"file-{name}", 0 if "reused" in name else Path(file_path).stat().st_size
+
+    monkeypatch.setattr(automation, "_upload_single", upload)
+    return state
+
+
+def _write(path, rows):
+    path.write_text("".join(f'{{"i": {i}}}\n' for i in range(rows)), encoding='utf-8')
+    return path
+
+
+def test_results_follow_input_order(automation, fake_upload, tmp_path):
+    train = tmp_path / "train.jsonl"
+    with ShardedJsonlWriter(train, max_bytes=40) as writer:
+        for i in range(10):
+            writer.write(f'{{"i": {i}}}\n'.encode())
+    validation = _write(tmp_path / "valid.jsonl", 3)
+
+    results = automation.upload_files([shard_manifest_path(train), None, validation], max_concurrency=3)
+    assert results == [[f"file-train_part{i:03d}.jsonl" for i in range(1, 4)], None, "file-valid.jsonl"]
+    assert len(fake_upload['uploaded']) == 4
+    assert fake_upload['max_running'] == 3
+
+
+def test_failed_uploads_are_none(automation, fake_upload, tmp_path):
+    train = tmp_path / "train.jsonl"
+    with ShardedJsonlWriter(train, max_bytes=40) as writer:
+        for i in range(10):
+            writer.write(f'{{"i": {i}}}\n'.encode())
+    (tmp_path / "train_part002.jsonl").rename(tmp_path / "bad_part.jsonl")
+    manifest = shard_manifest_path(train)
+    manifest.write_text(manifest.read_text(encoding='utf-8').replace("train_part002", "bad_part"), encoding='utf-8')
+
+    files = [_write(tmp_path / f"valid{i}.jsonl", 1) for i in range(4)] + [_write(tmp_path / "bad.jsonl", 1)]
+    results = automation.upload_files([manifest] + files, max_concurrency=2)
+    # 分片清单中任何一个分片失败，整个数据集记为失败
+    assert results == [None] + [f"file-valid{i}.jsonl" for i in range(4)] + [None]
+    assert fake_upload['max_running'] == 2
+
+
+def test_phase_counts_only_sent_bytes(automation, fake_upload, tmp_path):
+    sent = _write(tmp_path / "train.jsonl", 100)
+    reused = _write(tmp_path / "reused.jsonl", 1000)
+    assert automation.upload_files([sent, reused]) == ["file-train.jsonl", "file-reused.jsonl"]
+    [phase] = [phase for phase in automation.metrics.phases if phase['phase'] == 'upload']
+    assert (phase['files'], phase['failed'], phase['bytes']) == (2, 0, sent.stat().st_size)
@@ -0,0 +1,73 @@
+"""上传登记表：按内容复用 File ID，按 API 地址和账号隔离"""
+
+import json
+
+from upload_registry import REGISTRY_FORMAT_VERSION, UploadRegistry, account_id
+
+API_BASE = "http://127.0.0.1:8000/api/v1"
+
+
+def test_same_content_reuses_file_id(tmp_path):
+    registry_file = tmp_path / ".upload_registry.json"
+    data = tmp_path / "train.jsonl"
+    data.write_text('{"messages": []}\n', encoding='utf-8')
+
+    registry = UploadRegistry(registry_file, API_BASE, "sk-a")
+    assert registry.lookup(data) is None
+    registry.register(data, "file-1")
+    assert registry.lookup(data) == "file-1"
+
+    # 不同路径、相同内容；重新加载登记表后仍然命中
+    copy = tmp_path / "copy.jsonl"
+    copy.write_bytes(data.read_bytes())
+    reloaded = UploadRegistry(registry_file, API_BASE, "sk-a")
+    assert reloaded.lookup(copy) == "file-1"
+
+    # 内容变化后不再复用
+    data.write_text('{"messages": [1]}\n', encoding='utf-8')
+    assert reloaded.lookup(data) is None
+
+
+def test_scope_by_api_base_and_account(tmp_path):
+    registry_file = tmp_path / ".upload_registry.json"
+    data = tmp_path / "train.jsonl"
+    data.write_text('{"messages": []}\n', encoding='utf-8')
+    UploadRegistry(registry_file, API_BASE, "sk-a").register(data, "file-1")
+
+    assert UploadRegistry(registry_file, API_BASE, "sk-b").lookup(data) is None
+    assert UploadRegistry(registry_file, "https://other/api/v1", "sk-a").lookup(data) is None
+    assert UploadRegistry(registry_file, API_BASE, "sk-a").lookup(data) == "file-1"
+
+    # 登记表里不保存 Key 本身
+    text = registry_file.read_text(encoding='utf-8')
+    assert "sk-a" not in text
+    assert account_id("sk-a") in text
+    assert account_id(None) == "-"
+
+
+def test_forget_and_entries(tmp_path):
+    registry_file = tmp_path / ".upload_registry.json"
+    registry = UploadRegistry(registry_file, API_BASE, "sk-a")
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"part{i}.jsonl"
+        path.write_text(f'{{"i": {i}}}\n', encoding='utf-8')
+        paths.append(path)
+        registry.register(path, "file-shared" if i < 2 else "file-own")
+
+    assert len(registry.entries()) == 3
+    assert registry.forget("file-shared") == 2
+    assert registry.forget("file-missing") == 0
+    assert [entry['file_id'] for _, entry in registry.entries()] == ["file-own"]
+    assert UploadRegistry(registry_file, API_BASE, "sk-a").lookup(paths[0]) is None
+
+
+def test_unknown_or_corrupt_registry_is_ignored(tmp_path, capsys):
+    registry_file = tmp_path / ".upload_registry.json"
+    registry_file.write_text(json.dumps({'version': REGISTRY_FORMAT_VERSION - 1, 'files': {'x': {}}}),
+                             encoding='utf-8')
+    assert UploadRegistry(registry_file, API_BASE).files == {}
+
+    registry_file.write_text("{not json", encoding='utf-8')
+    assert UploadRegistry(registry_file, API_BASE).files == {}
+    assert "上传登记表损坏" in capsys.readouterr().out
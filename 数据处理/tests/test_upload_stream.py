@@ -0,0 +1,81 @@
+"""流式 multipart 请求体：Content-Length、与 urllib3 编码逐字节一致、压缩文件边解压边发送，以及上传进度"""
+
+import io
+
+import pytest
+from urllib3.filepost import encode_multipart_formdata
+
+import compressed_io
+from compressed_io import open_output
+from upload_stream import MultipartFileStream, UploadProgress
+
+FIELDS = {"purpose": "fine-tune", "description": "训练集"}
+
+
+def _expected_body(stream, filename, data):
+    fields = list(FIELDS.items()) + [("files", (filename, data, "application/octet-stream"))]
+    return encode_multipart_formdata(fields, boundary=stream.boundary)[0]
+
+
+def test_body_matches_urllib3(tmp_path):
+    data = "".join(f'{{"n": {i}, "q": "第{i}题"}}\n' for i in range(3000)).encode('utf-8')
+    path = tmp_path / 'train "v2".jsonl'
+    path.write_bytes(data)
+
+    stream = MultipartFileStream(path, "files", fields=FIELDS, chunk_size=4096)
+    body = b''.join(stream)
+    assert body == _expected_body(stream, path.name, data)
+    assert len(stream) == len(body)
+    assert stream.content_type == f"multipart/form-data; boundary={stream.boundary}"
+    # 每次迭代重新打开文件，重试时可以再发一遍
+    assert b''.join(stream) == body
+
+
+@pytest.mark.parametrize("suffix", [".gz", pytest.param(".zst", marks=pytest.mark.skipif(
+    compressed_io.zstandard is None, reason="未安装 zstandard"))])
+def test_compressed_file_is_sent_decompressed(tmp_path, suffix):
+    data = "".join(f'{{"n": {i}}}\n' for i in range(5000)).encode('utf-8')
+    plain = tmp_path / "train.jsonl"
+    plain.write_bytes(data)
+    packed = tmp_path / f"train.jsonl{suffix}"
+    with open_output(packed) as f:
+        f.write(data)
+
+    stream = MultipartFileStream(packed, "files", fields=FIELDS, chunk_size=4096)
+    # 文件名去掉压缩扩展名，长度与未压缩文件相同
+    assert len(stream) == len(MultipartFileStream(plain, "files", fields=FIELDS))
+    body = b''.join(stream)
+    assert body == _expected_body(stream, "train.jsonl", data)
+    assert len(body) == len(stream)
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / "empty.jsonl"
+    path.write_bytes(b'')
+    stream = MultipartFileStream(path, "files", fields=FIELDS)
+    assert b''.join(stream) == _expected_body(stream, path.name, b'')
+    assert len(stream) == len(stream.preamble) + len(stream.epilogue)
+
+
+def test_progress_reaches_total(tmp_path):
+    path = tmp_path / "train.jsonl"
+    path.write_bytes(b'x' * 10_000)
+    output = io.StringIO()
+    stream = MultipartFileStream(path, "files", chunk_size=1000)
+    stream.progress = UploadProgress(len(stream), interval=3600, stream=output)
+
+    chunks = list(stream)
+    assert len(chunks) == 12
+    assert stream.progress.sent_bytes == len(stream)
+    # 间隔很长时中间的块不输出，发送完时一定输出 100%
+    reports = output.getvalue().split('\r')[1:]
+    assert len(reports) <= 2
+    assert reports[-1].startswith("   进度: 100.0% (0.0/0.0 MB)") and reports[-1].endswith("MB/s\n")
+
+    # 重试时重新计数
+    list(stream)
+    assert stream.progress.sent_bytes == len(stream)
+
+    empty = io.StringIO()
+    UploadProgress(0, stream=empty).report()
+    assert "100.0%" in empty.getvalue()
@@ -0,0 +1,402 @@
+"""
+训练数据的 token 长度索引与 max_length 预检
+
+创建微调任务前，对转换后的数据集（JSONL 或分片清单）按行统计 token 数：
+- 多进程分批分词，结果保存为紧凑的逐行索引 xxx.tokens.npy（uint32），
+  输入文件未变化时直接复用
+- 对照 max_length 统计超长行，可选择过滤、截断或按长度分桶输出
+- 按 总 token × n_epochs 估算训练量，可选给出费用和耗时估计
+
+分词优先使用 DashScope SDK 自带的 Qwen 分词器（需要 tiktoken），
+不可用时退回按字符数的粗略估计，报告中会注明。
+
+用法：
+    python token_index.py ../datasets/MedQA_BaiLian/mainland_4opt_train.jsonl
+    python token_index.py <数据集> --max-length 1024 --policy truncate --workers 4
+    python token_index.py <数据集> --epochs 3 --price-per-1k 0.03 --tokens-per-second 2000
+"""
+
+import os
+import json
+import math
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from compressed_io import strip_compression
+from convert_to_bailian_format import (
+    MANIFEST_SUFFIX,
+    UPLOAD_LIMIT_MB,
+    ShardedJsonlWriter,
+    iter_raw_lines,
+    shard_manifest_path,
+    split_byte_ranges,
+)
+from evaluate_model import iter_dataset_files, percentile
+
+
+TOKEN_INDEX_SUFFIX = ".tokens.npy"
+TOKEN_META_SUFFIX = ".tokens.json"
+
+# 索引格式版本：计数方式变化时递增，使已有索引失效
+TOKEN_INDEX_VERSION = 1
+
+DEFAULT_TOKENIZER = "qwen-plus"
+
+# Qwen 对话模板中每条消息的额外 token：<|im_start|>、角色名、换行、<|im_end|>、换行
+MESSAGE_OVERHEAD = 5
+
+# 单个分词任务处理的字节数
+DEFAULT_CHUNK_MB = 8
+
+POLICIES = ("report", "filter", "truncate", "bucket")
+
+
+class TokenCounter:
+    """按模型名加载分词器；无法加载时退回粗略估计（exact 为 False）"""
+
+    def __init__(self, model=DEFAULT_TOKENIZER):
+        self.model = model
+        self._tokenizer = None
+        try:
+            from dashscope import get_tokenizer
+            self._tokenizer = get_tokenizer(model)
+        except Exception:
+            # 未安装 dashscope/tiktoken，或模型不是 Qwen 系列
+            self._tokenizer = None
+        self.exact = self._tokenizer is not None
+        self.name = model if self.exact else "estimate"
+
+    def count(self, text):
+        if self._tokenizer is not None:
+            return len(self._tokenizer.encode(text))
+        return estimate_tokens(text)
+
+    def count_messages(self, messages):
+        """一条训练样本（messages 列表）的 token 数，含对话模板开销"""
+        return sum(self.count(m.get('content') or '') + MESSAGE_OVERHEAD for m in messages)
+
+    def truncate_left(self, text, max_tokens):
+        """从开头截掉多余部分，只保留最后 max_tokens 个 token（题干结尾的问句和选项最重要）"""
+        if max_tokens <= 0:
+            return ''
+        if self._tokenizer is not None:
+            tokens = self._tokenizer.encode(text)
+            if len(tokens) <= max_tokens:
+                return text
+            return self._tokenizer.decode(tokens[-max_tokens:])
+        total = estimate_tokens(text)
+        if total <= max_tokens:
+            return text
+        return text[-max(1, int(len(text) * max_tokens / total)):]
+
+
+def estimate_tokens(text):
+    """粗略估计：中日韩文字约 1.4 字/token，其他字符约 4 字/token"""
+    cjk = sum(1 for ch in text if '　' <= ch <= '鿿' or '豈' <= ch <= '﫿')
+    return math.ceil(cjk / 1.4 + (len(text) - cjk) / 4)
+
+
+def dataset_stem(dataset_path):
+    """数据集名称（去掉 .gz / .zst、.jsonl 或分片清单后缀），用于命名旁路索引和派生文件"""
+    name = strip_compression(dataset_path).name
+    for suffix in (MANIFEST_SUFFIX, '.jsonl'):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def source_state(files):
+    """输入文件的名称、大小和修改时间，用于判断旁路索引是否仍然有效"""
+    return [{'file': Path(f).name, 'size': os.stat(f).st_size, 'mtime_ns': os.stat(f).st_mtime_ns}
+            for f in files]
+
+
+def index_paths(dataset_path):
+    """数据集对应的索引文件和元数据文件路径"""
+    dataset_path = Path(dataset_path)
+    stem = dataset_stem(dataset_path)
+    return (dataset_path.with_name(stem + TOKEN_INDEX_SUFFIX),
+            dataset_path.with_name(stem + TOKEN_META_SUFFIX))
+
+
+# 每个工作进程只加载一次分词器
+_worker_counter = None
+
+
+def _count_range(task):
+    """进程池工作函数：统计一个字节范围内每个非空行的 token 数"""
+    global _worker_counter
+    file_path, start, end, model = task
+    if _worker_counter is None or _worker_counter.model != model:
+        _worker_counter = TokenCounter(model)
+
+    counts = []
+    for raw in iter_raw_lines(file_path, start, end):
+        line = raw.strip()
+        if not line:
+            continue
+        counts.append(_worker_counter.count_messages(json.loads(line)['messages']))
+    return np.array(counts, dtype=np.uint32)
+
+
+def build_token_index(dataset_path, model=DEFAULT_TOKENIZER, workers=1, chunk_mb=DEFAULT_CHUNK_MB,
+                      force=False):
+    """
+    建立（或复用）逐行 token 数索引
+
+    Args:
+        dataset_path: 转换后的数据集（JSONL 或分片清单）
+        model: 分词器对应的模型名
+        workers: 分词进程数
+        chunk_mb: 单个分词任务的大小（MB）
+        force: 忽略已有索引重新统计
+
+    Returns:
+        (counts, meta)：counts 为 uint32 数组，按数据集中非空行的顺序排列
+    """
+    files = iter_dataset_files(dataset_path)
+    index_file, meta_file = index_paths(dataset_path)
+    tokenizer_name = TokenCounter(model).name
+    state = {
+        'version': TOKEN_INDEX_VERSION,
+        'tokenizer': tokenizer_name,
+        'sources': source_state(files),
+    }
+
+    if not force and index_file.exists() and meta_file.exists():
+        try:
+            with open(meta_file, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if all(meta.get(key) == value for key, value in state.items()):
+                return np.load(index_file), meta
+        except (OSError, ValueError):
+            pass
+
+    chunk_bytes = max(1, int(chunk_mb * 1024 * 1024))
+    tasks = []
+    for file_path in files:
+        num_ranges = max(1, -(-os.path.getsize(file_path) // chunk_bytes)) if workers > 1 else 1
+        tasks.extend((str(file_path), start, end, model) for start, end in split_byte_ranges(file_path, num_ranges))
+
+    # 小数据集只有一个分词任务，不必启动进程池
+    workers = min(workers, len(tasks))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(_count_range, tasks))
+    else:
+        parts = [_count_range(task) for task in tasks]
+    counts = np.concatenate(parts) if parts else np.empty(0, dtype=np.uint32)
+
+    np.save(index_file, counts)
+    meta = dict(state, rows=int(len(counts)), total_tokens=int(counts.sum(dtype=np.uint64)))
+    with open(meta_file, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return counts, meta
+
+
+def length_stats(counts, max_length):
+    """token 数分布和超长行统计"""
+    values = counts.tolist()
+    over = counts > max_length
+    return {
+        'rows': len(values),
+        'total_tokens': int(counts.sum(dtype=np.uint64)),
+        'mean': float(counts.mean()) if len(values) else None,
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': int(counts.max()) if len(values) else None,
+        'max_length': max_length,
+        'over_rows': int(over.sum()),
+        # 平台截断后实际参与训练的 token 数
+        'effective_tokens': int(np.minimum(counts, max_length).sum(dtype=np.uint64)),
+    }
+
+
+def bucket_edges(max_length):
+    """分桶上界：max_length 的 1/4、1/2 和 max_length 本身"""
+    return sorted({max(1, max_length // 4), max(1, max_length // 2), max_length})
+
+
+def _iter_rows(dataset_path):
+    """按索引顺序逐个返回非空行（bytes）"""
+    for file_path in iter_dataset_files(dataset_path):
+        for raw in iter_raw_lines(file_path):
+            if raw.strip():
+                yield raw if raw.endswith(b'\n') else raw + b'\n'
+
+
+def _written_path(writer):
+    """写入器的输出：发生分片时为分片清单，否则为文件本身"""
+    return shard_manifest_path(writer.output_file) if len(writer.shards) > 1 else writer.output_file
+
+
+def apply_length_policy(dataset_path, counts, max_length, policy, counter=None,
+                        max_shard_mb=UPLOAD_LIMIT_MB):
+    """
+    按 max_length 处理超长行并写出新数据集
+
+    Args:
+        dataset_path: 转换后的数据集
+        counts: build_token_index 得到的逐行 token 数
+        max_length: 训练时的最大长度
+        policy: 'filter' 删除超长行；'truncate' 从开头截断用户输入使其放得下（放不下时删除）；
+            'bucket' 按长度分桶写出多个文件
+        counter: 截断时使用的 TokenCounter
+        max_shard_mb: 输出文件的分片上限（MB）
+
+    Returns:
+        {输出文件路径: {'rows', 'tokens'}}
+    """
+    name, output_dir = dataset_stem(dataset_path), Path(dataset_path).parent
+    max_shard_bytes = int(max_shard_mb * 1024 * 1024) if max_shard_mb else None
+    outputs = {}
+
+    if policy in ("filter", "truncate"):
+        output_path = output_dir / f"{name}_maxlen{max_length}.jsonl"
+        rows = tokens = 0
+        with ShardedJsonlWriter(output_path, max_shard_bytes) as writer:
+            for raw, count in zip(_iter_rows(dataset_path), counts.tolist()):
+                if count > max_length:
+                    if policy == "filter":
+                        continue
+                    raw, count = _truncate_row(raw, count, max_length, counter)
+                    if raw is None:
+                        continue
+                writer.write(raw)
+                rows += 1
+                tokens += count
+        outputs[str(_written_path(writer))] = {'rows': rows, 'tokens': tokens}
+
+    elif policy == "bucket":
+        edges = bucket_edges(max_length)
+        labels = [f"len{edge}" for edge in edges] + [f"over{max_length}"]
+        writers = [ShardedJsonlWriter(output_dir / f"{name}_{label}.jsonl", max_shard_bytes) for label in labels]
+        totals = [[0, 0] for _ in labels]
+        try:
+            for raw, count in zip(_iter_rows(dataset_path), counts.tolist()):
+                bucket = next((i for i, edge in enumerate(edges) if count <= edge), len(edges))
+                writers[bucket].write(raw)
+                totals[bucket][0] += 1
+                totals[bucket][1] += count
+        finally:
+            for writer in writers:
+                writer.close()
+        for writer, (rows, tokens) in zip(writers, totals):
+            if rows:
+                outputs[str(_written_path(writer))] = {'rows': rows, 'tokens': tokens}
+            else:
+                os.remove(writer.output_file)
+
+    else:
+        raise ValueError(f"未知的处理方式: {policy}")
+
+    return outputs
+
+
+def _truncate_row(raw, count, max_length, counter):
+    """截断一行的用户输入；截断后仍放不下时返回 (None, 0)"""
+    data = json.loads(raw)
+    messages = data['messages']
+    user = next((m for m in messages if m['role'] == 'user'), None)
+    if user is None:
+        return None, 0
+
+    user_tokens = counter.count(user['content'])
+    keep = user_tokens - (count - max_length)
+    if keep <= 0:
+        return None, 0
+    user['content'] = counter.truncate_left(user['content'], keep)
+    count = counter.count_messages(messages)
+    if count > max_length:
+        return None, 0
+    return (json.dumps(data, ensure_ascii=False) + '\n').encode('utf-8'), count
+
+
+def estimate_training(stats, n_epochs, split=1.0, price_per_1k=None, tokens_per_second=None):
+    """
+    估算训练量
+
+    Args:
+        stats: length_stats 的结果
+        n_epochs: 训练轮数
+        split: 没有单独验证集时用于训练的比例（hyper_parameters 中的 split）
+        price_per_1k: 每千 token 的训练单价（元），可选
+        tokens_per_second: 训练吞吐量（token/秒），可选
+
+    Returns:
+        {'trained_tokens', 'cost', 'hours'}
+    """
+    trained = int(stats['effective_tokens'] * split * n_epochs)
+    return {
+        'trained_tokens': trained,
+        'cost': trained / 1000 * price_per_1k if price_per_1k else None,
+        'hours': trained / tokens_per_second / 3600 if tokens_per_second else None,
+    }
+
+
+def print_report(dataset_path, stats, estimate, n_epochs, tokenizer_name):
+    """打印 token 统计和训练量估计"""
+    print("\n" + "=" * 60)
+    print(f"📏 Token 统计: {Path(dataset_path).name}")
+    print("=" * 60)
+    note = "" if tokenizer_name != "estimate" else "（未找到 Qwen 分词器，按字符数粗略估计）"
+    print(f"分词器: {tokenizer_name}{note}")
+    if not stats['rows']:
+        print("数据集为空")
+        return
+    print(f"行数: {stats['rows']}  总 token: {stats['total_tokens']:,}")
+    print(f"每行 token: 平均 {stats['mean']:.0f}, p50 {stats['p50']}, p95 {stats['p95']}, "
+          f"p99 {stats['p99']}, 最大 {stats['max']}")
+    over_ratio = stats['over_rows'] / stats['rows']
+    print(f"超过 max_length={stats['max_length']} 的行: {stats['over_rows']} ({over_ratio:.2%})，"
+          f"截断后参与训练的 token: {stats['effective_tokens']:,}")
+    print(f"训练 token 估计: {estimate['trained_tokens']:,}（× {n_epochs} 轮）")
+    if estimate['cost'] is not None:
+        print(f"费用估计: {estimate['cost']:.2f} 元")
+    if estimate['hours'] is not None:
+        print(f"耗时估计: {estimate['hours']:.1f} 小时")
+    print("=" * 60)
+
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='统计训练数据的 token 长度，按 max_length 过滤/截断/分桶并估算训练量')
+    parser.add_argument('dataset', help='转换后的数据集（JSONL 或分片清单）')
+    parser.add_argument('--max-length', type=int, default=int(os.getenv("MAX_LENGTH", "2048")),
+                        help='训练的最大长度（默认取 .env 中的 MAX_LENGTH，否则 2048）')
+    parser.add_argument('--epochs', type=int, default=int(os.getenv("N_EPOCHS", "3")),
+                        help='训练轮数（默认取 .env 中的 N_EPOCHS，否则 3）')
+    parser.add_argument('--split', type=float, default=1.0,
+                        help='用于训练的比例（没有单独验证集时为 hyper_parameters 中的 split）')
+    parser.add_argument('--policy', choices=POLICIES, default='report',
+                        help='超长行的处理方式：report 只统计，filter 删除，truncate 截断，bucket 按长度分桶')
+    parser.add_argument('--tokenizer', default=os.getenv("FINE_TUNE_BASE_MODEL", DEFAULT_TOKENIZER),
+                        help='分词器对应的模型名（默认取 .env 中的 FINE_TUNE_BASE_MODEL）')
+    parser.add_argument('--workers', type=int, default=1, help='分词进程数（0 表示使用全部 CPU 核心）')
+    parser.add_argument('--price-per-1k', type=float, help='每千 token 的训练单价（元）')
+    parser.add_argument('--tokens-per-second', type=float, help='训练吞吐量（token/秒），用于估算耗时')
+    parser.add_argument('--force', action='store_true', help='忽略已有索引重新统计')
+    args = parser.parse_args()
+
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    counts, meta = build_token_index(args.dataset, args.tokenizer, workers=workers, force=args.force)
+    stats = length_stats(counts, args.max_length)
+    estimate = estimate_training(stats, args.epochs, args.split, args.price_per_1k, args.tokens_per_second)
+    print_report(args.dataset, stats, estimate, args.epochs, meta['tokenizer'])
+
+    if args.policy != 'report':
+        outputs = apply_length_policy(args.dataset, counts, args.max_length, args.policy,
+                                      TokenCounter(args.tokenizer))
+        print(f"\n按 {args.policy} 处理后的数据集:")
+        for path, item in outputs.items():
+            print(f"  - {Path(path).name}: {item['rows']} 条, {item['tokens']:,} token")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+已上传文件登记表
+
+按文件内容（SHA-256 + 大小）记录 upload_file 返回的 File ID。
+再次上传内容相同的文件时直接复用已有 File ID，不产生网络传输，
+也不会在平台上生成重复文件。分片数据集的每个分片单独登记。
+远端文件被删除后，可以按 File ID 删除登记，或在线校验后清理失效记录。
+
+File ID 只对上传它的账号可见，登记按 API 地址和账号（API Key 的摘要）分开，
+切换 API Key 后不会复用另一个账号的文件。
+"""
+
+import os
+import json
+import hashlib
+import time
+import threading
+from pathlib import Path
+
+from conversion_cache import file_sha256
+
+
+REGISTRY_FILE_NAME = ".upload_registry.json"
+REGISTRY_FORMAT_VERSION = 2
+
+
+def account_id(api_key):
+    """API Key 的摘要，用来区分账号而不在本地文件中保存 Key 本身"""
+    if not api_key:
+        return "-"
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+
+class UploadRegistry:
+    """内容寻址的上传登记表（JSON 文件）"""
+    
+    def __init__(self, registry_file, api_base, api_key=None):
+        """
+        Args:
+            registry_file: 登记表文件路径
+            api_base: 当前使用的 API 地址，不同地址（如本地替身服务）的登记互不影响
+            api_key: 当前使用的 API Key，不同账号的登记互不影响（只保存摘要）
+        """
+        self.path = Path(registry_file)
+        self.api_base = api_base
+        self.scope = f"{api_base}|{account_id(api_key)}"
+        self.files = {}
+        self.hashes = {}
+        self._hashes_dirty = False
+        # 并发上传时多个线程会同时登记
+        self._lock = threading.RLock()
+        if self.path.exists():
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == REGISTRY_FORMAT_VERSION:
+                    self.files = data.get('files', {})
+                    self.hashes = data.get('hashes', {})
+            except (OSError, ValueError) as e:
+                print(f"⚠️  上传登记表损坏，已忽略: {e}")
+    
+    def content_key(self, file_path):
+        """
+        返回文件的内容键 "sha256:size"
+        
+        按路径缓存哈希，文件大小和修改时间未变时不重新读取文件。
+        """
+        file_path = Path(file_path).resolve()
+        stat = file_path.stat()
+        cached = self.hashes.get(str(file_path))
+        if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+            sha256 = cached['sha256']
+        else:
+            sha256 = file_sha256(file_path)
+            with self._lock:
+                self.hashes[str(file_path)] = {
+                    'size': stat.st_size,
+                    'mtime_ns': stat.st_mtime_ns,
+                    'sha256': sha256,
+                }
+                self._hashes_dirty = True
+        return f"{sha256}:{stat.st_size}"
+    
+    def _entry_key(self, content_key):
+        return f"{self.scope}|{content_key}"
+    
+    def lookup(self, file_path):
+        """返回内容相同的文件已有的 File ID，没有则返回 None"""
+        key = self._entry_key(self.content_key(file_path))
+        with self._lock:
+            entry = self.files.get(key)
+            if self._hashes_dirty:
+                self.save()
+        return entry['file_id'] if entry else None
+    
+    def register(self, file_path, file_id):
+        """登记一次成功的上传"""
+        key = self._entry_key(self.content_key(file_path))
+        with self._lock:
+            self.files[key] = {
+                'file_id': file_id,
+                'name': Path(file_path).name,
+                'uploaded_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            }
+            self.save()
+    
+    def forget(self, file_id):
+        """
+        删除指向某个 File ID 的所有登记（远端文件已删除时使用）
+        
+        Returns:
+            删除的记录数
+        """
+        with self._lock:
+            keys = [key for key, entry in self.files.items() if entry['file_id'] == file_id]
+            for key in keys:
+                del self.files[key]
+            if keys:
+                self.save()
+        return len(keys)
+    
+    def entries(self):
+        """当前 API 地址和账号下的所有登记 [(content_key, entry), ...]"""
+        prefix = f"{self.scope}|"
+        return [
+            (key[len(prefix):], entry)
+            for key, entry in self.files.items()
+            if key.startswith(prefix)
+        ]
+    
+    def save(self):
+        """原子地写回登记表"""
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': REGISTRY_FORMAT_VERSION, 'files': self.files, 'hashes': self.hashes},
+                          f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+            self._hashes_dirty = False
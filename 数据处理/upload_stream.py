@@ -0,0 +1,136 @@
+"""
+流式 multipart 上传
+
+requests 的 files= 参数会先把整个文件读入内存拼成请求体，300MB 的训练文件
+就要占用 300MB 内存，而且上传过程中没有任何进度信息。这里按块生成
+multipart/form-data 请求体：预先算好 Content-Length，逐块读取文件发送，
+同时统计已发送字节数和吞吐量。
+
+压缩的数据集（xxx.jsonl.gz / xxx.jsonl.zst）边读边解压后发送，平台收到的是
+xxx.jsonl，不需要先在磁盘上解压出一份。
+"""
+
+import sys
+import time
+import uuid
+from pathlib import Path
+
+from compressed_io import iter_chunks, strip_compression, uncompressed_size
+
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadProgress:
+    """上传进度与吞吐量显示"""
+    
+    def __init__(self, total_bytes, interval=1.0, stream=None):
+        """
+        Args:
+            total_bytes: 需要发送的总字节数
+            interval: 两次进度输出之间的最小间隔（秒）
+            stream: 输出流（默认 stdout）
+        """
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.stream = stream or sys.stdout
+        self.reset()
+    
+    def reset(self):
+        """重新开始计数（重试时调用）"""
+        self.sent_bytes = 0
+        self.start_time = time.perf_counter()
+        self._last_report = 0.0
+    
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+    
+    @property
+    def throughput(self):
+        """平均吞吐量（字节/秒）"""
+        elapsed = self.elapsed
+        return self.sent_bytes / elapsed if elapsed > 0 else 0.0
+    
+    def update(self, num_bytes):
+        self.sent_bytes += num_bytes
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval or self.sent_bytes >= self.total_bytes:
+            self._last_report = now
+            self.report()
+    
+    def report(self):
+        percent = self.sent_bytes / self.total_bytes * 100 if self.total_bytes else 100.0
+        self.stream.write(
+            f"\r   进度: {percent:5.1f}% "
+            f"({self.sent_bytes / (1024 * 1024):.1f}/{self.total_bytes / (1024 * 1024):.1f} MB) "
+            f"{self.throughput / (1024 * 1024):.2f} MB/s"
+        )
+        if self.sent_bytes >= self.total_bytes:
+            self.stream.write("\n")
+        self.stream.flush()
+
+
+class MultipartFileStream:
+    """
+    按块生成的 multipart/form-data 请求体
+    
+    可迭代且实现了 __len__，requests 会据此设置 Content-Length 并逐块发送，
+    不会把整个文件读入内存。每次迭代都重新打开文件，重试时可以直接复用。
+    压缩文件按解压后的内容发送，文件名去掉压缩扩展名；Content-Length 需要
+    解压后的大小，构造时会先完整解压一遍计数。
+    """
+    
+    def __init__(self, file_path, field_name, fields=None, content_type='application/octet-stream',
+                 chunk_size=UPLOAD_CHUNK_SIZE, progress=None):
+        """
+        Args:
+            file_path: 要上传的文件
+            field_name: 文件字段名
+            fields: 其他表单字段 {name: value}
+            content_type: 文件部分的 Content-Type
+            chunk_size: 每次读取并发送的字节数
+            progress: 进度回调对象（需要实现 update(num_bytes)）
+        """
+        self.file_path = Path(file_path)
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.boundary = uuid.uuid4().hex
+        
+        preamble = []
+        for name, value in (fields or {}).items():
+            preamble.append(
+                f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                f'{value}\r\n'
+            )
+        # 与 urllib3 一致，按 HTML5 规则转义文件名中的引号和换行
+        filename = strip_compression(self.file_path).name.replace('"', '%22').replace('\r', '%0D').replace('\n', '%0A')
+        preamble.append(
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field_name}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'
+        )
+        self.preamble = ''.join(preamble).encode('utf-8')
+        self.epilogue = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+        self.file_size = uncompressed_size(self.file_path)
+    
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+    
+    def __len__(self):
+        return len(self.preamble) + self.file_size + len(self.epilogue)
+    
+    def __iter__(self):
+        if self.progress is not None:
+            self.progress.reset()
+        yield self._sent(self.preamble)
+        for chunk in iter_chunks(self.file_path, self.chunk_size):
+            yield self._sent(chunk)
+        yield self._sent(self.epilogue)
+    
+    def _sent(self, chunk):
+        if self.progress is not None:
+            self.progress.update(len(chunk))
+        return chunk